@@ -1,21 +1,35 @@
 # app/api/v1/router_downloads.py
 # (V6 - Controller 层)
 
-from fastapi import APIRouter, Depends, Path as FastPath, HTTPException, Response
-from starlette.responses import StreamingResponse
-from typing import Dict, List, Any
+from fastapi import APIRouter, Depends, Path as FastPath, HTTPException, Query, Request, Response
+from starlette.responses import FileResponse, StreamingResponse
+from typing import Dict, List, Any, Optional
 
 # 1. 导入 Service 和 DI
 from app.services.service_downloads import DownloaderService
 from app.core.dependencies import get_downloader_service
+from app.services.playlist_expander import PlaylistExpansionError
+from app.core.file_response import RangeFileResponse, media_type_for
 
 # 2. 导入 Schemas (DTOs)
 from app.schemas.schema_downloads import (
     DownloadRequest,
+    BatchDownloadRequest,
+    BatchTaskIdsResponse,
+    BandwidthLimitRequest,
+    BandwidthStatusResponse,
     FileDeleteRequest,
+    HostTuningResponse,
+    RecordingPartResponse,
     TaskStatusResponse,
+    TaskSummaryResponse,
+    TaskTimelineResponse,
     DriveResponse,
-    TaskIdResponse
+    ExtractorStatusResponse,
+    SchedulerStatusResponse,
+    SegmentCacheStatusResponse,
+    TaskIdResponse,
+    WorkerResponse
 )
 
 # 3. 创建一个 APIRouter (就像 Flask 的 Blueprint)
@@ -36,6 +50,56 @@ def get_drives(service: DownloaderService = Depends(get_downloader_service)):
     """
     return service.get_system_drives()
 
+@router.get("/system/scheduler", response_model=SchedulerStatusResponse)
+def get_scheduler(service: DownloaderService = Depends(get_downloader_service)):
+    """
+    (V9) 查看调度器状态: 并发上限、正在运行和排队中的任务数
+    """
+    return service.get_scheduler_status()
+
+@router.get("/system/workers", response_model=List[WorkerResponse])
+def get_workers(service: DownloaderService = Depends(get_downloader_service)):
+    """
+    (V31) 共享同一个 downloader.db 的 worker (uvicorn --workers / 多个容器) 及各自持有的任务数
+    """
+    return service.get_workers()
+
+@router.get("/system/segment-cache", response_model=SegmentCacheStatusResponse)
+def get_segment_cache(service: DownloaderService = Depends(get_downloader_service)):
+    """
+    (V20) 共享片段缓存的统计: 大小、命中 / 未命中次数、节省的上游流量
+    """
+    return service.get_segment_cache_status()
+
+@router.get("/system/extractor", response_model=ExtractorStatusResponse)
+def get_extractor(service: DownloaderService = Depends(get_downloader_service)):
+    """
+    (V32) yt-dlp 提取进程池和按 URL 的元数据缓存的统计
+    """
+    return service.get_extractor_status()
+
+@router.get("/system/hosts", response_model=List[HostTuningResponse])
+def get_host_tuning(service: DownloaderService = Depends(get_downloader_service)):
+    """
+    (V27) 每个主机根据实测吞吐量 / 限流学到的分片并发数
+    """
+    return service.get_host_tuning()
+
+@router.get("/system/bandwidth", response_model=BandwidthStatusResponse)
+def get_bandwidth(service: DownloaderService = Depends(get_downloader_service)):
+    """
+    (V23) 查看带宽预算: 全局上限、原生引擎共享的速率、分给 yt-dlp 子进程的速率
+    """
+    return service.get_bandwidth_status()
+
+@router.put("/system/bandwidth", response_model=BandwidthStatusResponse)
+def set_bandwidth(req: BandwidthLimitRequest, service: DownloaderService = Depends(get_downloader_service)):
+    """
+    (V23) 运行时修改全局带宽上限 (字节/秒, 0 表示不限速)。
+    原生引擎的任务立即生效; yt-dlp 子进程在下次启动时按新的预算分配。
+    """
+    return service.set_bandwidth_limit(req.limit)
+
 # (B) 核心下载流程
 @router.post("/start-download", response_model=TaskIdResponse)
 def start_download(
@@ -43,13 +107,22 @@ def start_download(
     service: DownloaderService = Depends(get_downloader_service)
 ):
     """
-    (V6) 启动一个新下载, 包含自定义文件名
+    (V9) 提交一个新下载, 包含自定义文件名。
+    任务会先进入 'queued' 状态, 由调度器在有空位时启动。
+    (V19) 同一 URL 正在下载时返回已有任务的 ID; 已下载过时新任务立即完成 (force=true 可强制重新下载)。
+    (V29) live=true (或 .m3u8 没有 #EXT-X-ENDLIST) 时按直播录制, 按时间 / 大小分段保存。
     """
     try:
         task_id = service.start_new_download(
             req.url,
             req.download_path,
-            req.custom_filename # <-- 【V6 新增】 传递自定义文件名
+            req.custom_filename, # <-- 【V6 新增】 传递自定义文件名
+            req.priority,        # <-- 【V9 新增】 调度优先级
+            req.force,           # <-- 【V19 新增】 强制重新下载
+            req.rate_limit,      # <-- 【V23 新增】 单任务带宽上限
+            live=req.live,       # <-- 【V29 新增】 直播录制及分段设置
+            rotate_seconds=req.rotate_seconds,
+            rotate_bytes=req.rotate_bytes,
         )
         return TaskIdResponse(taskId=task_id)
     except Exception as e:
@@ -57,13 +130,42 @@ def start_download(
         print(f"[ERROR] [API] 启动下载失败: {e}")
         raise HTTPException(status_code=500, detail=f"启动任务失败: {e}")
 
+@router.post("/start-download/batch", response_model=BatchTaskIdsResponse)
+def start_batch_download(
+    req: BatchDownloadRequest,
+    service: DownloaderService = Depends(get_downloader_service)
+):
+    """
+    (V28) 一次提交多个下载: URL 列表, 或者一个播放列表 / 频道 URL (服务端用 yt-dlp 展开)。
+    所有任务在一个事务中创建, 然后由调度器按并发上限依次启动。
+    """
+    try:
+        task_ids = service.start_batch_download(
+            req.urls,
+            req.download_path,
+            playlist_url=req.playlist_url,
+            max_items=req.max_items,
+            priority=req.priority,
+            force=req.force,
+            rate_limit=req.rate_limit,
+        )
+    except (ValueError, PlaylistExpansionError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"[ERROR] [API] 批量提交失败: {e}")
+        raise HTTPException(status_code=500, detail=f"批量提交失败: {e}")
+    return BatchTaskIdsResponse(taskIds=task_ids, count=len(task_ids))
+
 @router.get("/stream-progress/{task_id}")
-def stream_progress(
+async def stream_progress(
     task_id: str = FastPath(..., description="任务 ID"),
     service: DownloaderService = Depends(get_downloader_service)
 ):
     """
     (V6) 实时获取下载进度 (SSE)
+
+    (V30) async 路由 + 异步生成器: 连接在事件循环中等待日志, 不占用线程池。
+    (其他路由仍然是普通的 def, 由 Starlette 放到线程池中执行, 数据库访问不会阻塞事件循环)
     """
     stream_generator = service.get_download_stream(task_id)
     return StreamingResponse(
@@ -73,29 +175,146 @@ def stream_progress(
 
 # (C) 任务与文件管理
 @router.get("/tasks", response_model=List[TaskStatusResponse])
-def get_tasks(service: DownloaderService = Depends(get_downloader_service)):
+def get_tasks(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="每页条数 (不传则返回全部)"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 的值"),
+    status: Optional[str] = Query(None, description="按状态过滤, 多个用逗号分隔"),
+    url_contains: Optional[str] = Query(None, description="URL 包含的子串"),
+    path: Optional[str] = Query(None, description="下载目录 (精确匹配)"),
+    service: DownloaderService = Depends(get_downloader_service)
+):
     """
-    (V6) 从 *数据库* 获取所有任务的列表
+    (V17) 从 *数据库* 获取任务列表, 支持 keyset 分页和过滤。
+    不带参数时与之前一样返回全部任务; 有下一页时通过 X-Next-Cursor 响应头返回游标。
     """
-    # service.get_all_tasks() 返回一个 list[dict]
-    # "response_model=List[TaskStatusResponse]" 会自动将其转换为 JSON 列表
-    # (注意：Pydantic v1.x 使用 'response_model_by_alias=False' 会更好)
-    tasks_list = service.get_all_tasks()
+    return _list_tasks(request, response, service, limit, cursor, status, url_contains, path, summary=False)
+
+@router.get("/tasks/summary", response_model=List[TaskSummaryResponse])
+def get_tasks_summary(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="每页条数 (不传则返回全部)"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 的值"),
+    status: Optional[str] = Query(None, description="按状态过滤, 多个用逗号分隔"),
+    url_contains: Optional[str] = Query(None, description="URL 包含的子串"),
+    path: Optional[str] = Query(None, description="下载目录 (精确匹配)"),
+    service: DownloaderService = Depends(get_downloader_service)
+):
+    """
+    (V17) 与 /tasks 相同的分页和过滤, 但只返回轻量字段
+    """
+    return _list_tasks(request, response, service, limit, cursor, status, url_contains, path, summary=True)
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """(V18) If-None-Match 是否包含当前 ETag (弱比较)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+def _list_tasks(request: Request, response: Response, service: DownloaderService, limit, cursor, status,
+                url_contains, path, summary: bool):
+    statuses = [s.strip() for s in status.split(",") if s.strip()] if status else None
+    try:
+        tasks_list, next_cursor = service.list_tasks(
+            limit=limit, cursor=cursor, statuses=statuses,
+            url_contains=url_contains, path=path, summary=summary
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # (V18) 任何任务都没有变化时 (列表来自缓存, ETag 也已经算好), 列表的 ETag 不变 -> 304
+    etag = service.get_tasks_etag(tasks_list)
+    headers = {"ETag": etag}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
     return tasks_list
 
 @router.get("/status/{task_id}", response_model=TaskStatusResponse)
 def get_status(
+    request: Request,
+    response: Response,
     task_id: str = FastPath(..., description="任务 ID"),
     service: DownloaderService = Depends(get_downloader_service)
 ):
     """
-    (V6) 从 *数据库* 获取单个任务的最终状态
+    (V18) 获取单个任务的状态 (来自内存缓存, 未命中时读数据库)。
+    支持 ETag / If-None-Match: 任务没有变化时返回 304。
     """
     task = service.get_task_status(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found in database")
+    # ETag 由返回的内容计算, 与正文一定一致
+    etag = service.get_task_etag(task)
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
     return task
 
+@router.get("/task/{task_id}/timeline", response_model=TaskTimelineResponse)
+def get_task_timeline(
+    task_id: str = FastPath(..., description="任务 ID"),
+    service: DownloaderService = Depends(get_downloader_service)
+):
+    """
+    (V25) 任务每次运行的阶段时间线: 起止时间、字节数、子进程 CPU 时间
+    """
+    timeline = service.get_task_timeline(task_id)
+    if timeline is None:
+        raise HTTPException(status_code=404, detail="Task not found in database")
+    return timeline
+
+@router.get("/task/{task_id}/profile")
+def get_task_profile(
+    task_id: str = FastPath(..., description="任务 ID"),
+    service: DownloaderService = Depends(get_downloader_service)
+):
+    """
+    (V25) 下载任务运行期间的剖析结果 (.collapsed 调用栈采样或 .pstats)
+    """
+    path = service.get_task_profile(task_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="No profile recorded for this task")
+    return FileResponse(path, filename=path.name, media_type="application/octet-stream")
+
+@router.api_route("/task/{task_id}/file", methods=["GET", "HEAD"])
+def get_task_file(
+    task_id: str = FastPath(..., description="任务 ID"),
+    part: Optional[int] = Query(None, ge=1, description="直播录制的分段序号 (见 /task/{task_id}/recordings)"),
+    download: bool = Query(False, description="作为附件下载 (默认 inline, 浏览器中直接播放)"),
+    service: DownloaderService = Depends(get_downloader_service)
+):
+    """
+    (V33) 下载 / 在线播放已完成任务的文件。
+    支持 Range (包括多段) / If-Range / HEAD 和条件请求 (ETag, Last-Modified),
+    浏览器播放器拖动进度条时只读取请求的那一段。
+    """
+    path = service.get_task_file(task_id, part)
+    if path is None:
+        raise HTTPException(status_code=404, detail="File not found (task not complete, or the file was moved)")
+    return RangeFileResponse(path, filename=path.name, media_type=media_type_for(path), stat_result=path.stat(),
+                             content_disposition_type="attachment" if download else "inline")
+
+@router.get("/task/{task_id}/recordings", response_model=List[RecordingPartResponse])
+def get_task_recordings(
+    task_id: str = FastPath(..., description="任务 ID"),
+    service: DownloaderService = Depends(get_downloader_service)
+):
+    """
+    (V29) 直播录制任务已经保存的分段 (录制进行中也会随每个分段关闭而增加)
+    """
+    recordings = service.get_task_recordings(task_id)
+    if recordings is None:
+        raise HTTPException(status_code=404, detail="Task not found in database")
+    return recordings
+
 @router.delete("/task/{task_id}")
 def delete_task(
     task_id: str = FastPath(..., description="要从列表清除的任务 ID"),
@@ -135,10 +354,45 @@ def cancel_task(
 
     这会终止 yt-dlp 进程。
     该任务随后会自动失败 (status='error') 并被移入历史记录。
+    (V29) 直播录制任务则是停止录制: 当前分段正常保存, 任务以 'complete' 结束。
     """
     result = service.cancel_running_task(task_id)
     if not result["success"]:
         # 404 Not Found 或 409 Conflict 可能更合适, 但 404 易于处理
         raise HTTPException(status_code=404, detail=result.get("message"))
 
-    return {"message": "Task cancellation requested."}
\ No newline at end of file
+    return {"message": "Task cancellation requested."}
+
+
+@router.post("/task/{task_id}/resume", status_code=202)
+def resume_task(
+        task_id: str = FastPath(..., description="要续传的失败/已取消任务 ID"),
+        service: DownloaderService = Depends(get_downloader_service)
+):
+    """
+    (V12 新增) 重新排队一个失败或已取消的任务。
+
+    失败时保留的临时工作区和片段检查点不会被清理,
+    所以任务会从最后一个完成的片段继续, 而不是从头开始。
+    """
+    result = service.resume_task(task_id)
+    if not result["success"]:
+        raise HTTPException(status_code=404, detail=result.get("message"))
+
+    return {"message": "Task resume requested."}
+
+
+@router.put("/task/{task_id}/bandwidth", status_code=202)
+def set_task_bandwidth(
+        req: BandwidthLimitRequest,
+        task_id: str = FastPath(..., description="任务 ID"),
+        service: DownloaderService = Depends(get_downloader_service)
+):
+    """
+    (V23 新增) 修改单个任务的带宽上限 (字节/秒, 0 表示不限速)。
+    """
+    result = service.set_task_rate_limit(task_id, req.limit)
+    if not result["success"]:
+        raise HTTPException(status_code=404, detail=result.get("message"))
+
+    return {"message": "Task bandwidth limit updated."}
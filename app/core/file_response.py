@@ -0,0 +1,163 @@
+# app/core/file_response.py
+# (V33 - 下载完成的文件: Range / If-Range / HEAD / 条件请求, 以及零拷贝发送)
+
+import mimetypes
+import os
+import stat
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import quote
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+# 反向代理的 sendfile 头 (例如 nginx 的 X-Accel-Redirect, Apache / lighttpd 的 X-Sendfile);
+# 设置后文件正文完全由代理发送, 应用只返回头部。为空时由应用自己发送
+FILE_SENDFILE_HEADER = os.environ.get("FILE_SENDFILE_HEADER", "")
+# X-Accel-Redirect 的内部 location 前缀 (nginx: location /_files/ { internal; alias /; })
+FILE_SENDFILE_PREFIX = os.environ.get("FILE_SENDFILE_PREFIX", "")
+# 应用自己读取文件时每次读多少字节 (Starlette 默认 64 KiB)
+FILE_CHUNK_SIZE = int(os.environ.get("FILE_CHUNK_SIZE", str(1024 * 1024)))
+
+# ASGI 零拷贝扩展: 服务器直接对文件描述符调用 os.sendfile
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+# mimetypes 不一定认识的视频格式 (浏览器播放器需要正确的 Content-Type)
+MEDIA_TYPES = {
+    ".mkv": "video/x-matroska",
+    ".mp4": "video/mp4",
+    ".m4a": "audio/mp4",
+    ".webm": "video/webm",
+    ".ts": "video/mp2t",
+}
+
+
+def media_type_for(path: os.PathLike) -> str:
+    ext = os.path.splitext(os.fspath(path))[1].lower()
+    return MEDIA_TYPES.get(ext) or mimetypes.guess_type(os.fspath(path))[0] or "application/octet-stream"
+
+
+class RangeFileResponse(FileResponse):
+    """
+    在 Starlette 的 FileResponse (已支持 Range / If-Range / HEAD / 多段 Range) 之上增加:
+
+    - 条件请求: If-None-Match / If-Modified-Since -> 304, If-Match / If-Unmodified-Since -> 412
+    - ASGI 服务器提供 http.response.zerocopysend 扩展时, 整个文件和单段 Range 都通过 os.sendfile 发送,
+      正文不经过 Python (提供 http.response.pathsend 时整个文件由 Starlette 交给服务器)
+    - 配置了 FILE_SENDFILE_HEADER 时只返回代理的 sendfile 头, 由反向代理发送正文 (代理自己处理 Range)
+    - 否则按 FILE_CHUNK_SIZE 读取; Range 请求只读取请求的那一段, 在大文件中拖动进度条不会读取整个文件
+    """
+
+    chunk_size = FILE_CHUNK_SIZE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.stat_result is None:
+            # 没有传入 stat_result 时 Starlette 在 __call__ 中才设置 ETag / Last-Modified,
+            # 条件请求需要先知道它们; 文件不存在等错误仍由 FileResponse 报告
+            try:
+                stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+            except OSError:
+                stat_result = None
+            if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+                self.stat_result = stat_result
+                self.set_stat_headers(stat_result)
+        request_headers = Headers(scope=scope)
+        status = self._precondition_status(request_headers, scope["method"].upper())
+        if status is not None:
+            # 304 保留 ETag / Last-Modified 等验证头, 不带正文相关的头
+            headers = {k: v for k, v in self.headers.items()
+                       if k in ("etag", "last-modified", "cache-control", "accept-ranges")}
+            return await Response(status_code=status, headers=headers)(scope, receive, send)
+        if FILE_SENDFILE_HEADER:
+            return await self._offload(scope, receive, send)
+        self._zerocopy = ZEROCOPY_EXTENSION in scope.get("extensions", {})
+        await super().__call__(scope, receive, send)
+
+    # --- 条件请求 (RFC 9110 13.2.2 的求值顺序) ---
+    def _precondition_status(self, request_headers: Headers, method: str) -> Optional[int]:
+        etag = self.headers.get("etag")
+        mtime = self.stat_result.st_mtime if self.stat_result else None
+        if_match = request_headers.get("if-match")
+        if if_match is not None:
+            if not _etag_in(etag, if_match, weak=False):
+                return 412
+        elif mtime is not None and _not_after(mtime, request_headers.get("if-unmodified-since")) is False:
+            return 412
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            if _etag_in(etag, if_none_match, weak=True):
+                return 304 if method in ("GET", "HEAD") else 412
+        elif method in ("GET", "HEAD") and mtime is not None:
+            if _not_after(mtime, request_headers.get("if-modified-since")):
+                return 304
+        return None
+
+    # --- 零拷贝 ---
+    async def _handle_simple(self, send: Send, send_header_only: bool, send_pathsend: bool) -> None:
+        if send_header_only or send_pathsend or not self._zerocopy:
+            return await super()._handle_simple(send, send_header_only, send_pathsend)
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await self._zerocopy_send(send, 0, None)
+
+    async def _handle_single_range(self, send: Send, start: int, end: int, file_size: int,
+                                   send_header_only: bool) -> None:
+        if send_header_only or not self._zerocopy:
+            return await super()._handle_single_range(send, start, end, file_size, send_header_only)
+        self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+        self.headers["content-length"] = str(end - start)
+        await send({"type": "http.response.start", "status": 206, "headers": self.raw_headers})
+        await self._zerocopy_send(send, start, end - start)
+
+    async def _handle_multiple_ranges(self, send: Send, ranges, file_size: int, send_header_only: bool) -> None:
+        # Starlette 把 "multipart/byteranges; boundary=..." 写在 Content-Range 中,
+        # RFC 9110 14.6 要求放在 Content-Type (多段响应没有 Content-Range)
+        async def send_fixed(message):
+            if message["type"] == "http.response.start":
+                headers = [(k, v) for k, v in message["headers"] if k not in (b"content-range", b"content-type")]
+                headers.append((b"content-type", self.headers["content-range"].encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+        await super()._handle_multiple_ranges(send_fixed, ranges, file_size, send_header_only)
+
+    async def _zerocopy_send(self, send: Send, offset: int, count: Optional[int]) -> None:
+        with open(self.path, "rb") as file:
+            message = {"type": ZEROCOPY_EXTENSION, "file": file, "offset": offset, "more_body": False}
+            if count is not None:
+                message["count"] = count
+            await send(message)
+
+    # --- 反向代理 ---
+    async def _offload(self, scope: Scope, receive: Receive, send: Send) -> None:
+        location = FILE_SENDFILE_PREFIX + os.fspath(self.path)
+        if FILE_SENDFILE_HEADER.lower() == "x-accel-redirect":
+            location = quote(location)
+        headers = {k: v for k, v in self.headers.items() if k != "content-length"}
+        headers[FILE_SENDFILE_HEADER] = location
+        await Response(status_code=200, headers=headers, media_type=self.media_type)(scope, receive, send)
+
+
+def _etag_in(etag: Optional[str], header: str, weak: bool) -> bool:
+    """header (If-Match / If-None-Match) 是否匹配 etag; weak=True 时使用弱比较"""
+    if etag is None:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    if weak:
+        bare = etag.removeprefix("W/")
+        return any(tag.removeprefix("W/") == bare for tag in candidates)
+    return not etag.startswith("W/") and etag in candidates
+
+
+def _not_after(mtime: float, header: Optional[str]) -> Optional[bool]:
+    """文件的修改时间是否不晚于 header 中的日期 (按秒比较); 没有或无法解析时返回 None"""
+    if not header:
+        return None
+    try:
+        date = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return None
+    if date is None or date.tzinfo is None:
+        return None
+    return int(mtime) <= date.timestamp()
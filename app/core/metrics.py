@@ -0,0 +1,328 @@
+# app/core/metrics.py
+# (V24 - Prometheus 文本格式的指标: 计数器 / 直方图 / 抓取时计算的 gauge, 不依赖任何外部库)
+
+import bisect
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# SQLite 调用、子进程启动等短操作的桶 (秒)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# 任务阶段 (解析 / 下载 / 合并 / 移动) 的桶 (秒)
+PHASE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+
+LabelValues = Tuple[str, ...]
+
+
+class _Sharded:
+    """
+    每个线程一份的存储单元, 抓取时合并。
+    写入只修改当前线程自己的单元, 热路径上不需要加锁;
+    已经结束的线程的单元在抓取时并入 retired, 不会无限增长。
+    """
+
+    def __init__(self, factory: Callable[[], dict]):
+        self._factory = factory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Tuple[threading.Thread, dict]] = []
+        self.retired = factory()
+
+    def shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._factory()
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def collect(self, merge: Callable[[dict, dict], None]) -> List[dict]:
+        """把已结束线程的单元并入 retired, 返回所有仍需读取的单元"""
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    merge(self.retired, shard)
+            self._shards = alive
+            return [self.retired] + [shard for _, shard in alive]
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _format_labels(self, values: LabelValues, extra: str = "") -> str:
+        pairs = [f'{label}="{_escape(value)}"' for label, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        return lines + self.samples()
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values = _Sharded(dict)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        shard = self._values.shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    @staticmethod
+    def _merge(target: dict, source: dict) -> None:
+        for key, value in list(source.items()):
+            target[key] = target.get(key, 0) + value
+
+    def values(self) -> Dict[LabelValues, float]:
+        total: Dict[LabelValues, float] = {}
+        for shard in self._values.collect(self._merge):
+            self._merge(total, shard)
+        return total
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{self._format_labels(key)} {_number(value)}"
+                for key, value in sorted(self.values().items())]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = FAST_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = _Sharded(dict)
+
+    def observe(self, value: float, **labels) -> None:
+        shard = self._values.shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # [每个桶的计数 (非累积, 最后一个是 +Inf), 总和]
+            state = shard[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def time(self, **labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    @staticmethod
+    def _merge(target: dict, source: dict) -> None:
+        for key, (counts, total) in list(source.items()):
+            state = target.setdefault(key, [[0] * len(counts), 0.0])
+            for i, count in enumerate(counts):
+                state[0][i] += count
+            state[1] += total
+
+    def samples(self) -> List[str]:
+        merged: dict = {}
+        for shard in self._values.collect(self._merge):
+            self._merge(merged, shard)
+        lines = []
+        for key, (counts, total) in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                labels = self._format_labels(key, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_number(total)}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """
+    抓取时才计算的指标 (当前运行的任务数、SSE 订阅者数等)。
+    callback 返回一个数字, 或 {标签值元组: 数字}。
+    """
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], object],
+                 labels: Sequence[str] = (), type_name: str = "gauge"):
+        self.type_name = type_name
+        self._callback = callback
+        super().__init__(name, documentation, labels)
+
+    def samples(self) -> List[str]:
+        value = self._callback()
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{self._format_labels(key)} {_number(v)}" for key, v in sorted(value.items())]
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        with self._lock:
+            # 重复注册 (例如回调指标在服务重建时) 以最新的为准
+            self._metrics[metric.name] = metric
+
+    def expose(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines += metric.expose()
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {e}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value is None:
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) and not float(value).is_integer() else str(int(value))
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# --- 下载器的指标 ---
+TASKS_FINISHED = Counter("downloader_tasks_finished_total", "Tasks that reached a terminal status", ("status",))
+BYTES_DOWNLOADED = Counter("downloader_downloaded_bytes_total", "Bytes downloaded from upstream", ("engine",))
+PHASE_DURATION = Histogram("downloader_phase_duration_seconds", "Duration of task phases of successful tasks",
+                           ("phase",), buckets=PHASE_BUCKETS)
+SQLITE_LATENCY = Histogram("downloader_sqlite_call_duration_seconds", "Latency of repository calls", ("op",))
+SUBPROCESS_SPAWN = Histogram("downloader_subprocess_spawn_seconds", "Time to spawn a child process", ("program",))
+
+
+class PhaseTimer:
+    """
+    一个任务依次经历的阶段 (resolve -> download -> merge -> move)。
+    enter() 结束当前阶段并开始下一个; finish() 把所有阶段的耗时记入 PHASE_DURATION,
+    abort() 只结束当前阶段 (失败的任务不计入直方图)。
+
+    (V25) 每个阶段同时记录为一个 span: 起止时间 (epoch 秒)、该阶段产生的字节数
+    (add_bytes) 和子进程消耗的 CPU 秒数 (cpu_clock, 例如 yt-dlp 及其 ffmpeg 子进程)。
+    spans / timeline() 供持久化和 /task/{id}/timeline 使用。
+    """
+
+    def __init__(self, first: str):
+        self._lock = threading.Lock()
+        self.spans: List[Dict[str, Any]] = []
+        self._cpu_clock: Optional[Callable[[], float]] = None
+        self._last_cpu: Optional[float] = None
+        self._current: Optional[Dict[str, Any]] = None
+        self._open(first)
+
+    @property
+    def phase(self) -> Optional[str]:
+        current = self._current
+        return current["phase"] if current else None
+
+    def set_cpu_clock(self, clock: Callable[[], float]) -> None:
+        """子进程启动后调用; 当前阶段的 CPU 时间从 0 开始计"""
+        with self._lock:
+            self._cpu_clock = clock
+            self._last_cpu = 0.0
+            if self._current is not None and self._current["_cpu_start"] is None:
+                self._current["_cpu_start"] = 0.0
+
+    def sample_cpu(self) -> None:
+        """
+        刷新子进程的 CPU 时间。子进程退出后就读不到了,
+        所以调用方应在进程运行期间定期调用 (例如每次写入进度时)。
+        """
+        with self._lock:
+            self._read_cpu()
+
+    def _read_cpu(self) -> Optional[float]:
+        if self._cpu_clock is not None:
+            try:
+                self._last_cpu = self._cpu_clock()
+            except Exception:
+                pass  # 进程已退出: 沿用最后一次读到的值
+        return self._last_cpu
+
+    def _open(self, phase: str) -> None:
+        self._current = {"phase": phase, "started_at": time.time(), "ended_at": None,
+                         "bytes": 0, "cpu_seconds": None,
+                         "_perf": time.perf_counter(), "_cpu_start": self._read_cpu()}
+
+    def _close(self) -> None:
+        span, self._current = self._current, None
+        if span is None:
+            return
+        span["ended_at"] = time.time()
+        span["duration"] = time.perf_counter() - span.pop("_perf")
+        cpu_start, cpu_end = span.pop("_cpu_start"), self._read_cpu()
+        if cpu_start is not None and cpu_end is not None:
+            span["cpu_seconds"] = max(0.0, cpu_end - cpu_start)
+        self.spans.append(span)
+
+    def enter(self, phase: str) -> None:
+        with self._lock:
+            if phase == self.phase:
+                return
+            self._close()
+            self._open(phase)
+
+    def add_bytes(self, amount: int) -> None:
+        with self._lock:
+            if self._current is not None:
+                self._current["bytes"] += amount
+
+    def finish(self) -> None:
+        with self._lock:
+            self._close()
+            spans = list(self.spans)
+        for span in spans:
+            PHASE_DURATION.observe(span["duration"], phase=span["phase"])
+
+    def abort(self) -> None:
+        with self._lock:
+            self._close()
+
+    def timeline(self) -> List[Dict[str, Any]]:
+        """已结束的阶段 + 正在进行的阶段 (ended_at 为 None)"""
+        with self._lock:
+            spans = [dict(span) for span in self.spans]
+            current = self._current
+            if current is not None:
+                spans.append({"phase": current["phase"], "started_at": current["started_at"],
+                              "ended_at": None, "duration": time.perf_counter() - current["_perf"],
+                              "bytes": current["bytes"], "cpu_seconds": None})
+        return spans
@@ -5,7 +5,7 @@ import os
 import sys # (我们不再需要 sys.path.insert)
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from starlette.responses import FileResponse
+from starlette.responses import FileResponse, Response
 from contextlib import asynccontextmanager
 from pathlib import Path 
 
@@ -18,8 +18,10 @@ INDEX_HTML_FILE = DIST_DIR / "index.html"
 # --- 【【【修复结束】】】 ---
 
 # 4. 导入我们的模块 (现在 venv 会自动处理路径)
-from app.repository.repo_tasks import init_db
+from app.repository.repo_tasks import init_db, flush_pending_updates
 from app.api.v1 import router_downloads
+from app.services.service_downloads import downloader_service
+from app.core.metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
 from fastapi.middleware.cors import CORSMiddleware
 
 # ... (lifespan, app = FastAPI(...), CORS... 保持不变) ...
@@ -30,13 +32,24 @@ async def lifespan(app: FastAPI):
     print(f"--- [APP] Project Root: {PROJECT_ROOT}")
     print(f"--- [APP] Dist Dir: {DIST_DIR}")
     init_db()
+    # (V9) 恢复排队中的任务并启动调度器
+    downloader_service.startup()
     yield
     print("--- [APP] 应用正在关闭...")
+    # (V31) 停止调度器和租约续期, 注销本 worker
+    downloader_service.shutdown()
+    # (V16) 把写回缓冲中剩余的状态/进度写入数据库
+    flush_pending_updates()
 
 app = FastAPI(title="M3U8 Downloader API (V8)", lifespan=lifespan)
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"], expose_headers=["X-Next-Cursor", "ETag", "Content-Range", "Accept-Ranges", "Content-Length"])
 app.include_router(router_downloads.router)
 
+# (V24) Prometheus 文本格式的指标 (必须在前端的通配路由之前注册)
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(REGISTRY.expose(), media_type=METRICS_CONTENT_TYPE)
+
 # 9. 托管 Vue 前端 (使用绝对路径)
 app.mount("/assets", StaticFiles(directory=str(DIST_ASSETS_DIR)), name="assets")
 @app.get("/{full_path:path}", include_in_schema=False)
@@ -1,32 +1,122 @@
 # app/repository/repo_tasks.py
+import functools
+import os
 import sqlite3
+import time
 from pathlib import Path
 import threading
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+
+from app.core.metrics import SQLITE_LATENCY
 
 # --- 1. 数据库文件路径 (保持不变) ---
 DATABASE_FILE = Path(__file__).parent.parent.parent.joinpath("downloader.db")
 
 
-# --- 2. 数据库连接 (保持不变) ---
+# --- 2. 数据库连接 (V15: 线程本地的长连接 + WAL) ---
+# 每个线程复用自己的一条连接, 而不是每次调用都 connect/close:
+# - sqlite3 按连接缓存预编译语句 (cached_statements), 长连接才能真正命中缓存
+# - WAL 模式下读不会被写阻塞, API 的读请求不用等下载线程的写入
+_local = threading.local()
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",   # WAL 下 NORMAL 已足够安全, 且不会每次提交都 fsync
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",    # 约 16MB 页缓存
+)
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        DATABASE_FILE,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=256,
+        timeout=5.0,
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
 def get_db_conn():
     """
-    获取一个数据库连接。
-    (我们复用这个函数)
+    获取当前线程的数据库连接 (第一次调用时创建)。
+    调用方 *不要* 关闭它。
     """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        return conn
     try:
-        conn = sqlite3.connect(
-            DATABASE_FILE,
-            check_same_thread=False,
-            isolation_level=None
-        )
-        conn.row_factory = sqlite3.Row
+        conn = _connect()
+        _local.conn = conn
         return conn
     except Exception as e:
         print(f"[ERROR] 无法连接到 SQLite 数据库: {e}")
         return None
 
 
+def close_db_conn() -> None:
+    """关闭当前线程的连接 (例如在应用关闭时)"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _local.conn = None
+        conn.close()
+
+
+# --- (V16) 写回缓冲 (write-behind) ---
+# 状态和进度的更新先按 task_id 合并在内存中, 然后由后台线程
+# 每隔 DB_FLUSH_INTERVAL 秒 (或积压超过 DB_FLUSH_MAX_PENDING 个任务时)
+# 在 *一个* 事务中写入。终态 (complete / error) 会立即写入。
+DB_FLUSH_INTERVAL = float(os.environ.get("DB_FLUSH_INTERVAL", "0.5"))
+DB_FLUSH_MAX_PENDING = int(os.environ.get("DB_FLUSH_MAX_PENDING", "64"))
+TERMINAL_STATUSES = ("complete", "error")
+
+_pending_updates: Dict[str, Dict[str, Any]] = {}
+_inflight_updates: Dict[str, Dict[str, Any]] = {}  # 已取出、正在写入的批次
+_pending_cond = threading.Condition()
+_flush_lock = threading.Lock()
+_flusher: Optional[threading.Thread] = None
+
+
+# (V13) 进度相关的列 (也用于旧数据库的迁移)
+PROGRESS_COLUMNS = {
+    "progress": "REAL NOT NULL DEFAULT 0",
+    "downloaded_bytes": "INTEGER",
+    "total_bytes": "INTEGER",
+    "speed": "REAL",
+    "eta": "REAL",
+    "fragment_index": "INTEGER",
+    "fragment_count": "INTEGER",
+}
+
+# (V19) 去重相关的列: 规范化后的 URL, 完成文件的内容哈希和大小,
+#       以及直接复用了哪个任务的文件
+DEDUP_COLUMNS = {
+    "url_key": "TEXT",
+    "content_hash": "TEXT",
+    "content_size": "INTEGER",
+    "duplicate_of": "TEXT",
+}
+# (V29) 直播录制: 是否是直播任务, 以及每个任务自己的分段时长 / 大小 (为空时使用全局设置)
+LIVE_COLUMNS = {
+    "live": "INTEGER NOT NULL DEFAULT 0",
+    "rotate_seconds": "REAL",
+    "rotate_bytes": "INTEGER",
+}
+# (V31) 多进程 / 多节点: 任务由哪个 worker 持有 (租约到期前其他 worker 不会接手),
+#       以及其他 worker 转交过来的取消请求
+LEASE_COLUMNS = {
+    "lease_owner": "TEXT",
+    "lease_expires": "REAL",
+    "cancel_requested": "INTEGER NOT NULL DEFAULT 0",
+}
+ACTIVE_STATUSES = ("queued", "pending", "downloading", "merging")
+
+
 # --- 3. 数据库初始化 (保持不变) ---
 def init_db():
     """
@@ -44,54 +134,243 @@ def init_db():
         custom_name TEXT,
         final_filename TEXT,
         error_message TEXT,
-        startTime REAL
+        startTime REAL,
+        priority INTEGER NOT NULL DEFAULT 0,
+        progress REAL NOT NULL DEFAULT 0,
+        downloaded_bytes INTEGER,
+        total_bytes INTEGER,
+        speed REAL,
+        eta REAL,
+        fragment_index INTEGER,
+        fragment_count INTEGER,
+        url_key TEXT,
+        content_hash TEXT,
+        content_size INTEGER,
+        duplicate_of TEXT,
+        estimated_bytes INTEGER,
+        rate_limit INTEGER,
+        live INTEGER NOT NULL DEFAULT 0,
+        rotate_seconds REAL,
+        rotate_bytes INTEGER,
+        lease_owner TEXT,
+        lease_expires REAL,
+        cancel_requested INTEGER NOT NULL DEFAULT 0
+    );
+    """
+
+    create_segments_table_sql = """
+    CREATE TABLE IF NOT EXISTS task_segments (
+        task_id TEXT NOT NULL,
+        seq_index INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        PRIMARY KEY (task_id, seq_index)
     );
     """
 
-    conn = None
     try:
         conn = get_db_conn()
         if conn:
             cursor = conn.cursor()
             cursor.execute(create_table_sql)
+            # (V9) 旧数据库没有新增的列, 在这里补上
+            _ensure_column(cursor, "tasks", "priority", "INTEGER NOT NULL DEFAULT 0")
+            # (V13) 结构化进度
+            for column, ddl in PROGRESS_COLUMNS.items():
+                _ensure_column(cursor, "tasks", column, ddl)
+            # (V19) URL 去重 / 内容哈希
+            for column, ddl in DEDUP_COLUMNS.items():
+                _ensure_column(cursor, "tasks", column, ddl)
+            # (V21) 下载前的大小预估
+            _ensure_column(cursor, "tasks", "estimated_bytes", "INTEGER")
+            # (V23) 单任务带宽上限 (字节/秒)
+            _ensure_column(cursor, "tasks", "rate_limit", "INTEGER")
+            # (V29) 直播录制及其分段设置
+            for column, ddl in LIVE_COLUMNS.items():
+                _ensure_column(cursor, "tasks", column, ddl)
+            # (V31) 任务租约
+            for column, ddl in LEASE_COLUMNS.items():
+                _ensure_column(cursor, "tasks", column, ddl)
+            # (V12) 断点续传: 每个任务已完成 (已写入输出文件) 的片段
+            cursor.execute(create_segments_table_sql)
+            # (V17) 带版本号的迁移 (索引等)
+            _run_migrations(cursor)
             conn.commit()
             print("--- [DATABASE] 数据库和 'tasks' 表已成功初始化。")
     except Exception as e:
         print(f"[ERROR] 无法初始化数据库: {e}")
-    finally:
-        if conn:
-            conn.close()
+
+
+def _ensure_column(cursor, table: str, column: str, ddl: str) -> None:
+    """
+    (V9) 简单的 schema 迁移: 如果表中缺少某列, 就用 ALTER TABLE 补上
+    """
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row["name"] for row in cursor.fetchall()}
+    if column not in existing:
+        print(f"--- [DATABASE] 迁移: 为 '{table}' 表添加列 '{column}'")
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+# (V17) 按顺序执行的 schema 迁移; 已执行到的版本号记录在 PRAGMA user_version 中。
+# 新的迁移只能追加到末尾。
+MIGRATIONS = [
+    # 1: 任务列表的 keyset 分页 (startTime DESC, id DESC) 以及按状态 / 路径过滤
+    [
+        "CREATE INDEX IF NOT EXISTS idx_tasks_start ON tasks (startTime DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_status_start ON tasks (status, startTime DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_path_start ON tasks (path, startTime DESC, id DESC)",
+    ],
+    # 2: (V19) 按规范化 URL 和内容哈希查找重复的任务
+    [
+        "CREATE INDEX IF NOT EXISTS idx_tasks_url_key ON tasks (url_key, status)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_content_hash ON tasks (content_hash, content_size)",
+    ],
+    # 3: (V25) 每个任务每次运行 (attempt) 的阶段时间线
+    [
+        """
+        CREATE TABLE IF NOT EXISTS task_phases (
+            task_id TEXT NOT NULL,
+            attempt INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            phase TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            ended_at REAL,
+            duration REAL,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            cpu_seconds REAL,
+            PRIMARY KEY (task_id, attempt, seq)
+        )
+        """,
+    ],
+    # 4: (V27) 每个主机学到的分片并发数
+    [
+        """
+        CREATE TABLE IF NOT EXISTS host_tuning (
+            host TEXT PRIMARY KEY,
+            concurrency INTEGER NOT NULL,
+            throughput REAL,
+            throttles INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL
+        )
+        """,
+    ],
+    # 5: (V29) 直播录制任务已经完成的输出分段
+    [
+        """
+        CREATE TABLE IF NOT EXISTS task_recordings (
+            task_id TEXT NOT NULL,
+            part INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            ended_at REAL NOT NULL,
+            duration REAL NOT NULL,
+            size INTEGER NOT NULL,
+            segments INTEGER NOT NULL,
+            first_sequence INTEGER,
+            last_sequence INTEGER,
+            PRIMARY KEY (task_id, part)
+        )
+        """,
+    ],
+    # 6: (V31) 任务租约 + 共享同一个数据库的 worker 进程
+    [
+        "CREATE INDEX IF NOT EXISTS idx_tasks_lease_owner ON tasks (lease_owner)",
+        """
+        CREATE TABLE IF NOT EXISTS workers (
+            id TEXT PRIMARY KEY,
+            host TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            started_at REAL NOT NULL,
+            heartbeat_at REAL NOT NULL
+        )
+        """,
+    ],
+    # 7: (V19) 内容哈希只在出现大小相同的文件时才计算, 先按大小查找
+    [
+        "CREATE INDEX IF NOT EXISTS idx_tasks_content_size ON tasks (content_size, status)",
+    ],
+]
+
+
+def _run_migrations(cursor) -> None:
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for number, statements in enumerate(MIGRATIONS, start=1):
+        if number <= version:
+            continue
+        print(f"--- [DATABASE] 执行迁移 #{number}")
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute(f"PRAGMA user_version = {number}")
 
 
 # --- 【【【V6 核心：CRUD 函数】】】 ---
 # 这些函数是 Service 层和数据库之间的唯一接口
 
+def _timed(fn):
+    """(V24) 把调用耗时记入 downloader_sqlite_call_duration_seconds{op=函数名}"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            SQLITE_LATENCY.observe(time.perf_counter() - start, op=fn.__name__)
+    return wrapper
+
+
+CREATE_TASK_SQL = """
+INSERT INTO tasks (id, url, path, status, custom_name, startTime, priority, url_key, rate_limit,
+                   live, rotate_seconds, rotate_bytes, lease_owner, lease_expires)
+VALUES (:id, :url, :path, :status, :custom_name, :startTime, :priority, :url_key, :rate_limit,
+        :live, :rotate_seconds, :rotate_bytes, :lease_owner, :lease_expires)
+"""
+CREATE_TASK_DEFAULTS = {"custom_name": None, "priority": 0, "url_key": None, "rate_limit": None,
+                        "live": 0, "rotate_seconds": None, "rotate_bytes": None,
+                        "lease_owner": None, "lease_expires": None}
+
+
+@_timed
 def create_task(task_data: Dict[str, Any]) -> None:
     """
     (Create) 向数据库中插入一条新的任务记录
     """
     print(f"--- [REPO] Creating task: {task_data.get('id')}")
-    sql = """
-    INSERT INTO tasks (id, url, path, status, custom_name, startTime)
-    VALUES (:id, :url, :path, :status, :custom_name, :startTime)
-    """
+    task_data = {**CREATE_TASK_DEFAULTS, **task_data}
     try:
         conn = get_db_conn()
         cursor = conn.cursor()
-        cursor.execute(sql, task_data)
+        cursor.execute(CREATE_TASK_SQL, task_data)
         conn.commit()
     except Exception as e:
         print(f"[ERROR] [REPO] 无法创建任务: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 
+@_timed
+def create_tasks(tasks: List[Dict[str, Any]]) -> None:
+    """
+    (V28) (Create) 在一个事务中插入多条任务记录 (批量提交)。
+    与 create_task 不同, 失败时抛出异常: 要么全部插入, 要么一条都不插入。
+    """
+    if not tasks:
+        return
+    print(f"--- [REPO] Creating {len(tasks)} tasks in one transaction")
+    conn = get_db_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(CREATE_TASK_SQL, [{**CREATE_TASK_DEFAULTS, **task} for task in tasks])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+@_timed
 def get_all_tasks() -> List[Dict[str, Any]]:
     """
     (Read) 从数据库中获取所有任务
     """
     print("--- [REPO] Getting all tasks")
+    flush_pending_updates()
     sql = "SELECT * FROM tasks ORDER BY startTime DESC"
     tasks = []
     try:
@@ -105,11 +384,54 @@ def get_all_tasks() -> List[Dict[str, Any]]:
     except Exception as e:
         print(f"[ERROR] [REPO] 无法获取所有任务: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 
 
+# (V17) 列表的轻量投影: 不包含 error_message / custom_name 等大字段
+SUMMARY_COLUMNS = ("id", "status", "url", "path", "progress", "final_filename", "startTime", "priority")
+
+
+@_timed
+def list_tasks(limit: Optional[int] = None, after: Optional[Tuple[float, str]] = None,
+               statuses: Optional[List[str]] = None, url_contains: Optional[str] = None,
+               path: Optional[str] = None, summary: bool = False) -> List[Dict[str, Any]]:
+    """
+    (Read) (V17) 分页 + 过滤的任务列表, 按 (startTime DESC, id DESC) 排序。
+
+    - after: 上一页最后一行的 (startTime, id), 用于 keyset 分页
+    - statuses / url_contains / path: 过滤条件
+    - summary: 只读取 SUMMARY_COLUMNS
+    """
+    flush_pending_updates()
+    columns = ", ".join(SUMMARY_COLUMNS) if summary else "*"
+    where, params = [], []
+    if statuses:
+        where.append(f"status IN ({', '.join('?' for _ in statuses)})")
+        params += list(statuses)
+    if path:
+        where.append("path = ?")
+        params.append(path)
+    if url_contains:
+        where.append("instr(url, ?) > 0")
+        params.append(url_contains)
+    if after:
+        where.append("(startTime < ? OR (startTime = ? AND id < ?))")
+        params += [after[0], after[0], after[1]]
+    sql = f"SELECT {columns} FROM tasks"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY startTime DESC, id DESC"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    try:
+        conn = get_db_conn()
+        return [dict(row) for row in conn.execute(sql, params)]
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法获取任务列表: {e}")
+        return []
+
+
+@_timed
 def get_task_by_id(task_id: str) -> Optional[Dict[str, Any]]:
     """
     (Read) 从数据库中获取单个任务
@@ -121,57 +443,648 @@ def get_task_by_id(task_id: str) -> Optional[Dict[str, Any]]:
         cursor = conn.cursor()
         cursor.execute(sql, (task_id,))
         row = cursor.fetchone()
-        return dict(row) if row else None
+        return _with_pending(dict(row)) if row else None
     except Exception as e:
         print(f"[ERROR] [REPO] 无法获取任务 {task_id}: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
+
+
+@_timed
+def get_tasks_by_status(statuses: List[str]) -> List[Dict[str, Any]]:
+    """
+    (Read) (V9) 按状态获取任务, 按优先级 (高→低) 和提交时间 (早→晚) 排序。
+    调度器在启动时用它来恢复排队中的任务。
+    """
+    print(f"--- [REPO] Getting tasks with status in {statuses}")
+    flush_pending_updates()
+    placeholders = ", ".join("?" for _ in statuses)
+    sql = f"SELECT * FROM tasks WHERE status IN ({placeholders}) ORDER BY priority DESC, startTime ASC"
+    try:
+        conn = get_db_conn()
+        cursor = conn.cursor()
+        cursor.execute(sql, list(statuses))
+        return [dict(row) for row in cursor.fetchall()]
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法按状态获取任务: {e}")
+        return []
 
 
 def update_task_status(task_id: str, status: str, error_msg: Optional[str] = None,
                        final_name: Optional[str] = None) -> None:
     """
     (Update) 更新一个任务的状态、错误信息和最终文件名
+
+    (V16) 进入写回缓冲; 终态 (complete / error) 会连同该任务之前
+    积压的进度一起立即写入数据库。
     """
     print(f"--- [REPO] Updating task {task_id} to status {status}")
-    sql = """
-    UPDATE tasks
-    SET status = :status, error_message = :error_msg, final_filename = :final_name
-    WHERE id = :task_id
-    """
-    params = {
+    _queue_update(task_id, {
         "status": status,
-        "error_msg": error_msg,
-        "final_name": final_name,
-        "task_id": task_id
-    }
+        "error_message": error_msg,
+        "final_filename": final_name,
+    }, immediate=status in TERMINAL_STATUSES)
+
+
+def update_task_progress(task_id: str, progress: Dict[str, Any]) -> None:
+    """
+    (Update) (V13) 更新一个任务的结构化进度 (只更新 PROGRESS_COLUMNS 中的列)
+    (V16) 进入写回缓冲, 同一任务的多次更新只保留最新值
+    """
+    values = {k: v for k, v in progress.items() if k in PROGRESS_COLUMNS}
+    if values:
+        _queue_update(task_id, values)
+
+
+def set_task_content(task_id: str, content_hash: Optional[str], content_size: int,
+                     duplicate_of: Optional[str] = None) -> None:
+    """
+    (Update) (V19) 记录完成文件的内容哈希和大小。
+    与随后的 'complete' 状态一起写入数据库。
+    目录中没有大小相同的文件时不计算哈希 (content_hash 为 None), 以后需要比较时再补上。
+    """
+    _queue_update(task_id, {
+        "content_hash": content_hash,
+        "content_size": content_size,
+        "duplicate_of": duplicate_of,
+    })
+
+
+def set_task_content_hash(task_id: str, content_hash: str) -> None:
+    """
+    (Update) (V19) 补上之前没有计算的内容哈希
+    """
+    _queue_update(task_id, {"content_hash": content_hash})
+
+
+def update_task_estimate(task_id: str, estimated_bytes: int) -> None:
+    """
+    (Update) (V21) 记录下载前预估的大小 (字节)
+    """
+    _queue_update(task_id, {"estimated_bytes": estimated_bytes})
+
+
+def update_task_rate_limit(task_id: str, rate_limit: Optional[int]) -> None:
+    """
+    (Update) (V23) 修改单任务带宽上限 (字节/秒), None 表示不限速
+    """
+    _queue_update(task_id, {"rate_limit": rate_limit})
+
+
+def set_task_live(task_id: str) -> None:
+    """
+    (Update) (V29) 标记为直播录制任务 (下载时才发现播放列表没有 #EXT-X-ENDLIST)
+    """
+    _queue_update(task_id, {"live": 1})
+
+
+# --- 【【【V19 新增：去重查询】】】 ---
+
+@_timed
+def find_active_task(url_key: str, path: str) -> Optional[Dict[str, Any]]:
+    """
+    (Read) 同一目录下, 同一个 (规范化) URL 的排队中 / 运行中的任务
+    """
+    # 先写入缓冲: 非终态的状态变化不会立即写入 (例如重试时 error -> queued)
+    flush_pending_updates()
+    placeholders = ", ".join("?" for _ in ACTIVE_STATUSES)
+    sql = (f"SELECT * FROM tasks WHERE url_key = ? AND path = ? AND status IN ({placeholders}) "
+           "ORDER BY startTime ASC LIMIT 1")
     try:
         conn = get_db_conn()
-        cursor = conn.cursor()
-        cursor.execute(sql, params)
-        conn.commit()
+        row = conn.execute(sql, (url_key, path, *ACTIVE_STATUSES)).fetchone()
+        return dict(row) if row else None
     except Exception as e:
-        print(f"[ERROR] [REPO] 无法更新任务 {task_id}: {e}")
-    finally:
-        if conn:
-            conn.close()
+        print(f"[ERROR] [REPO] 无法查找运行中的重复任务: {e}")
+        return None
+
+
+@_timed
+def find_active_tasks(url_keys: List[str], path: str) -> Dict[str, str]:
+    """
+    (V28) (Read) find_active_task 的批量版本: {url_key: 最早的排队中 / 运行中任务的 ID}
+    """
+    flush_pending_updates()
+    found: Dict[str, str] = {}
+    statuses = ", ".join("?" for _ in ACTIVE_STATUSES)
+    try:
+        conn = get_db_conn()
+        # SQLite 对一条语句的参数个数有上限, 分批查询
+        for start in range(0, len(url_keys), 500):
+            chunk = url_keys[start:start + 500]
+            keys = ", ".join("?" for _ in chunk)
+            sql = (f"SELECT id, url_key FROM tasks WHERE path = ? AND status IN ({statuses}) "
+                   f"AND url_key IN ({keys}) ORDER BY startTime DESC")
+            for row in conn.execute(sql, (path, *ACTIVE_STATUSES, *chunk)):
+                found[row["url_key"]] = row["id"]   # 按时间倒序, 最后留下的是最早的
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法批量查找运行中的重复任务: {e}")
+    return found
+
+
+@_timed
+def find_completed_by_url(url_key: str) -> List[Dict[str, Any]]:
+    """
+    (Read) 同一个 (规范化) URL 已完成且记录了文件大小的任务, 最新的在前
+    """
+    sql = ("SELECT * FROM tasks WHERE url_key = ? AND status = 'complete' AND content_size IS NOT NULL "
+           "ORDER BY startTime DESC")
+    try:
+        conn = get_db_conn()
+        return [dict(row) for row in conn.execute(sql, (url_key,))]
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法按 URL 查找已完成的任务: {e}")
+        return []
+
+
+@_timed
+def find_completed_by_size(content_size: int) -> List[Dict[str, Any]]:
+    """
+    (Read) 文件大小相同的已完成任务 (可能内容相同), 最新的在前
+    """
+    flush_pending_updates()
+    sql = "SELECT * FROM tasks WHERE content_size = ? AND status = 'complete' ORDER BY startTime DESC"
+    try:
+        conn = get_db_conn()
+        return [_with_pending(dict(row)) for row in conn.execute(sql, (content_size,))]
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法按文件大小查找任务: {e}")
+        return []
+
+
+# --- 【【【V16 新增：写回缓冲】】】 ---
+
+def _queue_update(task_id: str, values: Dict[str, Any], immediate: bool = False) -> None:
+    global _flusher
+    with _pending_cond:
+        _pending_updates.setdefault(task_id, {}).update(values)
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_loop, name="db-write-behind")
+            _flusher.daemon = True
+            _flusher.start()
+        if len(_pending_updates) >= DB_FLUSH_MAX_PENDING:
+            _pending_cond.notify()
+    if immediate:
+        flush_pending_updates()
+
+
+def _with_pending(task: Dict[str, Any]) -> Dict[str, Any]:
+    """把还没写入的更新叠加到读出的行上, 保证 "读到自己的写入" """
+    with _pending_cond:
+        for buffer in (_inflight_updates, _pending_updates):
+            pending = buffer.get(task["id"])
+            if pending:
+                task.update(pending)
+    return task
+
 
+def _flush_loop() -> None:
+    while True:
+        with _pending_cond:
+            _pending_cond.wait(DB_FLUSH_INTERVAL)
+        flush_pending_updates()
 
+
+def flush_pending_updates() -> None:
+    """
+    把缓冲中的所有更新在一个事务中写入数据库。
+    (_flush_lock 保证同一时刻只有一个线程在写, 写入顺序与取出顺序一致)
+    """
+    with _flush_lock:
+        with _pending_cond:
+            if not _pending_updates:
+                return
+            batch = dict(_pending_updates)
+            _pending_updates.clear()
+            _inflight_updates.update(batch)
+        try:
+            # (V24) 只统计真正写入数据库的批次 (空缓冲直接返回, 不计入)
+            with SQLITE_LATENCY.time(op="flush_pending_updates"):
+                conn = get_db_conn()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    for task_id, values in batch.items():
+                        with _pending_cond:
+                            if task_id not in _inflight_updates:
+                                continue  # 写入期间被 delete_task 删除
+                        assignments = ", ".join(f"{column} = :{column}" for column in values)
+                        conn.execute(f"UPDATE tasks SET {assignments} WHERE id = :task_id",
+                                     {**values, "task_id": task_id})
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+        except Exception as e:
+            print(f"[ERROR] [REPO] 批量写入 {len(batch)} 个任务的更新失败: {e}")
+            # 放回缓冲 (不覆盖在此期间产生的更新的值), 下次再试
+            with _pending_cond:
+                for task_id, values in batch.items():
+                    if task_id not in _inflight_updates:
+                        continue
+                    _pending_updates[task_id] = {**values, **_pending_updates.get(task_id, {})}
+        finally:
+            with _pending_cond:
+                _inflight_updates.clear()
+
+
+@_timed
 def delete_task(task_id: str) -> None:
     """
     (Delete) 从数据库中删除一条任务记录
     """
     print(f"--- [REPO] Deleting task: {task_id}")
+    # 同时从正在写入的批次中去掉: flush 不会再写它, 失败时也不会把它放回缓冲
+    with _pending_cond:
+        _pending_updates.pop(task_id, None)
+        _inflight_updates.pop(task_id, None)
     sql = "DELETE FROM tasks WHERE id = ?"
     try:
         conn = get_db_conn()
         cursor = conn.cursor()
         cursor.execute(sql, (task_id,))
+        cursor.execute("DELETE FROM task_phases WHERE task_id = ?", (task_id,))
+        cursor.execute("DELETE FROM task_recordings WHERE task_id = ?", (task_id,))
         conn.commit()
     except Exception as e:
         print(f"[ERROR] [REPO] 无法删除任务 {task_id}: {e}")
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+
+
+# --- 【【【V12 新增：片段检查点】】】 ---
+
+@_timed
+def add_task_segment(task_id: str, seq_index: int, size: int) -> None:
+    """
+    (Create) 记录一个已经写入输出文件的片段
+    """
+    sql = "INSERT OR REPLACE INTO task_segments (task_id, seq_index, size) VALUES (?, ?, ?)"
+    try:
+        conn = get_db_conn()
+        conn.execute(sql, (task_id, seq_index, size))
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法记录片段检查点 {task_id}#{seq_index}: {e}")
+
+
+@_timed
+def get_task_checkpoint(task_id: str) -> Tuple[int, int]:
+    """
+    (Read) 返回 (从 0 开始连续完成的片段数, 这些片段的总字节数)
+    """
+    sql = "SELECT seq_index, size FROM task_segments WHERE task_id = ? ORDER BY seq_index"
+    try:
+        conn = get_db_conn()
+        count, offset = 0, 0
+        for row in conn.execute(sql, (task_id,)):
+            if row["seq_index"] != count:
+                break
+            count += 1
+            offset += row["size"]
+        return count, offset
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法读取片段检查点 {task_id}: {e}")
+        return 0, 0
+
+
+@_timed
+def clear_task_segments(task_id: str) -> None:
+    """
+    (Delete) 删除一个任务的所有片段检查点
+    """
+    sql = "DELETE FROM task_segments WHERE task_id = ?"
+    try:
+        conn = get_db_conn()
+        conn.execute(sql, (task_id,))
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法清除片段检查点 {task_id}: {e}")
+
+
+# --- 【【【V25 新增：阶段时间线】】】 ---
+
+PHASE_COLUMNS = ("phase", "started_at", "ended_at", "duration", "bytes", "cpu_seconds")
+
+
+@_timed
+def save_task_phases(task_id: str, spans: List[Dict[str, Any]]) -> None:
+    """
+    (Create) 把一次运行的所有阶段作为新的 attempt 写入 (续传后的运行不会覆盖之前的记录)
+    """
+    if not spans:
+        return
+    try:
+        conn = get_db_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT MAX(attempt) FROM task_phases WHERE task_id = ?", (task_id,)).fetchone()
+            attempt = (row[0] or 0) + 1
+            conn.executemany(
+                "INSERT INTO task_phases (task_id, attempt, seq, phase, started_at, ended_at, duration, bytes, cpu_seconds) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(task_id, attempt, seq, *(span.get(column) for column in PHASE_COLUMNS))
+                 for seq, span in enumerate(spans)],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法保存任务 {task_id} 的阶段时间线: {e}")
+
+
+@_timed
+def get_task_phases(task_id: str) -> List[Dict[str, Any]]:
+    """
+    (Read) 一个任务所有运行的阶段, 按 attempt / 顺序排列
+    """
+    sql = ("SELECT attempt, " + ", ".join(PHASE_COLUMNS) +
+           " FROM task_phases WHERE task_id = ? ORDER BY attempt, seq")
+    try:
+        conn = get_db_conn()
+        return [dict(row) for row in conn.execute(sql, (task_id,))]
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法读取任务 {task_id} 的阶段时间线: {e}")
+        return []
+
+
+# --- 【【【V29 新增：直播录制的分段】】】 ---
+
+RECORDING_COLUMNS = ("part", "filename", "started_at", "ended_at", "duration", "size", "segments",
+                     "first_sequence", "last_sequence")
+
+
+@_timed
+def add_task_recording(task_id: str, recording: Dict[str, Any]) -> None:
+    """
+    (Create) 登记一个已经移动到下载目录的直播分段
+    """
+    sql = (f"INSERT OR REPLACE INTO task_recordings (task_id, {', '.join(RECORDING_COLUMNS)}) "
+           f"VALUES (:task_id, {', '.join(':' + column for column in RECORDING_COLUMNS)})")
+    try:
+        conn = get_db_conn()
+        conn.execute(sql, {**{column: recording.get(column) for column in RECORDING_COLUMNS}, "task_id": task_id})
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法登记任务 {task_id} 的直播分段 #{recording.get('part')}: {e}")
+
+
+@_timed
+def get_task_recordings(task_id: str) -> List[Dict[str, Any]]:
+    """
+    (Read) 一个直播任务的所有分段, 按顺序排列
+    """
+    sql = f"SELECT {', '.join(RECORDING_COLUMNS)} FROM task_recordings WHERE task_id = ? ORDER BY part"
+    try:
+        conn = get_db_conn()
+        return [dict(row) for row in conn.execute(sql, (task_id,))]
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法读取任务 {task_id} 的直播分段: {e}")
+        return []
+
+
+# --- 【【【V27 新增：按主机学到的并发数】】】 ---
+
+@_timed
+def get_host_tuning() -> List[Dict[str, Any]]:
+    """
+    (Read) 所有主机学到的并发级别
+    """
+    try:
+        conn = get_db_conn()
+        return [dict(row) for row in conn.execute("SELECT * FROM host_tuning")]
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法读取主机并发设置: {e}")
+        return []
+
+
+@_timed
+def save_host_tuning(rows: List[Dict[str, Any]]) -> None:
+    """
+    (Upsert) 保存若干主机的并发级别
+    """
+    sql = """
+    INSERT INTO host_tuning (host, concurrency, throughput, throttles, updated_at)
+    VALUES (:host, :concurrency, :throughput, :throttles, :updated_at)
+    ON CONFLICT(host) DO UPDATE SET
+        concurrency = excluded.concurrency,
+        throughput = excluded.throughput,
+        throttles = excluded.throttles,
+        updated_at = excluded.updated_at
+    """
+    try:
+        conn = get_db_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(sql, rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法保存主机并发设置: {e}")
+
+
+# --- 【【【V31 新增：任务租约 / worker 注册】】】 ---
+# 租约相关的写入都直接提交 (不经过写回缓冲): 其他进程必须立即看到
+
+@_timed
+def claim_task(task_id: str, owner: str, ttl: float, start: bool = False) -> bool:
+    """
+    (Update) 为 owner 获取 (或续期) 一个任务的租约。
+    任务没有租约、租约已经到期或者本来就属于 owner 时成功, 返回是否成功。
+
+    start=True: 任务即将开始下载, 在同一条 UPDATE 中把状态改为 'downloading',
+    这样其他 worker 不会再把它当作排队中的任务拿走 (见 take_queued_tasks)
+    """
+    now = time.time()
+    sql = f"""
+    UPDATE tasks SET lease_owner = ?, lease_expires = ?{", status = 'downloading'" if start else ""}
+    WHERE id = ? AND (lease_owner IS NULL OR lease_owner = ? OR lease_expires < ?)
+    """
+    try:
+        if start:
+            # 缓冲中还没写入的 'queued' 不能在这之后覆盖掉 'downloading'
+            flush_pending_updates()
+        conn = get_db_conn()
+        return conn.execute(sql, (owner, now + ttl, task_id, owner, now)).rowcount == 1
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法获取任务 {task_id} 的租约: {e}")
+        return False
+
+
+@_timed
+def release_task(task_id: str, owner: str) -> None:
+    """
+    (Update) 任务结束: 释放 owner 持有的租约, 清除未处理的取消请求
+    """
+    sql = ("UPDATE tasks SET lease_owner = NULL, lease_expires = NULL, cancel_requested = 0 "
+           "WHERE id = ? AND lease_owner = ?")
+    try:
+        conn = get_db_conn()
+        conn.execute(sql, (task_id, owner))
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法释放任务 {task_id} 的租约: {e}")
+
+
+@_timed
+def renew_leases(owner: str, ttl: float) -> Dict[str, bool]:
+    """
+    (Update + Read) 一次续期 owner 持有的所有租约,
+    返回 {task_id: 是否有其他 worker 转交来的取消请求}。
+    不在结果中的本地任务说明已经被删除, 或者租约过期后被其他 worker 接手了。
+    """
+    try:
+        conn = get_db_conn()
+        conn.execute("UPDATE tasks SET lease_expires = ? WHERE lease_owner = ?", (time.time() + ttl, owner))
+        rows = conn.execute("SELECT id, cancel_requested FROM tasks WHERE lease_owner = ?", (owner,))
+        return {row["id"]: bool(row["cancel_requested"]) for row in rows}
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法续期 worker {owner} 的租约: {e}")
+        return {}
+
+
+@_timed
+def clear_cancel_request(task_id: str) -> None:
+    """
+    (Update) 取消请求已经由持有租约的 worker 处理
+    """
+    try:
+        conn = get_db_conn()
+        conn.execute("UPDATE tasks SET cancel_requested = 0 WHERE id = ?", (task_id,))
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法清除任务 {task_id} 的取消请求: {e}")
+
+
+@_timed
+def request_cancel(task_id: str, requester: str) -> Optional[str]:
+    """
+    (Update) 把取消请求转交给持有租约的 (其他) worker。
+    返回那个 worker 的 ID; 任务不属于任何活着的其他 worker 时返回 None。
+    """
+    now = time.time()
+    try:
+        conn = get_db_conn()
+        row = conn.execute(
+            "SELECT lease_owner FROM tasks WHERE id = ? AND lease_owner IS NOT NULL AND lease_owner != ? "
+            "AND lease_expires >= ?", (task_id, requester, now)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE tasks SET cancel_requested = 1 WHERE id = ? AND lease_owner = ?",
+                     (task_id, row["lease_owner"]))
+        return row["lease_owner"]
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法转交任务 {task_id} 的取消请求: {e}")
+        return None
+
+
+@_timed
+def adopt_orphaned_tasks(owner: str, ttl: float, exclude: List[str],
+                         reclaim_own: bool = False) -> List[Dict[str, Any]]:
+    """
+    (Update + Read) 接手没有租约或租约已经到期的排队中 / 运行中任务
+    (持有它们的 worker 已经退出, 或者是旧版本创建的任务)。
+    在一个事务中完成, 所以同一个任务只会被一个 worker 接手。
+    exclude: 本进程已经在处理的任务
+    reclaim_own: 启动时同时接回租约仍属于 owner 的任务 (固定 WORKER_ID 的 worker 重启)
+    """
+    now = time.time()
+    statuses = ", ".join("?" for _ in ACTIVE_STATUSES)
+    sql = (f"SELECT * FROM tasks WHERE status IN ({statuses}) "
+           f"AND (lease_owner IS NULL OR lease_owner = ? OR lease_expires < ?) ORDER BY startTime")
+    try:
+        conn = get_db_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            excluded = set(exclude)
+            rows = [dict(row) for row in conn.execute(sql, (*ACTIVE_STATUSES, owner if reclaim_own else None, now))
+                    if row["id"] not in excluded]
+            conn.executemany("UPDATE tasks SET lease_owner = ?, lease_expires = ?, cancel_requested = 0 WHERE id = ?",
+                             [(owner, now + ttl, row["id"]) for row in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [_with_pending(row) for row in rows]
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法接手无主的任务: {e}")
+        return []
+
+
+@_timed
+def take_queued_tasks(owner: str, ttl: float, limit: int) -> List[Dict[str, Any]]:
+    """
+    (Update + Read) owner 有空闲的下载槽位: 从其他 worker 的等待队列中拿走最多 limit 个
+    还没开始的任务 (按优先级、提交时间)。原来的 worker 续期时发现任务不再属于自己, 会把它移出队列。
+    """
+    now = time.time()
+    sql = """
+    SELECT * FROM tasks WHERE status = 'queued' AND lease_owner IS NOT NULL AND lease_owner != ?
+    AND lease_expires >= ? AND cancel_requested = 0
+    ORDER BY priority DESC, startTime LIMIT ?
+    """
+    if limit <= 0:
+        return []
+    try:
+        conn = get_db_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = [dict(row) for row in conn.execute(sql, (owner, now, limit))]
+            conn.executemany("UPDATE tasks SET lease_owner = ?, lease_expires = ? WHERE id = ? AND status = 'queued'",
+                             [(owner, now + ttl, row["id"]) for row in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法从其他 worker 的队列中获取任务: {e}")
+        return []
+
+
+@_timed
+def heartbeat_worker(worker_id: str, host: str, pid: int, started_at: float) -> None:
+    """
+    (Upsert) 登记 / 刷新一个 worker 进程
+    """
+    sql = """
+    INSERT INTO workers (id, host, pid, started_at, heartbeat_at) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at
+    """
+    try:
+        conn = get_db_conn()
+        conn.execute(sql, (worker_id, host, pid, started_at, time.time()))
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法刷新 worker {worker_id} 的心跳: {e}")
+
+
+@_timed
+def get_workers(alive_since: float) -> List[Dict[str, Any]]:
+    """
+    (Read) 心跳在 alive_since 之后的 worker, 以及每个 worker 当前持有的任务数
+    """
+    sql = """
+    SELECT w.*, (SELECT COUNT(*) FROM tasks t WHERE t.lease_owner = w.id) AS tasks
+    FROM workers w WHERE w.heartbeat_at >= ? ORDER BY w.started_at
+    """
+    try:
+        conn = get_db_conn()
+        return [dict(row) for row in conn.execute(sql, (alive_since,))]
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法读取 worker 列表: {e}")
+        return []
+
+
+@_timed
+def remove_worker(worker_id: str, stale_before: Optional[float] = None) -> None:
+    """
+    (Delete) 注销一个 worker (正常退出时); 同时清理心跳早于 stale_before 的记录
+    """
+    try:
+        conn = get_db_conn()
+        conn.execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+        if stale_before is not None:
+            conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (stale_before,))
+    except Exception as e:
+        print(f"[ERROR] [REPO] 无法注销 worker {worker_id}: {e}")
+
+
+def data_version() -> int:
+    """
+    (V31) 当前线程连接的 PRAGMA data_version: 其他连接 (包括其他进程) 提交后会变化
+    """
+    return get_db_conn().execute("PRAGMA data_version").fetchone()[0]
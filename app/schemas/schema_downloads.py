@@ -1,6 +1,6 @@
 # app/schemas/schema_downloads.py
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, root_validator
+from typing import Dict, List, Optional
 
 # Field(...) 意味着这个字段是必需的
 # Optional[str] = None 意味着这个字段是可选的
@@ -21,6 +21,45 @@ class DownloadRequest(BaseModel):
     custom_filename: Optional[str] = Field(None, description="用户自定义的文件名 (不含扩展名)")
     # --- 【【【修复结束】】】 ---
 
+    # (V9) 调度优先级: 数字越大越先开始
+    priority: int = Field(0, description="调度优先级 (越大越优先)")
+
+    # (V19) 默认会复用同一 URL 已下载的文件 / 正在进行的任务; 为 True 时强制重新下载
+    force: bool = Field(False, description="忽略已下载的文件, 强制重新下载")
+
+    # (V23) 单任务带宽上限
+    rate_limit: Optional[int] = Field(None, ge=0, description="单任务带宽上限 (字节/秒), 不传或 0 表示不限速")
+
+    # (V29) 直播录制: 直接的 .m3u8 链接会自动识别, 网页直播需要指定; 分段设置不传时使用全局设置
+    live: bool = Field(False, description="按直播录制 (持续轮询播放列表, 分段保存)")
+    rotate_seconds: Optional[float] = Field(None, gt=0, description="每个分段的最长时长 (秒)")
+    rotate_bytes: Optional[int] = Field(None, gt=0, description="每个分段的最大大小 (字节)")
+
+class BatchDownloadRequest(BaseModel):
+    """
+    (V28) 这是 POST /api/v1/start-download/batch 接收的 JSON:
+    多个 URL, 或者一个由服务端展开的播放列表 / 频道 URL (也可以两者都给)
+    """
+    urls: List[str] = Field([], description="要下载的 URL 列表")
+    playlist_url: Optional[str] = Field(None, description="播放列表 / 频道 URL, 用 yt-dlp 展开成单个视频")
+    max_items: Optional[int] = Field(None, ge=1, description="播放列表最多展开多少个条目")
+    download_path: str = Field(..., description="用户提供的绝对路径...")
+    priority: int = Field(0, description="调度优先级 (越大越优先)")
+    force: bool = Field(False, description="忽略已下载的文件, 强制重新下载")
+    rate_limit: Optional[int] = Field(None, ge=0, description="单任务带宽上限 (字节/秒), 不传或 0 表示不限速")
+
+    @root_validator(skip_on_failure=True)
+    def _urls_or_playlist(cls, values):
+        if not values.get("urls") and not values.get("playlist_url"):
+            raise ValueError("urls 和 playlist_url 至少需要一个")
+        return values
+
+class BandwidthLimitRequest(BaseModel):
+    """
+    (V23) 这是 PUT /api/v1/system/bandwidth 和 PUT /api/v1/task/{id}/bandwidth 接收的 JSON
+    """
+    limit: int = Field(..., ge=0, description="带宽上限 (字节/秒), 0 表示不限速")
+
 class FileDeleteRequest(BaseModel):
     """
     这是 DELETE /api/v1/file 接收的 JSON
@@ -51,9 +90,28 @@ class TaskStatusResponse(BaseModel):
     path: str
     log: Optional[str] = None
     progress: float = 0
+    # (V13) 结构化进度: 字节数、速度 (字节/秒)、ETA (秒) 和片段序号
+    downloaded_bytes: Optional[int] = None
+    total_bytes: Optional[int] = None
+    speed: Optional[float] = None
+    eta: Optional[float] = None
+    fragment_index: Optional[int] = None
+    fragment_count: Optional[int] = None
     final_filename: Optional[str] = None
     error_message: Optional[str] = None
     startTime: Optional[float] = None # 我们用它来排序
+    priority: int = 0
+    # (V19) 完成文件的 sha256, 以及复用了哪个任务的文件 (没有复用时为空)
+    content_hash: Optional[str] = None
+    duplicate_of: Optional[str] = None
+    # (V21) 下载前预估的大小 (字节), 用于磁盘空间预留
+    estimated_bytes: Optional[int] = None
+    # (V23) 单任务带宽上限 (字节/秒)
+    rate_limit: Optional[int] = None
+    # (V29) 直播录制任务; 已保存的分段见 /task/{task_id}/recordings
+    live: bool = False
+    # (V31) 持有任务租约 (正在执行 / 排队) 的 worker
+    lease_owner: Optional[str] = None
 
     class Config:
         # Pydantic 默认只处理字典, an_object.id
@@ -62,8 +120,137 @@ class TaskStatusResponse(BaseModel):
         # (这在我们将 Service 层的字典转为 Pydantic 模型时很有用)
         orm_mode = True
 
+class TaskSummaryResponse(BaseModel):
+    """
+    (V17) 这是 GET /api/v1/tasks/summary 返回的轻量列表项 (不含错误信息等大字段)
+    """
+    id: str
+    status: str
+    url: str
+    path: str
+    progress: float = 0
+    final_filename: Optional[str] = None
+    startTime: Optional[float] = None
+    priority: int = 0
+
+class SchedulerStatusResponse(BaseModel):
+    """
+    (V9) 这是 GET /api/v1/system/scheduler 返回的调度器状态
+    """
+    max_concurrent: int
+    max_per_host: int
+    running: int
+    queued: int
+    running_per_host: Dict[str, int] = {}
+    # (V21) 每个挂载点当前为运行中的任务预留的字节数
+    disk_reserved_bytes: Dict[str, int] = {}
+
+class SegmentCacheStatusResponse(BaseModel):
+    """
+    (V20) 这是 GET /api/v1/system/segment-cache 返回的片段缓存统计
+    """
+    enabled: bool
+    directory: str
+    max_bytes: int
+    size_bytes: int
+    entries: int
+    hits: int
+    misses: int
+    hit_ratio: float
+    bytes_saved: int
+    stores: int
+    evictions: int
+
+class ExtractorStatusResponse(BaseModel):
+    """
+    (V32) 这是 GET /api/v1/system/extractor 返回的 yt-dlp 提取进程池 / 元数据缓存统计
+    """
+    enabled: bool
+    workers: int
+    ttl_seconds: float
+    entries: int
+    hits: int
+    misses: int
+    hit_ratio: float
+    errors: int
+    extract_seconds: float   # 累计的提取耗时 (缓存未命中时)
+
+class HostTuningResponse(BaseModel):
+    """
+    (V27) 这是 GET /api/v1/system/hosts 返回的列表项: 每个主机学到的分片并发数
+    """
+    host: str
+    concurrency: int
+    throughput: Optional[float] = None  # 最近一个评估窗口的吞吐量 (字节/秒)
+    throttles: int = 0                  # 累计收到 429/503 的次数
+    updated_at: Optional[float] = None
+
+class WorkerResponse(BaseModel):
+    """
+    (V31) 这是 GET /api/v1/system/workers 返回的列表项: 共享同一个数据库的 worker 进程
+    """
+    id: str
+    host: str
+    pid: int
+    started_at: float
+    heartbeat_at: float
+    tasks: int = 0          # 当前持有租约的任务数 (运行中 + 排队中)
+    current: bool = False   # 是否是处理这个请求的 worker
+
+class BandwidthStatusResponse(BaseModel):
+    """
+    (V23) 这是 GET /api/v1/system/bandwidth 返回的带宽预算状态 (单位: 字节/秒, 0 表示不限速)
+    """
+    global_limit: int
+    native_rate: int
+    active_tasks: int
+    task_limits: Dict[str, int] = {}
+    ytdlp_rates: Dict[str, int] = {}
+
+class PhaseSpanResponse(BaseModel):
+    """
+    (V25) 任务时间线中的一个阶段 (resolve / download / merge / move)
+    """
+    attempt: int
+    phase: str
+    started_at: float
+    ended_at: Optional[float] = None  # None 表示阶段还在进行中
+    duration: Optional[float] = None
+    bytes: int = 0
+    cpu_seconds: Optional[float] = None  # yt-dlp (含 ffmpeg) 子进程的 CPU 时间; 原生引擎为 None
+
+class TaskTimelineResponse(BaseModel):
+    """
+    (V25) 这是 GET /api/v1/task/{task_id}/timeline 返回的阶段时间线
+    """
+    task_id: str
+    status: str
+    phases: List[PhaseSpanResponse] = []
+    profile: Optional[str] = None  # 剖析结果文件名 (TASK_PROFILE 开启时), 见 /task/{task_id}/profile
+
+class RecordingPartResponse(BaseModel):
+    """
+    (V29) 直播录制任务已经保存的一个分段 (位于任务的下载目录中)
+    """
+    part: int
+    filename: str
+    started_at: float
+    ended_at: float
+    duration: float   # 媒体时长 (秒); 中断后恢复的分段为 0
+    size: int
+    segments: int
+    first_sequence: Optional[int] = None
+    last_sequence: Optional[int] = None
+
 class TaskIdResponse(BaseModel):
     """
     这是 POST /api/v1/start-download 的标准返回
     """
-    taskId: str
\ No newline at end of file
+    taskId: str
+
+class BatchTaskIdsResponse(BaseModel):
+    """
+    (V28) 这是 POST /api/v1/start-download/batch 的返回: 与 (展开后的) URL 一一对应的任务 ID
+    """
+    taskIds: List[str]
+    count: int
\ No newline at end of file
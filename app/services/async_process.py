@@ -0,0 +1,101 @@
+# app/services/async_process.py
+# (V30 - 子进程在共享的事件循环中运行: asyncio.create_subprocess_exec + 异步逐行读取输出)
+
+import asyncio
+import contextlib
+import re
+from concurrent.futures import Future
+from typing import Awaitable, Callable, List, Optional
+
+# 与 universal_newlines 一致: \r\n / \r / \n 都算换行 (ffmpeg 和部分进度输出只用 \r)
+LINE_BREAK = re.compile(rb"\r\n|\r|\n")
+READ_CHUNK = 65536
+
+
+class AsyncProcess:
+    """
+    在后台事件循环 (HLS 引擎的循环) 中运行的子进程。
+
+    - start() 在调用线程中等待进程启动 (之后就有 pid)
+    - 输出在事件循环中异步读取, 每一行交给 on_line; on_line 在事件循环中调用, 必须是非阻塞的
+      (日志广播、进度节流、数据库写回缓冲都满足这一点)
+    - wait() 等待进程退出并返回退出码; terminate() 可以在任意线程中调用,
+      包括事件循环自己的线程 (例如在 on_line 中), 这时直接发信号, 不等待 Future
+
+    接口与 subprocess.Popen 的 pid / terminate() / returncode 一致, 取消 / 删除任务的代码不需要区分。
+    """
+
+    def __init__(self, submit: Callable[[Awaitable], Future], command: List[str],
+                 on_line: Callable[[str], None], **kwargs):
+        self._submit = submit
+        self._command = command
+        self._on_line = on_line
+        self._kwargs = kwargs
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._done: Optional[Future] = None
+
+    def start(self) -> "AsyncProcess":
+        self._process = self._submit(self._spawn()).result()
+        self._done = self._submit(self._pump())
+        return self
+
+    async def _spawn(self) -> asyncio.subprocess.Process:
+        self._loop = asyncio.get_running_loop()
+        return await asyncio.create_subprocess_exec(
+            *self._command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, **self._kwargs)
+
+    @property
+    def pid(self) -> int:
+        return self._process.pid
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self._process.returncode if self._process else None
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        return self._done.result(timeout)
+
+    def terminate(self) -> None:
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is None:
+            # 普通线程: 等信号发出之后再返回 (与 Popen.terminate() 一样)
+            self._submit(self._signal()).result()
+        elif running is self._loop:
+            # 就在进程所在的事件循环中: 等待 Future 会把循环卡死, 直接发信号
+            self._send_signal()
+        else:
+            # 另一个事件循环 (例如 API 的循环): 不阻塞它, 交给进程所在的循环
+            self._loop.call_soon_threadsafe(self._send_signal)
+
+    async def _signal(self) -> None:
+        self._send_signal()
+
+    def _send_signal(self) -> None:
+        if self._process.returncode is None:
+            with contextlib.suppress(ProcessLookupError):
+                self._process.terminate()
+
+    async def _pump(self) -> int:
+        stdout = self._process.stdout
+        pending = b""
+        try:
+            while True:
+                chunk = await stdout.read(READ_CHUNK)
+                if not chunk:
+                    break
+                *lines, pending = LINE_BREAK.split(pending + chunk)
+                for line in lines:
+                    self._on_line(line.decode("utf-8", errors="replace"))
+            if pending:
+                self._on_line(pending.decode("utf-8", errors="replace"))
+        except BaseException:
+            # 处理输出出错 (或协程被取消): 不留下没人管的子进程
+            if self._process.returncode is None:
+                self._process.kill()
+                await self._process.wait()
+            raise
+        return await self._process.wait()
@@ -0,0 +1,207 @@
+# app/services/bandwidth.py
+# (V23 - 带宽限制：全局 + 按任务的令牌桶, 所有运行中的任务共享)
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+# 全局带宽上限 (字节/秒), 0 表示不限速; 运行时可以通过 API 修改
+BANDWIDTH_LIMIT = int(os.environ.get("BANDWIDTH_LIMIT", "0"))
+# 令牌桶最多积攒多少秒的流量 (允许的突发)
+BANDWIDTH_BURST_SECONDS = float(os.environ.get("BANDWIDTH_BURST_SECONDS", "0.5"))
+# yt-dlp 的份额变大多少倍以上才重启子进程去使用它 (变小时总是重启, 否则全局预算会超出)
+YTDLP_RATE_RESTART_RATIO = float(os.environ.get("YTDLP_RATE_RESTART_RATIO", "1.25"))
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶。reserve() 不阻塞: 直接扣除令牌 (可以透支),
+    返回调用方需要等待的秒数, 由调用方自己 sleep (线程中 time.sleep, 协程中 asyncio.sleep)。
+    rate <= 0 表示不限速。
+    """
+
+    def __init__(self, rate: int = 0):
+        self._lock = threading.Lock()
+        self._rate = 0
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self.set_rate(rate)
+
+    @property
+    def rate(self) -> int:
+        return self._rate
+
+    def set_rate(self, rate: Optional[int]) -> None:
+        with self._lock:
+            self._rate = max(0, int(rate or 0))
+            self._tokens = min(self._tokens, self._burst())
+
+    def _burst(self) -> float:
+        return self._rate * BANDWIDTH_BURST_SECONDS
+
+    def reserve(self, amount: int) -> float:
+        with self._lock:
+            if self._rate <= 0:
+                return 0.0
+            now = time.monotonic()
+            self._tokens = min(self._burst(), self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            self._tokens -= amount
+            return -self._tokens / self._rate if self._tokens < 0 else 0.0
+
+
+class BandwidthGovernor:
+    """
+    所有任务共享的带宽预算。
+
+    - 原生引擎的任务在每读到一块数据后调用 throttle(), 共享一个全局令牌桶,
+      设置了单任务上限的任务还要再经过自己的令牌桶
+    - 全局上限在运行中的任务之间平分; 单任务上限更低的任务只拿它的上限, 剩下的再分给其他任务
+    - yt-dlp 子进程无法共享令牌桶: 它的份额通过 --limit-rate 传给它, 并从原生引擎的全局桶中扣除
+      (原生引擎的全局桶 = 全局上限 - 所有 yt-dlp 子进程正在使用的速率, 总和不超过全局上限)
+    - 任务开始 / 结束、修改全局或单任务上限时重新计算所有份额; yt-dlp 子进程的份额变小
+      (或明显变大) 时调用 on_ytdlp_rate_change(task_id, rate), 由调用方用新的 --limit-rate
+      重启子进程 (yt-dlp 从 .part 文件继续)
+    """
+
+    def __init__(self, global_limit: int = BANDWIDTH_LIMIT,
+                 on_ytdlp_rate_change: Optional[Callable[[str, int], None]] = None):
+        self._lock = threading.Lock()
+        self.global_limit = max(0, global_limit)
+        self.on_ytdlp_rate_change = on_ytdlp_rate_change
+        self._native_bucket = TokenBucket()
+        self._active: Dict[str, Optional[int]] = {}      # task_id -> 单任务上限
+        self._task_buckets: Dict[str, TokenBucket] = {}
+        self._ytdlp: Set[str] = set()                    # 以 yt-dlp 子进程运行的任务
+        self._ytdlp_rates: Dict[str, int] = {}           # task_id -> 子进程正在使用的速率 (0 = 不限速)
+        self._rebalance()
+
+    # --- 任务生命周期 ---
+    def task_started(self, task_id: str, limit: Optional[int] = None) -> None:
+        with self._lock:
+            self._active[task_id] = limit or None
+            if limit:
+                self._task_buckets[task_id] = TokenBucket(limit)
+            changes = self._rebalance()
+        self._notify(changes)
+
+    def task_finished(self, task_id: str) -> None:
+        with self._lock:
+            self._active.pop(task_id, None)
+            self._task_buckets.pop(task_id, None)
+            self._ytdlp.discard(task_id)
+            self._ytdlp_rates.pop(task_id, None)
+            changes = self._rebalance()
+        self._notify(changes)
+
+    def _shares(self) -> Dict[str, int]:
+        """(调用方持有 _lock) 每个运行中任务的目标速率, 0 表示不限速"""
+        if not self.global_limit:
+            return {task_id: limit or 0 for task_id, limit in self._active.items()}
+        # 上限最低的任务先分: 它用不完的部分留给后面的任务
+        ordered = sorted(self._active.items(), key=lambda item: item[1] or self.global_limit)
+        remaining, shares = self.global_limit, {}
+        for i, (task_id, limit) in enumerate(ordered):
+            share = max(1, remaining // (len(ordered) - i))
+            if limit:
+                share = min(share, limit)
+            shares[task_id] = share
+            remaining = max(0, remaining - share)
+        return shares
+
+    def _rebalance(self, starting: Optional[str] = None) -> List[Tuple[str, int]]:
+        """
+        (调用方持有 _lock) 重新计算份额, 返回需要重启的 yt-dlp 子进程 [(task_id, 新速率)]。
+        starting 是正在启动的子进程 (直接使用新的份额, 不需要重启)
+        """
+        shares = self._shares()
+        changes = []
+        for task_id in self._ytdlp:
+            target = shares.get(task_id, 0)
+            current = self._ytdlp_rates.get(task_id, 0)
+            if task_id == starting or _needs_restart(current, target):
+                self._ytdlp_rates[task_id] = target
+                if task_id != starting:
+                    changes.append((task_id, target))
+        if self.global_limit:
+            # 没有 yt-dlp 子进程使用的部分都给原生引擎 (没有原生引擎的任务时这个值不会被用到)
+            self._native_bucket.set_rate(self.global_limit - sum(self._ytdlp_rates.values()))
+        else:
+            self._native_bucket.set_rate(0)
+        return changes
+
+    def _notify(self, changes: List[Tuple[str, int]]) -> None:
+        if self.on_ytdlp_rate_change is None:
+            return
+        for task_id, rate in changes:
+            try:
+                self.on_ytdlp_rate_change(task_id, rate)
+            except Exception as e:
+                print(f"--- [BANDWIDTH] 无法调整任务 {task_id} 的 yt-dlp 速率: {e}")
+
+    # --- 原生引擎 ---
+    async def throttle(self, task_id: str, amount: int) -> None:
+        delay = self._native_bucket.reserve(amount)
+        bucket = self._task_buckets.get(task_id)
+        if bucket is not None:
+            delay = max(delay, bucket.reserve(amount))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    # --- yt-dlp ---
+    def ytdlp_rate(self, task_id: str) -> Optional[int]:
+        """
+        为即将 (重新) 启动的 yt-dlp 子进程计算 --limit-rate (字节/秒), 不限速时返回 None。
+        之后份额变化时通过 on_ytdlp_rate_change 通知
+        """
+        with self._lock:
+            if task_id not in self._active:
+                self._active[task_id] = None
+            self._ytdlp.add(task_id)
+            changes = self._rebalance(starting=task_id)
+            rate = self._ytdlp_rates.get(task_id, 0)
+        self._notify(changes)
+        return rate or None
+
+    # --- 运行时修改 ---
+    def set_global_limit(self, limit: int) -> None:
+        with self._lock:
+            self.global_limit = max(0, int(limit))
+            changes = self._rebalance()
+        self._notify(changes)
+
+    def set_task_limit(self, task_id: str, limit: Optional[int]) -> None:
+        """修改运行中任务的上限 (原生引擎立即生效; yt-dlp 子进程份额变化时重启)"""
+        with self._lock:
+            if task_id not in self._active:
+                return
+            self._active[task_id] = limit or None
+            if limit:
+                bucket = self._task_buckets.setdefault(task_id, TokenBucket())
+                bucket.set_rate(limit)
+            else:
+                self._task_buckets.pop(task_id, None)
+            changes = self._rebalance()
+        self._notify(changes)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "global_limit": self.global_limit,
+                "native_rate": self._native_bucket.rate,
+                "active_tasks": len(self._active),
+                "task_limits": {task_id: limit for task_id, limit in self._active.items() if limit},
+                "ytdlp_rates": dict(self._ytdlp_rates),
+            }
+
+
+def _needs_restart(current: int, target: int) -> bool:
+    """yt-dlp 子进程的速率从 current 变为 target (0 = 不限速) 时是否需要重启"""
+    if current == target:
+        return False
+    if target and (not current or target < current):
+        return True          # 变小: 必须重启, 否则超出全局预算
+    # 变大: 明显变大才值得重启
+    return not target or target >= current * YTDLP_RATE_RESTART_RATIO
@@ -0,0 +1,79 @@
+# app/services/dedup.py
+# (V19 - 重复提交去重：规范化 URL + 已完成文件的内容哈希)
+
+import hashlib
+import os
+from pathlib import Path
+from typing import Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# 计算内容哈希时每次读取的块大小
+HASH_CHUNK_SIZE = 1024 * 1024
+# 抽样哈希在文件开头 / 中间 / 结尾各读取多少字节
+SAMPLE_BLOCK_SIZE = 64 * 1024
+
+# 不影响内容的跟踪参数, 规范化时去掉
+TRACKING_PARAMS = ("fbclid", "gclid", "igshid", "si", "spm")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """
+    把 URL 规范化成去重用的键:
+    - scheme / 主机名小写, 去掉默认端口
+    - 去掉 #fragment 和 utm_* 等跟踪参数, 其余查询参数按名字排序
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    netloc = host
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{parts.port}"
+    if parts.username:
+        userinfo = parts.username + (f":{parts.password}" if parts.password else "")
+        netloc = f"{userinfo}@{netloc}"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    )
+    return urlunsplit((scheme, netloc, parts.path or "/", urlencode(query), ""))
+
+
+def hash_file(path: Path) -> Tuple[str, int]:
+    """返回文件的 (sha256 十六进制, 字节数)"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def sample_hash(path: Path) -> str:
+    """
+    文件大小和开头 / 中间 / 结尾各 SAMPLE_BLOCK_SIZE 字节的 sha256。
+    只读取很少的数据; 不同时内容一定不同, 相同时还要用 hash_file 确认
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode("ascii"))
+    offsets = sorted({0, max(0, size // 2 - SAMPLE_BLOCK_SIZE // 2), max(0, size - SAMPLE_BLOCK_SIZE)})
+    with open(path, "rb") as f:
+        for offset in offsets:
+            f.seek(offset)
+            digest.update(f.read(SAMPLE_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def link_file(source: Path, target: Path) -> None:
+    """
+    让 target 指向 source 的内容而不复制数据:
+    优先硬链接, 跨文件系统时退回符号链接
+    """
+    try:
+        os.link(source, target)
+    except OSError:
+        os.symlink(source.resolve(), target)
@@ -0,0 +1,115 @@
+# app/services/disk_space.py
+# (V21 - 磁盘空间感知的准入控制：带 TTL 的用量缓存 + 按任务预留空间)
+
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import psutil
+
+# 磁盘用量 / 分区列表的缓存时间 (秒)
+DISK_USAGE_TTL = float(os.environ.get("DISK_USAGE_TTL", "5"))
+# 每个挂载点始终保留的空闲空间 (MB), 任务不能占用
+DISK_SPACE_MARGIN_MB = int(os.environ.get("DISK_SPACE_MARGIN_MB", "512"))
+# 合并阶段临时文件和输出文件同时存在, 预留 "预估大小 x 该系数" 的空间
+MERGE_SPACE_FACTOR = float(os.environ.get("MERGE_SPACE_FACTOR", "2.0"))
+
+
+class DiskSpaceMonitor:
+    """
+    - disk_partitions() / disk_usage(): psutil 调用的 TTL 缓存
+    - reserve(): 任务开始前按预估大小预留目标挂载点的空间;
+      已写入的字节 (note_written) 会从预留中扣除, 因为它们已经反映在实际的空闲空间里
+    - release(): 任务结束时释放预留
+    """
+
+    def __init__(self, ttl: float = DISK_USAGE_TTL, margin_bytes: int = DISK_SPACE_MARGIN_MB * 1024 ** 2):
+        self.ttl = ttl
+        self.margin_bytes = margin_bytes
+        self._lock = threading.Lock()
+        self._partitions: Tuple[float, List[Any]] = (0.0, [])
+        self._usage: Dict[str, Tuple[float, Any]] = {}
+        self._mounts: Dict[str, str] = {}
+        # task_id -> [挂载点, 预留字节数, 已写入字节数]
+        self._reservations: Dict[str, List[Any]] = {}
+
+    # --- psutil 缓存 ---
+    def disk_partitions(self) -> List[Any]:
+        now = time.monotonic()
+        with self._lock:
+            fetched_at, partitions = self._partitions
+            if now - fetched_at < self.ttl:
+                return partitions
+        partitions = psutil.disk_partitions()
+        with self._lock:
+            self._partitions = (now, partitions)
+        return partitions
+
+    def disk_usage(self, mountpoint: str):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._usage.get(mountpoint)
+            if cached and now - cached[0] < self.ttl:
+                return cached[1]
+        usage = psutil.disk_usage(mountpoint)
+        with self._lock:
+            self._usage[mountpoint] = (now, usage)
+        return usage
+
+    def mount_of(self, path: str) -> str:
+        """路径所在的挂载点 (路径不存在时向上找到存在的父目录)"""
+        with self._lock:
+            cached = self._mounts.get(path)
+        if cached:
+            return cached
+        current = os.path.abspath(path)
+        while not os.path.ismount(current):
+            parent = os.path.dirname(current)
+            if parent == current:
+                break
+            current = parent
+        with self._lock:
+            self._mounts[path] = current
+        return current
+
+    # --- 预留 ---
+    def _outstanding(self, mount: str) -> int:
+        # (调用方持有 _lock)
+        return sum(max(0, reserved - written)
+                   for m, reserved, written in self._reservations.values() if m == mount)
+
+    def can_ever_fit(self, path: str, needed: int) -> bool:
+        """不考虑其他任务的预留时, 当前的空闲空间是否放得下"""
+        mount = self.mount_of(path)
+        return needed + self.margin_bytes <= self.disk_usage(mount).free
+
+    def reserve(self, task_id: str, path: str, needed: int) -> bool:
+        """空间足够时为任务预留 needed 字节并返回 True"""
+        mount = self.mount_of(path)
+        free = self.disk_usage(mount).free
+        with self._lock:
+            if task_id in self._reservations:
+                return True
+            if needed + self.margin_bytes > free - self._outstanding(mount):
+                return False
+            self._reservations[task_id] = [mount, needed, 0]
+            return True
+
+    def note_written(self, task_id: str, written: Optional[int]) -> None:
+        if written is None:
+            return
+        with self._lock:
+            reservation = self._reservations.get(task_id)
+            if reservation:
+                reservation[2] = written
+
+    def release(self, task_id: str) -> None:
+        with self._lock:
+            self._reservations.pop(task_id, None)
+
+    def snapshot(self) -> Dict[str, int]:
+        """每个挂载点当前还预留着的字节数"""
+        with self._lock:
+            mounts = {m for m, _, _ in self._reservations.values()}
+            return {mount: self._outstanding(mount) for mount in mounts}
@@ -0,0 +1,477 @@
+# app/services/engine_hls.py
+# (V10 - 原生 HLS 引擎：直接下载 .m3u8, 不再启动 yt-dlp 子进程)
+
+import asyncio
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Awaitable, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from app.core.metrics import BYTES_DOWNLOADED
+from app.services.http_pool import AsyncHttpPool, HttpError
+from app.services.hls_crypto import SUPPORTED_METHODS, SegmentDecryptor
+from app.services.segment_cache import SegmentCache, segment_cache
+from app.services.host_tuning import HostConcurrencyController, host_tuner
+from app.services.service_scheduler import host_of
+from app.services.hls_playlist import (
+    MasterPlaylist, MediaPlaylist, PlaylistError, Segment, Variant, parse_playlist
+)
+
+# 每个任务同时下载的片段数, 以及每个主机的最大 keep-alive 连接数
+# (V27) 开启自适应并发时, HLS_SEGMENT_CONCURRENCY 只是还没有学到级别的主机的起点
+HLS_SEGMENT_CONCURRENCY = int(os.environ.get("HLS_SEGMENT_CONCURRENCY", "8"))
+HLS_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("HLS_MAX_CONNECTIONS_PER_HOST", "16"))
+HLS_SEGMENT_RETRIES = 3
+
+# (V23) 限速回调: 每读到 n 字节后 await throttle(n)
+Throttle = Callable[[int], Awaitable[None]]
+
+
+class UnsupportedStreamError(Exception):
+    """
+    原生引擎无法处理的流 (例如: 分离的音轨、直播流、未知加密方式)。
+    Service 捕获它后会回退到 yt-dlp。
+    """
+
+
+class LivePlaylistError(UnsupportedStreamError):
+    """
+    (V29) 媒体播放列表没有 #EXT-X-ENDLIST (直播流)。
+    Service 捕获它后切换到直播录制 (hls_live), 而不是回退到 yt-dlp。
+    """
+
+
+def is_direct_m3u8(url: str) -> bool:
+    """URL 是否直接指向一个 .m3u8 播放列表"""
+    try:
+        return urlsplit(url).path.lower().endswith(".m3u8")
+    except ValueError:
+        return False
+
+
+class HlsEngine:
+    """
+    原生 HLS 下载引擎。
+
+    所有任务共享 *一个* 后台事件循环线程和 *一个* keep-alive 连接池,
+    下载线程通过 submit() 把协程提交到这个循环中执行,
+    拿到一个 concurrent.futures.Future (可以 cancel())。
+    """
+
+    def __init__(self, concurrency: int = HLS_SEGMENT_CONCURRENCY,
+                 max_connections_per_host: int = HLS_MAX_CONNECTIONS_PER_HOST,
+                 cache: SegmentCache = segment_cache,
+                 tuner: HostConcurrencyController = host_tuner):
+        self.concurrency = max(1, concurrency)
+        self.max_connections_per_host = max_connections_per_host
+        # (V20) 跨任务共享的片段缓存
+        self.cache = cache
+        # (V27) 按主机自适应的并发数
+        self.tuner = tuner
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pool: Optional[AsyncHttpPool] = None
+        self._lock = threading.Lock()
+
+    # --- 事件循环 ---
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="hls-engine-loop")
+                thread.daemon = True
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+    @property
+    def pool(self) -> AsyncHttpPool:
+        # (只在事件循环线程内访问)
+        if self._pool is None:
+            self._pool = AsyncHttpPool(max_per_host=self.max_connections_per_host)
+        return self._pool
+
+    def submit(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    # --- 对外接口 ---
+    def start_download(self, url: str, tmp_dir: Path, base_name: str,
+                       log: Callable[[str], None],
+                       resume_from: Tuple[int, int] = (0, 0),
+                       on_segment: Optional[Callable[[int, int, int], None]] = None,
+                       throttle: Optional[Throttle] = None) -> Future:
+        """
+        在引擎循环中开始下载, 立即返回 Future。
+        Future 的结果是写好的输出文件路径 (位于 tmp_dir 中)。
+
+        (V12) 断点续传:
+        - resume_from = (已完成的片段数, 这些片段在输出文件中占用的字节数)
+        - on_segment(index, size, total) 在每个片段写入并 flush 到文件后调用 (在线程池中),
+          调用方用它把检查点写进数据库, 并更新进度
+
+        (V23) throttle: 片段下载的限速回调 (缓存命中不经过它)
+        """
+        return self.submit(self._download(url, tmp_dir, base_name, log, resume_from, on_segment, throttle))
+
+    # --- 实现 ---
+    async def load_media_playlist(self, url: str, log: Callable[[str], None]) -> MediaPlaylist:
+        """
+        下载并解析播放列表。如果是主播放列表, 选择码率最高的 variant。
+        """
+        playlist, _ = await self._resolve_playlist(url, log)
+        return playlist
+
+    async def _resolve_playlist(self, url: str, log: Callable[[str], None]) -> Tuple[MediaPlaylist, Optional[Variant]]:
+        """返回 (媒体播放列表, 选中的 variant; 直接给出媒体播放列表时为 None)"""
+        variant = None
+        text = (await self.pool.fetch(url)).decode("utf-8", errors="replace")
+        playlist = parse_playlist(text, url)
+        if isinstance(playlist, MasterPlaylist):
+            variant = playlist.best_variant()
+            log(f"[hls] 主播放列表包含 {len(playlist.variants)} 个码率, 选择 "
+                f"{variant.resolution or '?'} @ {variant.bandwidth} bps")
+            if variant.audio and any(r.type == "AUDIO" and r.group_id == variant.audio and r.uri
+                                     for r in playlist.renditions):
+                raise UnsupportedStreamError("Variant uses a separate audio rendition")
+            text = (await self.pool.fetch(variant.uri)).decode("utf-8", errors="replace")
+            playlist = parse_playlist(text, variant.uri)
+            if isinstance(playlist, MasterPlaylist):
+                raise PlaylistError("Nested master playlists are not supported")
+        return playlist, variant
+
+    async def estimate_size(self, url: str) -> Optional[int]:
+        """
+        (V21) 下载前预估输出文件的大小 (字节), 无法预估时返回 None:
+        - 所有片段都有 BYTERANGE: 直接求和
+        - 有主播放列表: BANDWIDTH x 总时长 (BANDWIDTH 是峰值码率, 预估偏大, 对预留空间来说是安全的)
+        - 否则下载第一个片段按时长外推 (片段进入共享缓存, 正式下载时直接命中)
+        """
+        playlist, variant = await self._resolve_playlist(url, lambda _: None)
+        self.check_supported(playlist)
+        segments = playlist.segments
+        if all(segment.byterange for segment in segments):
+            return sum(segment.byterange[0] for segment in segments)
+        if variant and variant.bandwidth:
+            return int(variant.bandwidth * playlist.total_duration / 8)
+        if segments[0].duration > 0:
+            first = await self.fetch_segment(segments[0])
+            return int(len(first) / segments[0].duration * playlist.total_duration)
+        return None
+
+    def check_supported(self, playlist: MediaPlaylist) -> None:
+        if not playlist.endlist:
+            raise LivePlaylistError("Live playlist (no #EXT-X-ENDLIST)")
+        self.check_segments(playlist)
+
+    def check_segments(self, playlist: MediaPlaylist) -> None:
+        """(V29 从 check_supported 中拆出) 加密方式 / 片段列表的检查, 直播录制每次重新加载后也会调用"""
+        for segment in playlist.segments:
+            init = segment.init_section
+            if init and init.key and init.key.method != "NONE" and init.key.iv is None:
+                # 没有 IV 就无法解密初始化片段 (见 SegmentDecryptor.decrypt_init)
+                raise UnsupportedStreamError("Encrypted EXT-X-MAP without IV")
+            for key in (segment.key, init.key if init else None):
+                if not key:
+                    continue
+                if key.method not in SUPPORTED_METHODS:
+                    raise UnsupportedStreamError(f"Unsupported encryption method {key.method}")
+                if not (key.uri or "").lower().startswith(("http://", "https://")):
+                    raise UnsupportedStreamError(f"Unsupported key URI {key.uri}")
+        if not playlist.segments:
+            raise PlaylistError("Media playlist has no segments")
+
+    async def fetch_segment(self, segment: Segment, as_file: bool = False,
+                            throttle: Optional[Throttle] = None,
+                            use_cache: bool = True) -> Union[bytes, BinaryIO]:
+        return await self._fetch_cached(segment.uri, segment.byterange, f"Segment {segment.sequence}",
+                                        as_file, throttle, use_cache)
+
+    async def _fetch_cached(self, uri: str, byterange, label: str, as_file: bool = False,
+                            throttle: Optional[Throttle] = None,
+                            use_cache: bool = True) -> Union[bytes, BinaryIO]:
+        """
+        (V20) 先查共享片段缓存, 未命中时从上游下载 (带重试) 并写入缓存
+
+        (V22) as_file=True 时, 缓存命中返回打开的缓存文件而不是读出的数据,
+        写入输出文件时由 splice_file() 在内核中拷贝
+
+        (V29) use_cache=False: 直播片段只会下载一次, 不查也不写缓存 (以免挤掉点播的片段)
+        """
+        loop = asyncio.get_running_loop()
+        use_cache = use_cache and self.cache.enabled
+        if use_cache:
+            cached = await loop.run_in_executor(None, self.cache.open, uri, byterange)
+            if cached is not None:
+                if as_file:
+                    return cached
+                return await loop.run_in_executor(None, _read_and_close, cached)
+        data = await self._fetch_with_retries(uri, byterange, label, throttle)
+        BYTES_DOWNLOADED.inc(len(data), engine="native")
+        if use_cache:
+            await loop.run_in_executor(None, self.cache.put, uri, byterange, data)
+        return data
+
+    async def _fetch_with_retries(self, uri: str, byterange, label: str,
+                                  throttle: Optional[Throttle] = None) -> bytes:
+        headers: Dict[str, str] = {}
+        if byterange:
+            length, offset = byterange
+            headers["Range"] = f"bytes={offset}-{offset + length - 1}"
+        last_error = None
+        host = host_of(uri)
+        for attempt in range(HLS_SEGMENT_RETRIES):
+            try:
+                data = await self.pool.fetch(uri, headers, throttle)
+                self.tuner.observe(host, len(data), self.concurrency)
+                return data
+            except (HttpError, asyncio.TimeoutError) as e:
+                last_error = e
+                self.tuner.observe_error(host, self.concurrency, getattr(e, "status", None))
+                if isinstance(e, HttpError) and e.status in (403, 404, 410):
+                    break
+                await asyncio.sleep(0.5 * (2 ** attempt))
+        raise HttpError(f"{label} failed: {last_error}")
+
+    async def _download(self, url: str, tmp_dir: Path, base_name: str,
+                        log: Callable[[str], None],
+                        resume_from: Tuple[int, int] = (0, 0),
+                        on_segment: Optional[Callable[[int, int, int], None]] = None,
+                        throttle: Optional[Throttle] = None) -> Path:
+        playlist = await self.load_media_playlist(url, log)
+        self.check_supported(playlist)
+
+        ext = "mp4" if playlist.is_fmp4 else "ts"
+        output_path = tmp_dir / f"{base_name}.{ext}"
+        total = len(playlist.segments)
+        level = self.tuner.level(host_of(playlist.segments[0].uri), self.concurrency)
+        log(f"[hls] 共 {total} 个片段, 时长 {playlist.total_duration:.1f}s, 并发 {level}")
+        if playlist.is_encrypted:
+            log("[hls] 检测到 AES-128 加密, 边下载边解密")
+        log(f"[download] Destination: {output_path}")
+
+        start_index, start_offset = resume_from
+        if start_index > total or not output_path.exists() or output_path.stat().st_size < start_offset:
+            start_index, start_offset = 0, 0
+        loop = asyncio.get_running_loop()
+        if start_index:
+            log(f"[hls] 从检查点继续: 已完成 {start_index}/{total} 个片段 ({start_offset} 字节)")
+            out = open(output_path, "r+b")
+            # 丢掉检查点之后写了一半的数据
+            out.truncate(start_offset)
+            out.seek(start_offset)
+        else:
+            out = open(output_path, "wb")
+        with out:
+            await self._fetch_ordered(playlist, out, loop, log, SegmentDecryptor(self.pool),
+                                      start_index, on_segment, throttle)
+        return output_path
+
+    async def _fetch_ordered(self, playlist: MediaPlaylist, out, loop, log,
+                             decryptor: SegmentDecryptor, start_index: int = 0,
+                             on_segment: Optional[Callable[[int, int, int], None]] = None,
+                             throttle: Optional[Throttle] = None) -> None:
+        """
+        并发下载片段, (如有加密则在线程池中解密), 按顺序直接写入输出文件。
+
+        window 信号量限制 "已开始但还没写入" 的片段数, 这样内存占用
+        最多是 window 个片段, 与整个流的长度无关。
+
+        (V27) 同时下载的片段数由 tuner 按主机动态决定: 按最大并发启动 worker,
+        每个 worker 下载前先通过 gate (上限随时读取 tuner 的当前级别)。
+        """
+        segments = playlist.segments
+        total = len(segments)
+        host = host_of(segments[0].uri)
+        max_level = self.tuner.maximum if self.tuner.adaptive else self.concurrency
+        gate = _ConcurrencyGate(lambda: self.tuner.level(host, self.concurrency))
+        window = asyncio.Semaphore(max_level * 2)
+        ready: Dict[int, bytes] = {}
+        failures = []
+        cond = asyncio.Condition()
+        next_index = start_index
+        # 续传时, 上一个片段的初始化片段已经在文件里了
+        written_init = segments[start_index - 1].init_section if start_index else None
+        log_every = max(1, total // 20)
+        # 先拿到窗口许可, 再领取下一个序号: 保证正在下载的总是最靠前的片段
+        index_iter = _AcquiringIterator(window, total, start_index)
+
+        async def worker():
+            try:
+                async for index in index_iter:
+                    segment = segments[index]
+                    # (V22) 不需要解密的片段如果在缓存中, 只传递打开的缓存文件, 不读入内存
+                    plain = not segment.key or segment.key.method == "NONE"
+                    async with gate:
+                        data = await self.fetch_segment(segment, as_file=plain, throttle=throttle)
+                    if isinstance(data, bytes):
+                        data = await decryptor.decrypt(segment, data)
+                    async with cond:
+                        ready[index] = data
+                        cond.notify_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                async with cond:
+                    failures.append(e)
+                    cond.notify_all()
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(min(max_level, total - start_index))]
+        try:
+            while next_index < total:
+                async with cond:
+                    while next_index not in ready:
+                        if failures:
+                            raise failures[0]
+                        await cond.wait()
+                    data = ready.pop(next_index)
+
+                segment = segments[next_index]
+                chunks = [data]
+                if segment.init_section and segment.init_section != written_init:
+                    chunks.insert(0, await self.fetch_init(segment, decryptor))
+                    written_init = segment.init_section
+                size = await loop.run_in_executor(None, _write_and_flush, out, chunks)
+                if on_segment:
+                    await loop.run_in_executor(None, on_segment, next_index, size, total)
+                window.release()
+                next_index += 1
+                if next_index % log_every == 0 or next_index == total:
+                    log(f"[hls] 片段 {next_index}/{total}")
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            for data in ready.values():
+                if not isinstance(data, bytes):
+                    data.close()
+
+    async def fetch_init(self, segment: Segment, decryptor: SegmentDecryptor) -> bytes:
+        """下载片段的初始化片段; 它在 AES-128 密钥的作用范围内时用同一个密钥解密"""
+        init = segment.init_section
+        data = await self._fetch_cached(init.uri, init.byterange, "Init section")
+        return await decryptor.decrypt_init(init, data)
+
+
+def _write_and_flush(out, chunks: List[Union[bytes, BinaryIO]]) -> int:
+    # flush 之后才记录检查点, 这样进程被杀时检查点不会领先于文件内容
+    size = 0
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            out.write(chunk)
+            size += len(chunk)
+        else:
+            # (V22) 缓存文件: 在内核中直接拼接到输出文件
+            out.flush()
+            with chunk:
+                size += splice_file(out, chunk)
+    out.flush()
+    return size
+
+
+def _read_and_close(f: BinaryIO) -> bytes:
+    with f:
+        return f.read()
+
+
+# (V22) 内核中的文件到文件拷贝, 按优先顺序尝试:
+# copy_file_range (同一文件系统上, btrfs / XFS 等可以直接共享数据块), 然后 sendfile。
+# 源文件按显式的偏移读取 (不使用也不移动 src 的文件偏移), 写入 out 的当前偏移。
+# 函数在这个平台 / Python 版本上不存在时抛出 AttributeError, 同样退回下一种方式
+def _copy_file_range(in_fd: int, out_fd: int, offset: int, count: int) -> int:
+    return os.copy_file_range(in_fd, out_fd, count, offset_src=offset)
+
+
+def _sendfile(in_fd: int, out_fd: int, offset: int, count: int) -> int:
+    # (只有 Linux 支持输出到普通文件)
+    if not sys.platform.startswith("linux"):
+        raise AttributeError("sendfile")
+    return os.sendfile(out_fd, in_fd, offset, count)
+
+
+_KERNEL_COPIES = [_copy_file_range, _sendfile]
+
+
+def splice_file(out: BinaryIO, src: BinaryIO) -> int:
+    """
+    (V22) 把 src 从当前位置到末尾的内容追加到 out 的当前位置, 返回拷贝的字节数。
+    尽量在内核中完成 (数据不经过 Python); 都不可用时退回普通的读写。
+    调用前 out 必须已经 flush。
+    """
+    out_fd, in_fd = out.fileno(), src.fileno()
+    # (src 可能已经被缓冲读取过: 它的文件偏移不一定等于 tell())
+    start = src.tell()
+    remaining = os.fstat(in_fd).st_size - start
+    copied = 0
+    for kernel_copy in _KERNEL_COPIES:
+        try:
+            while copied < remaining:
+                n = kernel_copy(in_fd, out_fd, start + copied, remaining - copied)
+                if n == 0:
+                    break
+                copied += n
+            break
+        except (OSError, AttributeError):
+            if copied:
+                raise
+    # 内核直接移动了 out 的文件偏移; 让 Python 的缓冲对象与之同步
+    out.seek(os.lseek(out_fd, 0, os.SEEK_CUR))
+    src.seek(start + copied)
+    if copied < remaining:
+        before = out.tell()
+        shutil.copyfileobj(src, out)
+        copied += out.tell() - before
+    return copied
+
+
+class _ConcurrencyGate:
+    """
+    (V27) 上限可变的异步信号量: limit() 每次获取时重新读取,
+    所以 tuner 调整级别后, 正在运行的任务立即生效 (降低时等已经在下载的片段完成)。
+    """
+
+    def __init__(self, limit: Callable[[], int]):
+        self._limit = limit
+        self._active = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._active < self._limit())
+            self._active += 1
+
+    async def __aexit__(self, *exc):
+        async with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+        return False
+
+
+class _AcquiringIterator:
+    """
+    异步共享的序号发放器: 每次 __anext__ 之前先获取窗口许可。
+    (多个 worker 共享同一个实例)
+    """
+
+    def __init__(self, window: asyncio.Semaphore, total: int, start: int = 0):
+        self._window = window
+        self._total = total
+        self._next = start
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> int:
+        await self._window.acquire()
+        if self._next >= self._total:
+            self._window.release()
+            raise StopAsyncIteration
+        index = self._next
+        self._next += 1
+        return index
+
+
+# --- 单例 ---
+hls_engine = HlsEngine()
@@ -0,0 +1,275 @@
+# app/services/extractor_pool.py
+# (V32 - 常驻的 yt-dlp 提取进程池 + 按 URL 的元数据缓存)
+#
+# 原来每次预估大小 / 解析直播地址 / 展开播放列表都要启动一个新的 Python 解释器、重新 import yt_dlp,
+# 再从头运行提取器; 下载时 yt-dlp 子进程又把同一个页面提取一遍。
+# 现在由几个预先 import 好 yt_dlp 的进程负责提取, 结果按 URL 缓存 EXTRACT_CACHE_TTL 秒,
+# 下载时把缓存中的 info dict 通过 --load-info-json 交给 yt-dlp, 跳过提取, 直接开始下载。
+
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from app.services.dedup import normalize_url
+
+# 提取进程数 (0 = 不使用进程池, 每次提取启动一个 yt-dlp 子进程, 即原来的行为)
+EXTRACTOR_WORKERS = int(os.environ.get("EXTRACTOR_WORKERS", "2"))
+# 提取结果缓存多久 (秒); 媒体 / 清单地址通常带有签名和过期时间, 不宜太长
+EXTRACT_CACHE_TTL = float(os.environ.get("EXTRACT_CACHE_TTL", "300"))
+# 最多缓存多少个 URL 的结果
+EXTRACT_CACHE_SIZE = int(os.environ.get("EXTRACT_CACHE_SIZE", "256"))
+# 一次提取最多等待多久 (秒)
+EXTRACT_TIMEOUT = float(os.environ.get("EXTRACT_TIMEOUT", "120"))
+
+# 与命令行的 --no-playlist --no-warnings 相同
+BASE_OPTIONS = {"quiet": True, "no_warnings": True, "noplaylist": True, "skip_download": True}
+
+
+class ExtractionError(Exception):
+    """yt-dlp 无法提取这个 URL (不支持、需要登录、网络错误或超时)"""
+
+
+# --- 提取进程中运行的部分 ---
+_ydl_instances: Dict[Tuple, Any] = {}
+
+
+def _warm_up() -> None:
+    """
+    进程池的 initializer: import yt_dlp, 创建默认选项的 YoutubeDL,
+    并让每个提取器编译一次 URL 正则 (第一次匹配 URL 时要遍历所有提取器, 约占冷启动的一半)
+    """
+    import yt_dlp
+    from yt_dlp.extractor import gen_extractor_classes
+    _ydl_instances[()] = yt_dlp.YoutubeDL(dict(BASE_OPTIONS))
+    for ie in gen_extractor_classes():
+        ie.suitable("https://warm-up.invalid/")
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _extract_in_worker(url: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    import yt_dlp
+    key = tuple(sorted(options.items()))
+    ydl = _ydl_instances.get(key)
+    if ydl is None:
+        ydl = _ydl_instances[key] = yt_dlp.YoutubeDL({**BASE_OPTIONS, **options})
+    try:
+        info = ydl.extract_info(url, download=False)
+    except yt_dlp.utils.DownloadError as e:
+        # 异常对象中可能带有不能 pickle 的内容, 只传回消息
+        raise ExtractionError(str(e)) from None
+    # 与 yt-dlp -J 的输出相同 (可以直接写给 --load-info-json)
+    return ydl.sanitize_info(info)
+
+
+# --- 服务进程中的部分 ---
+class ExtractorPool:
+    """
+    - extract(url): 缓存命中直接返回; 同一个 URL 的并发请求只提取一次 (共享一个 Future)
+    - 缓存是进程内的 LRU, 条目 EXTRACT_CACHE_TTL 秒后过期
+    - 提取进程使用 spawn 启动 (服务进程中已经有很多线程, fork 不安全), 在 start() 时预热
+    - 进程池损坏 (提取进程崩溃) 时重建; EXTRACTOR_WORKERS=0 时退回到每次启动一个 yt-dlp 子进程
+    """
+
+    def __init__(self, workers: int = EXTRACTOR_WORKERS, ttl: float = EXTRACT_CACHE_TTL,
+                 max_entries: int = EXTRACT_CACHE_SIZE):
+        self.workers = workers
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._entries: "OrderedDict[Tuple, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[Tuple, Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.extract_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def start(self) -> None:
+        """创建进程池并让每个进程先完成 import (在后台进行, 不阻塞启动)"""
+        if not self.enabled:
+            return
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(_ping)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_up,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+                print(f"--- [EXTRACTOR] 启动 {self.workers} 个 yt-dlp 提取进程")
+            return self._executor
+
+    def _discard_executor(self, executor: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # --- 缓存 ---
+    @staticmethod
+    def _key(url: str, options: Dict[str, Any]) -> Tuple:
+        return (normalize_url(url),) + tuple(sorted(options.items()))
+
+    def cached(self, url: str, **options) -> Optional[Dict[str, Any]]:
+        """只查缓存 (不提取); 没有或已过期时返回 None"""
+        key = self._key(url, options)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def invalidate(self, url: str, **options) -> None:
+        with self._lock:
+            self._entries.pop(self._key(url, options), None)
+
+    def _store(self, key: Tuple, info: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, info)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # --- 提取 ---
+    def extract(self, url: str, timeout: float = EXTRACT_TIMEOUT, **options) -> Dict[str, Any]:
+        """
+        返回 URL 的 info dict (与 yt-dlp -J 的输出相同)。options 是额外的 YoutubeDL 选项,
+        例如 extract_flat="in_playlist" / playlistend=N (不同的选项分开缓存)。
+        失败时抛出 ExtractionError。
+        """
+        info = self.cached(url, **options)
+        if info is not None:
+            with self._lock:
+                self.hits += 1
+            return info
+        key = self._key(url, options)
+        with self._lock:
+            self.misses += 1
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if owner:
+            started = time.monotonic()
+            try:
+                info = self._run(url, options, timeout)
+                self._store(key, info)
+                future.set_result(info)
+            except BaseException as e:
+                with self._lock:
+                    self.errors += 1
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                    self.extract_seconds += time.monotonic() - started
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            raise ExtractionError(f"yt-dlp 提取超时 ({timeout:.0f}s): {url}")
+
+    def _run(self, url: str, options: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        if not self.enabled:
+            return _extract_with_subprocess(url, options, timeout)
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_extract_in_worker, url, options)
+        except (BrokenProcessPool, RuntimeError):
+            self._discard_executor(executor)
+            future = self._get_executor().submit(_extract_in_worker, url, options)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            # 进程池中的任务无法中途终止: 这个提取进程会在提取结束后才空闲下来
+            future.cancel()
+            raise ExtractionError(f"yt-dlp 提取超时 ({timeout:.0f}s): {url}")
+        except BrokenProcessPool:
+            self._discard_executor(executor)
+            raise ExtractionError(f"yt-dlp 提取进程异常退出: {url}")
+        except ExtractionError:
+            raise
+        except ImportError as e:
+            raise ExtractionError(f"无法加载 yt_dlp: {e}")
+
+    def write_info_json(self, url: str, path: Path) -> bool:
+        """
+        缓存中有这个 URL 的 (单个视频的) 结果时写到 path, 供 yt-dlp --load-info-json 使用;
+        没有时返回 False (yt-dlp 照常自己提取)
+        """
+        info = self.cached(url)
+        with self._lock:
+            if info is None:
+                self.misses += 1
+                return False
+            self.hits += 1
+        if info.get("_type", "video") != "video":
+            return False
+        path.write_text(json.dumps(info), encoding="utf-8")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "workers": self.workers,
+                "ttl_seconds": self.ttl,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "errors": self.errors,
+                "extract_seconds": round(self.extract_seconds, 3),
+            }
+
+
+def _extract_with_subprocess(url: str, options: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+    """(EXTRACTOR_WORKERS=0) 原来的方式: 一个 yt-dlp -J 子进程"""
+    command = [sys.executable, "-m", "yt_dlp", "-J", "--no-warnings"]
+    command.append("--no-playlist" if options.get("noplaylist", True) else "--yes-playlist")
+    if options.get("extract_flat"):
+        command.append("--flat-playlist")
+    if options.get("playlistend"):
+        command += ["--playlist-end", str(options["playlistend"])]
+    command.append(url)
+    try:
+        result = subprocess.run(command, capture_output=True, encoding="utf-8", errors="replace", timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise ExtractionError(f"yt-dlp 提取超时 ({timeout:.0f}s): {url}")
+    if result.returncode != 0:
+        message = result.stderr.strip().splitlines()[-1:] or [f"exit code {result.returncode}"]
+        raise ExtractionError(message[0])
+    try:
+        return json.loads(result.stdout)
+    except ValueError as e:
+        raise ExtractionError(f"yt-dlp 输出无法解析: {e}")
+
+
+extractor = ExtractorPool()
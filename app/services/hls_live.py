@@ -0,0 +1,235 @@
+# app/services/hls_live.py
+# (V29 - 直播录制: 按目标时长轮询滑动窗口的媒体播放列表, 只下载新出现的片段, 按时间 / 大小切分输出文件)
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable, List, Optional
+
+from app.services.engine_hls import HlsEngine, Throttle, _ConcurrencyGate, _write_and_flush
+from app.services.hls_crypto import SegmentDecryptor
+from app.services.hls_playlist import MediaPlaylist, PlaylistError, Segment, parse_playlist
+from app.services.service_scheduler import host_of
+from app.services.http_pool import HttpError
+
+# 每个输出分段最长多少秒 (媒体时长), 0 表示不按时间切分
+LIVE_ROTATE_SECONDS = float(os.environ.get("LIVE_ROTATE_SECONDS", "3600"))
+# 每个输出分段最大多少字节, 0 表示不按大小切分
+LIVE_ROTATE_BYTES = int(os.environ.get("LIVE_ROTATE_BYTES", "0"))
+# 开始录制时从窗口末尾往前取多少个片段 (0 表示整个窗口; DVR 窗口可能有几个小时)
+LIVE_START_SEGMENTS = int(os.environ.get("LIVE_START_SEGMENTS", "3"))
+# 连续多少次重新加载播放列表失败后放弃
+LIVE_MAX_POLL_FAILURES = int(os.environ.get("LIVE_MAX_POLL_FAILURES", "10"))
+
+
+@dataclass
+class RecordedPart:
+    """一个已经写完 (关闭) 的输出分段, 文件还在临时目录中"""
+    index: int
+    path: Path
+    started_at: float                     # 第一个片段写入的时间 (墙钟)
+    ended_at: float
+    duration: float = 0.0                 # 媒体时长 (秒, 按 #EXTINF 累加)
+    size: int = 0
+    segments: int = 0
+    first_sequence: Optional[int] = None
+    last_sequence: Optional[int] = None
+
+
+class LiveRecorder:
+    """
+    录制一个直播 HLS 流, 直到播放列表出现 #EXT-X-ENDLIST 或调用 stop()。
+
+    - 每隔一个目标时长 (#EXT-X-TARGETDURATION) 重新加载媒体播放列表; 没有新片段时半个目标时长后重试 (RFC 8216 6.3.4)
+    - 按媒体序号 (#EXT-X-MEDIA-SEQUENCE) 只下载比上次更新的片段, 片段不经过共享缓存
+    - 当前分段超过 rotate_seconds / rotate_bytes 时, 在片段边界切换到新文件,
+      关闭的分段立即交给 on_part (在线程池中调用, 由 Service 移动到下载目录并登记)
+
+    内存中最多只有一次重新加载带来的新片段, 临时目录中只有当前正在写的分段,
+    与录制时长无关。run() 在引擎的事件循环中执行, stop() 可以在任意线程中调用。
+    """
+
+    def __init__(self, engine: HlsEngine, url: str, tmp_dir: Path, base_name: str,
+                 log: Callable[[str], None],
+                 on_part: Callable[[RecordedPart], None],
+                 on_segment: Optional[Callable[[int], None]] = None,
+                 throttle: Optional[Throttle] = None,
+                 rotate_seconds: float = LIVE_ROTATE_SECONDS,
+                 rotate_bytes: int = LIVE_ROTATE_BYTES,
+                 first_part: int = 1):
+        self.engine = engine
+        self.url = url
+        self.tmp_dir = tmp_dir
+        self.base_name = base_name
+        self.log = log
+        self.on_part = on_part
+        self.on_segment = on_segment
+        self.throttle = throttle
+        self.rotate_seconds = rotate_seconds
+        self.rotate_bytes = rotate_bytes
+        self.parts = 0
+        self._next_part = first_part
+        self._part: Optional[RecordedPart] = None
+        self._out: Optional[BinaryIO] = None
+        self._written_init = None
+        self._stopping = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    def stop(self) -> None:
+        """结束录制: 当前分段正常关闭并交给 on_part, run() 随后返回"""
+        self._stopping = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def run(self) -> int:
+        """录制到结束, 返回本次运行产生的分段数"""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        playlist = await self.engine.load_media_playlist(self.url, self.log)
+        media_url = playlist.url
+        self.engine.check_segments(playlist)
+        self.log(f"[live] 开始录制: 目标时长 {playlist.target_duration:.0f}s, "
+                 f"窗口 {len(playlist.segments)} 个片段, 媒体序号从 {playlist.media_sequence} 开始")
+        decryptor = SegmentDecryptor(self.engine.pool)
+        last_sequence: Optional[int] = None
+        failures = 0
+        try:
+            while True:
+                polled_at = self._loop.time()
+                new = self._new_segments(playlist, last_sequence)
+                if new:
+                    await self._record(new, decryptor)
+                    last_sequence = new[-1].sequence
+                if playlist.endlist:
+                    self.log("[live] 播放列表已结束 (#EXT-X-ENDLIST)")
+                    break
+                if self._stopping:
+                    break
+                interval = playlist.target_duration if new else playlist.target_duration / 2
+                await self._sleep(interval - (self._loop.time() - polled_at))
+                if self._stopping:
+                    break
+                try:
+                    playlist = await self._reload(media_url)
+                    failures = 0
+                except (HttpError, asyncio.TimeoutError, PlaylistError) as e:
+                    failures += 1
+                    if failures >= LIVE_MAX_POLL_FAILURES:
+                        raise
+                    self.log(f"[live] 重新加载播放列表失败 ({failures}/{LIVE_MAX_POLL_FAILURES}): {e}")
+        finally:
+            await self._close_part()
+        if self._stopping:
+            self.log("[live] 录制已停止")
+        return self.parts
+
+    # --- 轮询 ---
+    async def _sleep(self, seconds: float) -> None:
+        if seconds <= 0:
+            return
+        try:
+            await asyncio.wait_for(self._wake.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _reload(self, media_url: str) -> MediaPlaylist:
+        text = (await self.engine.pool.fetch(media_url)).decode("utf-8", errors="replace")
+        playlist = parse_playlist(text, media_url)
+        if not isinstance(playlist, MediaPlaylist):
+            raise PlaylistError("Live media playlist turned into a master playlist")
+        self.engine.check_segments(playlist)
+        return playlist
+
+    def _new_segments(self, playlist: MediaPlaylist, last_sequence: Optional[int]) -> List[Segment]:
+        segments = playlist.segments
+        if last_sequence is None:
+            return segments[-LIVE_START_SEGMENTS:] if LIVE_START_SEGMENTS > 0 else segments
+        if segments and segments[-1].sequence < last_sequence - len(segments):
+            # 序号大幅回退: 源重新开始了推流
+            self.log(f"[live] 媒体序号从 {last_sequence} 回退到 {segments[-1].sequence}, 视为新的流")
+            return segments
+        new = [segment for segment in segments if segment.sequence > last_sequence]
+        if new and new[0].sequence > last_sequence + 1:
+            self.log(f"[live] {new[0].sequence - last_sequence - 1} 个片段在下载前已经滑出窗口")
+        return new
+
+    # --- 下载 / 写入 ---
+    async def _record(self, segments: List[Segment], decryptor: SegmentDecryptor) -> None:
+        """并发下载一次重新加载带来的新片段, 按顺序写入当前分段"""
+        host = host_of(segments[0].uri)
+        gate = _ConcurrencyGate(lambda: self.engine.tuner.level(host, self.engine.concurrency))
+
+        async def fetch(segment: Segment) -> bytes:
+            async with gate:
+                data = await self.engine.fetch_segment(segment, throttle=self.throttle, use_cache=False)
+            return await decryptor.decrypt(segment, data)
+
+        tasks = [asyncio.ensure_future(fetch(segment)) for segment in segments]
+        try:
+            for segment, task in zip(segments, tasks):
+                try:
+                    data = await task
+                except HttpError as e:
+                    # 直播中丢一个片段不应该结束整个录制
+                    self.log(f"[live] 跳过片段 {segment.sequence}: {e}")
+                    continue
+                await self._write(segment, data, decryptor)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _should_rotate(self) -> bool:
+        part = self._part
+        return ((self.rotate_seconds > 0 and part.duration >= self.rotate_seconds) or
+                (self.rotate_bytes > 0 and part.size >= self.rotate_bytes))
+
+    async def _write(self, segment: Segment, data: bytes, decryptor: SegmentDecryptor) -> None:
+        loop = asyncio.get_running_loop()
+        if self._part is not None and self._should_rotate():
+            await self._close_part()
+        if self._part is None:
+            await self._open_part(segment)
+        chunks = [data]
+        if segment.init_section and segment.init_section != self._written_init:
+            chunks.insert(0, await self.engine.fetch_init(segment, decryptor))
+            self._written_init = segment.init_section
+        size = await loop.run_in_executor(None, _write_and_flush, self._out, chunks)
+        part = self._part
+        part.size += size
+        part.duration += segment.duration
+        part.segments += 1
+        part.ended_at = time.time()
+        if part.first_sequence is None:
+            part.first_sequence = segment.sequence
+        part.last_sequence = segment.sequence
+        if self.on_segment:
+            await loop.run_in_executor(None, self.on_segment, size)
+
+    async def _open_part(self, segment: Segment) -> None:
+        ext = "mp4" if segment.init_section else "ts"
+        index = self._next_part
+        self._next_part += 1
+        path = self.tmp_dir / f"{self.base_name}.part{index:04d}.{ext}"
+        now = time.time()
+        self._out = await asyncio.get_running_loop().run_in_executor(None, open, path, "wb")
+        self._part = RecordedPart(index=index, path=path, started_at=now, ended_at=now)
+        # 每个分段都要能单独播放: fMP4 的初始化片段在每个分段开头重新写一次
+        self._written_init = None
+
+    async def _close_part(self) -> None:
+        part, out = self._part, self._out
+        if part is None:
+            return
+        self._part, self._out = None, None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, out.close)
+        if not part.segments:
+            await loop.run_in_executor(None, part.path.unlink)
+            return
+        self.log(f"[live] 分段 #{part.index} 完成: {part.segments} 个片段, {part.duration:.1f}s")
+        await loop.run_in_executor(None, self.on_part, part)
+        self.parts += 1
@@ -0,0 +1,243 @@
+# app/services/hls_playlist.py
+# (V10 - 原生 HLS 引擎：m3u8 播放列表解析)
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+
+
+class PlaylistError(Exception):
+    """m3u8 内容无法解析时抛出"""
+
+
+@dataclass
+class Key:
+    """#EXT-X-KEY: 加密方式, 密钥 URI 和 IV"""
+    method: str
+    uri: Optional[str] = None
+    iv: Optional[bytes] = None
+
+
+@dataclass
+class InitSection:
+    """#EXT-X-MAP: fMP4 的初始化片段"""
+    uri: str
+    byterange: Optional[Tuple[int, int]] = None  # (length, offset)
+    # 出现 #EXT-X-MAP 时生效的 #EXT-X-KEY (初始化片段同样被加密, RFC 8216 4.3.2.5)
+    key: Optional[Key] = None
+
+
+@dataclass
+class Segment:
+    uri: str
+    duration: float
+    sequence: int
+    byterange: Optional[Tuple[int, int]] = None  # (length, offset)
+    key: Optional[Key] = None
+    init_section: Optional[InitSection] = None
+    discontinuity: bool = False
+
+
+@dataclass
+class Variant:
+    """主播放列表中的一个码率 (#EXT-X-STREAM-INF)"""
+    uri: str
+    bandwidth: int = 0
+    resolution: Optional[str] = None
+    codecs: Optional[str] = None
+    audio: Optional[str] = None
+
+
+@dataclass
+class Rendition:
+    """主播放列表中的一个备选媒体 (#EXT-X-MEDIA)"""
+    type: str
+    group_id: str
+    uri: Optional[str] = None
+    name: Optional[str] = None
+
+
+@dataclass
+class MasterPlaylist:
+    url: str
+    variants: List[Variant] = field(default_factory=list)
+    renditions: List[Rendition] = field(default_factory=list)
+
+    def best_variant(self) -> Variant:
+        if not self.variants:
+            raise PlaylistError("Master playlist has no variants")
+        return max(self.variants, key=lambda v: v.bandwidth)
+
+
+@dataclass
+class MediaPlaylist:
+    url: str
+    target_duration: float = 0.0
+    media_sequence: int = 0
+    endlist: bool = False
+    playlist_type: Optional[str] = None
+    segments: List[Segment] = field(default_factory=list)
+
+    @property
+    def total_duration(self) -> float:
+        return sum(s.duration for s in self.segments)
+
+    @property
+    def is_encrypted(self) -> bool:
+        return any(s.key and s.key.method != "NONE" for s in self.segments)
+
+    @property
+    def is_fmp4(self) -> bool:
+        return any(s.init_section for s in self.segments)
+
+
+def parse_attributes(text: str) -> Dict[str, str]:
+    """
+    解析 'KEY=VALUE,KEY="QUOTED,VALUE"' 形式的属性列表
+    """
+    attrs: Dict[str, str] = {}
+    i, n = 0, len(text)
+    while i < n:
+        eq = text.find("=", i)
+        if eq < 0:
+            break
+        name = text[i:eq].strip().upper()
+        i = eq + 1
+        if i < n and text[i] == '"':
+            end = text.find('"', i + 1)
+            if end < 0:
+                end = n
+            value = text[i + 1:end]
+            i = end + 1
+        else:
+            end = text.find(",", i)
+            if end < 0:
+                end = n
+            value = text[i:end].strip()
+            i = end
+        attrs[name] = value
+        # 跳过分隔逗号
+        while i < n and text[i] in ", ":
+            i += 1
+    return attrs
+
+
+def _parse_byterange(value: str, last_end: int) -> Tuple[int, int]:
+    # "<n>[@<o>]", 省略 offset 时紧接上一个片段
+    if "@" in value:
+        length, offset = value.split("@", 1)
+        return int(length), int(offset)
+    return int(value), last_end
+
+
+def _parse_iv(value: Optional[str]) -> Optional[bytes]:
+    if not value:
+        return None
+    value = value.strip()
+    if value[:2].lower() == "0x":
+        value = value[2:]
+    return bytes.fromhex(value.rjust(32, "0"))
+
+
+def parse_playlist(text: str, url: str):
+    """
+    解析一个 m3u8 文本, 返回 MasterPlaylist 或 MediaPlaylist。
+    所有 URI 都会按 url 解析为绝对地址。
+    """
+    lines = [line.strip() for line in text.lstrip("\ufeff").splitlines()]
+    if not lines or not lines[0].startswith("#EXTM3U"):
+        raise PlaylistError("Not an m3u8 playlist (missing #EXTM3U)")
+
+    if any(line.startswith("#EXT-X-STREAM-INF") for line in lines):
+        return _parse_master(lines, url)
+    return _parse_media(lines, url)
+
+
+def _parse_master(lines: List[str], url: str) -> MasterPlaylist:
+    master = MasterPlaylist(url=url)
+    pending: Optional[Dict[str, str]] = None
+    for line in lines[1:]:
+        if not line:
+            continue
+        if line.startswith("#EXT-X-STREAM-INF:"):
+            pending = parse_attributes(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-MEDIA:"):
+            attrs = parse_attributes(line.split(":", 1)[1])
+            master.renditions.append(Rendition(
+                type=attrs.get("TYPE", ""),
+                group_id=attrs.get("GROUP-ID", ""),
+                uri=urljoin(url, attrs["URI"]) if attrs.get("URI") else None,
+                name=attrs.get("NAME"),
+            ))
+        elif line.startswith("#"):
+            continue
+        elif pending is not None:
+            master.variants.append(Variant(
+                uri=urljoin(url, line),
+                bandwidth=int(pending.get("BANDWIDTH") or pending.get("AVERAGE-BANDWIDTH") or 0),
+                resolution=pending.get("RESOLUTION"),
+                codecs=pending.get("CODECS"),
+                audio=pending.get("AUDIO"),
+            ))
+            pending = None
+    return master
+
+
+def _parse_media(lines: List[str], url: str) -> MediaPlaylist:
+    media = MediaPlaylist(url=url)
+    duration: Optional[float] = None
+    byterange: Optional[Tuple[int, int]] = None
+    last_end = 0
+    key: Optional[Key] = None
+    init_section: Optional[InitSection] = None
+    discontinuity = False
+    sequence = None
+
+    for line in lines[1:]:
+        if not line:
+            continue
+        if line.startswith("#EXT-X-TARGETDURATION:"):
+            media.target_duration = float(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            media.media_sequence = int(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-PLAYLIST-TYPE:"):
+            media.playlist_type = line.split(":", 1)[1].strip().upper()
+        elif line.startswith("#EXT-X-ENDLIST"):
+            media.endlist = True
+        elif line.startswith("#EXTINF:"):
+            duration = float(line.split(":", 1)[1].split(",", 1)[0] or 0)
+        elif line.startswith("#EXT-X-BYTERANGE:"):
+            byterange = _parse_byterange(line.split(":", 1)[1], last_end)
+        elif line.startswith("#EXT-X-DISCONTINUITY") and not line.startswith("#EXT-X-DISCONTINUITY-SEQUENCE"):
+            discontinuity = True
+        elif line.startswith("#EXT-X-KEY:"):
+            attrs = parse_attributes(line.split(":", 1)[1])
+            method = attrs.get("METHOD", "NONE").upper()
+            key = None if method == "NONE" else Key(
+                method=method,
+                uri=urljoin(url, attrs["URI"]) if attrs.get("URI") else None,
+                iv=_parse_iv(attrs.get("IV")),
+            )
+        elif line.startswith("#EXT-X-MAP:"):
+            attrs = parse_attributes(line.split(":", 1)[1])
+            map_range = _parse_byterange(attrs["BYTERANGE"], 0) if attrs.get("BYTERANGE") else None
+            init_section = InitSection(uri=urljoin(url, attrs["URI"]), byterange=map_range, key=key)
+        elif line.startswith("#"):
+            continue
+        else:
+            if sequence is None:
+                sequence = media.media_sequence
+            media.segments.append(Segment(
+                uri=urljoin(url, line),
+                duration=duration or 0.0,
+                sequence=sequence,
+                byterange=byterange,
+                key=key,
+                init_section=init_section,
+                discontinuity=discontinuity,
+            ))
+            if byterange:
+                last_end = byterange[0] + byterange[1]
+            sequence += 1
+            duration, byterange, discontinuity = None, None, False
+    return media
@@ -0,0 +1,193 @@
+# app/services/host_tuning.py
+# (V27 - 按主机自适应的分片并发数: 根据实测吞吐量、错误率和 429/503 调整, 结果保存在 SQLite 中)
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# 关闭后总是使用固定的基线 (HLS_SEGMENT_CONCURRENCY / YTDLP_CONCURRENT_FRAGMENTS)
+HOST_CONCURRENCY_ADAPTIVE = os.environ.get("HOST_CONCURRENCY_ADAPTIVE", "1") not in ("0", "false", "no")
+HOST_CONCURRENCY_MIN = int(os.environ.get("HOST_CONCURRENCY_MIN", "1"))
+HOST_CONCURRENCY_MAX = int(os.environ.get("HOST_CONCURRENCY_MAX", "16"))
+# 每个评估窗口至少多少秒 (窗口内还要有足够多的分片才做决定)
+HOST_TUNING_WINDOW = float(os.environ.get("HOST_TUNING_WINDOW", "2.0"))
+# 吞吐量至少提高多少才认为增加并发是值得的
+HOST_TUNING_GAIN = 0.05
+# 窗口内失败的分片比例超过它时降低并发
+HOST_TUNING_ERROR_RATE = 0.1
+# 被限流 (429/503) 或提速无效后, 多少个窗口内不再尝试增加并发
+HOST_TUNING_HOLD_WINDOWS = 5
+
+THROTTLE_STATUSES = (429, 503)
+
+
+class _HostState:
+    def __init__(self, level: int, throughput: Optional[float] = None, throttles: int = 0):
+        self.level = level
+        self.throughput = throughput    # 上一个窗口的吞吐量 (字节/秒)
+        self.throttles = throttles      # 累计被限流的次数
+        self.last_step = 0              # 上一次调整的方向 (+1 / -1 / 0)
+        self.hold = 0                   # 剩余多少个窗口不增加并发
+        self.last_cut = 0.0             # 上一次因限流减半的时间
+        self.updated_at = time.time()
+        self._reset_window(time.monotonic())
+
+    def _reset_window(self, now: float) -> None:
+        self.window_start = now
+        self.last_seen = now
+        self.bytes = 0
+        self.fragments = 0
+        self.errors = 0
+        self.window_throttles = 0
+
+
+class HostConcurrencyController:
+    """
+    每个主机一个并发级别 (每个任务同时下载的分片数)。
+
+    下载路径报告每个分片的结果 (observe / observe_error); 每个窗口结束时:
+    - 窗口内出现 429/503: 并发减半, 并在 HOST_TUNING_HOLD_WINDOWS 个窗口内不再提高
+    - 错误率过高: 并发 -1
+    - 否则爬山: 上次提高并发后吞吐量提高了至少 HOST_TUNING_GAIN 就继续 +1,
+      没有提高就退回 -1 并暂停一段时间
+
+    级别变化后主机被标记为 dirty, 由 Service 在任务结束时 flush() 到数据库,
+    下次进程启动后 load() 恢复, 这样同一个 CDN 的下一个任务直接从学到的级别开始。
+    (只在内存中计算, 不访问数据库, 所以可以在引擎的事件循环中调用)
+    """
+
+    def __init__(self, minimum: int = HOST_CONCURRENCY_MIN, maximum: int = HOST_CONCURRENCY_MAX,
+                 window: float = HOST_TUNING_WINDOW, adaptive: bool = HOST_CONCURRENCY_ADAPTIVE):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.window = window
+        self.adaptive = adaptive
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, _HostState] = {}
+        self._dirty = set()
+
+    def _clamp(self, level: int) -> int:
+        return max(self.minimum, min(self.maximum, int(level)))
+
+    def load(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """从数据库恢复学到的级别"""
+        with self._lock:
+            for row in rows:
+                state = _HostState(self._clamp(row["concurrency"]), row.get("throughput"), row.get("throttles") or 0)
+                state.updated_at = row.get("updated_at") or state.updated_at
+                self._hosts[row["host"]] = state
+
+    def _state(self, host: str, baseline: int) -> _HostState:
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState(self._clamp(baseline))
+        return state
+
+    def level(self, host: str, baseline: int) -> int:
+        if not self.adaptive:
+            return baseline
+        with self._lock:
+            return self._state(host, baseline).level
+
+    # --- 观测 ---
+    def observe(self, host: str, nbytes: int, baseline: int) -> None:
+        """一个分片下载成功"""
+        self._record(host, baseline, nbytes=nbytes)
+
+    def observe_error(self, host: str, baseline: int, status: Optional[int] = None) -> None:
+        """一个分片下载失败; status 为 429/503 时视为被限流"""
+        self._record(host, baseline, error=True, throttled=status in THROTTLE_STATUSES)
+
+    def end_run(self, host: str, baseline: int, nbytes: int, seconds: float, fragments: int = 0) -> None:
+        """
+        (yt-dlp) 子进程启动后并发数就固定了: 整个运行只算一个窗口, 结束时立即评估
+        """
+        if not self.adaptive or seconds <= 0:
+            return
+        with self._lock:
+            state = self._state(host, baseline)
+            state.bytes += nbytes
+            state.fragments += max(fragments, 1)
+            state.window_start = time.monotonic() - seconds
+            self._evaluate(host, state, time.monotonic())
+
+    def _record(self, host: str, baseline: int, nbytes: int = 0, error: bool = False,
+                throttled: bool = False) -> None:
+        if not self.adaptive:
+            return
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(host, baseline)
+            # 主机空闲过一段时间: 之前的窗口不能代表当前的吞吐量
+            if now - state.last_seen > self.window:
+                state._reset_window(now)
+            state.last_seen = now
+            state.bytes += nbytes
+            state.fragments += 1
+            state.errors += error
+            state.window_throttles += throttled
+            if throttled and now - state.last_cut >= self.window:
+                # 限流立即生效, 不等窗口结束 (同一批并发请求一起收到的 429 只减半一次)
+                self._evaluate(host, state, now)
+            elif now - state.window_start >= self.window and state.fragments >= 2 * state.level:
+                self._evaluate(host, state, now)
+
+    def _evaluate(self, host: str, state: _HostState, now: float) -> None:
+        old = state.level
+        elapsed = max(now - state.window_start, 1e-6)
+        throughput = state.bytes / elapsed
+        state.throttles += state.window_throttles
+        if state.window_throttles and now - state.last_cut >= self.window:
+            state.level = self._clamp(state.level // 2)
+            state.hold = HOST_TUNING_HOLD_WINDOWS
+            state.last_cut = now
+            step = -1
+        elif state.window_throttles:
+            # 刚减半过: 这些 429 来自减半之前发出的请求
+            step = 0
+        elif state.fragments and state.errors / state.fragments > HOST_TUNING_ERROR_RATE:
+            state.level = self._clamp(state.level - 1)
+            step = -1
+        elif state.last_step > 0 and state.throughput and throughput < state.throughput * (1 + HOST_TUNING_GAIN):
+            # 上次加的并发没有带来明显的提升: 退回去, 暂时停在这里
+            state.level = self._clamp(state.level - 1)
+            state.hold = HOST_TUNING_HOLD_WINDOWS
+            step = -1
+        elif state.hold > 0:
+            state.hold -= 1
+            step = 0
+        else:
+            state.level = self._clamp(state.level + 1)
+            step = 1
+        state.last_step = step if state.level != old else 0
+        state.throughput = throughput
+        state._reset_window(now)
+        if state.level != old:
+            state.updated_at = time.time()
+            self._dirty.add(host)
+            print(f"--- [TUNING] {host}: 并发 {old} -> {state.level} "
+                  f"({throughput / 1e6:.2f} MB/s, 累计限流 {state.throttles} 次)")
+
+    # --- 持久化 / 状态 ---
+    def flush(self, save: Callable[[List[Dict[str, Any]]], None]) -> None:
+        """把变化过的主机交给 save (写数据库)"""
+        with self._lock:
+            if not self._dirty:
+                return
+            rows = [self._row(host, self._hosts[host]) for host in self._dirty]
+            self._dirty.clear()
+        save(rows)
+
+    @staticmethod
+    def _row(host: str, state: _HostState) -> Dict[str, Any]:
+        return {"host": host, "concurrency": state.level, "throughput": state.throughput,
+                "throttles": state.throttles, "updated_at": state.updated_at}
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [self._row(host, state) for host, state in sorted(self._hosts.items())]
+
+
+# --- 单例 ---
+host_tuner = HostConcurrencyController()
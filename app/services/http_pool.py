@@ -0,0 +1,228 @@
+# app/services/http_pool.py
+# (V10 - 原生 HLS 引擎：基于 asyncio + h11 的 keep-alive 连接池)
+
+import asyncio
+import ssl
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+import h11
+
+DEFAULT_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+)
+READ_CHUNK_SIZE = 64 * 1024
+MAX_REDIRECTS = 5
+
+
+class HttpError(Exception):
+    """HTTP 请求失败 (非 2xx 状态码, 连接中断等)"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class _Connection:
+    """
+    一条到 (scheme, host, port) 的 HTTP/1.1 连接。
+    h11 负责协议状态机, asyncio streams 负责 I/O。
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.h11 = h11.Connection(h11.CLIENT)
+        self.reused = False
+
+    async def send(self, event) -> None:
+        data = self.h11.send(event)
+        if data:
+            self.writer.write(data)
+            await self.writer.drain()
+
+    async def next_event(self, timeout: float):
+        while True:
+            event = self.h11.next_event()
+            if event is h11.NEED_DATA:
+                data = await asyncio.wait_for(self.reader.read(READ_CHUNK_SIZE), timeout)
+                self.h11.receive_data(data)
+                continue
+            return event
+
+    def reusable(self) -> bool:
+        return self.h11.our_state is h11.DONE and self.h11.their_state is h11.DONE
+
+    def close(self) -> None:
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+
+class HttpResponse:
+    """一个流式响应。body 通过 iter_chunks() / read() 读取。"""
+
+    def __init__(self, url: str, status: int, headers: Dict[str, str], conn: _Connection, timeout: float):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self._conn = conn
+        self._timeout = timeout
+        self.complete = False
+
+    @property
+    def content_length(self) -> Optional[int]:
+        value = self.headers.get("content-length")
+        return int(value) if value and value.isdigit() else None
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        while not self.complete:
+            event = await self._conn.next_event(self._timeout)
+            if isinstance(event, h11.Data):
+                yield bytes(event.data)
+            elif isinstance(event, h11.EndOfMessage):
+                self.complete = True
+            elif isinstance(event, h11.ConnectionClosed):
+                raise HttpError(f"Connection closed before response body completed: {self.url}")
+
+    async def read(self) -> bytes:
+        return b"".join([chunk async for chunk in self.iter_chunks()])
+
+
+class AsyncHttpPool:
+    """
+    按 (scheme, host, port) 复用 keep-alive 连接的连接池。
+    同一个主机的并发连接数受 max_per_host 限制。
+    所有方法都必须在同一个事件循环中调用。
+    """
+
+    def __init__(self, max_per_host: int = 8, timeout: float = 30.0,
+                 user_agent: str = DEFAULT_USER_AGENT):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self._idle: Dict[Tuple[str, str, int], List[_Connection]] = {}
+        self._limits: Dict[Tuple[str, str, int], asyncio.Semaphore] = {}
+        self._ssl_context = ssl.create_default_context()
+
+    @staticmethod
+    def _origin(url: str) -> Tuple[str, str, int]:
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https"):
+            raise HttpError(f"Unsupported URL scheme: {url}")
+        port = parts.port or (443 if scheme == "https" else 80)
+        return scheme, parts.hostname or "", port
+
+    async def _acquire(self, origin: Tuple[str, str, int]) -> _Connection:
+        idle = self._idle.get(origin)
+        while idle:
+            conn = idle.pop()
+            if not conn.reader.at_eof():
+                conn.reused = True
+                return conn
+            conn.close()
+        scheme, host, port = origin
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                host, port,
+                ssl=self._ssl_context if scheme == "https" else None,
+                limit=READ_CHUNK_SIZE * 4,
+            ),
+            self.timeout,
+        )
+        return _Connection(reader, writer)
+
+    def _release(self, origin: Tuple[str, str, int], conn: _Connection, response: Optional[HttpResponse]) -> None:
+        if response is not None and response.complete and conn.reusable():
+            conn.h11.start_next_cycle()
+            self._idle.setdefault(origin, []).append(conn)
+        else:
+            conn.close()
+
+    async def _send_request(self, conn: _Connection, url: str, headers: Dict[str, str]) -> HttpResponse:
+        parts = urlsplit(url)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        host = parts.netloc.rsplit("@", 1)[-1]
+        request_headers = [("Host", host), ("User-Agent", self.user_agent), ("Accept", "*/*")]
+        request_headers += list(headers.items())
+        await conn.send(h11.Request(method="GET", target=target, headers=request_headers))
+        await conn.send(h11.EndOfMessage())
+        while True:
+            event = await conn.next_event(self.timeout)
+            if isinstance(event, h11.InformationalResponse):
+                continue
+            if isinstance(event, h11.Response):
+                response_headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in event.headers}
+                return HttpResponse(url, event.status_code, response_headers, conn, self.timeout)
+            raise HttpError(f"Unexpected HTTP event {event!r} for {url}")
+
+    @asynccontextmanager
+    async def stream(self, url: str, headers: Optional[Dict[str, str]] = None) -> AsyncIterator[HttpResponse]:
+        """
+        发起 GET 请求并返回一个流式响应 (自动跟随重定向)。
+        非 2xx 状态码会抛出 HttpError。
+        """
+        headers = headers or {}
+        for _ in range(MAX_REDIRECTS + 1):
+            origin = self._origin(url)
+            limit = self._limits.setdefault(origin, asyncio.Semaphore(self.max_per_host))
+            async with limit:
+                conn = await self._acquire(origin)
+                response = None
+                try:
+                    try:
+                        response = await self._send_request(conn, url, headers)
+                    except (ConnectionError, asyncio.IncompleteReadError, h11.RemoteProtocolError):
+                        # 复用的空闲连接可能已被服务器关闭: 换一条新连接重试一次
+                        if not conn.reused:
+                            raise
+                        conn.close()
+                        conn = await self._acquire_fresh(origin)
+                        response = await self._send_request(conn, url, headers)
+
+                    if response.status in (301, 302, 303, 307, 308) and response.headers.get("location"):
+                        await response.read()
+                        url = urljoin(url, response.headers["location"])
+                        continue
+                    if not 200 <= response.status < 300:
+                        await response.read()
+                        raise HttpError(f"HTTP {response.status} for {url}", status=response.status)
+                    yield response
+                    return
+                except (OSError, asyncio.TimeoutError, h11.ProtocolError) as e:
+                    raise HttpError(f"{type(e).__name__}: {e} ({url})") from e
+                finally:
+                    self._release(origin, conn, response)
+        raise HttpError(f"Too many redirects: {url}")
+
+    async def _acquire_fresh(self, origin: Tuple[str, str, int]) -> _Connection:
+        for conn in self._idle.pop(origin, []):
+            conn.close()
+        return await self._acquire(origin)
+
+    async def fetch(self, url: str, headers: Optional[Dict[str, str]] = None,
+                    throttle: Optional[Callable[[int], Awaitable[None]]] = None) -> bytes:
+        """
+        (V23) throttle(n) 在每读到 n 字节后被 await (限速);
+        等待期间不再从 socket 读取, TCP 窗口随之收紧, 真正降低网络速率
+        """
+        async with self.stream(url, headers) as response:
+            if throttle is None:
+                return await response.read()
+            chunks = []
+            async for chunk in response.iter_chunks():
+                chunks.append(chunk)
+                await throttle(len(chunk))
+            return b"".join(chunks)
+
+    async def close(self) -> None:
+        for conns in self._idle.values():
+            for conn in conns:
+                conn.close()
+        self._idle.clear()
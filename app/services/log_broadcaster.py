@@ -0,0 +1,162 @@
+# app/services/log_broadcaster.py
+# (V14 - 多订阅者日志广播：固定大小的环形缓冲 + 重放)
+
+import asyncio
+import os
+import threading
+from collections import deque
+from typing import Deque, List, Optional
+
+# 每个任务保留最近多少行日志 (新订阅者会先收到这些行)
+LOG_REPLAY_LINES = int(os.environ.get("LOG_REPLAY_LINES", "200"))
+# 每个订阅者最多积压多少行; 超出时丢弃最旧的行
+SUBSCRIBER_BACKLOG_LINES = int(os.environ.get("SUBSCRIBER_BACKLOG_LINES", "500"))
+
+
+class Subscription:
+    """
+    一个订阅者 (例如一个 SSE 连接) 的私有队列。
+
+    队列有上限: 消费者太慢时丢弃最旧的行, 下次读取时先收到一行
+    "跳过了 N 行" 的提示, 而不是阻塞发布者。
+    """
+
+    def __init__(self, backlog: int, initial: List[str]):
+        self._lines: Deque[str] = deque(initial, maxlen=backlog)
+        self._cond = threading.Condition()
+        self._dropped = 0
+        self._closed = False
+
+    def push(self, line: str) -> None:
+        with self._cond:
+            if len(self._lines) == self._lines.maxlen:
+                self._dropped += 1
+            self._lines.append(line)
+            self._cond.notify()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        取下一行。广播已结束且队列为空时返回 None;
+        超时返回空字符串 "" (调用方可以借机发送心跳)。
+        """
+        with self._cond:
+            if not self._lines and not self._closed:
+                self._cond.wait(timeout)
+            if self._dropped:
+                dropped, self._dropped = self._dropped, 0
+                return f"[日志] 消费太慢, 跳过了 {dropped} 行"
+            if self._lines:
+                return self._lines.popleft()
+            return None if self._closed else ""
+
+
+class AsyncSubscription(Subscription):
+    """
+    (V30) 在事件循环中消费的订阅者 (异步 SSE 生成器):
+    push() 仍然可以在任何线程中调用, 通过 call_soon_threadsafe 唤醒等待的协程,
+    等待期间不占用任何线程。
+    """
+
+    def __init__(self, backlog: int, initial: List[str], loop: asyncio.AbstractEventLoop):
+        super().__init__(backlog, initial)
+        self._loop = loop
+        self._ready = asyncio.Event()
+
+    def _wake(self) -> None:
+        # 协程已经被唤醒过 (还没有取走数据) 时不必再唤醒
+        if self._ready.is_set():
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            pass  # 事件循环已关闭 (应用正在退出)
+
+    def push(self, line: str) -> None:
+        super().push(line)
+        self._wake()
+
+    def close(self) -> None:
+        super().close()
+        self._wake()
+
+    async def get_async(self, timeout: Optional[float] = None) -> Optional[str]:
+        """与 get() 的返回值相同, 但在事件循环中等待"""
+        line = self.get(timeout=0)
+        if line != "":
+            return line
+        self._ready.clear()
+        # 清除之后再检查一次: 清除之前到达的行不会再唤醒我们
+        line = self.get(timeout=0)
+        if line != "":
+            return line
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return ""
+        return self.get(timeout=0)
+
+
+class TaskBroadcaster:
+    """
+    一个任务的日志广播中心。
+
+    - publish() 把一行发给所有订阅者, 并写入环形缓冲 (只保留最近 replay_lines 行)
+    - subscribe() 返回一个新的 Subscription, 先重放缓冲中的行
+    - close() 表示任务结束; 订阅者读完剩余行后收到 None
+
+    无论任务运行多久、有多少订阅者, 内存占用都有固定上限。
+    """
+
+    def __init__(self, replay_lines: int = LOG_REPLAY_LINES,
+                 backlog_lines: int = SUBSCRIBER_BACKLOG_LINES):
+        self._buffer: Deque[str] = deque(maxlen=replay_lines)
+        self._backlog = backlog_lines
+        self._subscribers: List[Subscription] = []
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def publish(self, line: str) -> None:
+        with self._lock:
+            if self.closed:
+                return
+            self._buffer.append(line)
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub.push(line)
+
+    def subscribe(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> Subscription:
+        """(V30) 指定 loop 时返回 AsyncSubscription, 在该事件循环中用 get_async() 读取"""
+        with self._lock:
+            if loop is not None:
+                sub = AsyncSubscription(self._backlog, list(self._buffer), loop)
+            else:
+                sub = Subscription(self._backlog, list(self._buffer))
+            if self.closed:
+                sub.close()
+            else:
+                self._subscribers.append(sub)
+            return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def close(self) -> None:
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            subscribers, self._subscribers = self._subscribers, []
+        for sub in subscribers:
+            sub.close()
@@ -0,0 +1,48 @@
+# app/services/playlist_expander.py
+# (V28 - 批量提交：用 yt-dlp 的 flat 提取把播放列表 / 频道展开成单个视频的 URL)
+
+import os
+from typing import Any, Dict, List
+
+from app.services.extractor_pool import extractor, ExtractionError
+
+# 展开一个播放列表最多等待多少秒
+PLAYLIST_EXPAND_TIMEOUT = float(os.environ.get("PLAYLIST_EXPAND_TIMEOUT", "120"))
+# 一次最多展开多少个条目
+PLAYLIST_MAX_ENTRIES = int(os.environ.get("PLAYLIST_MAX_ENTRIES", "1000"))
+
+
+class PlaylistExpansionError(Exception):
+    """播放列表无法展开 (yt-dlp 出错、超时或没有任何条目)"""
+
+
+def expand_playlist(url: str, limit: int = PLAYLIST_MAX_ENTRIES) -> List[str]:
+    """
+    返回播放列表中每个条目的 URL (按播放列表中的顺序)。
+    --flat-playlist 只读取列表本身, 不解析每个视频, 所以几百个条目也只需要一次请求。
+    不是播放列表的 URL 原样返回 (一个条目)。
+    """
+    limit = max(1, min(limit, PLAYLIST_MAX_ENTRIES))
+    # (V32) 在常驻的提取进程中运行, 相当于 yt-dlp -J --flat-playlist --playlist-end N
+    try:
+        info = extractor.extract(url, timeout=PLAYLIST_EXPAND_TIMEOUT, extract_flat="in_playlist",
+                                 noplaylist=False, playlistend=limit)
+    except ExtractionError as e:
+        raise PlaylistExpansionError(f"yt-dlp 无法展开播放列表: {e}")
+    urls = entry_urls(info)[:limit] if info.get("_type") == "playlist" else [url]
+    if not urls:
+        raise PlaylistExpansionError(f"播放列表中没有可下载的条目: {url}")
+    print(f"--- [PLAYLIST] {url} 展开为 {len(urls)} 个条目")
+    return urls
+
+
+def entry_urls(info: Dict[str, Any]) -> List[str]:
+    """flat 提取结果中的条目 URL; 没有 URL 的条目 (例如已删除的视频) 跳过"""
+    urls = []
+    for entry in info.get("entries") or []:
+        if not entry:
+            continue
+        url = entry.get("url") or entry.get("webpage_url")
+        if url and url.startswith(("http://", "https://")):
+            urls.append(url)
+    return urls
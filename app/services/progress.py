@@ -0,0 +1,187 @@
+# app/services/progress.py
+# (V13 - 结构化进度：百分比、速度、ETA、字节数)
+
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+# 进度写入数据库的最小间隔 (秒)
+PROGRESS_UPDATE_INTERVAL = float(os.environ.get("PROGRESS_UPDATE_INTERVAL", "1.0"))
+
+# yt-dlp 的 --progress-template: 每次进度回调输出一行, 字段用空格分隔, 缺失值为 NA
+YTDLP_PROGRESS_PREFIX = "[progress]"
+YTDLP_PROGRESS_TEMPLATE = (
+    "download:" + YTDLP_PROGRESS_PREFIX +
+    " %(progress.downloaded_bytes)s %(progress.total_bytes)s %(progress.total_bytes_estimate)s"
+    " %(progress.speed)s %(progress.eta)s %(progress.fragment_index)s %(progress.fragment_count)s"
+)
+
+# 没有使用 --progress-template 时 (例如旧版本 yt-dlp 忽略了该参数) 的默认进度行:
+# [download]  45.3% of ~  10.00MiB at    1.00MiB/s ETA 00:05 (frag 3/10)
+YTDLP_DEFAULT_PROGRESS = re.compile(
+    r"\[download\]\s+(?P<percent>\d+(?:\.\d+)?)%\s+of\s+~?\s*(?P<total>\d+(?:\.\d+)?[KMGTP]?i?B|Unknown)"
+    r"(?:[^(]*?\s+at\s+(?P<speed>\d+(?:\.\d+)?[KMGTP]?i?B/s|Unknown))?"
+    r"(?:\S*\s+ETA\s+(?P<eta>\d+(?::\d+)*|Unknown))?"
+    r"(?:.*?\(frag (?P<frag_index>\d+)/(?P<frag_count>\d+)\))?"
+)
+SIZE_UNITS = "KMGTP"
+
+PROGRESS_FIELDS = ("progress", "downloaded_bytes", "total_bytes", "speed", "eta",
+                   "fragment_index", "fragment_count")
+
+
+def _num(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _size(value: Optional[str]) -> Optional[float]:
+    """ "10.00MiB" / "1.5MB/s" -> 字节数; Unknown 等无法解析的值为 None"""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([KMGTP]?)(i?)B(?:/s)?", value or "")
+    if not match:
+        return None
+    number, unit, binary = match.groups()
+    power = SIZE_UNITS.index(unit) + 1 if unit else 0
+    return float(number) * (1024 if binary else 1000) ** power
+
+
+def _eta(value: Optional[str]) -> Optional[float]:
+    """ "01:02:03" / "00:05" -> 秒"""
+    if not value or not re.fullmatch(r"\d+(?::\d+)*", value):
+        return None
+    seconds = 0
+    for part in value.split(":"):
+        seconds = seconds * 60 + int(part)
+    return float(seconds)
+
+
+def _parse_default_progress(line: str) -> Optional[Dict[str, Any]]:
+    match = YTDLP_DEFAULT_PROGRESS.match(line)
+    if not match:
+        return None
+    total = _size(match["total"])
+    return {
+        "downloaded_bytes": float(match["percent"]) * total / 100 if total else None,
+        "total_bytes": total,
+        "speed": _size(match["speed"]),
+        "eta": _eta(match["eta"]),
+        "fragment_index": _num(match["frag_index"]),
+        "fragment_count": _num(match["frag_count"]),
+    }
+
+
+def parse_ytdlp_progress(line: str) -> Optional[Dict[str, Any]]:
+    """
+    解析一行 YTDLP_PROGRESS_TEMPLATE 的输出 (或 yt-dlp 默认格式的进度行), 不是进度行时返回 None
+    """
+    if not line.startswith(YTDLP_PROGRESS_PREFIX):
+        return _parse_default_progress(line)
+    parts = line[len(YTDLP_PROGRESS_PREFIX):].split()
+    if len(parts) < 7:
+        return None
+    downloaded, total, estimate, speed, eta, frag_index, frag_count = (_num(p) for p in parts[:7])
+    return {
+        "downloaded_bytes": downloaded,
+        "total_bytes": total or estimate,
+        "speed": speed,
+        "eta": eta,
+        "fragment_index": frag_index,
+        "fragment_count": frag_count,
+    }
+
+
+def format_bytes(value: Optional[float]) -> str:
+    if value is None:
+        return "?"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if value < 1024:
+            return f"{value:.1f}{unit}"
+        value /= 1024
+    return f"{value:.1f}TiB"
+
+
+class ProgressTracker:
+    """
+    一个任务的进度状态。
+
+    下载路径频繁调用 update(); 只有距离上次写入超过 interval 秒时,
+    才把快照交给 on_flush (通常是写入数据库)。速度和 ETA 在调用方
+    没有提供时, 根据字节数的变化自己估算。
+    """
+
+    def __init__(self, on_flush: Callable[[Dict[str, Any]], None],
+                 interval: float = PROGRESS_UPDATE_INTERVAL):
+        self._on_flush = on_flush
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        self._last_sample = (time.monotonic(), None)
+        self.state: Dict[str, Any] = {field: None for field in PROGRESS_FIELDS}
+        self.state["progress"] = 0.0
+
+    def update(self, **values) -> bool:
+        """
+        合并新的进度值; 如果这次触发了写入, 返回 True
+        """
+        with self._lock:
+            for key, value in values.items():
+                if key in self.state and value is not None:
+                    self.state[key] = value
+            self._derive(provided_speed=values.get("speed") is not None,
+                         provided_eta=values.get("eta") is not None)
+            now = time.monotonic()
+            if now - self._last_flush < self._interval:
+                return False
+            self._last_flush = now
+            snapshot = dict(self.state)
+        self._on_flush(snapshot)
+        return True
+
+    def finish(self) -> None:
+        """任务完成: 强制写入 100%"""
+        with self._lock:
+            self.state["progress"] = 100.0
+            self.state["eta"] = 0
+            if self.state["total_bytes"] is None:
+                self.state["total_bytes"] = self.state["downloaded_bytes"]
+            snapshot = dict(self.state)
+        self._on_flush(snapshot)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.state)
+
+    def _derive(self, provided_speed: bool, provided_eta: bool) -> None:
+        s = self.state
+        done = s["downloaded_bytes"]
+        now = time.monotonic()
+        if done is not None and not provided_speed:
+            last_time, last_done = self._last_sample
+            elapsed = now - last_time
+            if last_done is None:
+                self._last_sample = (now, done)
+            elif elapsed >= 0.5:
+                instant = max(0.0, (done - last_done) / elapsed)
+                # 指数平滑, 避免速度跳动
+                s["speed"] = instant if s["speed"] is None else 0.7 * s["speed"] + 0.3 * instant
+                self._last_sample = (now, done)
+
+        if done is not None and s["total_bytes"]:
+            s["progress"] = round(min(100.0, 100.0 * done / s["total_bytes"]), 2)
+        elif s["fragment_index"] and s["fragment_count"]:
+            s["progress"] = round(min(100.0, 100.0 * s["fragment_index"] / s["fragment_count"]), 2)
+
+        if not provided_eta and s["speed"] and done is not None and s["total_bytes"]:
+            s["eta"] = max(0.0, (s["total_bytes"] - done) / s["speed"])
+
+    def describe(self) -> str:
+        """给 SSE 日志用的一行可读文本"""
+        s = self.snapshot()
+        eta = f"{int(s['eta'])}s" if s["eta"] is not None else "?"
+        speed = f"{format_bytes(s['speed'])}/s" if s["speed"] else "?"
+        return (f"[progress] {s['progress']:.1f}% of {format_bytes(s['total_bytes'])} "
+                f"at {speed} ETA {eta}")
@@ -0,0 +1,212 @@
+# app/services/segment_cache.py
+# (V20 - 跨任务共享的片段磁盘缓存 + LRU 淘汰)
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+
+# 缓存目录和容量上限 (字节); 上限 <= 0 时禁用缓存
+SEGMENT_CACHE_DIR = Path(os.environ.get(
+    "SEGMENT_CACHE_DIR",
+    str(Path(os.environ.get("DOWNLOAD_ROOT", "/downloads")).joinpath(".segment-cache")),
+))
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get("SEGMENT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# (V31) 超过上限时淘汰到上限的多少 (淘汰前要重新扫描目录, 留出余量避免每次写入都扫描)
+SEGMENT_CACHE_LOW_WATER = float(os.environ.get("SEGMENT_CACHE_LOW_WATER", "0.9"))
+# (V31) 最多隔多少秒重新扫描一次目录, 把其他 worker 写入的条目计入总大小
+SEGMENT_CACHE_RESCAN_SECONDS = float(os.environ.get("SEGMENT_CACHE_RESCAN_SECONDS", "30"))
+# 多久以前的 .part 文件视为写了一半就退出的残留 (其他 worker 可能正在写)
+SEGMENT_CACHE_STALE_PART_SECONDS = 600
+
+ByteRange = Optional[Tuple[int, int]]
+
+
+class SegmentCache:
+    """
+    按 (片段 URL, 字节范围) 缓存从上游下载到的 *原始* 片段数据 (解密之前)。
+
+    - 每个条目是缓存目录中的一个文件, 先写临时文件再 os.replace, 不会读到写了一半的条目
+    - 内存中的 OrderedDict 记录 LRU 顺序; 启动后第一次使用时按文件的 mtime 重建
+    - 总大小超过 max_bytes 时淘汰最久未使用的条目
+    - 方法都是阻塞的文件操作, 引擎在线程池中调用它们
+
+    (V31) 多个 worker 共享同一个缓存目录: 命中时更新文件的 mtime, 索引中没有的条目
+    (其他 worker 写入的) 也会直接尝试打开; 超过上限时 (以及每隔 SEGMENT_CACHE_RESCAN_SECONDS)
+    重新扫描整个目录, 按 mtime 淘汰, 所以 max_bytes 是整个目录的上限, 而不是每个 worker 的
+    (最多超出其他 worker 在一个扫描间隔内写入的量)。条目在查找和打开之间被其他
+    worker 淘汰时按未命中处理; 已经打开的文件即使被删除也仍然可读。
+    """
+
+    def __init__(self, directory: Path = SEGMENT_CACHE_DIR, max_bytes: int = SEGMENT_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        self._loaded = False
+        self._scanned_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(uri: str, byterange: ByteRange = None) -> str:
+        raw = uri if not byterange else f"{uri}#{byterange[1]}+{byterange[0]}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.seg"
+
+    def _load_index(self) -> None:
+        # (调用方持有 _lock)
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            print(f"--- [SEGMENT-CACHE] 无法创建缓存目录 {self.directory}: {e}")
+            return
+        self._rescan()
+        stale = time.time() - SEGMENT_CACHE_STALE_PART_SECONDS
+        for leftover in self.directory.glob("*.part"):
+            try:
+                if leftover.stat().st_mtime < stale:
+                    leftover.unlink(missing_ok=True)
+            except OSError:
+                pass
+
+    def _rescan(self) -> None:
+        """(调用方持有 _lock) 按目录中的文件重建索引, 最久未使用 (mtime 最早) 的在前"""
+        found = []
+        for path in self.directory.glob("*.seg"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            found.append((stat.st_mtime, path.stem, stat.st_size))
+        self._entries.clear()
+        self._size = 0
+        self._scanned_at = time.monotonic()
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._size += size
+
+    def open(self, uri: str, byterange: ByteRange = None) -> Optional[BinaryIO]:
+        """
+        (V22) 命中时返回打开的缓存文件 (调用方负责关闭), 未命中返回 None。
+        文件打开之后即使条目被淘汰, 内容也仍然可读。
+        """
+        if not self.enabled:
+            return None
+        key = self.key(uri, byterange)
+        with self._lock:
+            self._load_index()
+            size = self._entries.get(key)
+            if size is not None:
+                self._entries.move_to_end(key)
+        # (V31) 索引中没有时也尝试打开: 条目可能是其他 worker 写入的
+        path = self._path(key)
+        try:
+            f = open(path, "rb")
+        except OSError:
+            f = None
+        if f is not None:
+            size = os.fstat(f.fileno()).st_size
+            try:
+                # 更新 mtime, 重启后 (以及其他 worker 淘汰时) 的 LRU 顺序仍然正确
+                os.utime(path)
+            except OSError:
+                pass
+        with self._lock:
+            if f is None:
+                # 已经被 (其他 worker) 淘汰
+                if key in self._entries:
+                    self._size -= self._entries.pop(key)
+                self.misses += 1
+            else:
+                if key not in self._entries:
+                    self._entries[key] = size
+                    self._size += size
+                self.hits += 1
+                self.hit_bytes += size
+        return f
+
+    def get(self, uri: str, byterange: ByteRange = None) -> Optional[bytes]:
+        f = self.open(uri, byterange)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def put(self, uri: str, byterange: ByteRange, data: bytes) -> None:
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        key = self.key(uri, byterange)
+        with self._lock:
+            self._load_index()
+            if key in self._entries:
+                return
+        path = self._path(key)
+        part = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.part")
+        try:
+            part.write_bytes(data)
+            os.replace(part, path)
+        except OSError as e:
+            print(f"--- [SEGMENT-CACHE] 写入缓存失败: {e}")
+            part.unlink(missing_ok=True)
+            return
+        evicted = []
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = len(data)
+                self._size += len(data)
+                self.stores += 1
+            if self._size > self.max_bytes or time.monotonic() - self._scanned_at > SEGMENT_CACHE_RESCAN_SECONDS:
+                # (V31) 其他 worker 也在写入和淘汰: 按目录的实际内容计算总大小
+                self._rescan()
+            target = self.max_bytes * SEGMENT_CACHE_LOW_WATER if self._size > self.max_bytes else self.max_bytes
+            while self._size > target and self._entries:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._size -= old_size
+                self.evictions += 1
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                self._path(old_key).unlink(missing_ok=True)
+            except OSError as e:
+                # (Windows 上正在被读取的文件不能删除)
+                print(f"--- [SEGMENT-CACHE] 无法删除被淘汰的条目: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            if self.enabled:
+                self._load_index()
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "directory": str(self.directory),
+                "max_bytes": self.max_bytes,
+                "size_bytes": self._size,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "bytes_saved": self.hit_bytes,
+                "stores": self.stores,
+                "evictions": self.evictions,
+            }
+
+
+# --- 单例 ---
+segment_cache = SegmentCache()
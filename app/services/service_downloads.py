@@ -1,36 +1,293 @@
 # app/services/service_downloads.py
 # (V8.6 - 修复版：修复 yt-dlp 路径，解除下载目录限制，支持 Docker 任意挂载)
 
-import psutil
+import asyncio
 import uuid
-import threading
+import base64
+import json
 import subprocess
-import queue
 import sys
 import time
 import os
+import re
+from concurrent.futures import CancelledError as FutureCancelledError, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional, Any, List
+from urllib.parse import urlsplit
+from typing import Dict, Optional, Any, List, Tuple
 import shutil
+import psutil
 
 # 【【V6 核心】】 导入我们的 Repository (数据库) 层
 import app.repository.repo_tasks as db 
+from app.core import metrics
+from app.services.service_scheduler import DownloadScheduler, host_of
+from app.services.engine_hls import hls_engine, is_direct_m3u8, LivePlaylistError, UnsupportedStreamError
+from app.services.async_process import AsyncProcess
+from app.services.hls_live import LiveRecorder, RecordedPart, LIVE_ROTATE_BYTES, LIVE_ROTATE_SECONDS
+from app.services.progress import ProgressTracker, YTDLP_PROGRESS_TEMPLATE, parse_ytdlp_progress, format_bytes
+from app.services.log_broadcaster import TaskBroadcaster
+from app.services.task_cache import TaskStateCache
+from app.services.dedup import normalize_url, hash_file, link_file, sample_hash
+from app.services.segment_cache import segment_cache
+from app.services.disk_space import DiskSpaceMonitor, MERGE_SPACE_FACTOR
+from app.services.size_estimator import estimate_download_size
+from app.services.bandwidth import BandwidthGovernor
+from app.services.task_profiler import start_task_profile, profile_path
+from app.services.host_tuning import host_tuner
+from app.services.playlist_expander import expand_playlist, PLAYLIST_MAX_ENTRIES
+from app.services.extractor_pool import extractor, ExtractionError
+from app.services.worker_leases import LeaseKeeper, WORKER_ID, TASK_LEASE_TTL
 
 # 【【V8 核心】】
 # 1. 从环境变量中读取下载根目录, 默认为 /downloads
 #    (用户将在 docker run -e 中设置这个)
 DOWNLOAD_ROOT = Path(os.environ.get("DOWNLOAD_ROOT", "/downloads"))
 TEMP_DIR_NAME = ".tmp"
+# (V14) SSE 连接空闲多久发送一次心跳
+SSE_KEEPALIVE_SECONDS = 15
+# (V21) 同时进行下载前大小预估的任务数
+SIZE_ESTIMATE_WORKERS = int(os.environ.get("SIZE_ESTIMATE_WORKERS", "2"))
+# (V23) yt-dlp 每个任务并发下载的分片数 (原来写死为 5)
+#  (V27) 开启自适应并发时, 只是还没有学到级别的主机的起点
+YTDLP_CONCURRENT_FRAGMENTS = int(os.environ.get("YTDLP_CONCURRENT_FRAGMENTS", "5"))
+# (V27) yt-dlp 日志中的 HTTP 错误 (例如 "HTTP Error 429: Too Many Requests")
+YTDLP_HTTP_ERROR = re.compile(r"HTTP Error (\d{3})")
+# (V31) 任务在其他 worker 中时, SSE 轮询数据库中进度的间隔 (秒)
+REMOTE_PROGRESS_POLL_SECONDS = 1.0
+# (V29) 上次中断时留在工作区中的直播分段 ("名称.part0003.ts")
+LIVE_PART_PATTERN = re.compile(r"\.part(\d+)\.(ts|mp4)$")
 
 class DownloaderService:
     def __init__(self):
         # 这个字典只存储 *正在运行* 的任务的“实时”对象
         self.live_tasks: Dict[str, dict] = {} 
+        # (V21) 磁盘空间准入: 预估完成后, 为任务预留目标挂载点的空间才能启动
+        self.disk = DiskSpaceMonitor()
+        self._admission: Dict[str, tuple] = {}     # task_id -> (下载目录, 需要预留的字节数)
+        self._waiting_for_disk = set()
+        self._estimator = ThreadPoolExecutor(max_workers=max(1, SIZE_ESTIMATE_WORKERS),
+                                             thread_name_prefix="size-estimate")
+        # (V23) 所有运行中任务共享的带宽预算; yt-dlp 子进程的份额变化时重启它
+        self.bandwidth = BandwidthGovernor(on_ytdlp_rate_change=self._restart_ytdlp)
+        # (V9) 有界调度器: 任务先进入 'queued' 状态, 有空位时才真正启动
+        self.scheduler = DownloadScheduler(runner=self._run_download_thread, admission=self._admit)
+        # (V18) 任务状态的读穿透缓存; 每次状态/进度变化时失效
+        self.task_cache = TaskStateCache(loader=db.get_task_by_id)
+        # (V31) 多个 worker 共享数据库: 续期租约, 处理转交来的取消请求, 接手无主的任务
+        self.leases = LeaseKeeper(local_tasks=lambda: list(self.live_tasks), capacity=self._free_slots,
+                                  on_cancel=self._forwarded_cancel, on_lost=self._lease_lost,
+                                  on_adopt=self._adopt_tasks, on_foreign_change=self.task_cache.invalidate_all)
+        self._register_metrics()
         # 确保根目录存在
         DOWNLOAD_ROOT.mkdir(parents=True, exist_ok=True)
         print(f"--- [SERVICE] DownloaderService V8.6 Singleton created.")
         print(f"--- [SERVICE] 默认下载根目录 (DOWNLOAD_ROOT): {DOWNLOAD_ROOT}")
 
+    # --- 【【V9 新增：启动时恢复排队任务】】 ---
+    def startup(self):
+        """
+        (V9) 由 FastAPI 的 lifespan 在 init_db() 之后调用:
+        把数据库中仍处于 'queued' (以及旧版的 'pending') 的任务重新放回调度队列,
+        然后启动调度器。
+
+        (V12) 上次进程退出时还在 'downloading' / 'merging' 的任务是被中断的,
+        它们也会重新排队, 并从检查点 (保留下来的工作区) 继续下载。
+
+        (V31) 只恢复没有租约 / 租约已经到期的任务: 其他还活着的 worker 的任务不动
+        """
+        # (V27) 恢复之前学到的每个主机的并发数
+        host_tuner.load(db.get_host_tuning())
+        restored = db.adopt_orphaned_tasks(WORKER_ID, TASK_LEASE_TTL, exclude=[], reclaim_own=True)
+        self._adopt_tasks(restored)
+        if restored:
+            print(f"--- [SERVICE] 已恢复 {len(restored)} 个排队中的任务")
+        # (V32) 预热 yt-dlp 提取进程 (后台进行)
+        extractor.start()
+        self.scheduler.start()
+        self.leases.start()
+        print(f"--- [SERVICE] Worker ID: {WORKER_ID}")
+
+    def shutdown(self):
+        """(V31) 由 lifespan 在应用关闭时调用"""
+        self.scheduler.stop()
+        self.leases.stop()
+        extractor.shutdown()
+
+    # --- 【【V31 新增：多 worker 租约的回调】】 ---
+    def _adopt_tasks(self, tasks: List[dict]):
+        """把 (已经获得租约的) 任务放回本进程的调度队列"""
+        for task in tasks:
+            if task["id"] in self.live_tasks:
+                continue
+            if task["status"] in ("downloading", "merging"):
+                print(f"--- [SERVICE] 任务 {task['id']} 在上次运行中被中断, 将从检查点继续")
+            if task["status"] != "queued":
+                self._update_status(task["id"], status="queued")
+            else:
+                self.task_cache.invalidate(task["id"])
+            self._enqueue(task["id"], task["url"], task.get("priority") or 0, task.get("startTime") or 0.0)
+
+    def _free_slots(self) -> int:
+        snapshot = self.scheduler.snapshot()
+        return snapshot["max_concurrent"] - snapshot["running"] - snapshot["queued"]
+
+    def _forwarded_cancel(self, task_id: str):
+        print(f"--- [SERVICE] 收到其他 worker 转交的取消请求: {task_id}")
+        self.cancel_running_task(task_id)
+
+    def _lease_lost(self, task_id: str):
+        print(f"--- [SERVICE] 任务 {task_id} 已被删除或由其他 worker 接手, 停止本地处理")
+        self._abandon_local_task(task_id)
+
+    def _abandon_local_task(self, task_id: str):
+        """
+        停止本进程中的任务 (出队 / 取消引擎协程 / 结束子进程 / 停止录制), 不再写入它的状态
+        """
+        if self.scheduler.remove(task_id):
+            self._release_admission(task_id)
+        live_task = self.live_tasks.pop(task_id, None)
+        if not live_task:
+            return
+        live_task["abandoned"] = True
+        if live_task.get("recorder"):
+            live_task["recorder"].stop()
+        if live_task.get("engine_future"):
+            live_task["engine_future"].cancel()
+        process = live_task.get("process")
+        if process:
+            print(f"--- [SERVICE] Task {task_id} is running, attempting to terminate...")
+            try:
+                process.terminate()
+            except Exception as e:
+                print(f"--- [ERROR] Failed to terminate process for {task_id}: {e}")
+        live_task["broadcaster"].close()
+
+    # --- 【【V24 新增：/metrics 中抓取时才计算的指标】】 ---
+    def _register_metrics(self):
+        def task_counts():
+            snapshot = self.scheduler.snapshot()
+            return {("running",): snapshot["running"], ("queued",): snapshot["queued"]}
+
+        def throughput():
+            trackers = [t["progress"] for t in list(self.live_tasks.values()) if t.get("progress")]
+            return sum(tracker.snapshot()["speed"] or 0 for tracker in trackers)
+
+        def subscribers():
+            return sum(t["broadcaster"].subscriber_count for t in list(self.live_tasks.values()))
+
+        def cache_lookups():
+            stats = segment_cache.stats()
+            return {("hit",): stats["hits"], ("miss",): stats["misses"]}
+
+        metrics.CallbackMetric("downloader_tasks", "Tasks currently running or queued", task_counts, ("state",))
+        metrics.CallbackMetric("downloader_throughput_bytes_per_second",
+                               "Aggregate download speed of running tasks", throughput)
+        metrics.CallbackMetric("downloader_sse_subscribers", "Open SSE log subscriptions", subscribers)
+        metrics.CallbackMetric("downloader_segment_cache_lookups_total", "Shared segment cache lookups",
+                               cache_lookups, ("result",), type_name="counter")
+        metrics.CallbackMetric("downloader_segment_cache_saved_bytes_total", "Upstream bytes served from the segment cache",
+                               lambda: segment_cache.stats()["bytes_saved"], type_name="counter")
+        metrics.CallbackMetric("downloader_extractor_cache_lookups_total", "yt-dlp metadata cache lookups",
+                               lambda: {("hit",): extractor.hits, ("miss",): extractor.misses}, ("result",),
+                               type_name="counter")
+        metrics.CallbackMetric("downloader_disk_reserved_bytes", "Disk space reserved for running tasks",
+                               lambda: {(mount,): size for mount, size in self.disk.snapshot().items()}, ("mount",))
+
+    # --- 【【V18 新增：所有任务状态写入都经过这里, 以便让缓存失效】】 ---
+    def _update_status(self, task_id: str, status: str, error_msg: Optional[str] = None,
+                       final_name: Optional[str] = None):
+        db.update_task_status(task_id, status=status, error_msg=error_msg, final_name=final_name)
+        self.task_cache.invalidate(task_id)
+        if status in db.TERMINAL_STATUSES:
+            metrics.TASKS_FINISHED.inc(status=status)
+
+    def _update_progress(self, task_id: str, snapshot: Dict[str, Any]):
+        db.update_task_progress(task_id, snapshot)
+        self.task_cache.invalidate(task_id)
+        self.disk.note_written(task_id, snapshot.get("downloaded_bytes"))
+
+    def _enqueue(self, task_id: str, url: str, priority: int, start_time: float):
+        """
+        (V9) 为任务准备内存中的 live 对象 (这样排队期间也能打开 SSE), 并提交给调度器
+        """
+        if task_id not in self.live_tasks:
+            self.live_tasks[task_id] = {"broadcaster": TaskBroadcaster(), "process": None, "engine_future": None,
+                                        "progress": None, "phases": None}
+        self.scheduler.submit(task_id, url, priority=priority, start_time=start_time)
+        # (V21) 预估完成之前, 准入检查不会放行这个任务
+        self._estimator.submit(self._preflight, task_id)
+
+    # --- 【【V21 新增：下载前的大小预估 + 磁盘空间准入】】 ---
+    def _preflight(self, task_id: str):
+        """
+        (V21) 在预估线程池中执行: 预估大小, 空闲空间永远放不下时直接拒绝,
+        否则登记需要预留的空间 (预估大小 x MERGE_SPACE_FACTOR, 包括合并阶段的临时空间)
+        """
+        try:
+            task = db.get_task_by_id(task_id)
+            if not task or task["status"] != "queued":
+                return
+            estimate = task.get("estimated_bytes")
+            # (V29) 直播录制的大小没有上限, 只检查安全余量
+            if estimate is None and not task.get("live"):
+                estimate = estimate_download_size(task["url"])
+                if estimate:
+                    db.update_task_estimate(task_id, estimate)
+                    self.task_cache.invalidate(task_id)
+            needed = int(estimate * MERGE_SPACE_FACTOR) if estimate else 0
+            self._publish(task_id, f"[preflight] 预计大小 {format_bytes(estimate)}, 需要预留 {format_bytes(needed)}")
+            if needed and not self.disk.can_ever_fit(task["path"], needed):
+                self._reject(task_id, f"磁盘空间不足: 预计需要 {format_bytes(needed)}, "
+                                      f"{self.disk.mount_of(task['path'])} 的空闲空间不够")
+                return
+        except Exception as e:
+            print(f"--- [ERROR] [SERVICE] 任务 {task_id} 的预估失败, 不预留空间: {e}")
+            needed, task = 0, db.get_task_by_id(task_id)
+            if not task:
+                return
+        self._admission[task_id] = (task["path"], needed)
+        self.scheduler.wake()
+
+    def _admit(self, task_id: str) -> bool:
+        """
+        (V21) 调度器的准入钩子 (持有调度器的锁, 不能调用调度器的方法)。
+        预估还没完成, 或者目标挂载点扣除其他任务的预留后放不下时, 任务继续排队。
+        """
+        entry = self._admission.get(task_id)
+        if entry is None:
+            return False
+        path, needed = entry
+        if self.disk.reserve(task_id, path, needed):
+            self._waiting_for_disk.discard(task_id)
+            return True
+        if task_id not in self._waiting_for_disk:
+            self._waiting_for_disk.add(task_id)
+            self._publish(task_id, f"[preflight] 等待磁盘空间 (需要 {format_bytes(needed)})...")
+        return False
+
+    def _release_admission(self, task_id: str):
+        self._admission.pop(task_id, None)
+        self._waiting_for_disk.discard(task_id)
+        self.disk.release(task_id)
+
+    def _reject(self, task_id: str, message: str):
+        """(V21) 拒绝一个还在排队的任务"""
+        if not self.scheduler.remove(task_id):
+            return
+        print(f"--- [SERVICE] Task {task_id} rejected: {message}")
+        self._update_status(task_id, status="error", error_msg=message)
+        self._release_admission(task_id)
+        db.release_task(task_id, WORKER_ID)
+        live_task = self.live_tasks.pop(task_id, None)
+        if live_task:
+            live_task["broadcaster"].publish(message)
+            live_task["broadcaster"].close()
+
+    def _publish(self, task_id: str, message: str):
+        live_task = self.live_tasks.get(task_id)
+        if live_task:
+            live_task["broadcaster"].publish(message)
+
     # --- 【【【V8.5 核心修复：更智能的驱动器过滤】】】 ---
     def get_system_drives(self):
         """
@@ -60,7 +317,8 @@ class DownloaderService:
         # --- 【【【 V8.5 修复结束 】】】 ---
         
         try:
-            partitions = psutil.disk_partitions()
+            # (V21) psutil 的结果有 TTL 缓存, 轮询这个接口不会每次都扫描所有挂载点
+            partitions = self.disk.disk_partitions()
             for p in partitions:
                 # p.device -> /dev/sda1
                 # p.mountpoint -> /mnt/sata1-1
@@ -91,7 +349,7 @@ class DownloaderService:
                     
                 # (通过了所有过滤, 这是一个真实、可写的硬盘)
                 try:
-                    usage = psutil.disk_usage(p.mountpoint)
+                    usage = self.disk.disk_usage(p.mountpoint)
                     drives.append({
                         "path": p.mountpoint,
                         "fstype": p.fstype,
@@ -108,11 +366,78 @@ class DownloaderService:
             return []
 
     # --- 【【V8.6 核心修改：start_new_download】】 ---
-    def start_new_download(self, url: str, subdirectory: Optional[str], custom_name: Optional[str]) -> str:
+    def start_new_download(self, url: str, subdirectory: Optional[str], custom_name: Optional[str],
+                           priority: int = 0, force: bool = False,
+                           rate_limit: Optional[int] = None, live: bool = False,
+                           rotate_seconds: Optional[float] = None,
+                           rotate_bytes: Optional[int] = None) -> str:
         """
-        (V8.6) 创建任务, *写入数据库*, 并启动后台线程
+        (V9) 创建任务, *写入数据库* (状态为 'queued'), 并交给调度器排队
+
+        (V19) 除非 force=True:
+        - 同一目录下同一个 URL 的任务还在排队 / 下载中: 直接返回那个任务的 ID
+        - 同一个 URL 已经下载完成且文件还在: 新任务立即完成, 复用 (链接到) 已有的文件
+
+        (V23) rate_limit: 单任务带宽上限 (字节/秒)
+
+        (V29) live=True: 直播录制 (直接的 .m3u8 链接不指定也会在下载时自动识别),
+              rotate_seconds / rotate_bytes 覆盖全局的分段设置
         """
+        print(f"--- [SERVICE] start_new_download() called. Path: {subdirectory or DOWNLOAD_ROOT}")
+        download_dir, relative_path_str = self._prepare_download_dir(subdirectory)
+
+        task_id = str(uuid.uuid4())
+
+        # (V19) 去重
+        url_key = normalize_url(url)
+        if not force:
+            active = db.find_active_task(url_key, relative_path_str)
+            if active:
+                print(f"--- [SERVICE] Same URL already in progress, attaching to task {active['id']}")
+                return active["id"]
+        # (V29) 直播每次录制的内容都不同, 不复用之前的文件
+        existing = None if force or live else self._find_existing_file(url_key)
+
+        task_data_to_db = {
+            "id": task_id,
+            "status": "queued",
+            "url": url,
+            "path": relative_path_str, # <-- 现在这里存的是绝对路径
+            "custom_name": custom_name,
+            "startTime": time.time(),
+            "priority": priority,
+            "url_key": url_key,
+            "rate_limit": rate_limit or None,
+            "live": int(live),
+            "rotate_seconds": rotate_seconds,
+            "rotate_bytes": rotate_bytes,
+            # (V31) 接收请求的 worker 持有租约; 它忙不过来时其他 worker 会拿走
+            "lease_owner": WORKER_ID,
+            "lease_expires": time.time() + TASK_LEASE_TTL,
+        }
+        
+        try:
+            db.create_task(task_data_to_db)
+            self.task_cache.invalidate(task_id)
+        except Exception as e:
+            print(f"[ERROR] [SERVICE] 数据库创建任务失败: {e}")
+            raise e
+
+        # (V19) 已经下载过: 不再排队, 直接完成
+        if existing and self._reuse_existing_file(task_id, existing[0], existing[1], download_dir, custom_name):
+            print(f"--- [SERVICE] New Task {task_id} reused the file of task {existing[0]['id']}")
+            return task_id
         
+        # 【V9】不再直接起线程, 而是交给调度器排队
+        self._enqueue(task_id, url, priority, task_data_to_db["startTime"])
+        
+        print(f"--- [SERVICE] New Task {task_id} queued (priority={priority})")
+        return task_id
+
+    # --- (V28 从 start_new_download 中拆出, 批量提交共用) ---
+    @staticmethod
+    def _prepare_download_dir(subdirectory: Optional[str]) -> Tuple[Path, str]:
+        """创建下载目录, 返回 (目录, 存入数据库的绝对路径字符串)"""
         # --- 【修改开始：解除路径限制】 ---
         # 原代码强制使用 DOWNLOAD_ROOT 拼接目录名，导致只能下到 downloads 下
         # 修改为：如果用户提供了路径（通常是绝对路径），直接使用它
@@ -121,158 +446,190 @@ class DownloaderService:
         else:
             download_dir = DOWNLOAD_ROOT
         # --- 【修改结束】 ---
-        
-        print(f"--- [SERVICE] start_new_download() called. Path: {download_dir}")
-        
+
         try:
             download_dir.mkdir(parents=True, exist_ok=True)
         except Exception as e:
             print(f"--- [ERROR] Failed to create directory {download_dir}: {e}")
             raise e 
 
-        task_id = str(uuid.uuid4())
-        log_queue = queue.Queue()
-        
         # --- 【修改开始：存储绝对路径】 ---
         # 修改为：直接存储绝对路径字符串，不再计算 relative_to
         relative_path_str = str(download_dir.resolve())
         # 统一路径分隔符
         relative_path_str = relative_path_str.replace('\\', '/')
         # --- 【修改结束】 ---
+        return download_dir, relative_path_str
 
-        task_data_to_db = {
-            "id": task_id,
-            "status": "pending",
-            "url": url,
-            "path": relative_path_str, # <-- 现在这里存的是绝对路径
-            "custom_name": custom_name,
-            "startTime": time.time()
-        }
-        
-        self.live_tasks[task_id] = {
-            "log_queue": log_queue, "process": None,
-        }
-        
-        try:
-            db.create_task(task_data_to_db)
-        except Exception as e:
-            print(f"[ERROR] [SERVICE] 数据库创建任务失败: {e}")
-            del self.live_tasks[task_id]
-            raise e
-        
-        # 【V8】后台线程现在接收 *绝对* 路径
-        thread = threading.Thread(target=self._run_download_thread, args=(task_id, download_dir,))
-        thread.daemon = True
-        thread.start()
-        
-        print(f"--- [SERVICE] New Task {task_id} started in thread {thread.name}")
-        return task_id
+    # --- 【【V28 新增：批量提交】】 ---
+    def start_batch_download(self, urls: List[str], subdirectory: Optional[str],
+                             playlist_url: Optional[str] = None, max_items: Optional[int] = None,
+                             priority: int = 0, force: bool = False,
+                             rate_limit: Optional[int] = None) -> List[str]:
+        """
+        (V28) 一次提交多个 URL, 或者一个播放列表 / 频道 URL (用 yt-dlp 的 flat 提取在服务端展开)。
+
+        - 目录只创建一次, 所有新任务在 *一个事务* 中写入数据库
+        - 去重规则与 start_new_download 相同 (除非 force=True), 批次内重复的 URL 只建一个任务
+        - 任务全部进入 'queued' 状态, 由调度器按并发上限依次启动
+
+        返回与输入 (展开后的) URL 一一对应的任务 ID
+        """
+        if playlist_url:
+            urls = list(urls) + expand_playlist(playlist_url, max_items or PLAYLIST_MAX_ENTRIES)
+        if not urls:
+            raise ValueError("没有需要下载的 URL")
+        print(f"--- [SERVICE] start_batch_download() called: {len(urls)} URLs. Path: {subdirectory or DOWNLOAD_ROOT}")
+        download_dir, path_str = self._prepare_download_dir(subdirectory)
+
+        url_keys = [normalize_url(url) for url in urls]
+        active = {} if force else db.find_active_tasks(sorted(set(url_keys)), path_str)
+        now = time.time()
+        task_ids: List[str] = []
+        assigned: Dict[str, str] = {}      # 批次内: url_key -> task_id
+        new_tasks: List[dict] = []
+        reuse: List[tuple] = []
+        for index, (url, url_key) in enumerate(zip(urls, url_keys)):
+            task_id = assigned.get(url_key) or active.get(url_key)
+            if task_id is None:
+                task_id = str(uuid.uuid4())
+                new_tasks.append({
+                    "id": task_id,
+                    "status": "queued",
+                    "url": url,
+                    "path": path_str,
+                    # 保持提交顺序 (任务列表按 startTime 排序)
+                    "startTime": now + index * 1e-6,
+                    "priority": priority,
+                    "url_key": url_key,
+                    "rate_limit": rate_limit or None,
+                    "lease_owner": WORKER_ID,
+                    "lease_expires": now + TASK_LEASE_TTL,
+                })
+                existing = None if force else self._find_existing_file(url_key)
+                if existing:
+                    reuse.append((task_id, existing))
+            assigned[url_key] = task_id
+            task_ids.append(task_id)
+
+        db.create_tasks(new_tasks)
+        for task in new_tasks:
+            self.task_cache.invalidate(task["id"])
+
+        reused = set()
+        for task_id, (source_task, source_file) in reuse:
+            if self._reuse_existing_file(task_id, source_task, source_file, download_dir, None):
+                reused.add(task_id)
+        for task in new_tasks:
+            if task["id"] not in reused:
+                self._enqueue(task["id"], task["url"], priority, task["startTime"])
+
+        print(f"--- [SERVICE] Batch: {len(new_tasks) - len(reused)} new tasks queued, "
+              f"{len(reused)} reused existing files, {len(task_ids) - len(new_tasks)} attached to existing tasks")
+        return task_ids
 
     # --- 【【【 V8.3 核心重构：_run_download_thread 】】】 ---
-    def _run_download_thread(self, task_id: str, download_dir: Path):
-        
+    def _run_download_thread(self, task_id: str):
+        """
+        (V9) 由调度器在工作线程中调用。下载目录从数据库记录中读取。
+        """
         live_task = self.live_tasks.get(task_id)
         db_task = db.get_task_by_id(task_id)
         
         if not live_task or not db_task:
             print(f"--- [ERROR] Thread {task_id}: Task not found in DB or LiveDict.")
             if task_id in self.live_tasks: del self.live_tasks[task_id]
+            self._release_admission(task_id)
+            return
+
+        # (V9) 在排队期间被取消/删除的任务, 不再启动
+        if db_task["status"] != "queued":
+            print(f"--- [SERVICE] Task {task_id} is no longer queued ({db_task['status']}), skipping.")
+            self._release_admission(task_id)
             return
+        # (V31) 开始之前确认租约仍然属于本 worker (排队期间可能已被其他 worker 拿走)
+        if not db.claim_task(task_id, WORKER_ID, TASK_LEASE_TTL, start=True):
+            print(f"--- [SERVICE] Task {task_id} is leased by another worker, skipping.")
+            self._release_admission(task_id)
+            live_task = self.live_tasks.pop(task_id, None)
+            if live_task:
+                live_task["broadcaster"].close()
+            return
+
+        download_dir = Path(db_task["path"])
 
-        log_queue = live_task["log_queue"]
+        broadcaster = live_task["broadcaster"]
         
         def log(message):
             print(f"--- [TASK {task_id}] {message}")
-            log_queue.put(message)
+            broadcaster.publish(message)
 
         # (V6.3) 定义“工作区”
         tmp_dir = download_dir.joinpath(TEMP_DIR_NAME, task_id)
+        succeeded = False
+        phases = None
+        # (V25) TASK_PROFILE 开启时剖析本次运行
+        profile = start_task_profile(task_id)
         
-        # (V6.4)
-        temp_filename_from_log = None
-
         try:
             # (V6.3) 创建“工作区”
             tmp_dir.mkdir(parents=True, exist_ok=True)
             log(f"创建临时工作区: {tmp_dir}")
             
-            db.update_task_status(task_id, status="downloading")
+            self._update_status(task_id, status="downloading")
             log("任务已启动，正在准备下载...")
-            
-            # (V6.4) 下载到 *隔离区*, 自动命名
-            output_template = str(tmp_dir.joinpath("%(title)s.%(ext)s"))
-
-            # --- 【修改开始：修复 yt-dlp 路径问题】 ---
-            # 使用 sys.executable -m yt_dlp 替代直接调用 "yt-dlp" 命令
-            command = [
-                sys.executable, "-m", "yt_dlp", 
-                "--merge-output-format", "mkv",
-                "-o", output_template,
-                "--progress",
-                "--encoding", "utf-8",
-                "--ffmpeg-location", "/usr/bin", 
-                "--concurrent-fragments", "5",
-                db_task["url"]
-            ]
-            # --- 【修改结束】 ---
-            
-            log(f"执行命令: {' '.join(command)}")
+            self.bandwidth.task_started(task_id, db_task.get("rate_limit"))
 
-            startupinfo = None
-            if sys.platform == "win32":
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            
-            process = subprocess.Popen(
-                command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                encoding='utf-8', errors='replace', bufsize=1,
-                universal_newlines=True, startupinfo=startupinfo
-            )
-            live_task["process"] = process
+            # (V13) 结构化进度: 节流后写入数据库
+            tracker = ProgressTracker(lambda snapshot: self._update_progress(task_id, snapshot))
+            live_task["progress"] = tracker
+            # (V24) 阶段耗时: resolve -> download -> (merge) -> move
+            #  (V25) 同时作为时间线, 任务结束时写入 task_phases
+            phases = metrics.PhaseTimer("resolve")
+            live_task["phases"] = phases
 
-            # (V8.3 修复：不再解析日志)
-            for line in process.stdout:
-                line = line.strip()
-                if not line: continue
-                log(line)
-                
-                # (V8.4 修复) 我们 *仍然* 需要解析文件名
-                if "[download] Destination:" in line:
-                    filepath = line.split("Destination: ")[-1]
-                    temp_filename_from_log = Path(filepath).name
-                elif "[ffmpeg] Merging formats into" in line:
-                    task_status_check = db.get_task_by_id(task_id)
-                    if task_status_check and task_status_check.get("status") != "merging":
-                        db.update_task_status(task_id, status="merging")
-                    filepath = line.split('"')[-2]
-                    temp_filename_from_log = Path(filepath).name
+            # (V10) 直接的 .m3u8 链接优先使用原生 HLS 引擎, 不支持时回退到 yt-dlp
+            temp_file_path = None
+            live = bool(db_task.get("live"))
+            if is_direct_m3u8(db_task["url"]) and not live:
+                try:
+                    temp_file_path = self._download_with_native_engine(db_task, tmp_dir, live_task, tracker, log)
+                except LivePlaylistError:
+                    log("检测到直播流 (播放列表没有 #EXT-X-ENDLIST), 切换到直播录制模式")
+                    db.set_task_live(task_id)
+                    self.task_cache.invalidate(task_id)
+                    live = True
+            # (V29) 直播: 分段录制, 每个分段关闭时已经移动到下载目录, 不再经过下面的移动 / 去重
+            if live:
+                final_name = self._record_live(db_task, tmp_dir, download_dir, live_task, tracker, log)
+                if live_task.get("abandoned"):
+                    return
+                if final_name:
+                    tracker.finish()
+                    self._update_status(task_id, status="complete", final_name=final_name)
+                    phases.finish()
+                    succeeded = True
+                    return
+            if temp_file_path is None:
+                temp_file_path = self._download_with_ytdlp(task_id, db_task, tmp_dir, live_task, tracker, log)
+            tracker.finish()
 
-            process.wait()
+            log(f"找到临时文件: {temp_file_path.name}")
+            phases.enter("move")
+            
+            downloaded_ext = temp_file_path.suffix.lstrip('.')
+            base_name = db_task["custom_name"] or temp_file_path.stem
 
-            if process.returncode == 0:
-                log("下载和合并完成。")
-                
-                # (V8.3/V6.4 修复：只使用“扫描”逻辑)
-                if not temp_filename_from_log:
-                    log("警告: 未能从日志中解析出文件名, 正在扫描目录...")
-                    found_files = list(tmp_dir.glob("*.mkv")) + list(tmp_dir.glob("*.mp4")) + list(tmp_dir.glob("*.webm"))
-                    if not found_files:
-                        raise Exception("Download complete but no valid video file (mkv, mp4, webm) found in temp directory.")
-                    temp_file_path = found_files[0]
-                else:
-                    temp_file_path = tmp_dir / temp_filename_from_log
-                    if not temp_file_path.exists():
-                        log(f"警告: 日志解析的文件 {temp_filename_from_log} 不存在, 正在扫描目录...")
-                        found_files = list(tmp_dir.glob("*.mkv")) + list(tmp_dir.glob("*.mp4")) + list(tmp_dir.glob("*.webm"))
-                        if not found_files:
-                            raise Exception("Download complete but no valid video file found after log parsing failed.")
-                        temp_file_path = found_files[0]
-
-                log(f"找到临时文件: {temp_file_path.name}")
-                
-                downloaded_ext = temp_file_path.suffix.lstrip('.')
-                base_name = db_task["custom_name"] or temp_file_path.stem
-                
+            # (V19) 目录中已经有内容完全相同的文件时直接复用, 不再生成 "name (2).mkv"
+            content_size = temp_file_path.stat().st_size
+            content_hash, same = self._find_same_content(task_id, temp_file_path, content_size, download_dir)
+            if same and (not db_task["custom_name"] or same[1].stem == db_task["custom_name"]):
+                log(f"目录中已有内容相同的文件, 直接复用: {same[1]}")
+                temp_file_path.unlink()
+                final_filename_with_ext = same[1].name
+                db.set_task_content(task_id, content_hash, content_size,
+                                    duplicate_of=same[0].get("duplicate_of") or same[0]["id"])
+            else:
                 resolved_base_filename = self._resolve_filename(
                     download_dir,
                     base_name, 
@@ -283,41 +640,462 @@ class DownloaderService:
                 
                 log(f"正在移动文件到: {final_file_path}")
                 os.rename(temp_file_path, final_file_path)
-                
-                db.update_task_status(
-                    task_id, 
-                    status="complete", 
-                    final_name=final_filename_with_ext
-                )
-            else:
-                if process.returncode == -15:
-                    raise Exception("任务被用户取消。")
-                else:
-                    raise Exception(f"yt-dlp 进程以错误码 {process.returncode} 退出。")
+                db.set_task_content(task_id, content_hash, content_size)
+                phases.add_bytes(content_size)
+            
+            self._update_status(
+                task_id, 
+                status="complete", 
+                final_name=final_filename_with_ext
+            )
+            phases.finish()
+            succeeded = True
 
         except Exception as e:
             log(f"!!! 任务失败 !!!")
             log(str(e))
-            db.update_task_status(
-                task_id, 
-                status="error", 
-                error_msg=str(e)
-            )
+            # (V31) 任务已被删除或由其他 worker 接手: 状态不再由本 worker 写入
+            if not live_task.get("abandoned"):
+                self._update_status(
+                    task_id, 
+                    status="error", 
+                    error_msg=str(e)
+                )
             
         finally:
-            log_queue.put(None)
+            broadcaster.close()
             if task_id in self.live_tasks:
                 del self.live_tasks[task_id]
+            # (V31) 先移出 live_tasks 再释放租约, 续期线程不会把刚结束的任务当作被接手
+            db.release_task(task_id, WORKER_ID)
+            self._release_admission(task_id)
+            self.bandwidth.task_finished(task_id)
+            host_tuner.flush(db.save_host_tuning)
+            if profile:
+                profile.stop()
+            deleted = not succeeded and db.get_task_by_id(task_id) is None
+            if phases and not deleted:
+                phases.abort()
+                db.save_task_phases(task_id, phases.spans)
             
-            try:
-                if tmp_dir.exists():
-                    log(f"正在清理临时工作区: {tmp_dir}")
-                    shutil.rmtree(tmp_dir)
-            except Exception as e_clean:
-                log(f"清理临时工作区失败: {e_clean}")
+            # (V12) 失败或取消的任务保留工作区和检查点, 以便之后续传;
+            #       只有成功完成 (或任务已被删除) 时才清理
+            if succeeded or deleted:
+                self._cleanup_workspace(task_id, tmp_dir, log)
+            elif tmp_dir.exists():
+                log(f"保留临时工作区以便续传: {tmp_dir}")
             
             log(f"--- 任务 {task_id} 线程结束 ---")
 
+    # --- 【【V10 新增：原生 HLS 引擎】】 ---
+    def _download_with_native_engine(self, db_task: dict, tmp_dir: Path, live_task: dict,
+                                     tracker: ProgressTracker, log) -> Optional[Path]:
+        """
+        (V10) 用进程内的 HLS 引擎下载直接的 .m3u8 链接。
+        返回临时文件路径; 如果这个流原生引擎不支持, 返回 None (由 yt-dlp 接手)。
+
+        (V12) 每写完一个片段就记录检查点, 续传时从最后一个完成的片段继续。
+        """
+        task_id = db_task["id"]
+        url = db_task["url"]
+        base_name = Path(urlsplit(url).path).stem or "video"
+        log(f"使用原生 HLS 引擎: {url}")
+        resume_from = db.get_task_checkpoint(task_id)
+        written = [resume_from[1]]
+
+        def on_segment(index: int, size: int, total: int):
+            live_task["phases"].enter("download")
+            live_task["phases"].add_bytes(size)
+            db.add_task_segment(task_id, index, size)
+            written[0] += size
+            # 总大小未知: 按已完成片段的平均大小估算
+            tracker.update(
+                downloaded_bytes=written[0],
+                total_bytes=int(written[0] / (index + 1) * total),
+                fragment_index=index + 1,
+                fragment_count=total,
+            )
+
+        future = hls_engine.start_download(
+            url, tmp_dir, base_name, log,
+            resume_from=resume_from,
+            on_segment=on_segment,
+            throttle=lambda n: self.bandwidth.throttle(task_id, n),
+        )
+        live_task["engine_future"] = future
+        try:
+            return future.result()
+        except FutureCancelledError:
+            raise Exception("任务被用户取消。")
+        except LivePlaylistError:
+            # (V29) 由 _run_download_thread 切换到直播录制
+            raise
+        except UnsupportedStreamError as e:
+            log(f"原生引擎不支持该流 ({e}), 回退到 yt-dlp...")
+            db.clear_task_segments(task_id)
+            for leftover in tmp_dir.iterdir():
+                if leftover.is_file():
+                    leftover.unlink()
+            return None
+        finally:
+            live_task["engine_future"] = None
+
+    # --- 【【V29 新增：直播录制】】 ---
+    def _record_live(self, db_task: dict, tmp_dir: Path, download_dir: Path, live_task: dict,
+                     tracker: ProgressTracker, log) -> Optional[str]:
+        """
+        (V29) 用 LiveRecorder 录制直播, 直到播放列表结束或用户停止 (cancel)。
+        每个分段关闭时立即移动到下载目录并登记到 task_recordings,
+        所以工作区中最多只有一个正在写的分段。返回最后一个分段的文件名;
+        不是 HLS 的直播 (解析不出 .m3u8) 返回 None, 由 yt-dlp 接手。
+        """
+        task_id = db_task["id"]
+        url = db_task["url"]
+        if not is_direct_m3u8(url):
+            url = self._resolve_live_manifest(url, log)
+            if url is None:
+                return None
+        base_name = db_task["custom_name"] or Path(urlsplit(url).path).stem or "live"
+        recordings = db.get_task_recordings(task_id)
+        next_part = max((r["part"] for r in recordings), default=0) + 1
+        totals = {"bytes": sum(r["size"] for r in recordings), "segments": sum(r["segments"] for r in recordings)}
+        last_name = [recordings[-1]["filename"] if recordings else None]
+
+        def on_segment(size: int):
+            live_task["phases"].enter("record")
+            live_task["phases"].add_bytes(size)
+            totals["bytes"] += size
+            totals["segments"] += 1
+            tracker.update(downloaded_bytes=totals["bytes"], fragment_index=totals["segments"])
+
+        def on_part(part: RecordedPart):
+            ext = part.path.suffix.lstrip(".")
+            stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(part.started_at))
+            resolved = self._resolve_filename(download_dir, f"{base_name} {stamp}", ext)
+            final_path = download_dir / f"{resolved}.{ext}"
+            os.rename(part.path, final_path)
+            if db.get_task_by_id(task_id) is not None:
+                db.add_task_recording(task_id, {
+                    "part": part.index, "filename": final_path.name,
+                    "started_at": part.started_at, "ended_at": part.ended_at, "duration": part.duration,
+                    "size": part.size, "segments": part.segments,
+                    "first_sequence": part.first_sequence, "last_sequence": part.last_sequence,
+                })
+            last_name[0] = final_path.name
+            log(f"[live] 分段 #{part.index} 已保存: {final_path} ({format_bytes(part.size)})")
+
+        # 上次运行被中断时正在写的分段: 内容都已 flush, 直接作为一个分段保存
+        for leftover in sorted(tmp_dir.iterdir()):
+            if leftover.is_file() and LIVE_PART_PATTERN.search(leftover.name) and leftover.stat().st_size:
+                stat = leftover.stat()
+                log(f"[live] 保存上次中断时未完成的分段: {leftover.name}")
+                on_part(RecordedPart(index=next_part, path=leftover, started_at=stat.st_mtime,
+                                     ended_at=stat.st_mtime, size=stat.st_size))
+                next_part += 1
+
+        recorder = LiveRecorder(
+            hls_engine, url, tmp_dir, base_name, log, on_part,
+            on_segment=on_segment,
+            throttle=lambda n: self.bandwidth.throttle(task_id, n),
+            rotate_seconds=db_task.get("rotate_seconds") or LIVE_ROTATE_SECONDS,
+            rotate_bytes=db_task.get("rotate_bytes") or LIVE_ROTATE_BYTES,
+            first_part=next_part,
+        )
+        log(f"使用直播录制: {url} (分段: {recorder.rotate_seconds:.0f}s / "
+            f"{format_bytes(recorder.rotate_bytes) if recorder.rotate_bytes else '不限大小'})")
+        future = hls_engine.submit(recorder.run())
+        live_task["engine_future"] = future
+        live_task["recorder"] = recorder
+        try:
+            future.result()
+        except FutureCancelledError:
+            raise Exception("任务被用户取消。")
+        finally:
+            live_task["engine_future"] = None
+            live_task["recorder"] = None
+        if last_name[0] is None:
+            raise Exception("直播录制没有得到任何片段。")
+        return last_name[0]
+
+    @staticmethod
+    def _resolve_live_manifest(url: str, log) -> Optional[str]:
+        """
+        (V29) 用 yt-dlp 解析网页直播的 HLS 播放列表地址; 不是 HLS 时返回 None
+        (V32) 使用提取进程池 (和缓存), 相当于 yt-dlp -g -f "best[protocol^=m3u8]"
+        """
+        try:
+            info = extractor.extract(url)
+        except ExtractionError as e:
+            log(f"yt-dlp 提取失败: {e}")
+            info = {}
+        manifest = hls_manifest_from_info(info)
+        if not manifest:
+            log("没有找到直播的 HLS 播放列表, 交给 yt-dlp 录制")
+            return None
+        return manifest
+
+    # --- 【【V10 重构：yt-dlp 下载路径 (原 _run_download_thread 主体)】】 ---
+    def _download_with_ytdlp(self, task_id: str, db_task: dict, tmp_dir: Path, live_task: dict,
+                             tracker: ProgressTracker, log) -> Path:
+        """
+        (V10) 启动 yt-dlp 子进程下载到工作区, 返回下载好的临时文件路径
+
+        (V30) 子进程由 asyncio.create_subprocess_exec 在共享的引擎事件循环中启动,
+        输出在循环中异步读取并逐行交给 on_line; 任务线程只等待退出码。
+        """
+        # (V6.4)
+        temp_filename_from_log = None
+        # (V15) 只在第一次看到合并日志时更新状态, 不再每行都查数据库
+        merging = False
+
+        # (V6.4) 下载到 *隔离区*, 自动命名
+        output_template = str(tmp_dir.joinpath("%(title)s.%(ext)s"))
+
+        # (V27) 分片并发数按主机自适应 (只能按提交的 URL 的主机统计; 启动后固定)
+        host = host_of(db_task["url"])
+        fragments = host_tuner.level(host, YTDLP_CONCURRENT_FRAGMENTS)
+
+        # --- 【修改开始：修复 yt-dlp 路径问题】 ---
+        # 使用 sys.executable -m yt_dlp 替代直接调用 "yt-dlp" 命令
+        command = [
+            sys.executable, "-m", "yt_dlp", 
+            "--merge-output-format", "mkv",
+            "-o", output_template,
+            "--progress",
+            # (V13) 每次进度回调输出一行机器可读的进度
+            "--newline",
+            "--progress-template", YTDLP_PROGRESS_TEMPLATE,
+            "--encoding", "utf-8",
+            "--ffmpeg-location", "/usr/bin", 
+            "--concurrent-fragments", str(fragments),
+            db_task["url"]
+        ]
+        # --- 【修改结束】 ---
+
+        # (V32) 预估大小时已经提取过 (还在缓存中): 直接交给 yt-dlp, 不再重新提取页面
+        info_path = tmp_dir / "info.json"
+        if extractor.write_info_json(db_task["url"], info_path):
+            command[-1:] = ["--load-info-json", str(info_path)]
+            log("使用缓存的提取结果, 跳过 yt-dlp 的提取步骤")
+
+        startupinfo = None
+        if sys.platform == "win32":
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+
+        # (V24) yt-dlp 报告的是当前文件的累计字节数 (视频和音频分别从 0 开始), 换算成增量计数
+        last_bytes = 0
+        # (V27) 本次运行的吞吐量, 结束时交给 host_tuner
+        run_bytes, run_started, run_fragments = 0, None, 0
+
+        # (V8.3 修复：不再解析日志)
+        # (V30) 在引擎的事件循环中逐行调用, 只做非阻塞的操作
+        def on_line(line: str):
+            nonlocal temp_filename_from_log, merging, last_bytes, run_bytes, run_started, run_fragments
+            line = line.strip()
+            if not line: return
+
+            # (V13) 进度行只更新 tracker, 节流后才推送一行可读文本
+            progress = parse_ytdlp_progress(line)
+            if progress is not None:
+                live_task["phases"].enter("download")
+                if run_started is None:
+                    run_started = time.monotonic()
+                downloaded = progress["downloaded_bytes"]
+                if downloaded is not None:
+                    delta = downloaded - last_bytes if downloaded >= last_bytes else downloaded
+                    metrics.BYTES_DOWNLOADED.inc(delta, engine="yt-dlp")
+                    live_task["phases"].add_bytes(delta)
+                    run_bytes += delta
+                    last_bytes = downloaded
+                run_fragments = max(run_fragments, int(progress["fragment_index"] or 0))
+                if tracker.update(**progress):
+                    live_task["phases"].sample_cpu()
+                    log(tracker.describe())
+                return
+            log(line)
+
+            http_error = YTDLP_HTTP_ERROR.search(line)
+            if http_error:
+                host_tuner.observe_error(host, YTDLP_CONCURRENT_FRAGMENTS, int(http_error.group(1)))
+            
+            # (V8.4 修复) 我们 *仍然* 需要解析文件名
+            if "[download] Destination:" in line:
+                filepath = line.split("Destination: ")[-1]
+                temp_filename_from_log = Path(filepath).name
+            elif "[ffmpeg] Merging formats into" in line:
+                if not merging:
+                    self._update_status(task_id, status="merging")
+                    live_task["phases"].enter("merge")
+                    merging = True
+                live_task["phases"].sample_cpu()
+                filepath = line.split('"')[-2]
+                temp_filename_from_log = Path(filepath).name
+
+        while True:
+            # (V23) yt-dlp 无法共享令牌桶: 分到全局预算中的一份; 份额变化时 _restart_ytdlp
+            #       结束子进程, 这里用新的 --limit-rate 重新启动 (yt-dlp 从 .part 文件继续)
+            live_task.pop("rate_restart", None)
+            rate = self.bandwidth.ytdlp_rate(task_id)
+            run_command = list(command)
+            if rate:
+                run_command[-1:-1] = ["--limit-rate", str(rate)]
+                log(f"带宽限制: {format_bytes(rate)}/s")
+            log(f"执行命令: {' '.join(run_command)}")
+            with metrics.SUBPROCESS_SPAWN.time(program="yt-dlp"):
+                process = AsyncProcess(hls_engine.submit, run_command, on_line, startupinfo=startupinfo).start()
+            live_task["process"] = process
+            # 启动期间份额又变了 (_restart_ytdlp 看到的还是上一个进程)
+            if live_task.get("rate_restart"):
+                process.terminate()
+            # (V25) yt-dlp 及其 ffmpeg 子进程的 CPU 时间计入各阶段
+            try:
+                ps_process = psutil.Process(process.pid)
+            except psutil.Error:
+                ps_process = None
+            live_task["phases"].set_cpu_clock(lambda: _process_cpu_seconds(ps_process))
+
+            process.wait()
+            live_task["phases"].sample_cpu()
+            if (process.returncode != 0 and live_task.get("rate_restart")
+                    and not live_task.get("cancelled") and not live_task.get("abandoned")):
+                log("带宽份额已变化, 重新启动 yt-dlp")
+                continue
+            break
+
+        if process.returncode != 0:
+            if process.returncode == -15:
+                raise Exception("任务被用户取消。")
+            else:
+                raise Exception(f"yt-dlp 进程以错误码 {process.returncode} 退出。")
+
+        if run_started is not None:
+            host_tuner.end_run(host, YTDLP_CONCURRENT_FRAGMENTS, run_bytes,
+                               time.monotonic() - run_started, run_fragments)
+        log("下载和合并完成。")
+        
+        # (V8.3/V6.4 修复：只使用“扫描”逻辑)
+        if not temp_filename_from_log:
+            log("警告: 未能从日志中解析出文件名, 正在扫描目录...")
+            found_files = list(tmp_dir.glob("*.mkv")) + list(tmp_dir.glob("*.mp4")) + list(tmp_dir.glob("*.webm"))
+            if not found_files:
+                raise Exception("Download complete but no valid video file (mkv, mp4, webm) found in temp directory.")
+            return found_files[0]
+
+        temp_file_path = tmp_dir / temp_filename_from_log
+        if not temp_file_path.exists():
+            log(f"警告: 日志解析的文件 {temp_filename_from_log} 不存在, 正在扫描目录...")
+            found_files = list(tmp_dir.glob("*.mkv")) + list(tmp_dir.glob("*.mp4")) + list(tmp_dir.glob("*.webm"))
+            if not found_files:
+                raise Exception("Download complete but no valid video file found after log parsing failed.")
+            temp_file_path = found_files[0]
+        return temp_file_path
+
+    # --- 【【V12 新增：工作区清理 / 续传】】 ---
+    def _cleanup_workspace(self, task_id: str, tmp_dir: Path, log=print):
+        db.clear_task_segments(task_id)
+        try:
+            if tmp_dir.exists():
+                log(f"正在清理临时工作区: {tmp_dir}")
+                shutil.rmtree(tmp_dir)
+        except Exception as e_clean:
+            log(f"清理临时工作区失败: {e_clean}")
+
+    def resume_task(self, task_id: str) -> dict:
+        """
+        (V12) 把一个失败/取消的任务重新排队。
+        工作区和检查点在失败时被保留, 所以会从上次完成的片段继续。
+        """
+        print(f"--- [SERVICE] Resuming task {task_id}")
+        task = db.get_task_by_id(task_id)
+        if not task:
+            return {"success": False, "message": "Task not found in database"}
+        if task["status"] != "error":
+            return {"success": False, "message": f"Only failed or cancelled tasks can be resumed (status: {task['status']})"}
+        if not db.claim_task(task_id, WORKER_ID, TASK_LEASE_TTL):
+            return {"success": False, "message": "Task is leased by another worker"}
+        self._update_status(task_id, status="queued")
+        self._enqueue(task_id, task["url"], task.get("priority") or 0, task.get("startTime") or 0.0)
+        return {"success": True}
+
+    # --- 【【V19 新增：复用已下载的文件】】 ---
+    def _find_existing_file(self, url_key: str) -> Optional[Tuple[dict, Path]]:
+        """
+        (V19) 同一个 URL 最近一次完成的任务, 且它的文件还在、大小没有变化
+        """
+        for task in db.find_completed_by_url(url_key):
+            found = self._completed_file(task)
+            if found:
+                return task, found
+        return None
+
+    def _find_same_content(self, task_id: str, file_path: Path, content_size: int,
+                           download_dir: Path) -> Tuple[Optional[str], Optional[Tuple[dict, Path]]]:
+        """
+        (V19) 返回 (file_path 的内容哈希, 同一目录下内容完全相同的已完成文件)。
+
+        先按大小筛选, 再比较抽样哈希, 都相同时才读取整个文件计算 sha256:
+        目录中没有大小相同的文件时 (绝大多数情况) 不再把刚写完的文件完整读一遍, 哈希为 None。
+        """
+        candidates = []
+        for task in db.find_completed_by_size(content_size):
+            found = self._completed_file(task)
+            if task["id"] != task_id and found and found.parent == download_dir.resolve():
+                candidates.append((task, found))
+        if not candidates:
+            return None, None
+        sample = sample_hash(file_path)
+        content_hash = None
+        for task, found in candidates:
+            if sample_hash(found) != sample:
+                continue
+            if content_hash is None:
+                content_hash, _ = hash_file(file_path)
+            existing = task["content_hash"]
+            if existing is None:
+                existing, _ = hash_file(found)
+                db.set_task_content_hash(task["id"], existing)
+            if existing == content_hash:
+                return content_hash, (task, found)
+        return content_hash, None
+
+    @staticmethod
+    def _completed_file(task: dict) -> Optional[Path]:
+        if not task.get("final_filename"):
+            return None
+        path = Path(task["path"]).joinpath(task["final_filename"]).resolve()
+        try:
+            if path.is_file() and path.stat().st_size == task["content_size"]:
+                return path
+        except OSError:
+            pass
+        return None
+
+    def _reuse_existing_file(self, task_id: str, source_task: dict, source_file: Path,
+                             download_dir: Path, custom_name: Optional[str]) -> bool:
+        """
+        (V19) 让新任务直接完成: 同一目录、同一文件名时指向原文件,
+        否则在目标目录中创建一个链接。链接失败时返回 False (照常下载)。
+        """
+        ext = source_file.suffix.lstrip('.')
+        base_name = custom_name or source_file.stem
+        if source_file.parent == download_dir.resolve() and base_name == source_file.stem:
+            final_name = source_file.name
+        else:
+            final_name = f"{self._resolve_filename(download_dir, base_name, ext)}.{ext}"
+            try:
+                link_file(source_file, download_dir / final_name)
+            except OSError as e:
+                print(f"--- [SERVICE] Could not link {source_file} into {download_dir}: {e}")
+                return False
+        size = source_task["content_size"]
+        db.set_task_content(task_id, source_task["content_hash"], size,
+                            duplicate_of=source_task.get("duplicate_of") or source_task["id"])
+        self._update_progress(task_id, {"progress": 100.0, "downloaded_bytes": size, "total_bytes": size})
+        self._update_status(task_id, status="complete", final_name=final_name)
+        db.release_task(task_id, WORKER_ID)
+        return True
+
     # --- (_resolve_filename 保持不变) ---
     def _resolve_filename(self, path: Path, base_name: str, ext: str) -> str:
         final_path = path / f"{base_name}.{ext}"
@@ -329,25 +1107,76 @@ class DownloaderService:
             final_path = path / f"{base_name}.{ext}"
         return base_name
 
-    # --- (get_download_stream 保持不变) ---
+    # --- 【【V14 修改：get_download_stream 改为订阅广播】】 ---
     def get_download_stream(self, task_id: str):
+        """
+        (V14) 每个 SSE 连接都是广播的一个独立订阅者:
+        先重放最近的日志, 然后实时接收新行。多个标签页可以同时打开。
+
+        (V30) 返回 *异步* 生成器: 在事件循环中等待新行, 不再占用 Starlette 线程池的线程,
+        所以打开几百个 SSE 连接也不会让其他 API 请求排队。
+
+        (V31) 任务在其他 worker 中: 日志只在那个进程里, 改为轮询数据库中的状态和进度
+        """
         live_task = self.live_tasks.get(task_id)
         if not live_task:
-            def error_generator():
+            async def lookup_generator():
+                # 这里在事件循环中运行: 数据库查询放到线程池中, 与 _remote_progress_stream 相同
+                task = await asyncio.get_running_loop().run_in_executor(None, db.get_task_by_id, task_id)
+                if task and task["status"] in db.ACTIVE_STATUSES and task.get("lease_owner") not in (None, WORKER_ID):
+                    async for event in self._remote_progress_stream(task_id, task["lease_owner"]):
+                        yield event
+                    return
                 yield "data: [ERROR] Task not found in live memory (already finished?).\n\n"
                 yield "data: [STREAM_END]\n\n"
-            return error_generator()
-        log_queue = live_task["log_queue"]
-        def stream_generator():
+            return lookup_generator()
+        broadcaster = live_task["broadcaster"]
+        async def stream_generator():
             print(f"--- [SSE] Stream opened for task {task_id}")
+            subscription = broadcaster.subscribe(loop=asyncio.get_running_loop())
+            try:
+                while True:
+                    line = await subscription.get_async(timeout=SSE_KEEPALIVE_SECONDS)
+                    if line is None:
+                        print(f"--- [SSE] Stream closing for task {task_id}")
+                        yield "data: [STREAM_END]\n\n"
+                        break
+                    if line == "":
+                        # 心跳 (SSE 注释行), 也让断开的连接能及时结束
+                        yield ": keep-alive\n\n"
+                        continue
+                    yield f"data: {line}\n\n"
+            finally:
+                broadcaster.unsubscribe(subscription)
+        return stream_generator()
+
+    @staticmethod
+    def _remote_progress_stream(task_id: str, owner: str):
+        async def remote_generator():
+            print(f"--- [SSE] Stream opened for task {task_id} (owned by worker {owner})")
+            yield f"data: 任务由 worker {owner} 执行, 这里只显示进度\n\n"
+            last_line, idle = None, 0.0
             while True:
-                line = log_queue.get() 
-                if line is None:
-                    print(f"--- [SSE] Stream closing for task {task_id}")
-                    yield "data: [STREAM_END]\n\n"
+                task = await asyncio.get_running_loop().run_in_executor(None, db.get_task_by_id, task_id)
+                if task is None:
                     break
-                yield f"data: {line}\n\n"
-        return stream_generator()
+                line = f"[{task['status']}] {task.get('progress') or 0:.1f}%"
+                if task.get("speed"):
+                    line += f" {format_bytes(task['speed'])}/s"
+                if task.get("error_message"):
+                    line += f" {task['error_message']}"
+                if line != last_line:
+                    last_line, idle = line, 0.0
+                    yield f"data: {line}\n\n"
+                elif idle >= SSE_KEEPALIVE_SECONDS:
+                    idle = 0.0
+                    yield ": keep-alive\n\n"
+                if task["status"] not in db.ACTIVE_STATUSES:
+                    break
+                await asyncio.sleep(REMOTE_PROGRESS_POLL_SECONDS)
+                idle += REMOTE_PROGRESS_POLL_SECONDS
+            yield "data: [STREAM_END]\n\n"
+        return remote_generator()
 
     # --- 【【V8.4 修复】】 ---
     def get_all_tasks(self) -> List[Dict[str, Any]]:
@@ -358,10 +1187,161 @@ class DownloaderService:
             print(f"[ERROR] [SERVICE] 无法从数据库获取任务: {e}")
             return [] # 即使数据库失败也返回空列表
 
+    # --- 【【V17 新增：分页 / 过滤的任务列表】】 ---
+    def list_tasks(self, limit: Optional[int] = None, cursor: Optional[str] = None,
+                   statuses: Optional[List[str]] = None, url_contains: Optional[str] = None,
+                   path: Optional[str] = None, summary: bool = False):
+        """
+        (V17) 返回 (任务列表, 下一页的游标)。没有下一页时游标为 None。
+        游标是上一页最后一行的 (startTime, id), 编码成不透明的字符串。
+        """
+        print(f"--- [SERVICE] list_tasks() called (limit={limit}, statuses={statuses})")
+        after = self._decode_cursor(cursor) if cursor else None
+        # (V18) 同样的查询在任务没有变化时直接用缓存的结果
+        query_key = (limit, after, tuple(statuses or ()), url_contains, path, summary)
+        tasks = self.task_cache.get_list(query_key, lambda: db.list_tasks(
+            limit=limit, after=after, statuses=statuses,
+            url_contains=url_contains, path=path, summary=summary))
+        next_cursor = None
+        if limit and len(tasks) == limit:
+            last = tasks[-1]
+            next_cursor = self._encode_cursor(last["startTime"], last["id"])
+        return tasks, next_cursor
+
+    @staticmethod
+    def _encode_cursor(start_time: float, task_id: str) -> str:
+        raw = json.dumps([start_time, task_id]).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        try:
+            start_time, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            return float(start_time), str(task_id)
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    # --- (V9 新增) ---
+    def get_workers(self) -> List[Dict[str, Any]]:
+        """(V31) 共享同一个数据库、心跳仍然有效的 worker"""
+        workers = db.get_workers(time.time() - TASK_LEASE_TTL)
+        for worker in workers:
+            worker["current"] = worker["id"] == WORKER_ID
+        return workers
+
+    def get_scheduler_status(self) -> Dict[str, Any]:
+        return {**self.scheduler.snapshot(), "disk_reserved_bytes": self.disk.snapshot()}
+
+    # --- (V20 新增) ---
+    def get_segment_cache_status(self) -> Dict[str, Any]:
+        return segment_cache.stats()
+
+    # --- (V27 新增) 按主机自适应的并发数 ---
+    def get_extractor_status(self) -> Dict[str, Any]:
+        return extractor.stats()
+
+    def get_host_tuning(self) -> List[Dict[str, Any]]:
+        return host_tuner.snapshot()
+
+    # --- (V23 新增) 带宽限制 ---
+    def get_bandwidth_status(self) -> Dict[str, Any]:
+        return self.bandwidth.snapshot()
+
+    def set_bandwidth_limit(self, limit: int) -> Dict[str, Any]:
+        print(f"--- [SERVICE] Global bandwidth limit set to {limit} B/s")
+        self.bandwidth.set_global_limit(limit)
+        return self.bandwidth.snapshot()
+
+    def _restart_ytdlp(self, task_id: str, rate: int):
+        """
+        (V23) BandwidthGovernor 的回调: yt-dlp 子进程的份额变化了, 结束它,
+        _download_with_ytdlp 用新的 --limit-rate 重新启动
+        """
+        live_task = self.live_tasks.get(task_id)
+        if not live_task:
+            return
+        # 先设置标记再读取进程: 与 _download_with_ytdlp 中启动后的检查配合, 不会漏掉正在启动的进程
+        live_task["rate_restart"] = True
+        process = live_task.get("process")
+        if process and process.returncode is None:
+            print(f"--- [SERVICE] Restarting yt-dlp for task {task_id} at {rate or 'unlimited'} B/s")
+            process.terminate()
+
+    def set_task_rate_limit(self, task_id: str, limit: Optional[int]) -> dict:
+        """
+        (V23) 修改单任务带宽上限: 原生引擎立即生效; yt-dlp 子进程以新的 --limit-rate 重启
+        """
+        task = db.get_task_by_id(task_id)
+        if not task:
+            return {"success": False, "message": "Task not found in database"}
+        db.update_task_rate_limit(task_id, limit or None)
+        self.task_cache.invalidate(task_id)
+        self.bandwidth.set_task_limit(task_id, limit or None)
+        return {"success": True}
+
+    # --- (V25 新增) 阶段时间线 / 剖析结果 ---
+    def get_task_timeline(self, task_id: str) -> Optional[Dict[str, Any]]:
+        task = self.task_cache.get(task_id)
+        if task is None:
+            return None
+        spans = db.get_task_phases(task_id)
+        live_task = self.live_tasks.get(task_id)
+        phases = live_task.get("phases") if live_task else None
+        if phases is not None:
+            attempt = spans[-1]["attempt"] + 1 if spans else 1
+            spans += [{**span, "attempt": attempt} for span in phases.timeline()]
+        profile = profile_path(task_id)
+        return {
+            "task_id": task_id,
+            "status": task["status"],
+            "phases": spans,
+            "profile": profile.name if profile else None,
+        }
+
+    def get_task_profile(self, task_id: str) -> Optional[Path]:
+        if self.task_cache.get(task_id) is None:
+            return None
+        return profile_path(task_id)
+
+    # --- (V29 新增) 直播录制的分段 ---
+    def get_task_recordings(self, task_id: str) -> Optional[List[Dict[str, Any]]]:
+        if self.task_cache.get(task_id) is None:
+            return None
+        return db.get_task_recordings(task_id)
+
+    # --- 【【V33 新增：通过 HTTP 提供已完成的文件】】 ---
+    def get_task_file(self, task_id: str, part: Optional[int] = None) -> Optional[Path]:
+        """
+        (V33) 已完成任务的文件; part 指定直播录制的某个分段 (录制进行中已经保存的分段也可以)。
+        任务未完成、文件已被移动 / 删除时返回 None
+        """
+        task = self.task_cache.get(task_id)
+        if task is None:
+            return None
+        if part is not None:
+            filename = next((rec["filename"] for rec in db.get_task_recordings(task_id) if rec["part"] == part), None)
+        else:
+            filename = task.get("final_filename") if task["status"] == "complete" else None
+        if not filename:
+            return None
+        directory = Path(task["path"]).resolve()
+        path = directory.joinpath(filename).resolve()
+        # 文件名来自数据库, 仍然确认没有跳出任务的目录
+        if path.parent != directory or not path.is_file():
+            return None
+        return path
+
     # --- (get_task_status 保持不变) ---
     def get_task_status(self, task_id: str) -> Optional[Dict[str, Any]]:
         print(f"--- [SERVICE] get_task_status() called for task: {task_id}")
-        return db.get_task_by_id(task_id)
+        return self.task_cache.get(task_id)
+
+    # --- (V18 新增) ETag: 由 get_task_status() / list_tasks() 返回的内容计算 ---
+    def get_task_etag(self, task: Dict[str, Any]) -> str:
+        return self.task_cache.etag(task)
+
+    def get_tasks_etag(self, tasks: List[Dict[str, Any]]) -> str:
+        return self.task_cache.list_etag(tasks)
 
     # --- 【【V8.6 核心修改：delete_file_from_server】】 ---
     def delete_file_from_server(self, file_path_relative: str) -> dict:
@@ -388,11 +1368,40 @@ class DownloaderService:
     def cancel_running_task(self, task_id: str) -> dict:
         print(f"--- [SERVICE] Attempting to cancel task {task_id}")
         if task_id not in self.live_tasks:
+            # (V31) 任务在其他 worker 中: 通过数据库转交, 由持有租约的 worker 在下次续期时取消
+            owner = db.request_cancel(task_id, WORKER_ID)
+            if owner:
+                print(f"--- [SERVICE] Task {task_id} is owned by worker {owner}, cancel request forwarded")
+                return {"success": True}
             return {"success": False, "message": "Task is not running or already finished."}
+        # (V9) 还在排队的任务: 直接出队并标记为取消
+        if self.scheduler.remove(task_id):
+            self._update_status(task_id, status="error", error_msg="任务被用户取消。")
+            self._release_admission(task_id)
+            db.release_task(task_id, WORKER_ID)
+            live_task = self.live_tasks.pop(task_id, None)
+            if live_task:
+                live_task["broadcaster"].publish("任务在排队中被取消。")
+                live_task["broadcaster"].close()
+            return {"success": True}
         live_task = self.live_tasks[task_id]
+        # (V29) 直播录制: 停止录制, 当前分段正常保存, 任务以 'complete' 结束
+        recorder = live_task.get("recorder")
+        if recorder:
+            print(f"--- [SERVICE] Stopping live recording for task {task_id}")
+            recorder.stop()
+            return {"success": True}
+        # (V10) 原生引擎任务: 取消引擎中的协程
+        engine_future = live_task.get("engine_future")
+        if engine_future:
+            print(f"--- [SERVICE] Cancelling native engine download for task {task_id}")
+            engine_future.cancel()
+            return {"success": True}
         process = live_task.get("process")
         if process:
             print(f"--- [SERVICE] Terminating process {process.pid} for task {task_id}")
+            # (V23) 与带宽份额变化引起的重启区分: 取消之后不再重启
+            live_task["cancelled"] = True
             try:
                 process.terminate()
                 return {"success": True}
@@ -405,21 +1414,41 @@ class DownloaderService:
     # --- (delete_task 保持不变) ---
     def delete_task(self, task_id: str) -> dict:
         print(f"--- [SERVICE] Deleting task {task_id} from DB and memory")
-        if task_id in self.live_tasks:
-            live_task = self.live_tasks[task_id]
-            process = live_task.get("process")
-            if process:
-                print(f"--- [SERVICE] Task {task_id} is running, attempting to terminate...")
-                try:
-                    process.terminate()
-                except Exception as e:
-                    print(f"--- [ERROR] Failed to terminate process for {task_id}: {e}")
-            del self.live_tasks[task_id]
+        task = db.get_task_by_id(task_id)
+        # (V31) 其他 worker 中的任务: 删除记录后, 那个 worker 续期时发现任务不在了, 会自己停止
+        self._abandon_local_task(task_id)
         try:
             db.delete_task(task_id)
+            self.task_cache.forget(task_id)
+            profile = profile_path(task_id)
+            if profile:
+                profile.unlink(missing_ok=True)
+            # (V12) 删除任务时, 保留下来的工作区和检查点也一起清理
+            #       (仍在运行的线程会在结束时自己清理)
+            if task and task["status"] not in ("downloading", "merging"):
+                self._cleanup_workspace(task_id, Path(task["path"]).joinpath(TEMP_DIR_NAME, task_id))
             return {"success": True}
         except Exception as e:
             return {"success": False, "message": f"DB delete failed: {e}"}
 
+
+def hls_manifest_from_info(info: Dict[str, Any]) -> Optional[str]:
+    """(V32) info dict 中最好的 (音视频合一的) HLS 格式的地址; yt-dlp 的 formats 按质量从低到高排列"""
+    formats = info.get("formats") or ([info] if info.get("url") else [])
+    hls = [fmt for fmt in formats if str(fmt.get("protocol", "")).startswith("m3u8") and fmt.get("url")]
+    muxed = [fmt for fmt in hls if fmt.get("vcodec") != "none" and fmt.get("acodec") != "none"]
+    best = (muxed or hls)[-1:]
+    return best[0]["url"] if best else None
+
+
+def _process_cpu_seconds(process: Optional[psutil.Process]) -> float:
+    """(V25) 进程及其已回收的子进程 (例如 ffmpeg) 消耗的 CPU 秒数"""
+    if process is None:
+        raise psutil.Error("no process")
+    times = process.cpu_times()
+    return (times.user + times.system +
+            getattr(times, "children_user", 0.0) + getattr(times, "children_system", 0.0))
+
+
 # --- 【【核心：创建单例】】 (保持不变) ---
 downloader_service = DownloaderService()
@@ -0,0 +1,198 @@
+# app/services/service_scheduler.py
+# (V9 - 有界调度器：全局并发上限 + 按主机限流 + 优先级)
+
+import heapq
+import itertools
+import os
+import threading
+from collections import Counter
+from typing import Callable, Dict, Optional, Any
+from urllib.parse import urlsplit
+
+# 全局同时运行的下载数上限, 以及同一个主机 (CDN) 同时运行的下载数上限
+# (用户可在 docker run -e 中覆盖)
+MAX_CONCURRENT_DOWNLOADS = int(os.environ.get("MAX_CONCURRENT_DOWNLOADS", "3"))
+MAX_DOWNLOADS_PER_HOST = int(os.environ.get("MAX_DOWNLOADS_PER_HOST", "2"))
+# (V21) 有任务因准入检查 (例如磁盘空间) 被挡住时, 每隔多少秒重新检查一次
+ADMISSION_RETRY_SECONDS = float(os.environ.get("ADMISSION_RETRY_SECONDS", "5"))
+
+
+def host_of(url: str) -> str:
+    """
+    提取 URL 的主机名, 用作按主机限流的 key
+    """
+    try:
+        return (urlsplit(url).hostname or "").lower()
+    except ValueError:
+        return ""
+
+
+class DownloadScheduler:
+    """
+    一个简单的 "调度器" 子系统。
+
+    - 排队中的任务放在一个优先队列里: 优先级高的先跑, 同优先级按提交时间先后
+    - 同时最多运行 max_concurrent 个任务, 同一个主机最多 max_per_host 个
+    - 一个后台 "分发线程" 在有空位时取出下一个可运行的任务,
+      交给 runner(task_id) 在独立的工作线程中执行
+
+    队列本身只在内存中; 持久化依靠数据库中的 'queued' 状态,
+    重启时由 Service 重新 submit 回来。
+
+    (V21) 可选的 admission(task_id) 钩子在任务启动前调用 (持有调度器的锁, 必须很快),
+    返回 False 时任务继续排队, 调度器每隔 ADMISSION_RETRY_SECONDS 秒重新检查。
+    """
+
+    def __init__(self, runner: Callable[[str], None],
+                 max_concurrent: int = MAX_CONCURRENT_DOWNLOADS,
+                 max_per_host: int = MAX_DOWNLOADS_PER_HOST,
+                 admission: Optional[Callable[[str], bool]] = None):
+        self._runner = runner
+        self._admission = admission
+        self._blocked = False                # 上次分发时是否有任务被准入检查挡住
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_per_host = max(1, max_per_host)
+
+        self._cond = threading.Condition()
+        self._heap = []                      # (-priority, start_time, seq, task_id)
+        self._queued: Dict[str, str] = {}    # task_id -> host (还在排队的任务)
+        self._running: Dict[str, str] = {}   # task_id -> host (正在运行的任务)
+        self._host_running = Counter()
+        self._seq = itertools.count()
+        self._dispatcher: Optional[threading.Thread] = None
+        self._stopped = False
+
+    # --- 生命周期 ---
+    def start(self) -> None:
+        with self._cond:
+            if self._dispatcher and self._dispatcher.is_alive():
+                return
+            self._stopped = False
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name="scheduler-dispatch")
+            self._dispatcher.daemon = True
+            self._dispatcher.start()
+        print(f"--- [SCHEDULER] 已启动 (全局上限={self.max_concurrent}, 每主机上限={self.max_per_host})")
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    # --- 队列操作 ---
+    def submit(self, task_id: str, url: str, priority: int = 0, start_time: float = 0.0) -> None:
+        """
+        把一个任务放入等待队列 (重复提交会被忽略)
+        """
+        with self._cond:
+            if task_id in self._queued or task_id in self._running:
+                return
+            self._queued[task_id] = host_of(url)
+            heapq.heappush(self._heap, (-int(priority or 0), start_time or 0.0, next(self._seq), task_id))
+            self._cond.notify_all()
+
+    def remove(self, task_id: str) -> bool:
+        """
+        从等待队列中移除一个任务。已经在运行的任务不受影响, 返回 False。
+        (堆中的条目采用惰性删除, 分发时跳过)
+        """
+        with self._cond:
+            return self._queued.pop(task_id, None) is not None
+
+    def wake(self) -> None:
+        """(V21) 准入条件可能变化了 (例如预估完成), 让分发线程立即重新检查"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def is_queued(self, task_id: str) -> bool:
+        with self._cond:
+            return task_id in self._queued
+
+    def set_limits(self, max_concurrent: Optional[int] = None, max_per_host: Optional[int] = None) -> None:
+        with self._cond:
+            if max_concurrent:
+                self.max_concurrent = max(1, max_concurrent)
+            if max_per_host:
+                self.max_per_host = max(1, max_per_host)
+            self._cond.notify_all()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_per_host": self.max_per_host,
+                "running": len(self._running),
+                "queued": len(self._queued),
+                "running_per_host": dict(self._host_running),
+            }
+
+    # --- 分发 ---
+    def _pick_next(self) -> Optional[str]:
+        """
+        (持有锁时调用) 按优先级顺序找出第一个主机未超限的任务。
+        因主机超限 (V21: 或未通过准入检查) 而跳过的条目会被放回堆中, 保持它们原来的顺序。
+        """
+        self._blocked = False
+        if len(self._running) >= self.max_concurrent:
+            return None
+        skipped = []
+        picked = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            task_id = entry[3]
+            host = self._queued.get(task_id)
+            if host is None:
+                continue  # 已被 remove() 的条目
+            if self._host_running[host] >= self.max_per_host:
+                skipped.append(entry)
+                continue
+            if not self._admit(task_id):
+                self._blocked = True
+                skipped.append(entry)
+                continue
+            picked = task_id
+            break
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return picked
+
+    def _admit(self, task_id: str) -> bool:
+        if self._admission is None:
+            return True
+        try:
+            return self._admission(task_id)
+        except Exception as e:
+            print(f"--- [ERROR] [SCHEDULER] 任务 {task_id} 的准入检查失败, 直接放行: {e}")
+            return True
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._cond:
+                task_id = None
+                while not self._stopped:
+                    task_id = self._pick_next()
+                    if task_id:
+                        break
+                    self._cond.wait(ADMISSION_RETRY_SECONDS if self._blocked else None)
+                if self._stopped:
+                    return
+                host = self._queued.pop(task_id)
+                self._running[task_id] = host
+                self._host_running[host] += 1
+
+            worker = threading.Thread(target=self._run_worker, args=(task_id,), name=f"task-{task_id[:8]}")
+            worker.daemon = True
+            worker.start()
+
+    def _run_worker(self, task_id: str) -> None:
+        try:
+            self._runner(task_id)
+        except Exception as e:
+            print(f"--- [ERROR] [SCHEDULER] 任务 {task_id} 的工作线程异常退出: {e}")
+        finally:
+            with self._cond:
+                host = self._running.pop(task_id, None)
+                if host is not None:
+                    self._host_running[host] -= 1
+                    if self._host_running[host] <= 0:
+                        del self._host_running[host]
+                self._cond.notify_all()
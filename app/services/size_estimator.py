@@ -0,0 +1,60 @@
+# app/services/size_estimator.py
+# (V21 - 下载前的大小预估: HLS 播放列表的码率 x 时长, 或 yt-dlp 的元数据)
+
+import os
+from typing import Any, Dict, Optional
+
+from app.services.engine_hls import hls_engine, is_direct_m3u8, LivePlaylistError, UnsupportedStreamError
+from app.services.extractor_pool import extractor, ExtractionError
+
+# 一次预估最多等待多久 (秒)
+SIZE_ESTIMATE_TIMEOUT = float(os.environ.get("SIZE_ESTIMATE_TIMEOUT", "60"))
+
+
+def estimate_download_size(url: str) -> Optional[int]:
+    """
+    预估下载结果的大小 (字节)。无法预估时返回 None, 调用方只检查安全余量。
+    """
+    if is_direct_m3u8(url):
+        future = hls_engine.submit(hls_engine.estimate_size(url))
+        try:
+            return future.result(SIZE_ESTIMATE_TIMEOUT)
+        except LivePlaylistError:
+            # (V29) 直播录制的大小没有上限; 分段会及时移出临时目录, 只检查安全余量
+            return None
+        except UnsupportedStreamError:
+            pass  # 原生引擎不支持: 下载会交给 yt-dlp, 预估也交给它
+        except Exception as e:
+            future.cancel()
+            print(f"--- [ESTIMATE] 无法从播放列表预估大小: {e}")
+            return None
+    return _estimate_with_ytdlp(url)
+
+
+def _estimate_with_ytdlp(url: str) -> Optional[int]:
+    # (V32) 由常驻的提取进程完成, 结果留在缓存中, 任务启动时直接交给 yt-dlp
+    try:
+        return size_from_info(extractor.extract(url, timeout=SIZE_ESTIMATE_TIMEOUT))
+    except ExtractionError as e:
+        print(f"--- [ESTIMATE] yt-dlp 提取失败: {e}")
+        return None
+    except Exception as e:
+        print(f"--- [ESTIMATE] 无法从 yt-dlp 元数据预估大小: {e}")
+        return None
+
+
+def size_from_info(info: Dict[str, Any]) -> Optional[int]:
+    """
+    从 yt-dlp 的 info dict 计算大小: 视频 + 音频分开下载时 (requested_formats) 求和,
+    没有 filesize / filesize_approx 时用 tbr (kbit/s) x 时长
+    """
+    formats = info.get("requested_formats") or [info]
+    total = 0.0
+    for fmt in formats:
+        size = fmt.get("filesize") or fmt.get("filesize_approx")
+        if not size and fmt.get("tbr") and info.get("duration"):
+            size = fmt["tbr"] * 1000 / 8 * info["duration"]
+        if not size:
+            return None
+        total += size
+    return int(total)
@@ -0,0 +1,134 @@
+# app/services/task_cache.py
+# (V18 - 任务状态的内存缓存 + 版本号, 用于 ETag / 条件 GET)
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+# 缓存多少个不同查询条件的任务列表结果
+LIST_CACHE_SIZE = 32
+# 不参与 ETag 计算的字段: 租约每隔几秒续期一次, 不代表任务有变化
+ETAG_IGNORED_FIELDS = ("lease_expires",)
+
+
+def content_etag(value: Any) -> str:
+    """
+    (V18) 由内容计算的弱 ETag: 任何 worker、任何时候返回同样的数据, ETag 都相同,
+    负载均衡后面的多个 worker 之间和进程重启之后仍然可以返回 304
+    """
+    def strip(item):
+        if isinstance(item, dict):
+            return {k: v for k, v in item.items() if k not in ETAG_IGNORED_FIELDS}
+        return item
+    if isinstance(value, list):
+        value = [strip(item) for item in value]
+    else:
+        value = strip(value)
+    raw = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return f'W/"{hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]}"'
+
+
+class TaskStateCache:
+    """
+    读穿透 (read-through) 的任务状态缓存。
+
+    - get(task_id): 命中直接返回; 未命中时调用 loader 读数据库并缓存
+    - invalidate(task_id): Service 在任务每次状态/进度变化时调用,
+      丢弃缓存并把该任务的版本号 +1, 同时把全局的 generation +1
+    - etag() / list_etag(): 由返回的内容计算 (content_etag), 列表的 ETag 每个 generation 只计算一次
+    - (V31) invalidate_all(): 其他 worker 修改了共享的数据库, 丢弃全部缓存
+    """
+
+    def __init__(self, loader: Callable[[str], Optional[Dict[str, Any]]]):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+        self._versions: Dict[str, int] = {}
+        self._generation = 0
+        # 查询条件 -> [generation, 结果, ETag (第一次需要时计算)]
+        self._lists: "OrderedDict[Hashable, List[Any]]" = OrderedDict()
+        self._foreign = 0      # (V31) invalidate_all() 的次数
+
+    # --- 单个任务 ---
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cached = self._tasks.get(task_id)
+            if cached is not None:
+                return dict(cached)
+            version = (self._versions.get(task_id, 0), self._foreign)
+        task = self._loader(task_id)
+        if task is None:
+            return None
+        with self._lock:
+            # 读取期间如果发生了 invalidate, 这份数据可能已经过时: 不缓存
+            if (self._versions.get(task_id, 0), self._foreign) == version:
+                self._tasks[task_id] = dict(task)
+        return task
+
+    def version(self, task_id: str) -> int:
+        with self._lock:
+            return self._versions.get(task_id, 0)
+
+    def etag(self, task: Dict[str, Any]) -> str:
+        """get() 返回的任务的 ETag"""
+        return content_etag(task)
+
+    def invalidate(self, task_id: str) -> None:
+        with self._lock:
+            self._tasks.pop(task_id, None)
+            self._versions[task_id] = self._versions.get(task_id, 0) + 1
+            self._generation += 1
+            self._lists.clear()
+
+    def forget(self, task_id: str) -> None:
+        """任务被删除: 版本号也不再需要保留"""
+        self.invalidate(task_id)
+        with self._lock:
+            self._versions.pop(task_id, None)
+
+    def invalidate_all(self) -> None:
+        """(V31) 数据库被其他进程修改: 不知道是哪些任务, 全部丢弃"""
+        with self._lock:
+            self._tasks.clear()
+            self._foreign += 1
+            self._generation += 1
+            self._lists.clear()
+
+    # --- 任务列表 ---
+    @property
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def list_etag(self, result: List[Any]) -> str:
+        """get_list() 返回的列表的 ETag; 仍在缓存中时只计算一次"""
+        with self._lock:
+            entry = next((entry for entry in self._lists.values() if entry[1] is result), None)
+            if entry is not None and entry[2] is not None:
+                return entry[2]
+        etag = content_etag(result)
+        if entry is not None:
+            with self._lock:
+                entry[2] = etag
+        return etag
+
+    def get_list(self, query_key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        缓存一个列表查询的结果, 直到任何任务发生变化 (generation 改变)
+        """
+        with self._lock:
+            generation = self._generation
+            cached = self._lists.get(query_key)
+            if cached is not None and cached[0] == generation:
+                self._lists.move_to_end(query_key)
+                return cached[1]
+        result = loader()
+        with self._lock:
+            if self._generation == generation:
+                self._lists[query_key] = [generation, result, None]
+                self._lists.move_to_end(query_key)
+                while len(self._lists) > LIST_CACHE_SIZE:
+                    self._lists.popitem(last=False)
+        return result
@@ -0,0 +1,145 @@
+# app/services/task_profiler.py
+# (V25 - 可选: 任务运行期间对服务进程做性能剖析)
+
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+# off / sample / cprofile
+#   sample:   类似 py-spy 的采样: 定期抓取服务进程所有线程的调用栈,
+#             输出 collapsed stacks 格式 (可直接交给 flamegraph.pl / speedscope)
+#   cprofile: 对任务线程启用 cProfile, 输出 .pstats (只覆盖任务线程本身)
+TASK_PROFILE = os.environ.get("TASK_PROFILE", "off").strip().lower()
+# 采样间隔 (秒)
+TASK_PROFILE_INTERVAL = float(os.environ.get("TASK_PROFILE_INTERVAL", "0.01"))
+# 剖析结果保存目录
+TASK_PROFILE_DIR = Path(os.environ.get(
+    "TASK_PROFILE_DIR",
+    str(Path(os.environ.get("DOWNLOAD_ROOT", "/downloads")).joinpath(".profiles")),
+))
+
+PROFILE_SUFFIXES = {"sample": ".collapsed", "cprofile": ".pstats"}
+
+
+def profile_path(task_id: str) -> Optional[Path]:
+    """任务已有的剖析结果文件 (没有时返回 None)"""
+    for suffix in PROFILE_SUFFIXES.values():
+        path = TASK_PROFILE_DIR / f"{task_id}{suffix}"
+        if path.is_file():
+            return path
+    return None
+
+
+class StackSampler:
+    """
+    在后台线程中每隔 interval 秒读取 sys._current_frames(),
+    按 "线程名;文件:函数;..." 聚合出现次数。
+    """
+
+    def __init__(self, interval: float = TASK_PROFILE_INTERVAL):
+        self._interval = interval
+        self._counts: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="task-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self._interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{Path(code.co_filename).name}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._counts[";".join(reversed(stack))] += 1
+
+    def stop(self, path: Path) -> None:
+        self._stop.set()
+        self._thread.join()
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self._counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+# Python 3.12+ 的 cProfile 基于 sys.monitoring, 同一时刻只能有一个在运行
+_cprofile_lock = threading.Lock()
+
+
+class ThreadProfiler:
+    """对调用 start() 的线程启用 cProfile"""
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self) -> None:
+        if not _cprofile_lock.acquire(blocking=False):
+            raise RuntimeError("另一个任务正在使用 cProfile")
+        try:
+            self._profile.enable()
+        except Exception:
+            _cprofile_lock.release()
+            raise
+
+    def stop(self, path: Path) -> None:
+        try:
+            self._profile.disable()
+            self._profile.dump_stats(str(path))
+        finally:
+            _cprofile_lock.release()
+
+
+class TaskProfile:
+    """
+    一个任务的剖析会话。必须在任务线程中 start() / stop()。
+    """
+
+    def __init__(self, task_id: str, mode: str):
+        self.task_id = task_id
+        self.mode = mode
+        self.path = TASK_PROFILE_DIR / f"{task_id}{PROFILE_SUFFIXES[mode]}"
+        self._profiler = StackSampler() if mode == "sample" else ThreadProfiler()
+        self._started = 0.0
+
+    def start(self) -> None:
+        TASK_PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        self._started = time.perf_counter()
+        self._profiler.start()
+
+    def stop(self) -> Optional[Path]:
+        try:
+            self._profiler.stop(self.path)
+            # 续传后的运行覆盖之前的结果 (包括另一种模式的)
+            for suffix in PROFILE_SUFFIXES.values():
+                if suffix != self.path.suffix:
+                    TASK_PROFILE_DIR.joinpath(f"{self.task_id}{suffix}").unlink(missing_ok=True)
+            print(f"--- [PROFILE] 任务 {self.task_id} 的剖析结果 ({self.mode}, "
+                  f"{time.perf_counter() - self._started:.1f}s): {self.path}")
+            return self.path
+        except Exception as e:
+            print(f"--- [PROFILE] 无法保存任务 {self.task_id} 的剖析结果: {e}")
+            return None
+
+
+def start_task_profile(task_id: str) -> Optional[TaskProfile]:
+    """TASK_PROFILE 开启时, 为任务启动剖析; 否则返回 None"""
+    if TASK_PROFILE not in PROFILE_SUFFIXES:
+        return None
+    profile = TaskProfile(task_id, TASK_PROFILE)
+    try:
+        profile.start()
+    except Exception as e:
+        print(f"--- [PROFILE] 任务 {task_id} 不做剖析: {e}")
+        return None
+    return profile
@@ -0,0 +1,105 @@
+# app/services/worker_leases.py
+# (V31 - 多进程 / 多节点: 多个 worker 共享同一个 downloader.db 和下载目录, 通过数据库中的租约分配任务)
+
+import os
+import socket
+import threading
+import time
+from typing import Callable, Iterable, List
+
+import app.repository.repo_tasks as db
+
+# 本进程的 worker ID (uvicorn --workers 的每个进程、每个容器各不相同)
+WORKER_ID = os.environ.get("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+# 租约有效期 (秒): worker 退出 / 卡死超过这么久后, 它的任务由其他 worker 接手
+TASK_LEASE_TTL = float(os.environ.get("TASK_LEASE_TTL", "30"))
+# 检查取消请求 / 被删除的任务的间隔 (秒)
+LEASE_POLL_INTERVAL = float(os.environ.get("LEASE_POLL_INTERVAL", "1.0"))
+
+
+class LeaseKeeper:
+    """
+    后台线程, 每隔 LEASE_POLL_INTERVAL 秒:
+    - 续期本 worker 持有的所有租约 (一条 UPDATE), 读回仍然属于自己的任务
+      * 其他 worker 转交来的取消请求 -> on_cancel(task_id)
+      * 本地还在处理、但已经不属于自己的任务 (被删除或被接手) -> on_lost(task_id)
+    - 本 worker 有空闲的下载槽位 (capacity() > 0) 且有其他 worker 时, 从它们的等待队列中拿走任务 -> on_adopt(rows)
+    - 每隔 TTL / 3 刷新 worker 心跳, 并接手其他 worker 留下的无主任务 -> on_adopt(rows)
+    - 有其他活着的 worker 时, 数据库被其他连接修改过 (PRAGMA data_version) -> on_foreign_change()
+      (本进程的任务缓存只在本地修改时失效, 看不到其他 worker 的写入)
+    """
+
+    def __init__(self, local_tasks: Callable[[], Iterable[str]],
+                 capacity: Callable[[], int],
+                 on_cancel: Callable[[str], None],
+                 on_lost: Callable[[str], None],
+                 on_adopt: Callable[[List[dict]], None],
+                 on_foreign_change: Callable[[], None],
+                 worker_id: str = WORKER_ID, ttl: float = TASK_LEASE_TTL,
+                 interval: float = LEASE_POLL_INTERVAL):
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.interval = interval
+        self._local_tasks = local_tasks
+        self._capacity = capacity
+        self._on_cancel = on_cancel
+        self._on_lost = on_lost
+        self._on_adopt = on_adopt
+        self._on_foreign_change = on_foreign_change
+        self._started_at = time.time()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-keeper", daemon=True)
+        self._data_version = None
+        self.peers = 0
+
+    def start(self) -> None:
+        self.heartbeat()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=5)
+        db.remove_worker(self.worker_id)
+
+    def heartbeat(self) -> None:
+        db.heartbeat_worker(self.worker_id, socket.gethostname(), os.getpid(), self._started_at)
+        alive = db.get_workers(time.time() - self.ttl)
+        self.peers = sum(1 for worker in alive if worker["id"] != self.worker_id)
+
+    def _run(self) -> None:
+        last_heartbeat = time.monotonic()
+        while not self._stop.wait(self.interval):
+            try:
+                self._tick()
+                if time.monotonic() - last_heartbeat >= self.ttl / 3:
+                    last_heartbeat = time.monotonic()
+                    self.heartbeat()
+                    db.remove_worker("", stale_before=time.time() - 10 * self.ttl)
+                    self._adopt()
+            except Exception as e:
+                print(f"--- [LEASE] 租约维护失败: {e}")
+
+    def _tick(self) -> None:
+        local = list(self._local_tasks())
+        owned = db.renew_leases(self.worker_id, self.ttl)
+        for task_id in local:
+            if task_id not in owned:
+                self._on_lost(task_id)
+            elif owned[task_id]:
+                db.clear_cancel_request(task_id)
+                self._on_cancel(task_id)
+        if self.peers:
+            taken = db.take_queued_tasks(self.worker_id, self.ttl, self._capacity())
+            if taken:
+                print(f"--- [LEASE] 从其他 worker 的队列中接过 {len(taken)} 个任务")
+                self._on_adopt(taken)
+            version = db.data_version()
+            if self._data_version is not None and version != self._data_version:
+                self._on_foreign_change()
+            self._data_version = version
+
+    def _adopt(self) -> None:
+        rows = db.adopt_orphaned_tasks(self.worker_id, self.ttl, exclude=list(self._local_tasks()))
+        if rows:
+            self._on_adopt(rows)
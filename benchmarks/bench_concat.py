@@ -0,0 +1,115 @@
+# benchmarks/bench_concat.py
+# (V22) 片段拼接的基准: ffmpeg 重新封装 (yt-dlp 的 --merge-output-format mkv 路径)
+#       vs 用户态读写拼接 vs 内核拼接 (copy_file_range / sendfile, 原生引擎命中片段缓存时的路径)
+#
+# 用法 (在项目根目录):
+#   python -m benchmarks.bench_concat [--segments 200] [--segment-mb 1] [--segments-dir DIR]
+#
+# 不指定 --segments-dir 时: 有 ffmpeg 就用它生成真实的 MPEG-TS 片段, 否则生成随机数据
+# (随机数据不是合法的 TS, 此时跳过 ffmpeg 路径)。
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from app.services.engine_hls import splice_file
+
+try:
+    import resource
+except ImportError:  # Windows: 只能统计本进程的 CPU 时间
+    resource = None
+
+
+def _cpu_seconds() -> float:
+    if resource is None:
+        return time.process_time()
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _measure(fn, *args):
+    wall, cpu = time.perf_counter(), _cpu_seconds()
+    fn(*args)
+    return time.perf_counter() - wall, _cpu_seconds() - cpu
+
+
+def concat_userspace(segments, output: Path):
+    with open(output, "wb") as out:
+        for segment in segments:
+            with open(segment, "rb") as src:
+                shutil.copyfileobj(src, out, 1024 * 1024)
+
+
+def concat_kernel(segments, output: Path):
+    with open(output, "wb") as out:
+        for segment in segments:
+            with open(segment, "rb") as src:
+                splice_file(out, src)
+
+
+def remux_ffmpeg(segments, output: Path):
+    # 与 yt-dlp 合并 / 修复阶段相同: 读入所有片段, 以 -c copy 重新封装成 mkv
+    listing = output.with_suffix(".txt")
+    listing.write_text("".join(f"file '{segment}'\n" for segment in segments))
+    subprocess.run(["ffmpeg", "-v", "error", "-y", "-f", "concat", "-safe", "0", "-i", str(listing),
+                    "-c", "copy", str(output.with_suffix(".mkv"))], check=True)
+
+
+def make_segments(directory: Path, count: int, segment_mb: float):
+    if shutil.which("ffmpeg"):
+        seconds = count * 2
+        bitrate = int(segment_mb * 8 * 1024 * 1024 / 2)
+        subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=30:duration={seconds}",
+                        "-c:v", "mpeg2video", "-b:v", str(bitrate), "-f", "segment", "-segment_time", "2",
+                        str(directory / "seg%05d.ts")], check=True)
+        return sorted(directory.glob("seg*.ts")), True
+    size = int(segment_mb * 1024 * 1024)
+    for i in range(count):
+        (directory / f"seg{i:05d}.ts").write_bytes(os.urandom(size))
+    return sorted(directory.glob("seg*.ts")), False
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--segments", type=int, default=200)
+    parser.add_argument("--segment-mb", type=float, default=1.0)
+    parser.add_argument("--segments-dir", help="使用已有的 .ts 片段 (按文件名排序)")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        if args.segments_dir:
+            segments, real_ts = sorted(Path(args.segments_dir).glob("*.ts")), True
+        else:
+            segments, real_ts = make_segments(tmp, args.segments, args.segment_mb)
+        total_mb = sum(s.stat().st_size for s in segments) / 1024 ** 2
+        print(f"{len(segments)} segments, {total_mb:.1f} MiB total")
+
+        methods = [("userspace read/write", concat_userspace), ("kernel splice", concat_kernel)]
+        if real_ts and shutil.which("ffmpeg"):
+            methods.insert(0, ("ffmpeg remux (current)", remux_ffmpeg))
+        else:
+            print("(ffmpeg 不可用或片段不是真实的 TS, 跳过 remux 路径)")
+
+        print(f"{'method':26} {'wall (s)':>10} {'cpu (s)':>10} {'MiB/s':>10}")
+        for name, fn in methods:
+            walls, cpus = [], []
+            for round_ in range(args.rounds):
+                output = tmp / f"out-{round_}.ts"
+                wall, cpu = _measure(fn, segments, output)
+                walls.append(wall)
+                cpus.append(cpu)
+                for leftover in tmp.glob("out-*"):
+                    leftover.unlink()
+            wall, cpu = min(walls), min(cpus)
+            print(f"{name:26} {wall:>10.3f} {cpu:>10.3f} {total_mb / wall:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
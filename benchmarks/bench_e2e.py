@@ -0,0 +1,381 @@
+# benchmarks/bench_e2e.py
+# (V26) 端到端基准: 本地合成 HLS 源 -> DownloaderService / REST API -> 最终文件
+#
+# 每个场景分别通过 DownloaderService 直接提交 ("service") 和通过 HTTP 调用 REST API ("rest"),
+# 统计吞吐量、CPU 时间、峰值 RSS、数据库操作次数/秒; 另外测量 SSE 多订阅者的扇出延迟。
+# 结果写成 JSON, 可以和之前版本的结果对比:
+#
+# 用法 (在项目根目录):
+#   python -m benchmarks.bench_e2e [--scenarios vod,multivariant,encrypted,lossy,live]
+#                                  [--runs 3] [--subscribers 16] [--output results.json]
+#                                  [--baseline old.json --tolerance 0.15]
+#
+# 有回归 (相对 baseline 变差超过 tolerance) 时退出码为 1。
+
+import argparse
+import contextlib
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlencode
+
+import psutil
+
+from benchmarks.hls_origin import serve_in_process
+
+SEGMENT_KIB = 256
+
+# 场景: 源上的路径 + 查询参数
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "vod": {"path": "vod.m3u8", "params": {"segments": 60, "size": SEGMENT_KIB * 1024}},
+    "multivariant": {"path": "master.m3u8", "params": {"variants": 3, "segments": 40, "size": SEGMENT_KIB * 1024}},
+    "encrypted": {"path": "vod.m3u8", "params": {"segments": 40, "size": SEGMENT_KIB * 1024, "key": 1}},
+    "lossy": {"path": "vod.m3u8",
+              "params": {"segments": 40, "size": SEGMENT_KIB * 1024, "latency": 0.02, "jitter": 0.02, "loss": 0.05}},
+    "live": {"path": "live.m3u8",
+             "params": {"window": 4, "total": 12, "duration": 0.5, "size": SEGMENT_KIB * 1024}},
+}
+
+# 对比 baseline 时的方向: True = 越大越好
+METRIC_DIRECTIONS = {
+    "throughput_mb_s": True,
+    "elapsed_s": False,
+    "cpu_s": False,
+    "peak_rss_mb": False,
+    "db_ops_per_s": None,   # 只报告, 不判断好坏
+    "p50_ms": False,
+    "p99_ms": False,
+}
+
+
+class PeakRss:
+    """后台线程定期采样本进程 (及子进程) 的 RSS, 记录峰值"""
+
+    def __init__(self, exclude: tuple = (), interval: float = 0.05):
+        self._interval = interval
+        self._exclude = set(exclude)
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self.peak = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self) -> int:
+        total = self._process.memory_info().rss
+        for child in self._process.children(recursive=True):
+            if child.pid in self._exclude:
+                continue
+            with contextlib.suppress(psutil.Error):
+                total += child.memory_info().rss
+        return total
+
+    def _run(self):
+        while True:
+            self.peak = max(self.peak, self._sample())
+            if self._stop.wait(self._interval):
+                break
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def _cpu_seconds() -> float:
+    """本进程 + 已回收的子进程 (yt-dlp / ffmpeg) 的 CPU 时间"""
+    times = psutil.Process().cpu_times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class Api:
+    """被测服务的 HTTP 客户端 (每个线程一个连接)"""
+
+    def __init__(self, port: int):
+        self.port = port
+        self._local = threading.local()
+
+    def request(self, method: str, path: str, body: Optional[dict] = None):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        payload = json.dumps(body).encode() if body is not None else None
+        conn.request(method, path, body=payload, headers={"Content-Type": "application/json"} if payload else {})
+        response = conn.getresponse()
+        data = response.read()
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path} -> {response.status}: {data[:200]!r}")
+        return data
+
+    def json(self, method: str, path: str, body: Optional[dict] = None):
+        return json.loads(self.request(method, path, body) or b"null")
+
+    def db_ops(self) -> int:
+        """/metrics 中所有 repository 调用的次数之和"""
+        total = 0
+        for line in self.request("GET", "/metrics").decode().splitlines():
+            if line.startswith("downloader_sqlite_call_duration_seconds_count"):
+                total += int(float(line.rsplit(" ", 1)[1]))
+        return total
+
+
+def _start_api_server(app) -> "tuple":
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", lifespan="on"))
+    thread = threading.Thread(target=server.run, name="bench-uvicorn", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("API server failed to start")
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, thread, port
+
+
+def run_download(submit: Callable[[], str], status: Callable[[str], dict], api: Api, timeout: float,
+                 exclude_pids: tuple = ()) -> Dict[str, Any]:
+    ops_before, cpu_before = api.db_ops(), _cpu_seconds()
+    start = time.perf_counter()
+    with PeakRss(exclude_pids) as rss:
+        task_id = submit()
+        deadline = start + timeout
+        while True:
+            task = status(task_id)
+            if task and task["status"] in ("complete", "error"):
+                break
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"task {task_id} still {task and task['status']} after {timeout}s")
+            time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    cpu = _cpu_seconds() - cpu_before
+    ops = api.db_ops() - ops_before
+    size = task.get("content_size") or task.get("downloaded_bytes") or 0
+    return {
+        "status": task["status"],
+        "error": task.get("error_message"),
+        "bytes": size,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_mb_s": round(size / elapsed / 1e6, 2) if task["status"] == "complete" else 0.0,
+        "cpu_s": round(cpu, 3),
+        "peak_rss_mb": round(rss.peak / 2**20, 1),
+        "db_ops_per_s": round(ops / elapsed, 1),
+    }
+
+
+def measure_sse_fanout(api: Api, service, url: str, subscribers: int, markers: int) -> Dict[str, Any]:
+    """
+    N 个 SSE 连接订阅同一个 (被源的延迟拖慢的) 任务, 服务端发布带时间戳的标记行,
+    统计从 publish 到各订阅者收到的延迟。
+    """
+    task_id = api.json("POST", "/api/v1/start-download",
+                       {"url": url, "download_path": str(service_root()), "force": True})["taskId"]
+    while task_id not in service.live_tasks or api.json("GET", f"/api/v1/status/{task_id}")["status"] == "queued":
+        time.sleep(0.05)
+
+    latencies: List[float] = []
+    lock = threading.Lock()
+    ready = threading.Barrier(subscribers + 1)
+
+    def subscriber():
+        conn = http.client.HTTPConnection("127.0.0.1", api.port, timeout=30)
+        conn.request("GET", f"/api/v1/stream-progress/{task_id}")
+        response = conn.getresponse()
+        ready.wait()
+        seen = 0
+        while seen < markers:
+            line = response.fp.readline().decode(errors="replace")
+            if not line or "[STREAM_END]" in line:
+                break
+            if line.startswith("data: [bench-sse]"):
+                sent = float(line.split()[-1])
+                with lock:
+                    latencies.append(time.perf_counter() - sent)
+                seen += 1
+        conn.close()
+
+    threads = [threading.Thread(target=subscriber, daemon=True) for _ in range(subscribers)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    broadcaster = service.live_tasks[task_id]["broadcaster"]
+    while broadcaster.subscriber_count < subscribers:
+        time.sleep(0.01)
+    for i in range(markers):
+        service._publish(task_id, f"[bench-sse] {i} {time.perf_counter()!r}")
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join(timeout=10)
+    api.request("POST", f"/api/v1/task/{task_id}/cancel")
+
+    latencies.sort()
+    expected = subscribers * markers
+    return {
+        "subscribers": subscribers,
+        "markers": markers,
+        "delivered_ratio": round(len(latencies) / expected, 3),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+        "p99_ms": round(latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000, 2) if latencies else None,
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else None,
+    }
+
+
+def service_root() -> Path:
+    return Path(os.environ["DOWNLOAD_ROOT"])
+
+
+def _median_runs(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    summary = dict(runs[-1])
+    for key, value in runs[-1].items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            summary[key] = round(statistics.median(r[key] for r in runs), 3)
+    summary["runs"] = len(runs)
+    summary["failed_runs"] = sum(r["status"] != "complete" for r in runs)
+    return summary
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    for name, current in results["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old:
+            continue
+        for metric, higher_is_better in METRIC_DIRECTIONS.items():
+            if higher_is_better is None or not old.get(metric) or current.get(metric) is None:
+                continue
+            change = (current[metric] - old[metric]) / old[metric]
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(f"{name}.{metric}: {old[metric]} -> {current[metric]} ({change:+.0%})")
+    return regressions
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end download benchmarks against a synthetic HLS origin")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--modes", default="service,rest")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=1, help="正式测量前不计入结果的下载次数")
+    parser.add_argument("--subscribers", type=int, default=16, help="SSE 扇出测试的订阅者数 (0 = 跳过)")
+    parser.add_argument("--markers", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--segment-cache", action="store_true", help="保留共享片段缓存 (默认禁用, 每次都走网络)")
+    parser.add_argument("--output", help="把 JSON 结果写入文件 (默认输出到 stdout)")
+    parser.add_argument("--baseline", help="之前版本的 JSON 结果, 用于检测回归")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--verbose", action="store_true", help="显示服务的日志输出")
+    args = parser.parse_args()
+
+    # 源在独立进程中运行 (在导入 app、启动各种后台线程之前 fork)
+    ready, stop = multiprocessing.Queue(), multiprocessing.Event()
+    origin = multiprocessing.Process(target=serve_in_process, args=(ready, stop), daemon=True)
+    origin.start()
+    origin_url = ready.get(timeout=30)
+
+    workdir = tempfile.TemporaryDirectory(prefix="bench-e2e-")
+    # 服务的配置都是模块级常量: 必须在导入 app 之前设置环境变量
+    os.environ["DOWNLOAD_ROOT"] = str(Path(workdir.name) / "downloads")
+    if not args.segment_cache:
+        os.environ["SEGMENT_CACHE_MAX_BYTES"] = "0"
+    os.environ.setdefault("TASK_PROFILE", "off")
+
+    import app.repository.repo_tasks as db
+    db.DATABASE_FILE = Path(workdir.name) / "bench.db"
+    from app.main import app
+    from app.services.service_downloads import downloader_service as service
+
+    log_sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    results: Dict[str, Any] = {
+        "meta": {
+            "timestamp": time.time(),
+            "git_revision": _git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": {},
+    }
+    try:
+        with log_sink:
+            server, thread, port = _start_api_server(app)
+            api = Api(port)
+            try:
+                # 预热: 导入、连接池、数据库页缓存等一次性开销不计入第一个场景
+                for run in range(args.warmup):
+                    url = f"{origin_url}/vod.m3u8?{urlencode(dict(SCENARIOS['vod']['params'], stream=f'warmup-{run}'))}"
+                    run_download(lambda: service.start_new_download(url, None, None, force=True),
+                                 db.get_task_by_id, api, args.timeout)
+                for scenario in args.scenarios.split(","):
+                    spec = SCENARIOS[scenario]
+                    for mode in args.modes.split(","):
+                        runs = []
+                        for run in range(args.runs):
+                            params = dict(spec["params"], stream=f"{scenario}-{mode}-{run}")
+                            url = f"{origin_url}/{spec['path']}?{urlencode(params)}"
+                            if mode == "service":
+                                submit = lambda: service.start_new_download(url, None, None, force=True)
+                                status = lambda task_id: db.get_task_by_id(task_id)
+                            else:
+                                submit = lambda: api.json("POST", "/api/v1/start-download", {
+                                    "url": url, "download_path": str(service_root()), "force": True})["taskId"]
+                                status = lambda task_id: api.json("GET", f"/api/v1/status/{task_id}")
+                            runs.append(run_download(submit, status, api, args.timeout, (origin.pid,)))
+                        results["results"][f"{scenario}/{mode}"] = _median_runs(runs)
+
+                if args.subscribers:
+                    slow = dict(SCENARIOS["vod"]["params"], latency=0.5, stream="sse")
+                    results["results"]["sse_fanout"] = measure_sse_fanout(
+                        api, service, f"{origin_url}/vod.m3u8?{urlencode(slow)}", args.subscribers, args.markers)
+            finally:
+                server.should_exit = True
+                thread.join(timeout=30)
+    finally:
+        stop.set()
+        origin.join(timeout=10)
+        workdir.cleanup()
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+
+    print(f"\n{'benchmark':24} {'status':>9} {'MB/s':>8} {'time s':>8} {'cpu s':>7} {'rss MB':>8} {'db op/s':>8}",
+          file=sys.stderr)
+    for name, r in results["results"].items():
+        if name == "sse_fanout":
+            print(f"{name:24} {r['subscribers']} subscribers: p50 {r['p50_ms']} ms, p99 {r['p99_ms']} ms, "
+                  f"delivered {r['delivered_ratio']:.0%}", file=sys.stderr)
+            continue
+        print(f"{name:24} {r['status']:>9} {r['throughput_mb_s']:>8} {r['elapsed_s']:>8} {r['cpu_s']:>7} "
+              f"{r['peak_rss_mb']:>8} {r['db_ops_per_s']:>8}", file=sys.stderr)
+
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# benchmarks/bench_repo_tasks.py
+# (V15) repo_tasks 的微基准: 每次调用都 connect/close (旧实现) vs 线程本地长连接 + WAL (新实现)
+#
+# 用法 (在项目根目录):
+#   python -m benchmarks.bench_repo_tasks [--calls 2000]
+
+import argparse
+import contextlib
+import io
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import app.repository.repo_tasks as db
+
+
+def _legacy_conn():
+    # 与 V14 及之前的 get_db_conn() 完全相同: 每次新建连接, 默认 journal 模式
+    conn = sqlite3.connect(db.DATABASE_FILE, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def legacy_get_task_by_id(task_id):
+    conn = _legacy_conn()
+    try:
+        row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+def legacy_update_task_status(task_id, status):
+    conn = _legacy_conn()
+    try:
+        conn.execute(
+            "UPDATE tasks SET status = :status, error_message = NULL, final_filename = NULL WHERE id = :task_id",
+            {"status": status, "task_id": task_id},
+        )
+    finally:
+        conn.close()
+
+
+def _time_calls(fn, calls):
+    samples = []
+    for i in range(calls):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "mean_us": round(statistics.mean(samples) * 1e6, 1),
+        "p50_us": round(samples[len(samples) // 2] * 1e6, 1),
+        "p99_us": round(samples[int(len(samples) * 0.99) - 1] * 1e6, 1),
+    }
+
+
+def _read_under_write(read_fn, write_fn, calls):
+    """一个线程持续写入时, 读取的延迟"""
+    stop = threading.Event()
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            write_fn(i)
+            i += 1
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        return _time_calls(read_fn, calls)
+    finally:
+        stop.set()
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for mode in ("legacy", "pooled"):
+            # 每种模式使用独立的数据库文件 (WAL 是持久化在文件上的)
+            db.DATABASE_FILE = Path(tmp) / f"{mode}.db"
+            db.close_db_conn()
+            with contextlib.redirect_stdout(io.StringIO()):
+                if mode == "legacy":
+                    conn = _legacy_conn()
+                    conn.execute("CREATE TABLE tasks (id TEXT PRIMARY KEY, url TEXT, path TEXT, status TEXT, "
+                                 "custom_name TEXT, final_filename TEXT, error_message TEXT, startTime REAL)")
+                    conn.close()
+                else:
+                    db.init_db()
+                ids = [str(uuid.uuid4()) for _ in range(100)]
+                conn = _legacy_conn() if mode == "legacy" else db.get_db_conn()
+                for task_id in ids:
+                    conn.execute("INSERT INTO tasks (id, url, path, status, startTime) VALUES (?, '', '', 'queued', 0)",
+                                 (task_id,))
+
+                if mode == "legacy":
+                    read = lambda i: legacy_get_task_by_id(ids[i % len(ids)])
+                    write = lambda i: legacy_update_task_status(ids[i % len(ids)], "downloading")
+                else:
+                    read = lambda i: db.get_task_by_id(ids[i % len(ids)])
+                    write = lambda i: db.update_task_status(ids[i % len(ids)], "downloading")
+
+                results[mode] = {
+                    "get_task_by_id": _time_calls(read, args.calls),
+                    "update_task_status": _time_calls(write, args.calls),
+                    "get_task_by_id_during_writes": _read_under_write(read, write, args.calls),
+                }
+            db.close_db_conn()
+
+    print(f"{'operation':32} {'legacy mean/p99 (us)':>24} {'pooled mean/p99 (us)':>24}")
+    for op in results["legacy"]:
+        legacy, pooled = results["legacy"][op], results["pooled"][op]
+        print(f"{op:32} {legacy['mean_us']:>12} / {legacy['p99_us']:<9} {pooled['mean_us']:>12} / {pooled['p99_us']:<9}")
+
+
+if __name__ == "__main__":
+    main()
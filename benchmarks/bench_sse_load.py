@@ -0,0 +1,195 @@
+# benchmarks/bench_sse_load.py
+# (V30) 负载测试: 打开几百个 SSE 连接的同时, 测量其他 API 请求的响应时间
+#
+# 同步的 SSE 生成器每个连接会占用 Starlette 线程池 (默认 40 个线程) 中的一个线程,
+# 连接数超过线程池大小后, 其他普通的 def 路由就只能排队。
+# 这个测试打开 --streams 个连接到同一个 (持续运行的直播录制) 任务并持续向它发布日志, 然后顺序请求
+# /api/v1/status/{id} 和 /api/v1/tasks/summary, 统计延迟; 同时检查所有连接都在收到日志。
+#
+# 用法 (在项目根目录):
+#   python -m benchmarks.bench_sse_load [--streams 300] [--requests 200] [--max-p99-ms 250]
+#
+# 有请求超时 / 失败, 有连接没收到日志, 或 p99 超过 --max-p99-ms 时退出码为 1。
+
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+from urllib.parse import urlencode
+
+from benchmarks.bench_e2e import _start_api_server
+from benchmarks.hls_origin import serve_in_process
+
+
+async def _request(port: int, path: str, timeout: float) -> float:
+    """发送一个 GET 请求 (新连接), 返回读完响应所用的秒数"""
+    start = time.perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        data = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    status = data.split(b" ", 2)[1] if data.startswith(b"HTTP/") else b"?"
+    if status != b"200":
+        raise RuntimeError(f"GET {path} -> {status.decode(errors='replace')}")
+    return time.perf_counter() - start
+
+
+class _Stream:
+    """一个 SSE 连接: 统计收到的 data 行"""
+
+    def __init__(self):
+        self.lines = 0
+        self.first_line = asyncio.Event()
+        self.error = None
+
+    async def run(self, port: int, task_id: str, stop: asyncio.Event):
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError as e:
+            self.error = e
+            self.first_line.set()
+            return
+        try:
+            writer.write(f"GET /api/v1/stream-progress/{task_id} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+            await writer.drain()
+            while not stop.is_set():
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.startswith(b"data: "):
+                    self.lines += 1
+                    self.first_line.set()
+        except (OSError, asyncio.CancelledError) as e:
+            self.error = self.error or (e if isinstance(e, OSError) else None)
+        finally:
+            writer.close()
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def _publish_loop(publish: Callable[[str], None], stop: asyncio.Event, interval: float = 0.05):
+    """模拟下载日志: 持续向任务的广播发布行 (所有 SSE 连接都会收到)"""
+    i = 0
+    while not stop.is_set():
+        publish(f"[bench-sse-load] {i}")
+        i += 1
+        await asyncio.sleep(interval)
+
+
+async def run_load(port: int, task_id: str, publish: Callable[[str], None], streams: int, requests: int,
+                   timeout: float, publish_interval: float) -> Dict[str, Any]:
+    stop = asyncio.Event()
+    publisher = asyncio.ensure_future(_publish_loop(publish, stop, publish_interval) if publish_interval > 0
+                                      else stop.wait())
+    clients = [_Stream() for _ in range(streams)]
+    tasks = [asyncio.ensure_future(client.run(port, task_id, stop)) for client in clients]
+    opened = time.perf_counter()
+    # 每个连接都先收到重放的日志, 说明服务端已经在为它服务
+    await asyncio.wait_for(asyncio.gather(*(c.first_line.wait() for c in clients)), timeout)
+    connect_s = time.perf_counter() - opened
+
+    latencies, failures = [], []
+    paths = [f"/api/v1/status/{task_id}", "/api/v1/tasks/summary?limit=50"]
+    for i in range(requests):
+        try:
+            latencies.append(await _request(port, paths[i % len(paths)], timeout))
+        except Exception as e:
+            failures.append(f"{type(e).__name__}: {e}")
+    lines_before = sum(c.lines for c in clients)
+    await asyncio.sleep(2)
+    receiving = sum(1 for c in clients if c.lines and not c.error)
+    lines_after = sum(c.lines for c in clients)
+
+    stop.set()
+    await publisher
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {
+        "streams": streams,
+        "streams_receiving": receiving,
+        "stream_errors": sum(1 for c in clients if c.error),
+        "connect_all_s": round(connect_s, 3),
+        "delivered_lines_per_s": round((lines_after - lines_before) / 2, 1),
+        "requests": requests,
+        "failed_requests": len(failures),
+        "failures": failures[:5],
+        "p50_ms": round(_percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API responsiveness with many concurrent SSE streams")
+    parser.add_argument("--streams", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=10, help="单个请求 / 建立所有连接的超时秒数")
+    parser.add_argument("--max-p99-ms", type=float, default=250)
+    parser.add_argument("--publish-interval", type=float, default=0.05,
+                        help="向任务发布日志行的间隔秒数 (0 = 不发布, 连接大部分时间在等待)")
+    parser.add_argument("--verbose", action="store_true", help="显示服务的日志输出")
+    args = parser.parse_args()
+
+    ready, stop = multiprocessing.Queue(), multiprocessing.Event()
+    origin = multiprocessing.Process(target=serve_in_process, args=(ready, stop), daemon=True)
+    origin.start()
+    origin_url = ready.get(timeout=30)
+
+    workdir = tempfile.TemporaryDirectory(prefix="bench-sse-")
+    os.environ["DOWNLOAD_ROOT"] = str(Path(workdir.name) / "downloads")
+    os.environ["SEGMENT_CACHE_MAX_BYTES"] = "0"
+    os.environ.setdefault("TASK_PROFILE", "off")
+
+    import app.repository.repo_tasks as db
+    db.DATABASE_FILE = Path(workdir.name) / "bench.db"
+    from app.main import app
+    from app.services.service_downloads import downloader_service as service
+
+    log_sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    try:
+        with log_sink:
+            server, thread, port = _start_api_server(app)
+            try:
+                # 一个足够长的直播: 整个测试期间任务都在运行, 并持续产生日志
+                params = {"stream": "sse-load", "window": 4, "total": 100000, "duration": 0.25, "size": 4096}
+                task_id = service.start_new_download(f"{origin_url}/live.m3u8?{urlencode(params)}", None, None,
+                                                     force=True)
+                while db.get_task_by_id(task_id)["status"] != "downloading":
+                    time.sleep(0.05)
+                publish = lambda line: service._publish(task_id, line)
+                result = asyncio.run(run_load(port, task_id, publish, args.streams, args.requests, args.timeout,
+                                                 args.publish_interval))
+                service.cancel_running_task(task_id)
+            finally:
+                server.should_exit = True
+                thread.join(timeout=30)
+    finally:
+        stop.set()
+        origin.join(timeout=10)
+        workdir.cleanup()
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    print(f"\n{result['streams_receiving']}/{result['streams']} streams receiving; "
+          f"{result['requests'] - result['failed_requests']}/{result['requests']} requests ok, "
+          f"p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms", file=sys.stderr)
+    failed = (result["failed_requests"] or result["streams_receiving"] < result["streams"] or
+              result["p99_ms"] is None or result["p99_ms"] > args.max_p99_ms)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
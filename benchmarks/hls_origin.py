@@ -0,0 +1,208 @@
+# benchmarks/hls_origin.py
+# (V26) 本地合成 HLS 源: 按查询参数即时生成播放列表和片段, 供基准测试使用
+#
+# 所有配置都在 URL 里, 同一个源可以同时服务不同的场景:
+#   /vod.m3u8?segments=40&size=262144&duration=4     点播 (有 #EXT-X-ENDLIST)
+#   /master.m3u8?variants=3&...                      多码率主播放列表, 每个码率指向 vod.m3u8
+#   /live.m3u8?stream=a&window=6&total=30&duration=1 直播: 按时间滑动窗口, 生成 total 个片段后结束
+#   ...&key=1                                        AES-128 加密 (密钥 /key.bin, IV 为片段序号)
+#   ...&latency=0.02&jitter=0.01&loss=0.05           每个片段请求的延迟 (秒) / 随机抖动 / 返回 503 的概率
+#
+# 单独运行 (在项目根目录):
+#   python -m benchmarks.hls_origin [--port 8089]
+
+import argparse
+import functools
+import hashlib
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from Cryptodome.Cipher import AES
+from Cryptodome.Util.Padding import pad
+
+TS_PACKET = 188
+# 片段 URL 需要透传的参数 (其余参数只影响播放列表本身)
+SEGMENT_PARAMS = ("size", "seed", "key", "latency", "jitter", "loss")
+
+
+def segment_key(seed: int) -> bytes:
+    return hashlib.sha256(f"bench-key-{seed}".encode()).digest()[:16]
+
+
+@functools.lru_cache(maxsize=1024)
+def segment_bytes(seed: int, index: int, size: int, encrypted: bool) -> bytes:
+    """
+    确定性的片段内容: 以 0x47 同步字节开头的 188 字节 TS 包, 负载由 (seed, index) 决定,
+    这样同一个 URL 每次返回相同的数据 (下载结果可以校验), 不同片段的数据又互不相同。
+    """
+    payload = bytes([(seed * 131 + index * 7 + i) & 0xFF for i in range(TS_PACKET - 4)])
+    packet = b"\x47\x40" + (index & 0xFFFF).to_bytes(2, "big") + payload
+    data = (packet * (size // TS_PACKET + 1))[:size]
+    if encrypted:
+        data = AES.new(segment_key(seed), AES.MODE_CBC, index.to_bytes(16, "big")).encrypt(pad(data, 16))
+    return data
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "SyntheticOrigin"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        params: Dict[str, str] = dict(parse_qsl(parts.query))
+        route = parts.path.rstrip("/").rsplit("/", 1)[-1]
+        self.server.count("requests")
+        try:
+            if route == "vod.m3u8":
+                body, content_type = self.server.vod_playlist(params), "application/vnd.apple.mpegurl"
+            elif route == "master.m3u8":
+                body, content_type = self.server.master_playlist(params), "application/vnd.apple.mpegurl"
+            elif route == "live.m3u8":
+                body, content_type = self.server.live_playlist(params), "application/vnd.apple.mpegurl"
+            elif route == "key.bin":
+                body, content_type = segment_key(int(params.get("seed", 0))), "application/octet-stream"
+            elif route.endswith(".ts"):
+                body = self.server.segment(int(route[:-3]), params)
+                if body is None:
+                    self.server.count("injected_errors")
+                    self._reply(503, b"injected failure", "text/plain")
+                    return
+                content_type = "video/mp2t"
+            else:
+                self._reply(404, b"not found", "text/plain")
+                return
+        except (KeyError, ValueError) as e:
+            self._reply(400, str(e).encode(), "text/plain")
+            return
+        self._reply(200, body.encode() if isinstance(body, str) else body, content_type)
+
+    def _reply(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class SyntheticOrigin(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self._lock = threading.Lock()
+        self._live_started: Dict[str, float] = {}
+        self.stats: Dict[str, int] = {"requests": 0, "injected_errors": 0, "segment_bytes": 0}
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += amount
+
+    # --- 播放列表 ---
+    @staticmethod
+    def _segment_query(params: Dict[str, str]) -> str:
+        return urlencode({k: params[k] for k in SEGMENT_PARAMS if k in params})
+
+    def _media_lines(self, params: Dict[str, str], first: int, last: int, endlist: bool) -> str:
+        duration = float(params.get("duration", 4))
+        seed = int(params.get("seed", 0))
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3",
+                 f"#EXT-X-TARGETDURATION:{int(duration + 0.999)}",
+                 f"#EXT-X-MEDIA-SEQUENCE:{first}"]
+        if params.get("key") == "1":
+            lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="key.bin?seed={seed}"')
+        query = self._segment_query(params)
+        for index in range(first, last + 1):
+            lines += [f"#EXTINF:{duration:.3f},", f"{index}.ts?{query}"]
+        if endlist:
+            lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def vod_playlist(self, params: Dict[str, str]) -> str:
+        return self._media_lines(params, 0, int(params.get("segments", 40)) - 1, endlist=True)
+
+    def master_playlist(self, params: Dict[str, str]) -> str:
+        variants = int(params.get("variants", 3))
+        size = int(params.get("size", 262144))
+        lines = ["#EXTM3U"]
+        for v in range(variants):
+            # 码率从低到高; 最高码率的片段大小等于 size
+            variant = dict(params, size=str(size * (v + 1) // variants), seed=str(v))
+            variant.pop("variants", None)
+            bandwidth = int(variant["size"]) * 8 // int(float(params.get("duration", 4)) or 1)
+            lines += [f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={320 * (v + 1)}x{180 * (v + 1)}",
+                      f"vod.m3u8?{urlencode(variant)}"]
+        return "\n".join(lines) + "\n"
+
+    def live_playlist(self, params: Dict[str, str]) -> str:
+        """
+        第一次请求某个 stream 时开始计时, 每 duration 秒产生一个新片段;
+        窗口里只保留最近 window 个片段, 产生 total 个片段后加上 #EXT-X-ENDLIST。
+        """
+        stream = params.get("stream", "default")
+        duration = float(params.get("duration", 1))
+        window = int(params.get("window", 6))
+        total = int(params.get("total", 30))
+        with self._lock:
+            started = self._live_started.setdefault(stream, time.monotonic())
+        newest = min(total - 1, int((time.monotonic() - started) / duration))
+        return self._media_lines(params, max(0, newest - window + 1), newest, endlist=newest >= total - 1)
+
+    # --- 片段 ---
+    def segment(self, index: int, params: Dict[str, str]) -> Optional[bytes]:
+        latency = float(params.get("latency", 0)) + random.uniform(0, float(params.get("jitter", 0)))
+        if latency > 0:
+            time.sleep(latency)
+        if random.random() < float(params.get("loss", 0)):
+            return None
+        data = segment_bytes(int(params.get("seed", 0)), index, int(params.get("size", 262144)),
+                             params.get("key") == "1")
+        self.count("segment_bytes", len(data))
+        return data
+
+    # --- 生命周期 ---
+    def start(self) -> "SyntheticOrigin":
+        self._thread = threading.Thread(target=self.serve_forever, name="hls-origin", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def serve_in_process(ready, stop, host: str = "127.0.0.1"):
+    """multiprocessing 入口: 在独立进程中运行源, 不占用被测进程的 CPU / 内存"""
+    origin = SyntheticOrigin(host).start()
+    ready.put(origin.base_url)
+    stop.wait()
+    origin.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic HLS origin")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    args = parser.parse_args()
+    origin = SyntheticOrigin(args.host, args.port)
+    print(f"Serving synthetic HLS on {origin.base_url} (try {origin.base_url}/master.m3u8)")
+    try:
+        origin.serve_forever()
+    except KeyboardInterrupt:
+        origin.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# tests/conftest.py
+# 测试共用的环境: 在 import app 之前把下载目录 / 数据库指向临时目录, 并关闭会访问网络或外部程序的功能
+
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+
+_TEST_ROOT = Path(tempfile.mkdtemp(prefix="m3u8-downloader-tests-"))
+os.environ.setdefault("DOWNLOAD_ROOT", str(_TEST_ROOT / "downloads"))
+os.environ.setdefault("SEGMENT_CACHE_MAX_BYTES", "0")
+os.environ.setdefault("EXTRACTOR_WORKERS", "0")
+os.environ.setdefault("TASK_PROFILE", "off")
+
+import app.repository.repo_tasks as db  # noqa: E402
+
+# 整个测试会话共用一个数据库: 各线程的连接 (包括写回缓冲的后台线程) 都连到这里
+db.DATABASE_FILE = _TEST_ROOT / "test.db"
+db.init_db()
+
+
+@pytest.fixture
+def tmp_download_dir(tmp_path: Path) -> Path:
+    directory = tmp_path / "downloads"
+    directory.mkdir()
+    return directory
+
+
+@pytest.fixture
+def origin():
+    """本地的合成 HLS 源站 (benchmarks/hls_origin.py)"""
+    from benchmarks.hls_origin import SyntheticOrigin
+    server = SyntheticOrigin().start()
+    try:
+        yield server
+    finally:
+        server.stop()
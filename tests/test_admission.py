@@ -0,0 +1,123 @@
+# tests/test_admission.py
+# (V21) 磁盘空间感知的准入控制: 按挂载点预留空间, 调度器的准入钩子
+
+import threading
+import time
+from collections import namedtuple
+
+import pytest
+
+from app.services import service_scheduler
+from app.services.disk_space import DiskSpaceMonitor
+from app.services.service_scheduler import DownloadScheduler
+
+Usage = namedtuple("Usage", "total used free percent")
+MB = 1024 ** 2
+
+
+@pytest.fixture
+def monitor(tmp_path):
+    """tmp_path 所在挂载点有 1000 MB 空闲, 安全余量 100 MB"""
+    disk = DiskSpaceMonitor(ttl=60, margin_bytes=100 * MB)
+    disk.free = 1000 * MB
+    disk.disk_usage = lambda mount: Usage(0, 0, disk.free, 0.0)
+    return disk
+
+
+def test_reservations_share_the_free_space(monitor, tmp_path):
+    path = str(tmp_path)
+    assert monitor.reserve("a", path, 500 * MB)
+    # 900 MB 可用, a 预留了 500 MB
+    assert not monitor.reserve("b", path, 500 * MB)
+    assert monitor.reserve("b", path, 400 * MB)
+    assert monitor.snapshot() == {monitor.mount_of(path): 900 * MB}
+    # 重复预留不会再扣一次
+    assert monitor.reserve("a", path, 500 * MB)
+    monitor.release("a")
+    assert monitor.reserve("c", path, 500 * MB)
+
+
+def test_written_bytes_are_no_longer_reserved(monitor, tmp_path):
+    path = str(tmp_path)
+    assert monitor.reserve("a", path, 800 * MB)
+    assert not monitor.reserve("b", path, 200 * MB)
+    # a 已经写了 300 MB: 它们已经反映在实际空闲空间中
+    monitor.free -= 300 * MB
+    monitor.note_written("a", 300 * MB)
+    assert monitor.snapshot()[monitor.mount_of(path)] == 500 * MB
+    assert not monitor.reserve("b", path, 200 * MB)
+    monitor.note_written("a", 800 * MB)
+    assert monitor.reserve("b", path, 200 * MB)
+
+
+def test_can_ever_fit_ignores_other_reservations(monitor, tmp_path):
+    path = str(tmp_path)
+    assert monitor.reserve("a", path, 800 * MB)
+    assert monitor.can_ever_fit(path, 900 * MB)
+    assert not monitor.can_ever_fit(path, 901 * MB)
+
+
+def test_mount_of_missing_path_uses_existing_parent(monitor, tmp_path):
+    assert monitor.mount_of(str(tmp_path / "not" / "created")) == monitor.mount_of(str(tmp_path))
+
+
+def test_usage_is_cached_for_ttl(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_usage(mount):
+        calls.append(mount)
+        return Usage(0, 0, 1, 0.0)
+
+    monkeypatch.setattr("app.services.disk_space.psutil.disk_usage", fake_usage)
+    disk = DiskSpaceMonitor(ttl=60)
+    disk.disk_usage("/")
+    disk.disk_usage("/")
+    assert calls == ["/"]
+    expired = DiskSpaceMonitor(ttl=0)
+    expired.disk_usage("/")
+    expired.disk_usage("/")
+    assert len(calls) == 3
+
+
+def test_scheduler_skips_blocked_task_and_retries(monkeypatch):
+    monkeypatch.setattr(service_scheduler, "ADMISSION_RETRY_SECONDS", 0.05)
+    admitted = {"small"}
+    started = []
+    done = threading.Event()
+
+    def runner(task_id):
+        started.append(task_id)
+        if len(started) == 2:
+            done.set()
+
+    scheduler = DownloadScheduler(runner, max_concurrent=2, admission=lambda task_id: task_id in admitted)
+    scheduler.submit("big", "https://a.example/1", priority=5)
+    scheduler.submit("small", "https://b.example/1", priority=0)
+    scheduler.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not started and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # 优先级更高的任务放不下时, 后面放得下的任务先开始, 被挡住的任务继续排队
+        assert started == ["small"]
+        assert scheduler.is_queued("big")
+        admitted.add("big")
+        assert done.wait(5)
+        assert started == ["small", "big"]
+    finally:
+        scheduler.stop()
+
+
+def test_failing_admission_hook_lets_task_through():
+    started = threading.Event()
+
+    def broken(task_id):
+        raise RuntimeError("psutil failed")
+
+    scheduler = DownloadScheduler(lambda task_id: started.set(), admission=broken)
+    scheduler.submit("t", "https://a.example/1")
+    scheduler.start()
+    try:
+        assert started.wait(5)
+    finally:
+        scheduler.stop()
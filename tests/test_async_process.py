@@ -0,0 +1,161 @@
+# tests/test_async_process.py
+# (V30) 事件循环中的子进程 (逐行读取输出, 任意线程 terminate) 和异步 SSE 生成器
+
+import asyncio
+import sys
+import threading
+import time
+import uuid
+
+import pytest
+
+import app.repository.repo_tasks as db
+from app.services import service_downloads
+from app.services.async_process import AsyncProcess
+from app.services.log_broadcaster import TaskBroadcaster
+from app.services.service_downloads import downloader_service
+
+# 输出 ready 之后一直等待, 直到被 terminate
+SLEEPER = [sys.executable, "-c", "import sys, time; print('ready', flush=True); time.sleep(60)"]
+
+
+@pytest.fixture
+def engine_loop():
+    """后台线程中的事件循环, 与 HLS 引擎的循环相同"""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    loop.close()
+
+
+@pytest.fixture
+def submit(engine_loop):
+    return lambda coro: asyncio.run_coroutine_threadsafe(coro, engine_loop)
+
+
+def test_streams_lines_and_returns_exit_code(submit):
+    lines = []
+    command = [sys.executable, "-c",
+               "import sys; sys.stdout.write('a\\r\\nb\\rc\\n' + 'x' * 70000 + '\\nlast'); sys.exit(3)"]
+    process = AsyncProcess(submit, command, lines.append).start()
+    assert process.pid > 0
+    assert process.wait(timeout=30) == 3 and process.returncode == 3
+    assert lines == ["a", "b", "c", "x" * 70000, "last"]
+    process.terminate()                                  # 已经退出: 什么也不做
+
+
+def _ready(event):
+    def on_line(line):
+        if line == "ready":
+            event.set()
+    return on_line
+
+
+def test_terminate_from_another_thread(submit):
+    ready = threading.Event()
+    process = AsyncProcess(submit, SLEEPER, _ready(ready)).start()
+    assert ready.wait(30)
+    assert process.returncode is None
+    process.terminate()
+    assert process.wait(timeout=10) != 0
+
+
+def test_terminate_from_on_line_does_not_deadlock(submit):
+    # on_line 在事件循环的线程中调用: 取消任务的代码可能在这里 terminate
+    holder = {}
+    called_on = []
+
+    def on_line(line):
+        if line == "ready":
+            called_on.append(threading.current_thread())
+            holder["process"].terminate()
+
+    holder["process"] = process = AsyncProcess(submit, SLEEPER, on_line).start()
+    assert process.wait(timeout=10) != 0
+    assert called_on and called_on[0] is not threading.current_thread()
+
+
+def test_terminate_from_another_event_loop(submit):
+    ready = threading.Event()
+    process = AsyncProcess(submit, SLEEPER, _ready(ready)).start()
+    assert ready.wait(30)
+
+    async def cancel_from_api():
+        started = time.monotonic()
+        process.terminate()
+        return time.monotonic() - started
+
+    # 不阻塞调用方的事件循环, 信号由进程所在的循环发出
+    assert asyncio.run(cancel_from_api()) < 1
+    assert process.wait(timeout=10) != 0
+
+
+# --- SSE ---
+async def _collect(generator, count=None):
+    events = []
+    async for event in generator:
+        events.append(event)
+        if count and len(events) == count:
+            await generator.aclose()
+            break
+    return events
+
+
+def test_sse_replays_then_streams_until_closed(monkeypatch):
+    task_id = f"test-{uuid.uuid4()}"
+    broadcaster = TaskBroadcaster(replay_lines=10)
+    monkeypatch.setitem(downloader_service.live_tasks, task_id, {"broadcaster": broadcaster})
+    broadcaster.publish("[download] old")
+
+    async def run():
+        stream = downloader_service.get_download_stream(task_id)
+        threading.Timer(0.05, broadcaster.publish, args=("[download] new",)).start()
+        threading.Timer(0.1, broadcaster.close).start()
+        return await asyncio.wait_for(_collect(stream), 5)
+
+    assert asyncio.run(run()) == ["data: [download] old\n\n", "data: [download] new\n\n", "data: [STREAM_END]\n\n"]
+    assert broadcaster.subscriber_count == 0
+
+
+def test_sse_keep_alive_and_disconnect_unsubscribes(monkeypatch):
+    task_id = f"test-{uuid.uuid4()}"
+    broadcaster = TaskBroadcaster()
+    monkeypatch.setitem(downloader_service.live_tasks, task_id, {"broadcaster": broadcaster})
+    monkeypatch.setattr(service_downloads, "SSE_KEEPALIVE_SECONDS", 0.01)
+
+    async def run():
+        stream = downloader_service.get_download_stream(task_id)
+        events = await asyncio.wait_for(_collect(stream, count=2), 5)
+        return events
+
+    assert asyncio.run(run()) == [": keep-alive\n\n"] * 2
+    # 客户端断开 (生成器被关闭) 之后不再是订阅者
+    assert broadcaster.subscriber_count == 0
+
+
+def test_sse_unknown_task():
+    events = asyncio.run(_collect(downloader_service.get_download_stream(f"missing-{uuid.uuid4()}")))
+    assert events[-1] == "data: [STREAM_END]\n\n" and "[ERROR]" in events[0]
+
+
+def test_sse_task_owned_by_another_worker_polls_progress(monkeypatch):
+    monkeypatch.setattr(service_downloads, "REMOTE_PROGRESS_POLL_SECONDS", 0.01)
+    task_id = f"test-{uuid.uuid4()}"
+    db.create_task({"id": task_id, "url": f"https://example.com/{task_id}.m3u8", "path": "/tmp/tests/sse",
+                    "status": "downloading", "startTime": time.time(), "lease_owner": "other-worker",
+                    "lease_expires": time.time() + 60})
+
+    async def run():
+        stream = downloader_service.get_download_stream(task_id)
+        events = [await stream.__anext__(), await stream.__anext__()]
+        await asyncio.get_running_loop().run_in_executor(
+            None, lambda: downloader_service._update_status(task_id, status="error", error_msg="boom"))
+        return events + await asyncio.wait_for(_collect(stream), 5)
+
+    events = asyncio.run(run())
+    assert "other-worker" in events[0]
+    assert events[1] == "data: [downloading] 0.0%\n\n"
+    assert events[-2:] == ["data: [error] 0.0% boom\n\n", "data: [STREAM_END]\n\n"]
@@ -0,0 +1,219 @@
+# tests/test_bandwidth.py
+# (V23) 带宽限制: 令牌桶, 全局预算在原生引擎和 yt-dlp 之间的分配
+
+import asyncio
+
+import pytest
+
+from app.services import bandwidth
+from app.services.bandwidth import BandwidthGovernor, TokenBucket
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(bandwidth.time, "monotonic", clock)
+    monkeypatch.setattr(bandwidth, "BANDWIDTH_BURST_SECONDS", 0.5)
+    return clock
+
+
+def test_unlimited_bucket_never_waits(clock):
+    bucket = TokenBucket(0)
+    assert bucket.reserve(10 ** 9) == 0.0
+
+
+def test_bucket_starts_empty_and_overdraws(clock):
+    bucket = TokenBucket(1000)
+    # 没有积攒的令牌: 500 字节要等 0.5 秒, 再来 500 字节累计等 1 秒
+    assert bucket.reserve(500) == pytest.approx(0.5)
+    assert bucket.reserve(500) == pytest.approx(1.0)
+    clock.now += 1.0
+    assert bucket.reserve(0) == 0.0
+
+
+def test_bucket_refills_up_to_burst(clock):
+    bucket = TokenBucket(1000)
+    clock.now += 60
+    # 最多积攒 0.5 秒 (500 字节) 的突发
+    assert bucket.reserve(500) == 0.0
+    assert bucket.reserve(100) == pytest.approx(0.1)
+
+
+def test_lowering_rate_caps_saved_tokens(clock):
+    bucket = TokenBucket(10000)
+    clock.now += 60
+    bucket.set_rate(1000)
+    assert bucket.reserve(500) == 0.0
+    assert bucket.reserve(1000) == pytest.approx(1.0)
+    bucket.set_rate(None)
+    assert bucket.rate == 0 and bucket.reserve(10 ** 6) == 0.0
+
+
+def test_long_run_rate_matches_limit(clock):
+    bucket = TokenBucket(2000)
+    waited = 0.0
+    for _ in range(100):
+        delay = bucket.reserve(200)
+        clock.now += delay
+        waited += delay
+    # 20000 字节 @ 2000 B/s: 约 10 秒 (减去初始为空的桶 -> 正好 10 秒)
+    assert waited == pytest.approx(10.0)
+
+
+def test_governor_splits_global_limit_with_ytdlp(clock):
+    governor = BandwidthGovernor(global_limit=1000)
+    governor.task_started("native")
+    governor.task_started("ytdlp")
+    assert governor.ytdlp_rate("ytdlp") == 500
+    snapshot = governor.snapshot()
+    assert snapshot["native_rate"] == 500
+    assert snapshot["ytdlp_rates"] == {"ytdlp": 500}
+    governor.task_finished("ytdlp")
+    assert governor.snapshot()["native_rate"] == 1000
+
+
+def test_governor_task_limit_and_runtime_changes(clock):
+    governor = BandwidthGovernor(global_limit=0)
+    governor.task_started("capped", limit=100)
+    assert governor.ytdlp_rate("capped") == 100
+    governor.task_started("free")
+    assert governor.ytdlp_rate("free") is None
+    governor.set_task_limit("free", 300)
+    governor.set_global_limit(200)
+    assert governor.snapshot()["task_limits"] == {"capped": 100, "free": 300}
+    # 单任务上限和全局份额取较小的一个
+    assert governor.ytdlp_rate("free") == 100
+    governor.set_task_limit("missing", 5)
+    assert "missing" not in governor.snapshot()["task_limits"]
+
+
+def test_throttle_sleeps_for_the_slower_bucket(clock, monkeypatch):
+    slept = []
+
+    async def fake_sleep(delay):
+        slept.append(delay)
+
+    monkeypatch.setattr(bandwidth.asyncio, "sleep", fake_sleep)
+    governor = BandwidthGovernor(global_limit=1000)
+    governor.task_started("t", limit=100)
+    asyncio.run(governor.throttle("t", 50))
+    asyncio.run(governor.throttle("other", 50))
+    assert slept == [pytest.approx(0.5), pytest.approx(0.1)]
+
+
+def _committed(governor) -> int:
+    snapshot = governor.snapshot()
+    return sum(snapshot["ytdlp_rates"].values()) + snapshot["native_rate"]
+
+
+def test_shares_are_recomputed_and_never_overcommit(clock):
+    restarts = []
+    governor = BandwidthGovernor(global_limit=10_000_000,
+                                 on_ytdlp_rate_change=lambda task_id, rate: restarts.append((task_id, rate)))
+    governor.task_started("a")
+    assert governor.ytdlp_rate("a") == 10_000_000
+    governor.task_started("b")
+    # a 的份额变小: 必须以新的 --limit-rate 重启, b 启动时直接拿到它的份额
+    assert restarts == [("a", 5_000_000)]
+    assert governor.ytdlp_rate("b") == 5_000_000
+    governor.task_started("c")       # 原生引擎的任务
+    assert sorted(restarts[1:]) == [("a", 3_333_333), ("b", 3_333_333)]
+    assert governor.snapshot()["native_rate"] == 3_333_334
+    assert _committed(governor) == 10_000_000
+
+    governor.task_finished("c")
+    # 变大不到 YTDLP_RATE_RESTART_RATIO: 不重启, 多出来的给原生引擎 (这时没有原生任务)
+    assert governor.snapshot()["ytdlp_rates"] == {"a": 5_000_000, "b": 5_000_000}
+    governor.task_finished("b")
+    assert restarts[-1] == ("a", 10_000_000)
+    assert _committed(governor) == 10_000_000
+
+
+def test_runtime_limit_changes_reach_running_ytdlp(clock):
+    restarts = []
+    governor = BandwidthGovernor(global_limit=0,
+                                 on_ytdlp_rate_change=lambda task_id, rate: restarts.append((task_id, rate)))
+    governor.task_started("y")
+    assert governor.ytdlp_rate("y") is None
+    governor.task_started("n")
+    # 不限速 -> 限速: 重启
+    governor.set_global_limit(1000)
+    assert restarts == [("y", 500)]
+    assert _committed(governor) <= 1000
+    governor.set_task_limit("y", 100)
+    assert restarts[-1] == ("y", 100)
+    # y 用不完的份额给了原生引擎
+    assert governor.snapshot()["native_rate"] == 900
+    governor.set_task_limit("y", None)
+    assert restarts[-1] == ("y", 500)
+    governor.set_global_limit(0)
+    assert restarts[-1] == ("y", 0) and governor.snapshot()["native_rate"] == 0
+
+
+@pytest.mark.parametrize("steps", [
+    [("start", "a", None), ("ytdlp", "a"), ("start", "b", 300), ("ytdlp", "b"), ("start", "c", None),
+     ("global", 2000), ("finish", "a"), ("ytdlp", "c"), ("global", 700), ("limit", "c", 50), ("finish", "b")],
+    [("start", "a", 100), ("start", "b", None), ("ytdlp", "b"), ("start", "c", None), ("ytdlp", "c"),
+     ("start", "d", None), ("finish", "a"), ("global", 333), ("finish", "d"), ("limit", "b", 10)],
+])
+def test_budget_invariant(clock, steps):
+    governor = BandwidthGovernor(global_limit=1000)
+    for step in steps:
+        action, *args = step
+        if action == "start":
+            governor.task_started(*args)
+        elif action == "finish":
+            governor.task_finished(*args)
+        elif action == "ytdlp":
+            governor.ytdlp_rate(*args)
+        elif action == "global":
+            governor.set_global_limit(*args)
+        else:
+            governor.set_task_limit(*args)
+        snapshot = governor.snapshot()
+        assert _committed(governor) <= snapshot["global_limit"], step
+        for task_id, rate in snapshot["ytdlp_rates"].items():
+            assert rate > 0
+            limit = snapshot["task_limits"].get(task_id)
+            assert not limit or rate <= limit, step
+
+
+def test_failing_restart_callback_does_not_break_accounting(clock):
+    def explode(task_id, rate):
+        raise RuntimeError("process gone")
+
+    governor = BandwidthGovernor(global_limit=1000, on_ytdlp_rate_change=explode)
+    governor.task_started("a")
+    governor.ytdlp_rate("a")
+    governor.task_started("b")
+    assert governor.snapshot()["ytdlp_rates"] == {"a": 500}
+
+
+def test_service_restarts_ytdlp_with_new_share():
+    from app.services.service_downloads import DownloaderService
+
+    class _Process:
+        returncode = None
+        terminated = 0
+
+        def terminate(self):
+            self.terminated += 1
+
+    process = _Process()
+    service = DownloaderService.__new__(DownloaderService)
+    service.live_tasks = {"t": {"process": process}}
+    service._restart_ytdlp("t", 500)
+    assert process.terminated == 1 and service.live_tasks["t"]["rate_restart"]
+    # 进程已经退出 / 任务不在本进程中: 只留下标记
+    process.returncode = 0
+    service._restart_ytdlp("t", 500)
+    service._restart_ytdlp("missing", 500)
+    assert process.terminated == 1
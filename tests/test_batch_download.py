@@ -0,0 +1,188 @@
+# tests/test_batch_download.py
+# (V28) 批量提交: 一个事务建任务, 批次内去重, 播放列表展开 (extractor 换成桩)
+
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+
+import app.repository.repo_tasks as db
+from app.api.v1.router_downloads import router
+from app.schemas.schema_downloads import BatchDownloadRequest
+from app.services import playlist_expander, service_downloads
+from app.services.extractor_pool import ExtractionError
+from app.services.playlist_expander import PlaylistExpansionError, entry_urls, expand_playlist
+from app.services.service_downloads import downloader_service
+
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    """不真正启动下载: 记录提交给调度器的任务"""
+    calls = []
+    monkeypatch.setattr(downloader_service, "_enqueue",
+                        lambda task_id, url, priority, start_time: calls.append((task_id, url, priority)))
+    return calls
+
+
+@pytest.fixture
+def playlist(monkeypatch):
+    """service_downloads 中的 expand_playlist 换成桩: 记录 (url, limit), 返回 limit 个条目"""
+    calls = []
+
+    def fake_expand(url, limit):
+        calls.append((url, limit))
+        return [f"{url}/entry-{i}" for i in range(min(limit, 3))]
+
+    monkeypatch.setattr(service_downloads, "expand_playlist", fake_expand)
+    return calls
+
+
+def _url(name: str) -> str:
+    return f"https://example.com/{uuid.uuid4()}/{name}.m3u8"
+
+
+def test_batch_creates_one_task_per_url(tmp_download_dir, enqueued):
+    urls = [_url("a"), _url("b"), _url("c")]
+    task_ids = downloader_service.start_batch_download(urls, str(tmp_download_dir), priority=5, rate_limit=1000)
+    assert len(set(task_ids)) == 3
+    assert [call[:2] for call in enqueued] == list(zip(task_ids, urls))
+    tasks = [db.get_task_by_id(task_id) for task_id in task_ids]
+    assert [task["url"] for task in tasks] == urls
+    assert all(task["status"] == "queued" and task["priority"] == 5 and task["rate_limit"] == 1000
+               for task in tasks)
+    # 提交顺序保存在 startTime 中
+    assert [task["startTime"] for task in tasks] == sorted(task["startTime"] for task in tasks)
+
+
+def test_batch_dedups_within_the_batch(tmp_download_dir, enqueued):
+    url = _url("same")
+    urls = [url, url.replace("https://example.com", "https://EXAMPLE.com:443") + "?utm_source=x#t=1", _url("other")]
+    task_ids = downloader_service.start_batch_download(urls, str(tmp_download_dir))
+    assert task_ids[0] == task_ids[1] != task_ids[2]
+    assert len(enqueued) == 2
+
+
+def test_batch_attaches_to_active_tasks_unless_forced(tmp_download_dir, enqueued):
+    urls = [_url("a"), _url("b")]
+    first = downloader_service.start_batch_download(urls, str(tmp_download_dir))
+    assert downloader_service.start_batch_download(urls, str(tmp_download_dir)) == first
+    assert len(enqueued) == 2
+    forced = downloader_service.start_batch_download(urls, str(tmp_download_dir), force=True)
+    assert not set(forced) & set(first) and len(enqueued) == 4
+
+
+def test_batch_expands_playlist_with_max_items(tmp_download_dir, enqueued, playlist):
+    direct = _url("direct")
+    playlist_url = f"https://example.com/{uuid.uuid4()}/playlist"
+    task_ids = downloader_service.start_batch_download([direct], str(tmp_download_dir),
+                                                       playlist_url=playlist_url, max_items=2)
+    assert playlist == [(playlist_url, 2)]
+    assert [url for _, url, _ in enqueued] == [direct, f"{playlist_url}/entry-0", f"{playlist_url}/entry-1"]
+    assert len(task_ids) == 3
+    # 不传 max_items: 使用 PLAYLIST_MAX_ENTRIES
+    downloader_service.start_batch_download([], str(tmp_download_dir), playlist_url=playlist_url)
+    assert playlist[-1] == (playlist_url, service_downloads.PLAYLIST_MAX_ENTRIES)
+
+
+def test_batch_without_urls_is_rejected(tmp_download_dir, enqueued):
+    with pytest.raises(ValueError):
+        downloader_service.start_batch_download([], str(tmp_download_dir))
+    assert enqueued == []
+
+
+def test_create_tasks_is_all_or_nothing():
+    task_id = f"test-{uuid.uuid4()}"
+    other_id = f"test-{uuid.uuid4()}"
+    task = {"id": task_id, "url": _url("a"), "path": "/tmp/tests/batch", "status": "queued", "startTime": 1.0}
+    with pytest.raises(Exception):
+        db.create_tasks([{**task, "id": other_id}, task, task])
+    assert db.get_task_by_id(other_id) is None and db.get_task_by_id(task_id) is None
+    db.create_tasks([task])
+    assert db.get_task_by_id(task_id)["url"] == task["url"]
+
+
+class _FakeExtractor:
+    def __init__(self, result):
+        self.result = result
+        self.calls = []
+
+    def extract(self, url, **options):
+        self.calls.append((url, options))
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def test_expand_playlist_clamps_limit_and_skips_bad_entries(monkeypatch):
+    fake = _FakeExtractor({"_type": "playlist", "entries": [
+        {"url": "https://example.com/1"}, None, {"url": "ytsearch:foo"},
+        {"webpage_url": "https://example.com/2"}, {"title": "deleted"}, {"url": "https://example.com/3"},
+    ]})
+    monkeypatch.setattr(playlist_expander, "extractor", fake)
+    assert expand_playlist("https://example.com/list", 2) == ["https://example.com/1", "https://example.com/2"]
+    assert fake.calls[-1][1]["playlistend"] == 2 and fake.calls[-1][1]["extract_flat"] == "in_playlist"
+    expand_playlist("https://example.com/list", 0)
+    assert fake.calls[-1][1]["playlistend"] == 1
+    expand_playlist("https://example.com/list", 10 ** 9)
+    assert fake.calls[-1][1]["playlistend"] == playlist_expander.PLAYLIST_MAX_ENTRIES
+
+
+def test_expand_playlist_single_video_and_errors(monkeypatch):
+    monkeypatch.setattr(playlist_expander, "extractor", _FakeExtractor({"_type": "video", "id": "x"}))
+    assert expand_playlist("https://example.com/watch") == ["https://example.com/watch"]
+    monkeypatch.setattr(playlist_expander, "extractor", _FakeExtractor({"_type": "playlist", "entries": [None]}))
+    with pytest.raises(PlaylistExpansionError):
+        expand_playlist("https://example.com/empty")
+    monkeypatch.setattr(playlist_expander, "extractor", _FakeExtractor(ExtractionError("boom")))
+    with pytest.raises(PlaylistExpansionError):
+        expand_playlist("https://example.com/broken")
+
+
+def test_entry_urls_without_entries():
+    assert entry_urls({}) == [] and entry_urls({"entries": None}) == []
+
+
+@pytest.mark.parametrize("fields", [
+    {},
+    {"urls": []},
+    {"urls": ["https://example.com/a"], "max_items": 0},
+    {"playlist_url": "https://example.com/list", "rate_limit": -1},
+])
+def test_request_validation_errors(fields):
+    with pytest.raises(ValidationError):
+        BatchDownloadRequest(download_path="/tmp/tests/batch", **fields)
+
+
+def test_request_accepts_urls_or_playlist():
+    assert BatchDownloadRequest(download_path="/tmp", urls=["https://example.com/a"]).playlist_url is None
+    assert BatchDownloadRequest(download_path="/tmp", playlist_url="https://example.com/list").urls == []
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+def test_batch_route(client, tmp_download_dir, enqueued, monkeypatch):
+    urls = [_url("a"), _url("b")]
+    response = client.post("/api/v1/start-download/batch",
+                           json={"urls": urls, "download_path": str(tmp_download_dir)})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["count"] == 2 and [url for _, url, _ in enqueued] == urls
+    assert [call[0] for call in enqueued] == body["taskIds"]
+
+    assert client.post("/api/v1/start-download/batch",
+                       json={"download_path": str(tmp_download_dir)}).status_code == 422
+
+    def broken(url, limit):
+        raise PlaylistExpansionError("没有条目")
+
+    monkeypatch.setattr(service_downloads, "expand_playlist", broken)
+    response = client.post("/api/v1/start-download/batch",
+                           json={"playlist_url": "https://example.com/list", "download_path": str(tmp_download_dir)})
+    assert response.status_code == 400 and "没有条目" in response.json()["detail"]
@@ -0,0 +1,90 @@
+# tests/test_dedup.py
+# (V19) 重复提交去重: URL 规范化, 内容哈希, 相同内容的已完成文件
+
+import time
+import uuid
+
+import pytest
+
+import app.repository.repo_tasks as db
+from app.services import dedup
+from app.services.dedup import hash_file, normalize_url, sample_hash
+from app.services.service_downloads import downloader_service
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("HTTPS://Example.COM:443/a/b.m3u8", "https://example.com/a/b.m3u8"),
+    ("http://example.com:80", "http://example.com/"),
+    ("http://example.com:8080/v", "http://example.com:8080/v"),
+    ("https://example.com/v?b=2&a=1#t=30", "https://example.com/v?a=1&b=2"),
+    ("https://example.com/v?utm_source=x&UTM_medium=y&fbclid=z&id=7", "https://example.com/v?id=7"),
+    ("  https://user:pw@Example.com/v  ", "https://user:pw@example.com/v"),
+    ("https://example.com/v?flag=", "https://example.com/v?flag="),
+])
+def test_normalize_url(url, expected):
+    assert normalize_url(url) == expected
+
+
+def test_normalize_url_keeps_distinct_content_apart():
+    assert normalize_url("https://example.com/v?id=1") != normalize_url("https://example.com/v?id=2")
+    assert normalize_url("https://example.com/A") != normalize_url("https://example.com/a")
+
+
+def test_sample_hash_reads_only_samples(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, "SAMPLE_BLOCK_SIZE", 4)
+    a, b, c = tmp_path / "a", tmp_path / "b", tmp_path / "c"
+    a.write_bytes(b"0123456789abcdefghij")
+    b.write_bytes(b"0123456X89abcdefghij")    # 差异不在抽样范围内
+    c.write_bytes(b"0123456789abcdefghiJ")    # 差异在结尾
+    assert sample_hash(a) == sample_hash(b)
+    assert hash_file(a) != hash_file(b)
+    assert sample_hash(a) != sample_hash(c)
+    assert hash_file(a)[1] == 20
+
+
+def _completed(directory, name: str, data: bytes, content_hash=None) -> dict:
+    (directory / name).write_bytes(data)
+    task = {"id": f"test-{uuid.uuid4()}", "url": f"https://example.com/{name}", "path": str(directory),
+            "status": "queued", "startTime": time.time()}
+    db.create_task(task)
+    db.set_task_content(task["id"], content_hash, len(data))
+    db.update_task_status(task["id"], "complete", final_name=name)
+    return task
+
+
+def test_unique_size_is_not_hashed(tmp_download_dir, monkeypatch):
+    _completed(tmp_download_dir, "other.ts", b"x" * 10)
+    new = tmp_download_dir / "new.ts"
+    new.write_bytes(b"y" * 11)
+    monkeypatch.setattr("app.services.service_downloads.hash_file", pytest.fail)
+    monkeypatch.setattr("app.services.service_downloads.sample_hash", pytest.fail)
+    assert downloader_service._find_same_content("new", new, 11, tmp_download_dir) == (None, None)
+
+
+def test_same_content_is_found_and_missing_hash_is_filled_in(tmp_download_dir):
+    data = b"\x47" * 5000
+    old = _completed(tmp_download_dir, "old.ts", data)
+    _completed(tmp_download_dir, "same-size.ts", b"\x00" * 5000)
+    new = tmp_download_dir / "new.ts"
+    new.write_bytes(data)
+
+    content_hash, same = downloader_service._find_same_content("new", new, len(data), tmp_download_dir)
+    assert content_hash == hash_file(new)[0]
+    assert same[0]["id"] == old["id"] and same[1] == (tmp_download_dir / "old.ts").resolve()
+    assert db.get_task_by_id(old["id"])["content_hash"] == content_hash
+
+
+def test_same_size_different_content(tmp_download_dir):
+    _completed(tmp_download_dir, "old.ts", b"a" * 100)
+    new = tmp_download_dir / "new.ts"
+    new.write_bytes(b"b" * 100)
+    assert downloader_service._find_same_content("new", new, 100, tmp_download_dir) == (None, None)
+
+
+def test_other_directory_is_not_reused(tmp_path, tmp_download_dir):
+    elsewhere = tmp_path / "elsewhere"
+    elsewhere.mkdir()
+    _completed(elsewhere, "old.ts", b"z" * 64)
+    new = tmp_download_dir / "new.ts"
+    new.write_bytes(b"z" * 64)
+    assert downloader_service._find_same_content("new", new, 64, tmp_download_dir) == (None, None)
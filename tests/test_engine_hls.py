@@ -0,0 +1,101 @@
+# tests/test_engine_hls.py
+# (V10 / V11 / V12) 原生 HLS 引擎: 按顺序写出片段, 从片段检查点续传, AES-128 解密
+
+import uuid
+
+import pytest
+
+import app.repository.repo_tasks as db
+from app.services.engine_hls import HlsEngine
+from benchmarks.hls_origin import segment_bytes
+
+SEGMENTS = 12
+SIZE = 188 * 40
+
+
+def _expected(seed: int = 0, segments: int = SEGMENTS, size: int = SIZE) -> bytes:
+    return b"".join(segment_bytes(seed, i, size, False) for i in range(segments))
+
+
+@pytest.fixture
+def engine():
+    return HlsEngine(concurrency=4)
+
+
+def _download(engine, url, tmp_dir, **kwargs):
+    logs = []
+    path = engine.start_download(url, tmp_dir, "video", logs.append, **kwargs).result(30)
+    return path, logs
+
+
+def test_segments_written_in_playlist_order(engine, origin, tmp_download_dir):
+    # 随机延迟让片段乱序完成
+    url = f"{origin.base_url}/vod.m3u8?segments={SEGMENTS}&size={SIZE}&latency=0.005&jitter=0.03"
+    seen = []
+    path, _ = _download(engine, url, tmp_download_dir,
+                        on_segment=lambda index, size, total: seen.append((index, size, total)))
+    assert path.name == "video.ts"
+    assert path.read_bytes() == _expected()
+    assert seen == [(i, SIZE, SEGMENTS) for i in range(SEGMENTS)]
+
+
+def test_resume_from_task_segments_checkpoint(engine, origin, tmp_download_dir):
+    task_id = f"test-{uuid.uuid4()}"
+    url = f"{origin.base_url}/vod.m3u8?segments={SEGMENTS}&size={SIZE}"
+    expected = _expected()
+    done = 5
+    # 模拟上一次下载在写第 6 个片段时中断: 检查点只有前 5 个, 文件末尾是写了一半的数据
+    for index in range(done):
+        db.add_task_segment(task_id, index, SIZE)
+    (tmp_download_dir / "video.ts").write_bytes(expected[:done * SIZE] + b"\x00" * 1000)
+    resume_from = db.get_task_checkpoint(task_id)
+    assert resume_from == (done, done * SIZE)
+
+    before = origin.stats["segment_bytes"]
+    try:
+        path, logs = _download(engine, url, tmp_download_dir, resume_from=resume_from,
+                               on_segment=lambda index, size, total: db.add_task_segment(task_id, index, size))
+        assert path.read_bytes() == expected
+        assert origin.stats["segment_bytes"] - before == (SEGMENTS - done) * SIZE
+        assert any("检查点" in line for line in logs)
+        assert db.get_task_checkpoint(task_id) == (SEGMENTS, SEGMENTS * SIZE)
+    finally:
+        db.clear_task_segments(task_id)
+
+
+def test_stale_checkpoint_restarts_from_scratch(engine, origin, tmp_download_dir):
+    # 输出文件比检查点短 (例如被删掉了): 不能在它后面接着写
+    url = f"{origin.base_url}/vod.m3u8?segments={SEGMENTS}&size={SIZE}"
+    (tmp_download_dir / "video.ts").write_bytes(b"\x47" * 10)
+    path, _ = _download(engine, url, tmp_download_dir, resume_from=(3, 3 * SIZE))
+    assert path.read_bytes() == _expected()
+
+
+def test_aes128_segments_are_decrypted(engine, origin, tmp_download_dir):
+    url = f"{origin.base_url}/vod.m3u8?segments={SEGMENTS}&size={SIZE}&seed=7&key=1"
+    path, logs = _download(engine, url, tmp_download_dir)
+    assert path.read_bytes() == _expected(seed=7)
+    assert any("AES-128" in line for line in logs)
+
+
+def test_master_playlist_picks_highest_bandwidth(engine, origin, tmp_download_dir):
+    url = f"{origin.base_url}/master.m3u8?variants=3&segments=4&size={SIZE}"
+    path, _ = _download(engine, url, tmp_download_dir)
+    # 最高码率是最后一个 variant (seed=2, 片段大小等于 size)
+    assert path.read_bytes() == _expected(seed=2, segments=4)
+
+
+def test_second_download_is_spliced_from_the_segment_cache(origin, tmp_download_dir, tmp_path):
+    # conftest 默认禁用了缓存; 这里使用独立的缓存目录, 第二次下载的片段全部来自缓存
+    from app.services.segment_cache import SegmentCache
+    cache = SegmentCache(tmp_path / "cache", max_bytes=10 ** 8)
+    engine = HlsEngine(concurrency=4, cache=cache)
+    url = f"{origin.base_url}/vod.m3u8?segments={SEGMENTS}&size={SIZE}&seed=3"
+    for name in ("first", "second"):
+        (tmp_download_dir / name).mkdir()
+    first, _ = _download(engine, url, tmp_download_dir / "first")
+    before = origin.stats["segment_bytes"]
+    second, _ = _download(engine, url, tmp_download_dir / "second")
+    assert origin.stats["segment_bytes"] == before
+    assert first.read_bytes() == second.read_bytes() == _expected(seed=3)
+    assert cache.stats()["hits"] == SEGMENTS
@@ -0,0 +1,196 @@
+# tests/test_extractor_pool.py
+# (V32) yt-dlp 提取进程池: 按 URL 的 TTL 缓存, 错误计数, EXTRACTOR_WORKERS=0 的子进程回退, 提取进程崩溃后重建
+
+import os
+import subprocess
+import threading
+import time
+
+import pytest
+
+from app.services import extractor_pool
+from app.services.extractor_pool import ExtractionError, ExtractorPool
+
+
+# --- 提取进程中运行的桩 (模块级函数: spawn 的进程按名字 import 本模块) ---
+def _no_warm_up():
+    pass
+
+
+def _stub_extract(url, options):
+    if "crash" in url:
+        os._exit(1)
+    if "fail" in url:
+        raise ExtractionError(f"unsupported: {url}")
+    return {"_type": "video", "id": url, "pid": os.getpid(), "options": options}
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class _StubRunner:
+    """代替 _extract_with_subprocess (EXTRACTOR_WORKERS=0 时每次提取调用一次)"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, url, options, timeout):
+        self.calls.append((url, options))
+        if "fail" in url:
+            raise ExtractionError(f"unsupported: {url}")
+        return {"_type": "playlist" if "list" in url else "video", "id": url}
+
+
+@pytest.fixture
+def runner(monkeypatch):
+    runner = _StubRunner()
+    monkeypatch.setattr(extractor_pool, "_extract_with_subprocess", runner)
+    return runner
+
+
+def test_cache_hit_miss_and_ttl(runner, monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(extractor_pool.time, "monotonic", clock)
+    pool = ExtractorPool(workers=0, ttl=60)
+    info = pool.extract("https://example.com/v?utm_source=x")
+    # 规范化之后是同一个 URL: 命中缓存
+    assert pool.extract("https://EXAMPLE.com/v") is info
+    assert len(runner.calls) == 1
+    # 不同的选项分开缓存
+    pool.extract("https://example.com/v", extract_flat="in_playlist")
+    assert len(runner.calls) == 2 and runner.calls[-1][1] == {"extract_flat": "in_playlist"}
+    assert pool.cached("https://example.com/v") is info
+
+    clock.now += 61
+    assert pool.cached("https://example.com/v") is None
+    pool.extract("https://example.com/v")
+    assert len(runner.calls) == 3
+    stats = pool.stats()
+    assert (stats["hits"], stats["misses"], stats["errors"]) == (1, 3, 0)
+    assert stats["hit_ratio"] == 0.25 and not stats["enabled"]
+
+
+def test_lru_evicts_oldest_and_invalidate(runner):
+    pool = ExtractorPool(workers=0, max_entries=2)
+    for name in ("a", "b"):
+        pool.extract(f"https://example.com/{name}")
+    pool.extract("https://example.com/a")                # a 变成最近使用
+    pool.extract("https://example.com/c")
+    assert pool.cached("https://example.com/b") is None
+    assert pool.cached("https://example.com/a") is not None
+    pool.invalidate("https://example.com/a")
+    assert pool.cached("https://example.com/a") is None
+    assert pool.stats()["entries"] == 1
+
+
+def test_errors_are_counted_and_not_cached(runner):
+    pool = ExtractorPool(workers=0)
+    for _ in range(2):
+        with pytest.raises(ExtractionError):
+            pool.extract("https://example.com/fail")
+    assert len(runner.calls) == 2
+    stats = pool.stats()
+    assert stats["errors"] == 2 and stats["misses"] == 2 and stats["entries"] == 0
+    assert not pool._inflight
+
+
+def test_concurrent_requests_share_one_extraction(monkeypatch):
+    release = threading.Event()
+    calls = []
+
+    def slow(url, options, timeout):
+        calls.append(url)
+        release.wait(5)
+        return {"id": url}
+
+    monkeypatch.setattr(extractor_pool, "_extract_with_subprocess", slow)
+    pool = ExtractorPool(workers=0)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(pool.extract("https://example.com/v")))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while not calls:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert calls == ["https://example.com/v"]
+    assert len(results) == 4 and all(result is results[0] for result in results)
+
+
+def test_write_info_json(runner, tmp_path):
+    pool = ExtractorPool(workers=0)
+    path = tmp_path / "info.json"
+    assert not pool.write_info_json("https://example.com/v", path) and not path.exists()
+    pool.extract("https://example.com/v")
+    assert pool.write_info_json("https://example.com/v", path)
+    assert '"id": "https://example.com/v"' in path.read_text(encoding="utf-8")
+    # 播放列表的结果不能交给 --load-info-json
+    pool.extract("https://example.com/list")
+    assert not pool.write_info_json("https://example.com/list", tmp_path / "list.json")
+
+
+def _completed(returncode=0, stdout="", stderr=""):
+    return subprocess.CompletedProcess([], returncode, stdout, stderr)
+
+
+def test_subprocess_fallback_command_and_errors(monkeypatch):
+    commands = []
+    results = [_completed(stdout='{"id": "v"}'), _completed(1, stderr="WARNING: x\nERROR: unsupported URL"),
+               _completed(stdout="not json"), subprocess.TimeoutExpired("yt-dlp", 1)]
+
+    def fake_run(command, **kwargs):
+        commands.append(command)
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(extractor_pool.subprocess, "run", fake_run)
+    pool = ExtractorPool(workers=0)
+    assert pool.extract("https://example.com/list", extract_flat="in_playlist",
+                        noplaylist=False, playlistend=5) == {"id": "v"}
+    assert commands[0][-5:] == ["--yes-playlist", "--flat-playlist", "--playlist-end", "5",
+                                "https://example.com/list"]
+    assert "-J" in commands[0]
+    for message in ("ERROR: unsupported URL", "无法解析", "超时"):
+        with pytest.raises(ExtractionError, match=message):
+            pool.extract("https://example.com/other")
+    assert "--no-playlist" in commands[1]
+    assert pool.stats()["errors"] == 3
+
+
+@pytest.fixture
+def process_pool(monkeypatch):
+    monkeypatch.setattr(extractor_pool, "_warm_up", _no_warm_up)
+    monkeypatch.setattr(extractor_pool, "_extract_in_worker", _stub_extract)
+    pool = ExtractorPool(workers=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_process_pool_extracts_in_worker(process_pool):
+    process_pool.start()
+    info = process_pool.extract("https://example.com/v", timeout=60)
+    assert info["pid"] != os.getpid() and process_pool.stats()["enabled"]
+    with pytest.raises(ExtractionError, match="unsupported"):
+        process_pool.extract("https://example.com/fail", timeout=60)
+    assert process_pool.stats()["errors"] == 1
+
+
+def test_process_pool_is_rebuilt_after_worker_dies(process_pool):
+    first = process_pool.extract("https://example.com/v", timeout=60)["pid"]
+    broken = process_pool._executor
+    with pytest.raises(ExtractionError, match="异常退出"):
+        process_pool.extract("https://example.com/crash", timeout=60)
+    assert process_pool._executor is None and process_pool.stats()["errors"] == 1
+    # 下一次提取在新的进程池中进行
+    second = process_pool.extract("https://example.com/other", timeout=60)["pid"]
+    assert process_pool._executor is not broken and second != first
@@ -0,0 +1,150 @@
+# tests/test_file_response.py
+# (V33) 下载完成的文件: Range / 条件请求 / 零拷贝发送 / 反向代理 sendfile 头
+
+import asyncio
+import os
+from email.utils import formatdate
+
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.core import file_response
+from app.core.file_response import RangeFileResponse, ZEROCOPY_EXTENSION, _etag_in, _not_after
+
+DATA = bytes(range(256)) * 40
+MTIME = 1_700_000_000
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(DATA)
+    os.utime(path, (MTIME, MTIME))
+    return path
+
+
+@pytest.fixture
+def client(video):
+    async def serve(request):
+        return RangeFileResponse(video)
+    return TestClient(Starlette(routes=[Route("/file", serve, methods=["GET", "HEAD", "PUT"])]))
+
+
+def test_etag_in():
+    assert _etag_in('"a"', '"b", "a"', weak=False)
+    assert _etag_in('"a"', "*", weak=False)
+    assert not _etag_in(None, "*", weak=True)
+    # 弱比较忽略 W/ 前缀, 强比较时弱 ETag 永远不匹配
+    assert _etag_in('W/"a"', '"a"', weak=True)
+    assert _etag_in('"a"', 'W/"a"', weak=True)
+    assert not _etag_in('W/"a"', 'W/"a"', weak=False)
+    assert not _etag_in('"a"', '"ab"', weak=True)
+
+
+def test_not_after():
+    assert _not_after(MTIME, formatdate(MTIME, usegmt=True)) is True
+    # 按秒比较: 文件时间的小数部分不算 "更晚"
+    assert _not_after(MTIME + 0.9, formatdate(MTIME, usegmt=True)) is True
+    assert _not_after(MTIME + 1, formatdate(MTIME, usegmt=True)) is False
+    assert _not_after(MTIME, None) is None
+    assert _not_after(MTIME, "not a date") is None
+    assert _not_after(MTIME, "Tue, 14 Nov 2023 22:13:20") is None       # 没有时区
+
+
+def test_full_and_head(client):
+    response = client.get("/file")
+    assert response.status_code == 200 and response.content == DATA
+    assert response.headers["content-type"] == "video/mp4"
+    assert response.headers["accept-ranges"] == "bytes"
+    head = client.head("/file")
+    assert head.status_code == 200 and head.content == b""
+    assert head.headers["content-length"] == str(len(DATA))
+
+
+def test_single_range(client):
+    response = client.get("/file", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.content == DATA[100:200]
+    assert response.headers["content-range"] == f"bytes 100-199/{len(DATA)}"
+    suffix = client.get("/file", headers={"Range": "bytes=-10"})
+    assert suffix.content == DATA[-10:]
+    assert client.get("/file", headers={"Range": f"bytes={len(DATA)}-"}).status_code == 416
+
+
+def test_multiple_ranges_use_content_type(client):
+    response = client.get("/file", headers={"Range": "bytes=0-9, 20-29"})
+    assert response.status_code == 206
+    assert response.headers["content-type"].startswith("multipart/byteranges; boundary=")
+    assert "content-range" not in response.headers
+    assert DATA[0:10] in response.content and DATA[20:30] in response.content
+
+
+def test_if_range_with_stale_etag_sends_whole_file(client):
+    etag = client.head("/file").headers["etag"]
+    assert client.get("/file", headers={"Range": "bytes=0-9", "If-Range": etag}).status_code == 206
+    response = client.get("/file", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200 and response.content == DATA
+
+
+def test_conditional_requests(client):
+    head = client.head("/file")
+    etag, last_modified = head.headers["etag"], head.headers["last-modified"]
+    before = formatdate(MTIME - 60, usegmt=True)
+
+    not_modified = client.get("/file", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304 and not_modified.content == b""
+    assert not_modified.headers["etag"] == etag and "content-length" not in not_modified.headers
+    assert client.get("/file", headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+    assert client.get("/file", headers={"If-Modified-Since": last_modified}).status_code == 304
+    assert client.get("/file", headers={"If-Modified-Since": before}).status_code == 200
+    # If-None-Match 存在时忽略 If-Modified-Since
+    assert client.get("/file", headers={"If-None-Match": '"other"',
+                                        "If-Modified-Since": last_modified}).status_code == 200
+    # 非 GET / HEAD 请求匹配 If-None-Match 时是 412
+    assert client.put("/file", headers={"If-None-Match": "*"}).status_code == 412
+
+    assert client.get("/file", headers={"If-Match": etag}).status_code == 200
+    assert client.get("/file", headers={"If-Match": '"other"'}).status_code == 412
+    assert client.get("/file", headers={"If-Unmodified-Since": before}).status_code == 412
+    assert client.get("/file", headers={"If-Unmodified-Since": last_modified}).status_code == 200
+    # If-Match 存在时忽略 If-Unmodified-Since
+    assert client.get("/file", headers={"If-Match": etag, "If-Unmodified-Since": before}).status_code == 200
+
+
+def _call(response: RangeFileResponse, headers=(), extensions=None):
+    scope = {"type": "http", "method": "GET", "path": "/file", "headers": list(headers),
+             "extensions": extensions or {}}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == ZEROCOPY_EXTENSION:
+            file = message["file"]
+            file.seek(message["offset"])
+            message = {**message, "body": file.read(message.get("count", -1))}
+        messages.append(message)
+
+    asyncio.run(response(scope, receive, send))
+    return messages
+
+
+def test_zerocopy_extension(video):
+    extensions = {ZEROCOPY_EXTENSION: {}}
+    start, body = _call(RangeFileResponse(video, stat_result=video.stat()), extensions=extensions)
+    assert start["status"] == 200 and body["type"] == ZEROCOPY_EXTENSION and body["body"] == DATA
+    start, body = _call(RangeFileResponse(video), headers=[(b"range", b"bytes=10-19")], extensions=extensions)
+    assert start["status"] == 206 and body["body"] == DATA[10:20]
+    assert (b"content-length", b"10") in start["headers"]
+
+
+def test_proxy_sendfile_header(video, monkeypatch):
+    monkeypatch.setattr(file_response, "FILE_SENDFILE_HEADER", "X-Accel-Redirect")
+    monkeypatch.setattr(file_response, "FILE_SENDFILE_PREFIX", "/_files")
+    start, body = _call(RangeFileResponse(video))
+    headers = dict(start["headers"])
+    assert headers[b"x-accel-redirect"].decode() == "/_files" + str(video)
+    assert b"etag" in headers and body["body"] == b""
@@ -0,0 +1,90 @@
+# tests/test_hls_live.py
+# (V29) 直播录制: 轮询滑动窗口的播放列表, 只下载新片段, 按时长 / 大小切分输出文件
+
+import threading
+import time
+import uuid
+
+import pytest
+
+from app.services.engine_hls import HlsEngine
+from app.services.hls_live import LiveRecorder
+from app.services.hls_playlist import parse_playlist
+from benchmarks.hls_origin import segment_bytes
+
+SIZE = 188 * 10
+
+
+@pytest.fixture
+def engine():
+    return HlsEngine(concurrency=4)
+
+
+def _live_url(origin, **params) -> str:
+    query = {"stream": uuid.uuid4().hex, "size": SIZE, **params}
+    return f"{origin.base_url}/live.m3u8?" + "&".join(f"{k}={v}" for k, v in query.items())
+
+
+def _record(engine, url, tmp_dir, timeout=20, **kwargs):
+    parts, logs = [], []
+    recorder = LiveRecorder(engine, url, tmp_dir, "live", logs.append, on_part=parts.append, **kwargs)
+    count = engine.submit(recorder.run()).result(timeout)
+    return recorder, count, parts, logs
+
+
+def test_records_every_segment_once_and_rotates(engine, origin, tmp_download_dir):
+    url = _live_url(origin, duration=0.25, window=8, total=8)
+    _, count, parts, logs = _record(engine, url, tmp_download_dir, rotate_seconds=0.75, rotate_bytes=0)
+
+    assert count == len(parts) == 3
+    assert [part.index for part in parts] == [1, 2, 3]
+    assert [(part.first_sequence, part.last_sequence) for part in parts] == [(0, 2), (3, 5), (6, 7)]
+    assert [part.path.name for part in parts] == ["live.part0001.ts", "live.part0002.ts", "live.part0003.ts"]
+    data = b"".join(part.path.read_bytes() for part in parts)
+    assert data == b"".join(segment_bytes(0, i, SIZE, False) for i in range(8))
+    assert sum(part.size for part in parts) == len(data)
+    assert any("#EXT-X-ENDLIST" in line for line in logs)
+
+
+def test_rotation_by_size_and_first_part_number(engine, origin, tmp_download_dir):
+    url = _live_url(origin, duration=0.25, window=8, total=4)
+    _, count, parts, _ = _record(engine, url, tmp_download_dir, rotate_seconds=0,
+                                 rotate_bytes=2 * SIZE, first_part=5)
+    assert [part.index for part in parts] == [5, 6]
+    assert [part.segments for part in parts] == [2, 2]
+
+
+def test_stop_closes_current_part(engine, origin, tmp_download_dir):
+    url = _live_url(origin, duration=0.25, window=8, total=1000)
+    parts, logs = [], []
+    recorder = LiveRecorder(engine, url, tmp_download_dir, "live", logs.append, on_part=parts.append,
+                            rotate_seconds=0, rotate_bytes=0)
+    future = engine.submit(recorder.run())
+    time.sleep(1.5)
+    threading.Thread(target=recorder.stop).start()
+    assert future.result(10) == 1
+    assert len(parts) == 1 and parts[0].segments >= 1
+    assert parts[0].path.stat().st_size == parts[0].size
+    assert "[live] 录制已停止" in logs
+
+
+def _playlist(first: int, count: int):
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:2", f"#EXT-X-MEDIA-SEQUENCE:{first}"]
+    for i in range(first, first + count):
+        lines += ["#EXTINF:2,", f"{i}.ts"]
+    return parse_playlist("\n".join(lines), "https://live.example/index.m3u8")
+
+
+def test_new_segments_by_media_sequence(engine, tmp_download_dir):
+    logs = []
+    recorder = LiveRecorder(engine, "https://live.example/index.m3u8", tmp_download_dir, "live",
+                            logs.append, on_part=lambda part: None)
+    # 开始时只取窗口末尾的 LIVE_START_SEGMENTS 个片段
+    assert [s.sequence for s in recorder._new_segments(_playlist(10, 6), None)] == [13, 14, 15]
+    assert recorder._new_segments(_playlist(11, 5), 15) == []
+    assert [s.sequence for s in recorder._new_segments(_playlist(12, 6), 15)] == [16, 17]
+    # 两次重新加载之间滑出窗口的片段: 记录并跳过
+    assert [s.sequence for s in recorder._new_segments(_playlist(30, 3), 17)] == [30, 31, 32]
+    assert any("12 个片段在下载前已经滑出窗口" in line for line in logs)
+    # 媒体序号大幅回退: 源重新开始推流, 整个窗口都是新的
+    assert [s.sequence for s in recorder._new_segments(_playlist(0, 3), 500)] == [0, 1, 2]
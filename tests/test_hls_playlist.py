@@ -0,0 +1,164 @@
+# tests/test_hls_playlist.py
+# (V10 / V11) m3u8 解析: 主播放列表, 片段属性, #EXT-X-KEY / #EXT-X-MAP, 以及片段 / 初始化片段的解密
+
+import asyncio
+
+import pytest
+from Cryptodome.Cipher import AES
+from Cryptodome.Util.Padding import pad
+
+from app.services.engine_hls import HlsEngine, LivePlaylistError, UnsupportedStreamError
+from app.services.hls_crypto import SegmentDecryptor, sequence_iv
+from app.services.hls_playlist import (
+    InitSection, Key, MasterPlaylist, MediaPlaylist, PlaylistError, parse_attributes, parse_playlist
+)
+
+BASE = "https://cdn.example.com/live/index.m3u8"
+KEY = bytes(range(16))
+
+
+def test_parse_attributes_handles_quoted_commas():
+    attrs = parse_attributes('METHOD=AES-128,URI="key?a=1,b=2",IV=0x1F')
+    assert attrs == {"METHOD": "AES-128", "URI": "key?a=1,b=2", "IV": "0x1F"}
+
+
+def test_not_a_playlist():
+    with pytest.raises(PlaylistError):
+        parse_playlist("<html></html>", BASE)
+
+
+def test_master_playlist_variants_and_renditions():
+    text = "\n".join([
+        "#EXTM3U",
+        '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",NAME="en",URI="audio/en.m3u8"',
+        '#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360,CODECS="avc1.4d401e,mp4a.40.2"',
+        "360p.m3u8",
+        '#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720,AUDIO="aud"',
+        "https://other.example.com/720p.m3u8",
+    ])
+    master = parse_playlist(text, BASE)
+    assert isinstance(master, MasterPlaylist)
+    assert [v.uri for v in master.variants] == [
+        "https://cdn.example.com/live/360p.m3u8", "https://other.example.com/720p.m3u8"]
+    assert master.variants[0].codecs == "avc1.4d401e,mp4a.40.2"
+    best = master.best_variant()
+    assert best.bandwidth == 2500000 and best.audio == "aud"
+    assert master.renditions[0].uri == "https://cdn.example.com/live/audio/en.m3u8"
+
+
+def test_media_playlist_segments_byteranges_and_sequence():
+    text = "\n".join([
+        "#EXTM3U",
+        "#EXT-X-TARGETDURATION:6",
+        "#EXT-X-MEDIA-SEQUENCE:100",
+        "#EXT-X-PLAYLIST-TYPE:vod",
+        "#EXTINF:6.0,",
+        "#EXT-X-BYTERANGE:1000@0",
+        "all.ts",
+        "#EXTINF:5.5,",
+        "#EXT-X-BYTERANGE:500",
+        "all.ts",
+        "#EXT-X-DISCONTINUITY",
+        "#EXTINF:4,",
+        "other.ts",
+        "#EXT-X-ENDLIST",
+    ])
+    media = parse_playlist(text, BASE)
+    assert isinstance(media, MediaPlaylist)
+    assert media.endlist and media.playlist_type == "VOD" and media.target_duration == 6
+    assert [s.sequence for s in media.segments] == [100, 101, 102]
+    assert [s.byterange for s in media.segments] == [(1000, 0), (500, 1000), None]
+    assert [s.discontinuity for s in media.segments] == [False, False, True]
+    assert media.total_duration == pytest.approx(15.5)
+    assert not media.is_encrypted and not media.is_fmp4
+
+
+def test_keys_apply_until_changed():
+    text = "\n".join([
+        "#EXTM3U",
+        "#EXTINF:4,", "0.ts",
+        '#EXT-X-KEY:METHOD=AES-128,URI="k1.bin",IV=0x000000000000000000000000000000AB',
+        "#EXTINF:4,", "1.ts",
+        "#EXTINF:4,", "2.ts",
+        "#EXT-X-KEY:METHOD=NONE",
+        "#EXTINF:4,", "3.ts",
+    ])
+    segments = parse_playlist(text, BASE).segments
+    assert segments[0].key is None
+    assert segments[1].key == segments[2].key == Key(
+        method="AES-128", uri="https://cdn.example.com/live/k1.bin", iv=(0xAB).to_bytes(16, "big"))
+    assert segments[3].key is None
+
+
+def test_map_records_key_in_effect():
+    text = "\n".join([
+        "#EXTM3U",
+        '#EXT-X-KEY:METHOD=AES-128,URI="k.bin",IV=0x01',
+        '#EXT-X-MAP:URI="init.mp4",BYTERANGE="720@0"',
+        "#EXTINF:4,", "seg0.m4s",
+        "#EXT-X-KEY:METHOD=NONE",
+        '#EXT-X-MAP:URI="init2.mp4"',
+        "#EXTINF:4,", "seg1.m4s",
+    ])
+    media = parse_playlist(text, BASE)
+    first, second = media.segments
+    assert first.init_section == InitSection(
+        uri="https://cdn.example.com/live/init.mp4", byterange=(720, 0),
+        key=Key("AES-128", "https://cdn.example.com/live/k.bin", (1).to_bytes(16, "big")))
+    assert second.init_section.key is None
+    assert media.is_fmp4 and media.is_encrypted
+
+
+def test_check_supported():
+    engine = HlsEngine()
+    live = parse_playlist("#EXTM3U\n#EXTINF:4,\n0.ts\n", BASE)
+    with pytest.raises(LivePlaylistError):
+        engine.check_supported(live)
+    sample_aes = parse_playlist('#EXTM3U\n#EXT-X-KEY:METHOD=SAMPLE-AES,URI="k"\n#EXTINF:4,\n0.ts\n#EXT-X-ENDLIST\n', BASE)
+    with pytest.raises(UnsupportedStreamError):
+        engine.check_supported(sample_aes)
+    # 加密的初始化片段没有 IV 时无法解密, 交给 yt-dlp
+    map_without_iv = parse_playlist('#EXTM3U\n#EXT-X-KEY:METHOD=AES-128,URI="k"\n#EXT-X-MAP:URI="init.mp4"\n'
+                                    '#EXTINF:4,\n0.m4s\n#EXT-X-ENDLIST\n', BASE)
+    with pytest.raises(UnsupportedStreamError):
+        engine.check_supported(map_without_iv)
+
+
+class _KeyServer:
+    """SegmentDecryptor 只用到 pool.fetch(uri)"""
+
+    def __init__(self):
+        self.requests = 0
+
+    async def fetch(self, uri, headers=None, throttle=None):
+        self.requests += 1
+        return KEY
+
+
+def test_segment_and_init_section_decryption():
+    text = "\n".join([
+        "#EXTM3U",
+        "#EXT-X-MEDIA-SEQUENCE:7",
+        '#EXT-X-KEY:METHOD=AES-128,URI="k.bin",IV=0x0A',
+        '#EXT-X-MAP:URI="init.mp4"',
+        '#EXT-X-KEY:METHOD=AES-128,URI="k.bin"',
+        "#EXTINF:4,", "seg7.m4s",
+        "#EXT-X-ENDLIST",
+    ])
+    segment = parse_playlist(text, BASE).segments[0]
+    init_plain, media_plain = b"ftyp-init-section", b"moof-mdat" * 10
+    init_data = AES.new(KEY, AES.MODE_CBC, (10).to_bytes(16, "big")).encrypt(pad(init_plain, 16))
+    # 媒体片段的 #EXT-X-KEY 没有 IV: 用片段序号
+    media_data = AES.new(KEY, AES.MODE_CBC, sequence_iv(7)).encrypt(pad(media_plain, 16))
+
+    async def run():
+        server = _KeyServer()
+        decryptor = SegmentDecryptor(server)
+        init = await decryptor.decrypt_init(segment.init_section, init_data)
+        media = await decryptor.decrypt(segment, media_data)
+        return init, media, server.requests
+
+    init, media, requests = asyncio.run(run())
+    assert init == init_plain
+    assert media == media_plain
+    assert requests == 1
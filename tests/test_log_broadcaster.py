@@ -0,0 +1,107 @@
+# tests/test_log_broadcaster.py
+# (V14) 多订阅者日志广播: 重放, 慢消费者丢弃, 固定内存; (V30) 事件循环中的订阅者
+
+import asyncio
+import threading
+
+from app.services.log_broadcaster import AsyncSubscription, TaskBroadcaster
+
+
+def _drain(sub):
+    lines = []
+    while True:
+        line = sub.get(timeout=0)
+        if not line:
+            return lines, line
+        lines.append(line)
+
+
+def test_late_subscriber_gets_last_lines():
+    broadcaster = TaskBroadcaster(replay_lines=3, backlog_lines=10)
+    for i in range(5):
+        broadcaster.publish(f"line {i}")
+    sub = broadcaster.subscribe()
+    broadcaster.publish("line 5")
+    assert _drain(sub) == (["line 2", "line 3", "line 4", "line 5"], "")
+
+
+def test_every_subscriber_gets_every_line():
+    broadcaster = TaskBroadcaster(replay_lines=0, backlog_lines=10)
+    first, second = broadcaster.subscribe(), broadcaster.subscribe()
+    broadcaster.publish("a")
+    broadcaster.unsubscribe(second)
+    broadcaster.publish("b")
+    assert _drain(first)[0] == ["a", "b"]
+    assert _drain(second)[0] == ["a"]
+    assert broadcaster.subscriber_count == 1
+
+
+def test_slow_subscriber_drops_oldest_lines_with_notice():
+    broadcaster = TaskBroadcaster(replay_lines=0, backlog_lines=3)
+    sub = broadcaster.subscribe()
+    for i in range(10):
+        broadcaster.publish(f"line {i}")
+    lines, _ = _drain(sub)
+    assert lines == ["[日志] 消费太慢, 跳过了 7 行", "line 7", "line 8", "line 9"]
+    # 提示只出现一次
+    broadcaster.publish("line 10")
+    assert _drain(sub)[0] == ["line 10"]
+
+
+def test_memory_is_bounded_without_subscribers():
+    broadcaster = TaskBroadcaster(replay_lines=50, backlog_lines=10)
+    for i in range(10000):
+        broadcaster.publish(f"line {i}")
+    assert len(broadcaster._buffer) == 50
+    # 订阅者的初始积压同样受 backlog 限制
+    sub = broadcaster.subscribe()
+    assert _drain(sub)[0] == [f"line {i}" for i in range(9990, 10000)]
+
+
+def test_close_ends_subscriptions():
+    broadcaster = TaskBroadcaster(replay_lines=5, backlog_lines=10)
+    sub = broadcaster.subscribe()
+    broadcaster.publish("last")
+    broadcaster.close()
+    broadcaster.publish("ignored")
+    assert _drain(sub) == (["last"], None)
+    assert broadcaster.subscriber_count == 0
+    # 结束之后订阅: 只有重放的行, 然后是 None
+    assert _drain(broadcaster.subscribe()) == (["last"], None)
+
+
+def test_blocking_get_wakes_on_publish():
+    broadcaster = TaskBroadcaster()
+    sub = broadcaster.subscribe()
+    threading.Timer(0.05, broadcaster.publish, args=("hello",)).start()
+    assert sub.get(timeout=5) == "hello"
+    assert sub.get(timeout=0.01) == ""
+
+
+def test_async_subscription_wakes_from_other_threads():
+    broadcaster = TaskBroadcaster(replay_lines=1, backlog_lines=10)
+    broadcaster.publish("replayed")
+
+    async def consume():
+        sub = broadcaster.subscribe(asyncio.get_running_loop())
+        assert isinstance(sub, AsyncSubscription)
+        assert await sub.get_async(timeout=1) == "replayed"
+        threading.Timer(0.05, broadcaster.publish, args=("from thread",)).start()
+        assert await sub.get_async(timeout=5) == "from thread"
+        assert await sub.get_async(timeout=0.01) == ""
+        # close() 同样通过 call_soon_threadsafe 唤醒正在等待的协程
+        threading.Timer(0.05, broadcaster.close).start()
+        return await asyncio.wait_for(sub.get_async(timeout=30), 5)
+
+    assert asyncio.run(consume()) is None
+
+
+def test_async_subscription_after_loop_closed():
+    loop = asyncio.new_event_loop()
+    broadcaster = TaskBroadcaster()
+    sub = broadcaster.subscribe(loop)
+    loop.close()
+    # 应用退出时事件循环已经关闭: 发布者不受影响
+    broadcaster.publish("line")
+    broadcaster.close()
+    assert _drain(sub) == (["line"], None)
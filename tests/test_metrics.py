@@ -0,0 +1,121 @@
+# tests/test_metrics.py
+# (V24) Prometheus 文本格式的指标: 计数器, 直方图, 回调指标, 阶段计时
+
+import threading
+
+import pytest
+
+from app.core import metrics
+from app.core.metrics import CallbackMetric, Counter, Histogram, PhaseTimer, Registry
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = Registry()
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    return registry
+
+
+def test_counter_sums_across_threads(registry):
+    counter = Counter("test_requests_total", "Requests", ("route",))
+
+    def work():
+        for _ in range(1000):
+            counter.inc(route="a")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc(2.5, route='b"\n')
+    # 已结束线程的单元并入 retired 后数值不变
+    assert counter.values() == {("a",): 4000, ('b"\n',): 2.5}
+    assert counter.values() == {("a",): 4000, ('b"\n',): 2.5}
+    assert registry.expose().splitlines() == [
+        "# HELP test_requests_total Requests",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{route="a"} 4000',
+        'test_requests_total{route="b\\"\\n"} 2.5',
+    ]
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = Histogram("test_latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+    assert histogram.samples() == [
+        'test_latency_seconds_bucket{le="0.1"} 2',
+        'test_latency_seconds_bucket{le="1"} 3',
+        'test_latency_seconds_bucket{le="+Inf"} 4',
+        "test_latency_seconds_sum 3.65",
+        "test_latency_seconds_count 4",
+    ]
+
+
+def test_histogram_timer(registry):
+    histogram = Histogram("test_op_seconds", "Op", ("op",), buckets=(10.0,))
+    with histogram.time(op="x"):
+        pass
+    assert 'test_op_seconds_count{op="x"} 1' in histogram.samples()
+
+
+def test_callback_metric_and_failing_callback(registry):
+    CallbackMetric("test_running", "Running", lambda: {("hls",): 2, ("ytdlp",): 1}, labels=("engine",))
+    CallbackMetric("test_broken", "Broken", lambda: 1 / 0)
+    text = registry.expose()
+    assert 'test_running{engine="hls"} 2' in text
+    assert "# TYPE test_running gauge" in text
+    assert "# test_broken unavailable: division by zero" in text
+
+
+def test_reregistering_replaces_metric(registry):
+    CallbackMetric("test_value", "Value", lambda: 1)
+    CallbackMetric("test_value", "Value", lambda: 2)
+    assert registry.expose().count("test_value 2") == 1
+    assert "test_value 1" not in registry.expose()
+
+
+def test_phase_timer_spans(monkeypatch):
+    observed = []
+    monkeypatch.setattr(metrics.PHASE_DURATION, "observe", lambda value, phase: observed.append(phase))
+    timer = PhaseTimer("resolve")
+    timer.enter("download")
+    timer.add_bytes(100)
+    timer.enter("download")
+    timer.add_bytes(50)
+    timeline = timer.timeline()
+    assert [span["phase"] for span in timeline] == ["resolve", "download"]
+    assert timeline[-1]["ended_at"] is None and timeline[-1]["bytes"] == 150
+    timer.enter("move")
+    timer.finish()
+    assert observed == ["resolve", "download", "move"]
+    assert all(span["ended_at"] is not None for span in timer.spans)
+
+
+def test_aborted_phase_timer_is_not_observed(monkeypatch):
+    observed = []
+    monkeypatch.setattr(metrics.PHASE_DURATION, "observe", lambda *args, **kwargs: observed.append(args))
+    timer = PhaseTimer("download")
+    timer.abort()
+    assert observed == [] and len(timer.spans) == 1
+
+
+def test_phase_timer_cpu_clock():
+    cpu = [0.0]
+
+    def clock():
+        if cpu[0] is None:
+            raise ProcessLookupError
+        return cpu[0]
+
+    timer = PhaseTimer("download")
+    timer.set_cpu_clock(clock)
+    cpu[0] = 1.5
+    timer.enter("merge")
+    cpu[0] = 2.0
+    timer.sample_cpu()
+    # 子进程退出后沿用最后一次读到的值
+    cpu[0] = None
+    timer.abort()
+    assert [span["cpu_seconds"] for span in timer.spans] == [1.5, pytest.approx(0.5)]
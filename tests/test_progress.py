@@ -0,0 +1,87 @@
+# tests/test_progress.py
+# (V13) 结构化进度: yt-dlp 进度行的解析, 节流写入, 速度 / ETA 估算
+
+import pytest
+
+from app.services import progress
+from app.services.progress import ProgressTracker, format_bytes, parse_ytdlp_progress
+
+MiB = 1024 * 1024
+
+
+def _expected(downloaded=None, total=None, speed=None, eta=None, fragment_index=None, fragment_count=None):
+    return {"downloaded_bytes": downloaded, "total_bytes": total, "speed": speed, "eta": eta,
+            "fragment_index": fragment_index, "fragment_count": fragment_count}
+
+
+@pytest.mark.parametrize("line, expected", [
+    # --progress-template 的输出
+    ("[progress] 1024 4096 NA 512.5 6 NA NA", _expected(1024, 4096, 512.5, 6)),
+    ("[progress] 1024 NA 8192.0 NA NA NA NA", _expected(1024, 8192)),
+    ("[progress] 300 NA 3000 100 27 3 10", _expected(300, 3000, 100, 27, 3, 10)),
+    ("[progress] NA NA NA NA NA NA NA", _expected()),
+    ("[progress] 1 2 3", None),
+    # yt-dlp 默认格式 (带单位)
+    ("[download]  50.0% of   10.00MiB at    1.00MiB/s ETA 00:05",
+     _expected(5 * MiB, 10 * MiB, MiB, 5)),
+    ("[download]  45.0% of ~  10.00MiB at  512.00KiB/s ETA 01:02:03 (frag 3/10)",
+     _expected(4.5 * MiB, 10 * MiB, 512 * 1024, 3723, 3, 10)),
+    ("[download]   1.0% of 500.00KB at 10.00KB/s ETA 00:49", _expected(5000, 500000, 10000, 49)),
+    ("[download]  12.0% of Unknown at Unknown B/s ETA Unknown", _expected()),
+    ("[download] 100% of   10.00MiB in 00:00:05 at 2.00MiB/s", _expected(10 * MiB, 10 * MiB, 2 * MiB)),
+    # 不是进度行
+    ("[download] Destination: /tmp/video.mp4", None),
+    ("[ffmpeg] Merging formats into \"video.mkv\"", None),
+    ("", None),
+])
+def test_parse_ytdlp_progress(line, expected):
+    assert parse_ytdlp_progress(line) == expected
+
+
+def test_template_matches_parser():
+    # 模板输出的字段顺序和解析器一致: 前缀 + 7 个字段
+    fields = progress.YTDLP_PROGRESS_TEMPLATE.removeprefix("download:").split()
+    assert fields[0] == progress.YTDLP_PROGRESS_PREFIX and len(fields) == 8
+
+
+@pytest.mark.parametrize("value, text", [(None, "?"), (512, "512.0B"), (1536, "1.5KiB"),
+                                         (3 * MiB, "3.0MiB"), (2 * 1024 ** 4, "2.0TiB")])
+def test_format_bytes(value, text):
+    assert format_bytes(value) == text
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_tracker_throttles_and_derives_speed(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(progress.time, "monotonic", clock)
+    flushed = []
+    tracker = ProgressTracker(flushed.append, interval=1.0)
+    assert tracker.update(downloaded_bytes=0, total_bytes=1000)
+    clock.now += 0.5
+    assert not tracker.update(downloaded_bytes=100)
+    assert len(flushed) == 1
+    clock.now += 0.5
+    assert tracker.update(downloaded_bytes=200)
+    # 1 秒 200 字节 (从第一次采样开始): 200 B/s, 剩余 800 字节 -> 4 秒
+    assert flushed[-1]["speed"] == pytest.approx(200)
+    assert flushed[-1]["eta"] == pytest.approx(4)
+    assert flushed[-1]["progress"] == 20.0
+    tracker.finish()
+    assert flushed[-1]["progress"] == 100.0 and flushed[-1]["eta"] == 0
+
+
+def test_tracker_uses_fragments_without_total(monkeypatch):
+    tracker = ProgressTracker(lambda snapshot: None, interval=0)
+    tracker.update(downloaded_bytes=100, fragment_index=3, fragment_count=12, speed=50, eta=9)
+    snapshot = tracker.snapshot()
+    assert snapshot["progress"] == 25.0 and snapshot["speed"] == 50 and snapshot["eta"] == 9
+    tracker.finish()
+    assert tracker.snapshot()["total_bytes"] == 100
+    assert tracker.describe() == "[progress] 100.0% of 100.0B at 50.0B/s ETA 0s"
@@ -0,0 +1,210 @@
+# tests/test_repo_tasks.py
+# 任务仓库: (V16) 写回缓冲, (V17) 迁移和 keyset 分页
+
+import sqlite3
+import threading
+import time
+import uuid
+
+import pytest
+
+import app.repository.repo_tasks as db
+from app.services.service_downloads import DownloaderService
+
+
+def _new_task(**fields) -> dict:
+    task = {"id": f"test-{uuid.uuid4()}", "url": "https://example.com/v.m3u8", "path": "/tmp/tests",
+            "status": "queued", "startTime": time.time()}
+    task.update(fields)
+    db.create_task(task)
+    return task
+
+
+def _raw_row(task_id: str):
+    row = db.get_db_conn().execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+    return dict(row) if row else None
+
+
+# --- (V16) 写回缓冲 ---
+
+def test_buffered_updates_are_visible_before_flush():
+    task = _new_task()
+    db.update_task_progress(task["id"], {"progress": 42.0, "downloaded_bytes": 1000})
+    assert db.get_task_by_id(task["id"])["progress"] == 42.0
+    db.flush_pending_updates()
+    assert _raw_row(task["id"])["downloaded_bytes"] == 1000
+
+
+def test_terminal_status_is_written_immediately():
+    task = _new_task()
+    db.update_task_status(task["id"], "complete", final_name="v.mp4")
+    with db._pending_cond:
+        assert task["id"] not in db._pending_updates
+    assert _raw_row(task["id"])["status"] == "complete"
+
+
+def test_find_active_task_sees_buffered_status():
+    url_key = f"example.com/{uuid.uuid4()}"
+    task = _new_task(status="error", url_key=url_key)
+    assert db.find_active_task(url_key, task["path"]) is None
+    # 重试: error -> queued 只进入缓冲
+    db.update_task_status(task["id"], "queued")
+    assert db.find_active_task(url_key, task["path"])["id"] == task["id"]
+    assert db.find_active_tasks([url_key], task["path"]) == {url_key: task["id"]}
+
+
+def test_delete_drops_pending_and_inflight_updates():
+    task = _new_task()
+    db.update_task_progress(task["id"], {"progress": 10.0})
+    # 模拟 flush 已经取出批次、还没写到这个任务时发生删除
+    with db._pending_cond:
+        db._inflight_updates[task["id"]] = {"progress": 20.0}
+    db.delete_task(task["id"])
+    with db._pending_cond:
+        assert task["id"] not in db._pending_updates
+        assert task["id"] not in db._inflight_updates
+    assert db.get_task_by_id(task["id"]) is None
+
+
+def test_failed_flush_does_not_requeue_deleted_task(monkeypatch):
+    keep, gone = _new_task(), _new_task()
+    db.update_task_progress(keep["id"], {"progress": 1.0})
+    db.update_task_progress(gone["id"], {"progress": 2.0})
+    real_conn = db.get_db_conn()
+
+    class _FailingConn:
+        """批次写到一半时 gone 被删除, 然后事务失败"""
+
+        def execute(self, sql, *args):
+            if sql.startswith("UPDATE"):
+                with db._pending_cond:
+                    db._inflight_updates.pop(gone["id"], None)
+                raise RuntimeError("disk I/O error")
+            return real_conn.execute(sql, *args)
+
+    monkeypatch.setattr(db, "get_db_conn", lambda: _FailingConn())
+    db.flush_pending_updates()
+    monkeypatch.undo()
+    with db._pending_cond:
+        assert keep["id"] in db._pending_updates
+        assert gone["id"] not in db._pending_updates
+    db.flush_pending_updates()
+    assert _raw_row(keep["id"])["progress"] == 1.0
+
+
+# --- (V17) 迁移 ---
+
+def _in_thread(fn):
+    """在新线程中运行 (使用新的线程本地连接, 不影响测试会话的数据库连接)"""
+    result, errors = [], []
+
+    def run():
+        try:
+            result.append(fn())
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            db.close_db_conn()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    if errors:
+        raise errors[0]
+    return result[0]
+
+
+def test_init_db_migrates_legacy_database(tmp_path, monkeypatch):
+    path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(path)
+    # 最早版本的 tasks 表, 带一条旧数据
+    conn.execute("CREATE TABLE tasks (id TEXT PRIMARY KEY, url TEXT NOT NULL, path TEXT NOT NULL, "
+                 "status TEXT NOT NULL DEFAULT 'pending', custom_name TEXT, final_filename TEXT, "
+                 "error_message TEXT, startTime REAL)")
+    conn.execute("INSERT INTO tasks (id, url, path, status, startTime) VALUES ('old', 'u', '/p', 'complete', 1)")
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(db, "DATABASE_FILE", path)
+
+    def migrate():
+        db.init_db()
+        cursor = db.get_db_conn().cursor()
+        columns = {row["name"] for row in cursor.execute("PRAGMA table_info(tasks)")}
+        indexes = {row["name"] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        tables = {row["name"] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        old = dict(cursor.execute("SELECT * FROM tasks WHERE id = 'old'").fetchone())
+        # 再执行一次不会出错, 也不会重复迁移
+        db.init_db()
+        again = cursor.execute("PRAGMA user_version").fetchone()[0]
+        return columns, indexes, tables, version, old, again
+
+    columns, indexes, tables, version, old, again = _in_thread(migrate)
+    for group in (db.PROGRESS_COLUMNS, db.DEDUP_COLUMNS, db.LIVE_COLUMNS, db.LEASE_COLUMNS):
+        assert set(group) <= columns
+    assert {"priority", "estimated_bytes", "rate_limit"} <= columns
+    assert {"idx_tasks_start", "idx_tasks_url_key", "idx_tasks_lease_owner"} <= indexes
+    assert {"task_segments", "task_phases", "host_tuning", "task_recordings", "workers"} <= tables
+    assert version == again == len(db.MIGRATIONS)
+    assert old["priority"] == 0 and old["progress"] == 0 and old["cancel_requested"] == 0
+
+
+def test_migrations_resume_from_recorded_version(tmp_path, monkeypatch):
+    path = tmp_path / "partial.db"
+    monkeypatch.setattr(db, "DATABASE_FILE", path)
+    monkeypatch.setattr(db, "MIGRATIONS", db.MIGRATIONS[:2])
+    _in_thread(db.init_db)
+    monkeypatch.undo()
+    monkeypatch.setattr(db, "DATABASE_FILE", path)
+
+    def migrate():
+        db.init_db()
+        cursor = db.get_db_conn().cursor()
+        return cursor.execute("PRAGMA user_version").fetchone()[0]
+
+    assert _in_thread(migrate) == len(db.MIGRATIONS)
+
+
+# --- (V17) keyset 分页 ---
+
+def _page_all(path: str, limit: int, **filters):
+    pages, cursor = [], None
+    while True:
+        after = DownloaderService._decode_cursor(cursor) if cursor else None
+        rows = db.list_tasks(limit=limit, after=after, path=path, **filters)
+        pages.append([row["id"] for row in rows])
+        if len(rows) < limit:
+            return pages
+        cursor = DownloaderService._encode_cursor(rows[-1]["startTime"], rows[-1]["id"])
+
+
+def test_keyset_pagination_visits_every_row_once():
+    path = f"/tmp/tests/{uuid.uuid4()}"
+    # 有相同 startTime 的行: 靠 id 区分先后, 不会跨页重复或遗漏
+    times = [100.0, 100.0, 100.0, 101.0, 102.0, 102.0, 103.0]
+    ids = [_new_task(id=f"{path}/{i}", path=path, startTime=t)["id"] for i, t in enumerate(times)]
+    expected = sorted(ids, key=lambda task_id: (times[ids.index(task_id)], task_id), reverse=True)
+
+    pages = _page_all(path, limit=3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [task_id for page in pages for task_id in page] == expected
+    assert db.list_tasks(path=path) == db.list_tasks(path=path, limit=100)
+
+
+def test_list_tasks_filters_and_summary():
+    path = f"/tmp/tests/{uuid.uuid4()}"
+    done = _new_task(path=path, url="https://a.example/one.m3u8", startTime=1.0)
+    _new_task(path=path, url="https://b.example/two.m3u8", startTime=2.0)
+    db.update_task_status(done["id"], "complete", final_name="one.mp4")
+
+    complete = db.list_tasks(path=path, statuses=["complete"])
+    assert [row["id"] for row in complete] == [done["id"]]
+    assert [row["url"] for row in db.list_tasks(path=path, url_contains="b.example")] == ["https://b.example/two.m3u8"]
+    summary = db.list_tasks(path=path, summary=True)
+    assert set(summary[0]) == set(db.SUMMARY_COLUMNS)
+
+
+def test_invalid_cursor_is_rejected():
+    assert DownloaderService._decode_cursor(DownloaderService._encode_cursor(1.5, "x")) == (1.5, "x")
+    with pytest.raises(ValueError):
+        DownloaderService._decode_cursor("not-a-cursor")
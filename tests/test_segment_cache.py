@@ -0,0 +1,120 @@
+# tests/test_segment_cache.py
+# (V20) 跨任务共享的片段磁盘缓存: 按 (URL, 字节范围) 索引, LRU 淘汰; (V31) 多个 worker 共享目录
+
+import os
+
+import pytest
+
+from app.services import segment_cache as segment_cache_module
+from app.services.segment_cache import SegmentCache
+
+URL = "https://cdn.example.com/seg"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SegmentCache(tmp_path / "cache", max_bytes=300)
+
+
+def _age(cache, uri, mtime, byterange=None):
+    """把条目的 mtime 设为 mtime (越小越久未使用)"""
+    path = cache._path(cache.key(uri, byterange))
+    os.utime(path, (mtime, mtime))
+
+
+def test_counters_and_byte_range_keys(cache):
+    assert cache.get(f"{URL}/1.ts") is None
+    cache.put(f"{URL}/1.ts", None, b"a" * 50)
+    cache.put(f"{URL}/all.ts", (10, 0), b"b" * 10)
+    cache.put(f"{URL}/all.ts", (10, 10), b"c" * 10)
+    assert cache.get(f"{URL}/1.ts") == b"a" * 50
+    # 同一个 URL 的不同字节范围是不同的条目
+    assert cache.get(f"{URL}/all.ts", (10, 10)) == b"c" * 10
+    assert cache.get(f"{URL}/all.ts", (10, 0)) == b"b" * 10
+    assert cache.get(f"{URL}/all.ts") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["bytes_saved"]) == (3, 2, 70)
+    assert (stats["entries"], stats["size_bytes"], stats["stores"]) == (3, 70, 3)
+    assert stats["hit_ratio"] == 0.6
+
+
+def test_disabled_or_oversized(tmp_path):
+    disabled = SegmentCache(tmp_path / "off", max_bytes=0)
+    disabled.put(URL, None, b"x")
+    assert disabled.get(URL) is None and not (tmp_path / "off").exists()
+    small = SegmentCache(tmp_path / "small", max_bytes=10)
+    small.put(URL, None, b"x" * 11)
+    assert small.stats()["entries"] == 0
+
+
+def test_lru_eviction_at_size_cap(cache):
+    for name, mtime in (("a", 1), ("b", 2), ("c", 3)):
+        cache.put(f"{URL}/{name}", None, bytes(100))
+        _age(cache, f"{URL}/{name}", mtime)
+    assert cache.get(f"{URL}/a") is not None          # a 变成最近使用
+    cache.put(f"{URL}/d", None, bytes(100))
+    # 超过 300: 淘汰到低水位 (270), b 和 c 是最久未使用的
+    assert cache.get(f"{URL}/b") is None and cache.get(f"{URL}/c") is None
+    assert cache.get(f"{URL}/a") is not None and cache.get(f"{URL}/d") is not None
+    stats = cache.stats()
+    assert stats["evictions"] == 2 and stats["size_bytes"] == 200
+    assert sorted(p.name for p in cache.directory.iterdir()) == sorted(
+        f"{cache.key(f'{URL}/{name}')}.seg" for name in "ad")
+
+
+def test_index_is_rebuilt_from_mtimes(cache, tmp_path):
+    for name, mtime in (("new", 300), ("old", 100), ("mid", 200)):
+        cache.put(f"{URL}/{name}", None, bytes(100))
+        _age(cache, f"{URL}/{name}", mtime)
+    stale = cache.directory / "x.seg.1.2.part"
+    fresh = cache.directory / "y.seg.3.4.part"
+    stale.write_bytes(b"?")
+    fresh.write_bytes(b"?")
+    os.utime(stale, (1, 1))
+
+    restarted = SegmentCache(cache.directory, max_bytes=300)
+    assert restarted.stats()["size_bytes"] == 300
+    # 写了一半就退出的残留被清理; 刚写的 (其他 worker 可能正在写) 保留
+    assert not stale.exists() and fresh.exists()
+    restarted.put(f"{URL}/newest", None, bytes(50))
+    assert restarted.get(f"{URL}/old") is None
+    assert restarted.get(f"{URL}/mid") is not None and restarted.get(f"{URL}/new") is not None
+
+
+def test_entry_removed_before_open_is_a_miss(cache):
+    cache.put(URL, None, b"data")
+    cache._path(cache.key(URL)).unlink()
+    assert cache.open(URL) is None
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["entries"] == 0 and stats["size_bytes"] == 0
+
+
+def test_open_file_survives_eviction(cache):
+    cache.put(URL, None, b"first")
+    f = cache.open(URL)
+    cache._path(cache.key(URL)).unlink()
+    with f:
+        assert f.read() == b"first"
+
+
+def test_workers_share_the_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(segment_cache_module, "SEGMENT_CACHE_RESCAN_SECONDS", 0)
+    first = SegmentCache(tmp_path / "cache", max_bytes=300)
+    second = SegmentCache(tmp_path / "cache", max_bytes=300)
+    assert second.stats()["entries"] == 0             # second 的索引在 first 写入之前建立
+
+    first.put(f"{URL}/a", None, bytes(100))
+    _age(first, f"{URL}/a", 1)
+    # 其他 worker 写入的条目也能命中
+    assert second.get(f"{URL}/a") == bytes(100)
+    first.put(f"{URL}/b", None, bytes(100))
+    first.put(f"{URL}/c", None, bytes(100))
+    _age(first, f"{URL}/b", 2)
+    _age(first, f"{URL}/c", 3)
+    _age(first, f"{URL}/a", 4)
+    second.put(f"{URL}/d", None, bytes(100))
+    # 上限是整个目录的: second 淘汰了 first 写入的最久未使用的条目
+    assert {p.stat().st_size for p in first.directory.glob("*.seg")} == {100}
+    assert len(list(first.directory.glob("*.seg"))) == 2
+    assert first.get(f"{URL}/b") is None and first.get(f"{URL}/c") is None
+    assert first.get(f"{URL}/a") is not None and first.get(f"{URL}/d") is not None
@@ -0,0 +1,116 @@
+# tests/test_splice_file.py
+# (V22) 缓存的片段在内核中拼接到输出文件: copy_file_range -> sendfile -> 普通读写
+
+import errno
+import os
+
+import pytest
+
+from app.services import engine_hls
+from app.services.engine_hls import _write_and_flush, splice_file
+
+OLD = b"o" * 300
+SEGMENT = bytes(range(256)) * 64
+OFFSET = 100
+
+
+@pytest.fixture
+def files(tmp_path):
+    """与续传时一样: 输出文件以 r+b 打开, 定位到检查点 (不是文件开头)"""
+    out_path, src_path = tmp_path / "video.ts", tmp_path / "cached.seg"
+    out_path.write_bytes(OLD)
+    src_path.write_bytes(SEGMENT)
+    out = open(out_path, "r+b")
+    out.seek(OFFSET)
+    src = open(src_path, "rb")
+    yield out, src, out_path
+    out.close()
+    src.close()
+
+
+def _fail(exc):
+    def kernel_copy(*args, **kwargs):
+        raise exc
+    return kernel_copy
+
+
+@pytest.fixture(params=["copy_file_range", "sendfile", "copyfileobj", "unavailable"])
+def copy_path(request, monkeypatch):
+    """强制使用某一种拷贝方式, 并记录实际调用了哪些"""
+    calls = []
+
+    def record(name, real):
+        def kernel_copy(*args, **kwargs):
+            calls.append(name)
+            return real(*args, **kwargs)
+        return kernel_copy
+
+    if request.param == "copy_file_range":
+        if not hasattr(os, "copy_file_range"):
+            pytest.skip("copy_file_range is not available")
+        monkeypatch.setattr(os, "copy_file_range", record("copy_file_range", os.copy_file_range))
+    else:
+        monkeypatch.setattr(os, "copy_file_range", _fail(OSError(errno.EXDEV, "cross-device")), raising=False)
+    if request.param == "sendfile":
+        if not hasattr(os, "sendfile") or not engine_hls.sys.platform.startswith("linux"):
+            pytest.skip("sendfile to a regular file is not available")
+        monkeypatch.setattr(os, "sendfile", record("sendfile", os.sendfile))
+    elif request.param == "copyfileobj":
+        monkeypatch.setattr(os, "sendfile", _fail(OSError(errno.EINVAL, "not supported")), raising=False)
+    elif request.param == "unavailable":
+        # 这个 Python / 平台上根本没有这两个函数
+        monkeypatch.delattr(os, "copy_file_range", raising=False)
+        monkeypatch.delattr(os, "sendfile", raising=False)
+    return request.param, calls
+
+
+def test_splice_at_resume_offset(files, copy_path):
+    out, src, out_path = files
+    mode, calls = copy_path
+    assert splice_file(out, src) == len(SEGMENT)
+    assert out.tell() == OFFSET + len(SEGMENT)
+    assert src.tell() == len(SEGMENT)
+    # 之后的普通写入接在拼接的数据后面
+    out.write(b"tail")
+    out.close()
+    assert out_path.read_bytes() == OLD[:OFFSET] + SEGMENT + b"tail"
+    if mode in ("copy_file_range", "sendfile"):
+        assert calls and set(calls) == {mode}
+
+
+def test_splice_from_partially_read_source(files, copy_path):
+    out, src, out_path = files
+    # 缓冲读取会预读: src 的文件偏移已经在末尾, 但 tell() 是 10
+    assert src.read(10) == SEGMENT[:10]
+    assert splice_file(out, src) == len(SEGMENT) - 10
+    out.close()
+    assert out_path.read_bytes() == OLD[:OFFSET] + SEGMENT[10:]
+
+
+def test_failure_after_partial_kernel_copy_is_raised(files, monkeypatch):
+    out, src, _ = files
+    calls = []
+
+    def flaky(in_fd, out_fd, offset, count):
+        calls.append(offset)
+        if len(calls) > 1:
+            raise OSError(errno.EIO, "I/O error")
+        return engine_hls._copy_file_range(in_fd, out_fd, offset, min(count, 1000))
+
+    if not hasattr(os, "copy_file_range"):
+        pytest.skip("copy_file_range is not available")
+    monkeypatch.setattr(engine_hls, "_KERNEL_COPIES", [flaky, engine_hls._sendfile])
+    # 已经写了一部分: 不能换一种方式从头再写 (输出会重复), 交给引擎的重试
+    with pytest.raises(OSError):
+        splice_file(out, src)
+    assert calls == [0, 1000]
+
+
+def test_write_and_flush_mixes_bytes_and_cached_files(files, copy_path):
+    out, src, out_path = files
+    size = _write_and_flush(out, [b"init", src, b"more"])
+    assert size == 4 + len(SEGMENT) + 4
+    assert src.closed
+    assert out.tell() == OFFSET + size
+    out.close()
+    assert out_path.read_bytes() == OLD[:OFFSET] + b"init" + SEGMENT + b"more"
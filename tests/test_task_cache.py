@@ -0,0 +1,130 @@
+# tests/test_task_cache.py
+# (V18) 任务状态缓存, 由内容计算的 ETag, 条件 GET -> 304
+
+import time
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import app.repository.repo_tasks as db
+from app.api.v1.router_downloads import router
+from app.services.service_downloads import downloader_service
+from app.services.task_cache import TaskStateCache, content_etag
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+def _task(path: str, **fields) -> str:
+    task_id = f"test-{uuid.uuid4()}"
+    db.create_task({"id": task_id, "url": f"https://example.com/{task_id}.m3u8", "path": path,
+                    "status": "queued", "startTime": time.time(), **fields})
+    downloader_service.task_cache.invalidate(task_id)
+    return task_id
+
+
+def test_content_etag_is_stable():
+    task = {"id": "a", "status": "queued", "progress": 1.5}
+    # 与字段顺序 / 进程无关; 租约续期不改变 ETag
+    assert content_etag(task) == content_etag(dict(reversed(list(task.items()))))
+    assert content_etag(task) == content_etag({**task, "lease_expires": 123.0})
+    assert content_etag(task) != content_etag({**task, "status": "downloading"})
+    assert content_etag([task]) != content_etag([task, task])
+    assert content_etag(task).startswith('W/"')
+
+
+def test_cache_reads_through_and_invalidates():
+    rows = {"a": {"id": "a", "status": "queued"}}
+    loads = []
+
+    def loader(task_id):
+        loads.append(task_id)
+        return dict(rows[task_id]) if task_id in rows else None
+
+    cache = TaskStateCache(loader)
+    assert cache.get("a") == rows["a"] and cache.get("a") == rows["a"]
+    assert loads == ["a"]
+    first = cache.etag(cache.get("a"))
+    rows["a"]["status"] = "downloading"
+    assert cache.etag(cache.get("a")) == first       # 还没有 invalidate
+    cache.invalidate("a")
+    assert cache.get("a")["status"] == "downloading"
+    assert cache.etag(cache.get("a")) != first
+    assert cache.get("missing") is None and cache.get("missing") is None
+    assert loads.count("missing") == 2               # 不存在的任务不缓存
+
+
+def test_list_cache_and_etag_follow_generation():
+    cache = TaskStateCache(lambda task_id: None)
+    calls = []
+
+    def load():
+        calls.append(1)
+        return [{"id": "a"}]
+
+    first = cache.get_list(("q",), load)
+    assert cache.get_list(("q",), load) is first and len(calls) == 1
+    etag = cache.list_etag(first)
+    assert cache.list_etag(first) == etag == content_etag(first)
+    cache.invalidate("a")
+    second = cache.get_list(("q",), load)
+    assert second is not first and len(calls) == 2
+    # 内容相同: ETag 相同 (例如另一个 worker, 或进程重启之后)
+    assert cache.list_etag(second) == etag
+    cache.invalidate_all()
+    assert cache.get_list(("q",), load) is not second
+
+
+def test_status_200_then_304_then_200_after_change(client):
+    task_id = _task("/tmp/tests/etag")
+    response = client.get(f"/api/v1/status/{task_id}")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    not_modified = client.get(f"/api/v1/status/{task_id}", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304 and not_modified.headers["etag"] == etag
+
+    downloader_service._update_status(task_id, status="error", error_msg="boom")
+    changed = client.get(f"/api/v1/status/{task_id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.json()["status"] == "error"
+    assert changed.headers["etag"] != etag
+    assert client.get("/api/v1/status/missing-task").status_code == 404
+
+
+def test_status_etag_survives_a_new_cache(client, monkeypatch):
+    # 另一个 worker (或重启之后) 的缓存是空的: 同样的数据给出同样的 ETag
+    task_id = _task("/tmp/tests/etag")
+    etag = client.get(f"/api/v1/status/{task_id}").headers["etag"]
+    monkeypatch.setattr(downloader_service, "task_cache", TaskStateCache(loader=db.get_task_by_id))
+    assert client.get(f"/api/v1/status/{task_id}", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_list_etag_changes_when_a_task_is_added(client):
+    path = f"/tmp/tests/{uuid.uuid4()}"
+    _task(path)
+    response = client.get("/api/v1/tasks", params={"path": path})
+    assert response.status_code == 200 and len(response.json()) == 1
+    etag = response.headers["etag"]
+    assert client.get("/api/v1/tasks", params={"path": path},
+                      headers={"If-None-Match": etag}).status_code == 304
+
+    _task(path)
+    response = client.get("/api/v1/tasks", params={"path": path}, headers={"If-None-Match": etag})
+    assert response.status_code == 200 and len(response.json()) == 2
+    assert response.headers["etag"] != etag
+
+
+def test_list_304_keeps_next_cursor(client):
+    path = f"/tmp/tests/{uuid.uuid4()}"
+    _task(path, startTime=1.0)
+    _task(path, startTime=2.0)
+    first = client.get("/api/v1/tasks/summary", params={"path": path, "limit": 1})
+    cursor = first.headers["x-next-cursor"]
+    again = client.get("/api/v1/tasks/summary", params={"path": path, "limit": 1},
+                       headers={"If-None-Match": first.headers["etag"]})
+    assert again.status_code == 304 and again.headers["x-next-cursor"] == cursor
@@ -0,0 +1,120 @@
+# tests/test_task_profiler.py
+# (V25) 阶段时间线 (task_phases + 运行中的 PhaseTimer) 和可选的任务剖析 (TASK_PROFILE)
+
+import pstats
+import threading
+import time
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import app.repository.repo_tasks as db
+from app.api.v1.router_downloads import router
+from app.core import metrics
+from app.services import task_profiler
+from app.services.service_downloads import downloader_service
+from app.services.task_profiler import profile_path, start_task_profile
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(task_profiler, "TASK_PROFILE_DIR", tmp_path / "profiles")
+    return tmp_path / "profiles"
+
+
+def _busy(seconds: float) -> int:
+    total, end = 0, time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        total += sum(range(100))
+    return total
+
+
+@pytest.mark.parametrize("mode", ["off", "", "flamegraph"])
+def test_profiling_disabled(profile_dir, monkeypatch, mode):
+    monkeypatch.setattr(task_profiler, "TASK_PROFILE", mode)
+    assert start_task_profile("t") is None
+    assert not profile_dir.exists()
+
+
+def test_sample_mode_writes_collapsed_stacks(profile_dir, monkeypatch):
+    monkeypatch.setattr(task_profiler, "TASK_PROFILE", "sample")
+    profile = start_task_profile("sampled")
+    worker = threading.Thread(target=_busy, args=(0.3,), name="busy-worker")
+    worker.start()
+    worker.join()
+    path = profile.stop()
+    assert path == profile_dir / "sampled.collapsed" == profile_path("sampled")
+    lines = path.read_text(encoding="utf-8").splitlines()
+    stacks = dict(line.rsplit(" ", 1) for line in lines)
+    assert any(stack.startswith("busy-worker;") and "_busy" in stack for stack in stacks)
+    assert all(int(count) > 0 for count in stacks.values())
+
+
+def test_cprofile_mode_is_exclusive_and_replaces_old_results(profile_dir, monkeypatch):
+    monkeypatch.setattr(task_profiler, "TASK_PROFILE", "cprofile")
+    profile_dir.mkdir()
+    (profile_dir / "profiled.collapsed").write_text("old 1\n")
+    profile = start_task_profile("profiled")
+    # Python 3.12+ 同一时刻只能有一个 cProfile: 第二个任务不做剖析
+    assert start_task_profile("other") is None
+    _busy(0.05)
+    path = profile.stop()
+    assert path.suffix == ".pstats" and profile_path("profiled") == path
+    assert not (profile_dir / "profiled.collapsed").exists()
+    functions = {func[2] for func in pstats.Stats(str(path)).stats}
+    assert "_busy" in functions
+    # 锁已释放
+    again = start_task_profile("again")
+    assert again is not None
+    again.stop()
+
+
+def test_phase_timer_open_close_and_duration(monkeypatch):
+    monkeypatch.setattr(metrics.PHASE_DURATION, "observe", lambda *args, **kwargs: None)
+    timer = metrics.PhaseTimer("resolve")
+    time.sleep(0.02)
+    timer.enter("download")
+    timer.add_bytes(1000)
+    live = timer.timeline()
+    assert [span["phase"] for span in live] == ["resolve", "download"]
+    assert live[0]["ended_at"] is not None and live[0]["duration"] >= 0.02
+    assert live[1]["ended_at"] is None and live[1]["bytes"] == 1000
+    timer.finish()
+    resolve, download = timer.spans
+    assert resolve["ended_at"] <= download["started_at"] <= download["ended_at"]
+    assert download["duration"] == pytest.approx(download["ended_at"] - download["started_at"], abs=0.05)
+    assert all(not key.startswith("_") for span in timer.spans for key in span)
+
+
+def test_timeline_endpoint_merges_saved_and_running_attempts(profile_dir, monkeypatch):
+    monkeypatch.setattr(metrics.PHASE_DURATION, "observe", lambda *args, **kwargs: None)
+    task_id = f"test-{uuid.uuid4()}"
+    db.create_task({"id": task_id, "url": "https://example.com/v.m3u8", "path": "/tmp/tests",
+                    "status": "downloading", "startTime": time.time()})
+    downloader_service.task_cache.invalidate(task_id)
+    finished = metrics.PhaseTimer("resolve")
+    finished.enter("download")
+    finished.add_bytes(10)
+    finished.abort()
+    db.save_task_phases(task_id, finished.spans)
+    running = metrics.PhaseTimer("download")
+    running.add_bytes(5)
+    monkeypatch.setitem(downloader_service.live_tasks, task_id, {"phases": running})
+    profile_dir.mkdir()
+    (profile_dir / f"{task_id}.pstats").write_bytes(b"")
+
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+    body = client.get(f"/api/v1/task/{task_id}/timeline").json()
+    assert body["task_id"] == task_id and body["status"] == "downloading"
+    assert body["profile"] == f"{task_id}.pstats"
+    assert [(span["attempt"], span["phase"]) for span in body["phases"]] == [
+        (1, "resolve"), (1, "download"), (2, "download")]
+    assert body["phases"][1]["bytes"] == 10 and body["phases"][1]["ended_at"] is not None
+    assert body["phases"][2]["ended_at"] is None and body["phases"][2]["bytes"] == 5
+    assert set(body["phases"][0]) == {"attempt", "phase", "started_at", "ended_at", "duration", "bytes",
+                                      "cpu_seconds"}
+    assert client.get("/api/v1/task/missing-task/timeline").status_code == 404
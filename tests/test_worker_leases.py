@@ -0,0 +1,197 @@
+# tests/test_worker_leases.py
+# (V31) 多个 worker 共享一个数据库: 任务租约的获取 / 续期 / 接手, 取消请求的转交
+
+import asyncio
+import threading
+import time
+import uuid
+
+import pytest
+
+import app.repository.repo_tasks as db
+from app.services.service_downloads import downloader_service
+from app.services.worker_leases import LeaseKeeper
+
+TTL = 30.0
+
+
+@pytest.fixture
+def lease_db(tmp_path, monkeypatch):
+    """独立的数据库: 接手无主任务时会扫描整个 tasks 表"""
+    db.close_db_conn()
+    monkeypatch.setattr(db, "DATABASE_FILE", tmp_path / "leases.db")
+    db.init_db()
+    yield
+    db.close_db_conn()
+
+
+def _task(status="queued", owner=None, expires=None, priority=0, start=None) -> str:
+    task_id = f"test-{uuid.uuid4()}"
+    db.create_task({"id": task_id, "url": "https://example.com/v.m3u8", "path": "/tmp/tests", "status": status,
+                    "startTime": start if start is not None else time.time(), "priority": priority,
+                    "lease_owner": owner, "lease_expires": expires})
+    return task_id
+
+
+def _row(task_id):
+    return dict(db.get_db_conn().execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone())
+
+
+def test_claim_is_exclusive_until_expiry(lease_db):
+    task_id = _task()
+    assert db.claim_task(task_id, "w1", TTL)
+    assert not db.claim_task(task_id, "w2", TTL)
+    assert db.claim_task(task_id, "w1", TTL)       # 续期自己的租约
+    db.get_db_conn().execute("UPDATE tasks SET lease_expires = ? WHERE id = ?", (time.time() - 1, task_id))
+    assert db.claim_task(task_id, "w2", TTL, start=True)
+    row = _row(task_id)
+    assert row["lease_owner"] == "w2" and row["status"] == "downloading"
+
+
+def test_release_only_by_owner(lease_db):
+    task_id = _task(owner="w1", expires=time.time() + TTL)
+    db.release_task(task_id, "w2")
+    assert _row(task_id)["lease_owner"] == "w1"
+    db.release_task(task_id, "w1")
+    assert _row(task_id)["lease_owner"] is None and _row(task_id)["lease_expires"] is None
+
+
+def test_renew_reports_owned_tasks_and_cancel_requests(lease_db):
+    mine = _task(owner="w1", expires=time.time() + 1)
+    cancelled = _task(owner="w1", expires=time.time() + 1)
+    _task(owner="w2", expires=time.time() + 1)
+    assert db.request_cancel(cancelled, "w2") == "w1"
+    assert db.request_cancel(cancelled, "w1") is None      # 自己的任务不需要转交
+    owned = db.renew_leases("w1", TTL)
+    assert owned == {mine: False, cancelled: True}
+    assert _row(mine)["lease_expires"] > time.time() + TTL - 5
+    db.clear_cancel_request(cancelled)
+    assert db.renew_leases("w1", TTL)[cancelled] is False
+
+
+def test_request_cancel_ignores_expired_lease(lease_db):
+    task_id = _task(owner="dead", expires=time.time() - 1)
+    assert db.request_cancel(task_id, "w1") is None
+
+
+def test_adopt_orphaned_tasks(lease_db):
+    now = time.time()
+    orphan = _task(start=1)
+    expired = _task(status="downloading", owner="dead", expires=now - 1, start=2)
+    _task(owner="w2", expires=now + TTL)                     # 还活着的 worker 的任务
+    _task(status="complete")                                 # 已经结束
+    local = _task(start=3)                                   # 本进程已经在处理
+    own = _task(owner="w1", expires=now + TTL, start=4)
+    adopted = db.adopt_orphaned_tasks("w1", TTL, exclude=[local])
+    assert [row["id"] for row in adopted] == [orphan, expired]
+    assert {_row(orphan)["lease_owner"], _row(expired)["lease_owner"]} == {"w1"}
+    # 第二个 worker 不会再接手同样的任务
+    assert db.adopt_orphaned_tasks("w3", TTL, exclude=[local]) == []
+    # 固定 WORKER_ID 的 worker 重启: 接回仍然属于自己的任务
+    assert [row["id"] for row in db.adopt_orphaned_tasks("w1", TTL, exclude=[local], reclaim_own=True)] == \
+        [orphan, expired, own]
+
+
+def test_take_queued_tasks_from_other_workers(lease_db):
+    now = time.time()
+    low = _task(owner="w2", expires=now + TTL, priority=0, start=1)
+    high = _task(owner="w2", expires=now + TTL, priority=5, start=2)
+    _task(status="downloading", owner="w2", expires=now + TTL)
+    cancelling = _task(owner="w2", expires=now + TTL, priority=9)
+    db.request_cancel(cancelling, "w1")
+    assert db.take_queued_tasks("w1", TTL, 0) == []
+    assert [row["id"] for row in db.take_queued_tasks("w1", TTL, 1)] == [high]
+    assert [row["id"] for row in db.take_queued_tasks("w1", TTL, 5)] == [low]
+    assert db.renew_leases("w2", TTL).keys() == {cancelling} | {
+        row["id"] for row in db.get_db_conn().execute(
+            "SELECT id FROM tasks WHERE lease_owner = 'w2' AND status = 'downloading'")}
+
+
+def test_workers_heartbeat_and_cleanup(lease_db):
+    now = time.time()
+    db.heartbeat_worker("w1", "host", 1, now)
+    db.heartbeat_worker("w2", "host", 2, now)
+    _task(owner="w1", expires=now + TTL)
+    db.get_db_conn().execute("UPDATE workers SET heartbeat_at = ? WHERE id = 'w2'", (now - 1000,))
+    alive = db.get_workers(now - TTL)
+    assert [(w["id"], w["tasks"]) for w in alive] == [("w1", 1)]
+    db.remove_worker("w1", stale_before=now - 500)
+    assert db.get_workers(0) == []
+
+
+def test_lease_keeper_tick(lease_db):
+    now = time.time()
+    running = _task(status="downloading", owner="w1", expires=now + 5)
+    lost = _task(status="downloading", owner="w2", expires=now + TTL)
+    forwarded = _task(status="downloading", owner="w1", expires=now + 5)
+    db.request_cancel(forwarded, "w2")
+    queued_elsewhere = _task(owner="w2", expires=now + TTL)
+    events = []
+    keeper = LeaseKeeper(
+        local_tasks=lambda: [running, lost, forwarded],
+        capacity=lambda: 1,
+        on_cancel=lambda task_id: events.append(("cancel", task_id)),
+        on_lost=lambda task_id: events.append(("lost", task_id)),
+        on_adopt=lambda rows: events.append(("adopt", [row["id"] for row in rows])),
+        on_foreign_change=lambda: events.append(("foreign",)),
+        worker_id="w1", ttl=TTL, interval=60)
+    keeper.peers = 1
+    keeper._tick()
+    assert ("lost", lost) in events
+    assert ("cancel", forwarded) in events
+    assert ("adopt", [queued_elsewhere]) in events
+    assert ("cancel", running) not in events
+    assert _row(forwarded)["cancel_requested"] == 0
+    assert _row(running)["lease_expires"] > now + TTL - 5
+
+    # 其他连接 (其他 worker) 提交的修改 -> 任务缓存失效
+    events.clear()
+    done = threading.Event()
+
+    def other_worker():
+        db.heartbeat_worker("w2", "host", 2, now)
+        db.close_db_conn()
+        done.set()
+
+    threading.Thread(target=other_worker).start()
+    assert done.wait(5)
+    keeper._tick()
+    assert ("foreign",) in events
+
+
+def _collect(stream, count: int):
+    async def run():
+        events = []
+        async for event in stream:
+            events.append(event)
+            if len(events) == count:
+                break
+        await stream.aclose()
+        return events
+    return asyncio.run(run())
+
+
+def test_sse_for_task_owned_by_other_worker_polls_without_blocking(lease_db, monkeypatch):
+    task_id = _task(status="downloading", owner="other-worker", expires=time.time() + TTL)
+    main_thread = threading.get_ident()
+    lookups = []
+    real_get = db.get_task_by_id
+
+    def get_task_by_id(tid):
+        lookups.append(threading.get_ident())
+        return real_get(tid)
+
+    monkeypatch.setattr(db, "get_task_by_id", get_task_by_id)
+    stream = downloader_service.get_download_stream(task_id)
+    # 创建生成器时不访问数据库 (调用方在事件循环中)
+    assert lookups == []
+    events = _collect(stream, 2)
+    assert "other-worker" in events[0]
+    assert events[1] == "data: [downloading] 0.0%\n\n"
+    assert lookups and main_thread not in lookups
+
+
+def test_sse_for_unknown_task(lease_db):
+    events = _collect(downloader_service.get_download_stream("missing-task"), 2)
+    assert events[0].startswith("data: [ERROR]")
+    assert events[1] == "data: [STREAM_END]\n\n"